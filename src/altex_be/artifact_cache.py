@@ -0,0 +1,152 @@
+"""
+入力ファイルから作る成果物 (GTF/GFF3から変換したアノテーション、FASTAのインデックス (.fai)、オフターゲットのゲノムインデックス) を、
+複数のジョブで共有するためのキャッシュ。`--cache-dir` で指定する。
+
+- キーは入力ファイルの内容のハッシュ (BLAKE2b) と、作り方を決める設定 (形式のバージョン、--contigs など) から計算する。
+  ファイルの場所や名前が変わっても同じ成果物を使い、内容が変われば作り直す
+- 成果物は同じディレクトリの一時ディレクトリに作ってから、os.replace で名前を変える。読み込む側が書きかけの成果物を見ることはない
+- 作成中はキーごとのファイルロック (fcntl.flock) を持つ。同時に起動したジョブは、先に始めたジョブの作成が終わるのを待ち、その成果物を使う
+- ファイルの内容のハッシュも (パス, サイズ, 更新時刻) をキーにしてキャッシュに保存し、同じファイルを2回目以降は読み直さない
+"""
+from __future__ import annotations
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from . import logging_config  # noqa: F401
+
+try:
+    import fcntl
+except ImportError:  # Windowsではファイルロックを使わない (一時ディレクトリからの名前の変更だけで、書きかけの成果物は読まない)
+    fcntl = None
+
+HASH_BLOCK_SIZE = 1 << 24 # ファイルのハッシュを計算するときに一度に読み込むバイト数
+KEY_LENGTH = 32 # キー (16進数の文字列) の長さ
+
+
+def hash_file(path: Path) -> str:
+    """
+    Purpose: ファイルの内容のBLAKE2bハッシュを16進数の文字列で返す
+    """
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@contextmanager
+def file_lock(lock_path: Path) -> Iterator[None]:
+    """
+    Purpose:
+        lock_pathの排他ロックを持つ。ほかのプロセスが持っている場合は、解放されるまで待つ
+        ロックはプロセスが終了すると (異常終了した場合も) OSによって解放される
+    """
+    with open(lock_path, "a") as lock_file:
+        if fcntl is None:
+            yield
+            return
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logging.info(f"Waiting for another job to finish building {lock_path.with_suffix('')}...")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def atomic_output_path(output_path: Path) -> Iterator[Path]:
+    """
+    Purpose:
+        output_pathと同じディレクトリの一時ファイルのパスを渡し、ブロックが正常に終わったら output_path に名前を変える
+        例外が起きた場合は一時ファイルを削除し、output_path は変更しない
+    """
+    output_path = Path(output_path)
+    fd, temp_name = tempfile.mkstemp(prefix=f".{output_path.name}.", suffix=".tmp", dir=output_path.parent)
+    os.close(fd)
+    temp_path = Path(temp_name)
+    try:
+        yield temp_path
+        os.replace(temp_path, output_path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+
+@dataclass(frozen=True)
+class ArtifactCache:
+    """
+    成果物を種類 (kind) とキーごとのディレクトリ (root/kind/key/) に保存するキャッシュ
+    """
+    root: Path
+
+    def get_or_build(self, kind: str, key: str, build: Callable[[Path], None]) -> Path:
+        """
+        Purpose:
+            成果物のディレクトリを返す。まだない場合は、build(一時ディレクトリ) で作ってから名前を変える
+            ほかのジョブが同じ成果物を作っている場合は、終わるのを待ってその成果物を返す
+        Parameters:
+            kind: str, 成果物の種類 (キャッシュのサブディレクトリ名)
+            key: str, artifact_key で計算したキー
+            build: Callable[[Path], None], 渡されたディレクトリに成果物のファイルを書き出す関数
+        Returns:
+            Path, 成果物のディレクトリ
+        """
+        artifact_dir = Path(self.root) / kind / key
+        if artifact_dir.is_dir():
+            return artifact_dir
+        artifact_dir.parent.mkdir(parents=True, exist_ok=True)
+        with file_lock(artifact_dir.parent / f"{key}.lock"):
+            # ロックを待っている間に、ほかのジョブが作り終えている場合がある
+            if artifact_dir.is_dir():
+                logging.info(f"Using the {kind} built by another job: {artifact_dir}")
+                return artifact_dir
+            temp_dir = Path(tempfile.mkdtemp(prefix=f".{key}.", suffix=".tmp", dir=artifact_dir.parent))
+            try:
+                build(temp_dir)
+                os.replace(temp_dir, artifact_dir)
+            except BaseException:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                raise
+        logging.info(f"Saved the {kind} to the cache: {artifact_dir}")
+        return artifact_dir
+
+    def file_digest(self, path: Path) -> str:
+        """
+        Purpose:
+            ファイルの内容のハッシュを返す。(パス, サイズ, 更新時刻) が同じファイルのハッシュはキャッシュから読み、ファイルを読み直さない
+        """
+        stat = Path(path).stat()
+        stat_key = hashlib.blake2b(
+            f"{Path(path).resolve()}\0{stat.st_size}\0{stat.st_mtime_ns}".encode(), digest_size=KEY_LENGTH // 2
+        ).hexdigest()
+
+        def build(digest_dir: Path) -> None:
+            logging.info(f"Hashing {path} for the cache key (only on the first run)...")
+            (digest_dir / "blake2b").write_text(hash_file(path))
+
+        return (self.get_or_build("digests", stat_key, build) / "blake2b").read_text()
+
+    def artifact_key(self, input_paths: list[Path], **settings) -> str:
+        """
+        Purpose:
+            入力ファイルの内容と設定から成果物のキーを計算する
+        Parameters:
+            input_paths: list[Path], 成果物の元になるファイル
+            settings: 成果物の作り方を決める値 (JSONに変換できる値)。値が変わると別の成果物になる
+        Returns:
+            str, 16進数のキー
+        """
+        key_source = json.dumps(
+            {"inputs": [self.file_digest(path) for path in input_paths], "settings": settings}, sort_keys=True
+        )
+        return hashlib.blake2b(key_source.encode(), digest_size=KEY_LENGTH // 2).hexdigest()
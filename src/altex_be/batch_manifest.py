@@ -0,0 +1,114 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from pathlib import Path
+import re
+import pandas as pd
+from .class_def.base_editors import BaseEditor
+from .gene_identifier_index import GeneIdentifierIndex
+
+MANIFEST_COLUMNS = ("output_prefix", "genes", "gene_file", "base_editors")
+# 出力ファイル名に使うため、パスの区切りなどを含まない名前だけを許可する
+OUTPUT_PREFIX_PATTERN = re.compile(r"^[A-Za-z0-9._-]+$")
+
+
+@dataclass(frozen=True)
+class BatchEntry:
+    """
+    バッチのマニフェストの1行 (1つの依頼) を保持するためのdataclass
+    """
+    output_prefix: str # 出力ファイル名の接頭辞
+    genes: tuple[str, ...] # 遺伝子記号、RefSeq ID、Ensembl ID
+    base_editor_names: tuple[str, ...] # 使用するbase editorの名前
+
+
+def split_manifest_cell(value) -> list[str]:
+    """
+    Purpose:
+        マニフェストのセルの値を ";" 、 "," または空白で区切ってリストにする。空のセルは空のリストにする
+    """
+    if pd.isna(value):
+        return []
+    return [item for item in re.split(r"[;,\s]+", str(value)) if item]
+
+
+def read_gene_list_file(gene_file: Path) -> list[str]:
+    """
+    Purpose:
+        1行に1つの遺伝子を書いたファイルを読み込む (--gene-file と同じ形式)
+    """
+    with open(gene_file) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def load_batch_manifest(manifest_path: Path, available_base_editors: dict[str, BaseEditor]) -> list[BatchEntry]:
+    """
+    Purpose:
+        バッチのマニフェスト (csv, tsv, txt) を読み込む
+        列: output_prefix (必須), genes (";" 区切り), gene_file (マニフェストからの相対パス), base_editors (";" 区切り)
+        genes と gene_file の少なくとも一方が必要。base_editors が空の場合は、利用可能なすべてのbase editorを使う
+    Parameters:
+        manifest_path: Path, マニフェストのパス
+        available_base_editors: dict[str, BaseEditor], プリセットと --be-files などで指定されたbase editor
+    Returns:
+        list[BatchEntry]
+    """
+    manifest_path = Path(manifest_path)
+    ext = manifest_path.suffix.lower()
+    if ext not in [".csv", ".tsv", ".txt"]:
+        raise ValueError("Unsupported file extension for batch manifest. Use .csv, .tsv, or .txt")
+    manifest_df = pd.read_csv(manifest_path, sep="," if ext == ".csv" else "\t", header=0, dtype=str)
+    unknown_columns = set(manifest_df.columns) - set(MANIFEST_COLUMNS)
+    if "output_prefix" not in manifest_df.columns or unknown_columns:
+        raise ValueError(f"Batch manifest columns are invalid. Expected columns: {list(MANIFEST_COLUMNS)}, but got: {list(manifest_df.columns)}")
+    if manifest_df.empty:
+        raise ValueError("Batch manifest has no entries")
+
+    entries = []
+    for _, row in manifest_df.iterrows():
+        output_prefix = str(row["output_prefix"]).strip()
+        if pd.isna(row["output_prefix"]) or not OUTPUT_PREFIX_PATTERN.match(output_prefix):
+            raise ValueError(f"Invalid output_prefix '{row['output_prefix']}' in batch manifest. Use letters, digits, '.', '_' or '-'")
+        genes = split_manifest_cell(row.get("genes"))
+        if not pd.isna(row.get("gene_file")):
+            genes += read_gene_list_file(manifest_path.parent / str(row["gene_file"]).strip())
+        if not genes:
+            raise ValueError(f"No genes are given for '{output_prefix}' in batch manifest")
+        base_editor_names = split_manifest_cell(row.get("base_editors")) or list(available_base_editors)
+        unknown_base_editors = [name for name in base_editor_names if name not in available_base_editors]
+        if unknown_base_editors:
+            raise ValueError(f"Unknown base editors for '{output_prefix}' in batch manifest: {unknown_base_editors}")
+        entries.append(BatchEntry(
+            output_prefix=output_prefix,
+            genes=tuple(dict.fromkeys(genes)),
+            base_editor_names=tuple(dict.fromkeys(base_editor_names)),
+        ))
+
+    duplicated = pd.Series([entry.output_prefix for entry in entries]).duplicated()
+    if duplicated.any():
+        raise ValueError(f"output_prefix must be unique in batch manifest: {[entries[i].output_prefix for i in duplicated[duplicated].index]}")
+    return entries
+
+
+def collect_batch_genes(entries: list[BatchEntry]) -> list[str]:
+    """
+    Purpose: すべての依頼の遺伝子を、重複なしで順に並べたリストを返す
+    """
+    return list(dict.fromkeys(gene for entry in entries for gene in entry.genes))
+
+
+def collect_batch_base_editors(entries: list[BatchEntry], available_base_editors: dict[str, BaseEditor]) -> dict[str, BaseEditor]:
+    """
+    Purpose: いずれかの依頼で使われるbase editorだけを返す
+    """
+    used_names = {name for entry in entries for name in entry.base_editor_names}
+    return {name: base_editor for name, base_editor in available_base_editors.items() if name in used_names}
+
+
+def select_entry_sgrnas(sgrna_df: pd.DataFrame, entry: BatchEntry, gene_index: GeneIdentifierIndex) -> pd.DataFrame:
+    """
+    Purpose:
+        すべての依頼をまとめて設計、オフターゲット計算したsgRNAのテーブルから、1つの依頼の遺伝子とbase editorの行を取り出す
+    """
+    gene_symbols = {gene_index.resolve(gene) for gene in entry.genes} - {None}
+    selected = sgrna_df["geneName"].isin(gene_symbols) & sgrna_df["base_editor_name"].isin(entry.base_editor_names)
+    return sgrna_df[selected.to_numpy()].reset_index(drop=True)
@@ -9,15 +9,15 @@ def format_sgrna_for_ucsc_custom_track(
         sgrna_df (pd.DataFrame): offtarget までの情報を含むsgRNA情報のDataFrame。
     Return : pd.DataFrame 12 bedに修正された DataFrame
     """
-    # score 列に1000を超える値が入ることがあるため、1000でクリップする
-    sgrna_df["pam+20bp_exact_match_count"] = sgrna_df["pam+20bp_exact_match_count"].apply(lambda x: 1000 if x > 1000 else x)
-
     bed_df = pd.DataFrame()
     bed_df["chrom"] = sgrna_df["chrom"]
     bed_df["chromStart"] = sgrna_df["sgrna_start_in_genome"]
     bed_df["chromEnd"] = sgrna_df["sgrna_end_in_genome"]
-    bed_df["name"] = sgrna_df["geneName"] + "_" + sgrna_df["site_type"] + "_" + sgrna_df["base_editor_name"]  + "_" + sgrna_df["uuid"]
-    bed_df["score"] = sgrna_df["pam+20bp_exact_match_count"]
+    bed_df["name"] = (
+        sgrna_df["geneName"].astype(str) + "_" + sgrna_df["site_type"].astype(str) + "_" + sgrna_df["base_editor_name"].astype(str) + "_" + sgrna_df["uuid"].astype(str)
+    )
+    # score 列に1000を超える値が入ることがあるため、1000でクリップする (入力のデータフレームは変更しない)
+    bed_df["score"] = sgrna_df["pam+20bp_exact_match_count"].clip(upper=1000)
     bed_df["strand"] = sgrna_df["sgrna_strand"]
     bed_df["thickStart"] = bed_df["chromStart"] # 別に必要ないが、9bed にするために追加
     bed_df["thickEnd"] = bed_df["chromEnd"]
@@ -28,4 +28,51 @@ def format_sgrna_for_ucsc_custom_track(
     
     # Reorder columns for BED9 format
     bed_df = bed_df[["chrom", "chromStart", "chromEnd", "name", "score", "strand", "thickStart", "thickEnd", "itemRgb"]]
-    return bed_df
\ No newline at end of file
+    return bed_df
+
+# bigBedに保存する列の型と説明 (BED9 + AltEx-BEの列)
+SGRNA_BIGBED_AUTOSQL = """table altexBeSgrna
+"sgRNAs designed by AltEx-BE"
+    (
+    string chrom;              "Reference sequence chromosome or scaffold"
+    uint   chromStart;         "Start position of sgRNA in chromosome"
+    uint   chromEnd;           "End position of sgRNA in chromosome"
+    string name;               "geneName_siteType_baseEditorName_uuid"
+    uint   score;              "Exact matches of PAM+20bp in the genome (clipped to 1000)"
+    char[1] strand;            "Strand of sgRNA"
+    uint   thickStart;         "Same as chromStart"
+    uint   thickEnd;           "Same as chromEnd"
+    uint   reserved;           "Color by base editor type (ABE: red, CBE: blue)"
+    uint   pam20ExactMatchCount; "Exact matches of PAM+20bp in the genome"
+    uint   pam12ExactMatchCount; "Exact matches of PAM+12bp (seed) in the genome"
+    uint   sgrnaPriority;      "Rank of sgRNA in the target exon (1 is the best)"
+    string geneName;           "Gene symbol of the target exon"
+    string siteType;           "Target splice site (acceptor or donor)"
+    string baseEditorName;     "Base editor used to design sgRNA"
+    string sgrnaSequence;      "sgRNA sequence"
+    )
+"""
+# SGRNA_BIGBED_AUTOSQL の拡張の列に対応するsgRNAテーブルの列
+SGRNA_BIGBED_EXTRA_COLUMNS = {
+    "pam20ExactMatchCount": "pam+20bp_exact_match_count",
+    "pam12ExactMatchCount": "pam+12bp_exact_match_count",
+    "sgrnaPriority": "sgrna_priority",
+    "geneName": "geneName",
+    "siteType": "site_type",
+    "baseEditorName": "base_editor_name",
+    "sgrnaSequence": "sgrna_sequence",
+}
+
+def format_sgrna_for_bigbed(
+    sgrna_df: pd.DataFrame,
+) -> pd.DataFrame:
+    """
+    Purpose : 最終出力のsgRNA情報を、SGRNA_BIGBED_AUTOSQL に対応したBED9+7形式に変換する
+    Parameters:
+        sgrna_df (pd.DataFrame): 優先順位付けまでの情報を含むsgRNA情報のDataFrame (変更しない)
+    Return : pd.DataFrame BED9の列の後に、オフターゲット数 (1000でクリップしない)、優先度などの列を持つDataFrame
+    """
+    bed_df = format_sgrna_for_ucsc_custom_track(sgrna_df)
+    for field, col in SGRNA_BIGBED_EXTRA_COLUMNS.items():
+        bed_df[field] = sgrna_df[col]
+    return bed_df.reset_index(drop=True)
@@ -0,0 +1,38 @@
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+
+# エキソンを同定する列 (explode_classified_refflatで重複を除いた後、この組み合わせは一意になる)
+EXON_ID_COLUMNS = ["chrom", "geneName", "exonStarts", "exonEnds", "strand"]
+# sgRNAを同定する列。同じsgRNAが複数のエキソンで設計されることがあるため、エキソンの座標も含める
+SGRNA_ID_COLUMNS = [
+    "chrom",
+    "sgrna_start_in_genome",
+    "sgrna_strand",
+    "base_editor_name",
+    "site_type",
+    "geneName",
+    "exonStarts",
+    "exonEnds",
+]
+
+
+def compute_content_ids(df: pd.DataFrame, id_columns: list[str], assembly_name: str | None = None) -> np.ndarray:
+    """
+    Purpose:
+        id_columnsの値 (とassembly_name) から、行ごとの64bitのIDを計算する
+        uuid4と異なり、同じ入力からは毎回同じIDが得られるため、実行間での比較、結合、キャッシュに使える
+    Parameters:
+        df: pd.DataFrame, IDを付ける行を持つデータフレーム
+        id_columns: list[str], IDの計算に使う列
+        assembly_name: str | None, 指定した場合はIDの計算に含める (異なるアセンブリ間でIDが衝突しないようにする)
+    Returns:
+        np.ndarray, uint64のID
+    Comments:
+        pandasのhash_pandas_objectは固定のキーを使うSipHashで、実行や環境によらず同じ値を返す。
+        列の型 (int/object/category) によってハッシュ値が変わらないように、すべての列を文字列にしてから計算する
+    """
+    key_df = df[id_columns].astype(str)
+    if assembly_name is not None:
+        key_df.insert(0, "assembly_name", assembly_name)
+    return pd.util.hash_pandas_object(key_df, index=False, categorize=True).to_numpy(dtype=np.uint64)
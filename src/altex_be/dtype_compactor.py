@@ -0,0 +1,95 @@
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+from .output_writer import is_arrow_available
+
+# 値の種類が少なく、行ごとに同じ文字列が繰り返される列 (categoryにすると各行は整数のコードだけを持つ)
+CATEGORICAL_COLUMNS = (
+    "chrom",
+    "strand",
+    "geneName",
+    "coding",
+    "frame",
+    "exontype",
+    "exon_position",
+    "cds_info",
+    "exon_intron_boundary_±25bp_sequence", # 同じエキソンから設計されたsgRNAの間で重複する
+    "site_type",
+    "sgrna_strand",
+    "base_editor_name",
+    "base_editor_pam_sequence",
+    "base_editor_type",
+    "offtarget_scanned_contigs",
+)
+# ゲノム座標と小さな整数の列。値がint32に収まる場合はint32にする
+INT32_COLUMNS = (
+    "exonStarts",
+    "exonEnds",
+    "exonlengths",
+    "chromStart_acceptor",
+    "chromEnd_acceptor",
+    "chromStart_donor",
+    "chromEnd_donor",
+    "acceptor_splice_site_shared_exon_count",
+    "donor_splice_site_shared_exon_count",
+    "splice_site_shared_exon_count",
+    "sgrna_target_pos_in_sgrna",
+    "sgrna_overlap_between_cds_and_editing_window",
+    "sgrna_possible_unintended_edited_base_count",
+    "sgrna_start_in_genome",
+    "sgrna_end_in_genome",
+    "base_editor_editing_window_start",
+    "base_editor_editing_window_end",
+    "pam+20bp_exact_match_count",
+    "pam+12bp_exact_match_count",
+)
+# 行ごとに値が異なる文字列の列。pyarrowがある場合はArrowの文字列型にする
+ARROW_STRING_COLUMNS = (
+    "sgrna_sequence",
+    "sgrna_target_sequence",
+    "crisprdirect_url",
+)
+INT32_MIN, INT32_MAX = np.iinfo(np.int32).min, np.iinfo(np.int32).max
+
+
+def to_int32_if_possible(series: pd.Series) -> pd.Series:
+    """
+    Purpose:
+        整数の列 (explodeの結果object型になっているものを含む) を、欠損値がなく値がint32に収まる場合にint32にする
+        変換できない場合はそのまま返す
+    """
+    if series.dtype == np.int32:
+        return series
+    values = pd.to_numeric(series, errors="coerce") if series.dtype == object else series
+    if not pd.api.types.is_integer_dtype(values) or values.isna().any():
+        return series
+    if len(values) and (values.min() < INT32_MIN or values.max() > INT32_MAX):
+        return series
+    return values.astype(np.int32)
+
+
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Purpose:
+        パイプラインの中間データフレームのメモリ使用量を減らすために、既知の列の型を変換する
+        CATEGORICAL_COLUMNS -> category, INT32_COLUMNS -> int32, ARROW_STRING_COLUMNS -> string[pyarrow]
+        存在しない列とすでに変換済みの列は無視するため、各ステージの後に何度呼び出してもよい
+    Parameters:
+        df: pd.DataFrame, 変換するデータフレーム (列を置き換える)
+    Returns:
+        pd.DataFrame, 型を変換したデータフレーム
+    Comments:
+        categoryのカテゴリは辞書順に並ぶため、sort_valuesの結果は文字列のままの場合と同じになる。
+        CSVに書き出す値も変わらない
+    """
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns and df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) == "string":
+            df[col] = df[col].astype("category")
+    for col in INT32_COLUMNS:
+        if col in df.columns:
+            df[col] = to_int32_if_possible(df[col])
+    if is_arrow_available():
+        for col in ARROW_STRING_COLUMNS:
+            if col in df.columns and df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) == "string":
+                df[col] = df[col].astype("string[pyarrow]")
+    return df
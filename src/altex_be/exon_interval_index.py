@@ -0,0 +1,275 @@
+from __future__ import annotations
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class ExonIntervalIndex:
+    """
+    染色体ごとに、エキソンの区間をstart順にソートした配列として保持するためのdataclass
+    区間は refFlat と同じく 0-based start, 1-based end (半開区間) で扱う
+    """
+    starts: dict[str, np.ndarray] # 染色体ごとの、start順にソートされたエキソンのstart
+    ends: dict[str, np.ndarray] # startsと同じ順序で並んだエキソンのend
+    row_offsets: dict[str, np.ndarray] # startsと同じ順序で並んだ、元のエキソンテーブルでの行番号
+    max_lengths: dict[str, int] # 染色体ごとの最大のエキソン長 (探索範囲の下限を決めるために使う)
+
+    def query(self, chrom: str, start: int, end: int) -> np.ndarray:
+        """
+        Purpose:
+            [start, end) の区間と1塩基以上重なるエキソンの、元のエキソンテーブルでの行番号を返す
+        Comments:
+            startがソートされているので、重なりうるエキソンは start - max_length <= exon_start < end を満たす範囲に限られる。
+            この範囲を二分探索で求めてから、exon_end > start で絞り込むため、アノテーション全体を走査する必要はない。
+        """
+        if chrom not in self.starts:
+            return np.empty(0, dtype=np.int64)
+        starts = self.starts[chrom]
+        lo = np.searchsorted(starts, start - self.max_lengths[chrom], side="left")
+        hi = np.searchsorted(starts, end, side="left")
+        candidate = slice(lo, hi)
+        overlapped = self.ends[chrom][candidate] > start
+        return self.row_offsets[chrom][candidate][overlapped]
+
+    def query_regions(self, regions: list[tuple[str, int, int]]) -> np.ndarray:
+        """
+        Purpose:
+            複数の区間のいずれかと重なるエキソンの行番号を、重複なしで昇順に返す
+        """
+        hits = [self.query(chrom, start, end) for chrom, start, end in regions]
+        if not hits:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(hits))
+
+
+def build_exon_interval_index(exon_df: pd.DataFrame) -> ExonIntervalIndex:
+    """
+    Purpose:
+        1エキソン1行のテーブルから、染色体ごとの区間インデックスを作成する
+    Parameters:
+        exon_df: pd.DataFrame, "chrom", "exonStarts", "exonEnds" 列を持ち、exonStarts/exonEndsがint型のデータフレーム
+    Returns:
+        ExonIntervalIndex
+    """
+    starts, ends, row_offsets, max_lengths = {}, {}, {}, {}
+    all_starts = exon_df["exonStarts"].to_numpy(dtype=np.int64)
+    all_ends = exon_df["exonEnds"].to_numpy(dtype=np.int64)
+    for chrom, positions in exon_df.groupby("chrom", sort=False, observed=True).indices.items():
+        order = positions[np.argsort(all_starts[positions], kind="stable")]
+        starts[chrom] = all_starts[order]
+        ends[chrom] = all_ends[order]
+        row_offsets[chrom] = order
+        max_lengths[chrom] = int((ends[chrom] - starts[chrom]).max())
+    return ExonIntervalIndex(starts=starts, ends=ends, row_offsets=row_offsets, max_lengths=max_lengths)
+
+
+# annotateが返す領域の種類。複数に重なる場合は、この順で先にあるものを優先する
+GENOMIC_REGION_TYPES = ("cds", "exon", "intron", "intergenic")
+
+
+def merge_intervals(starts: np.ndarray, ends: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Purpose:
+        重なる (または接する) 区間をまとめ、互いに重ならないstart順の区間の配列にする
+    """
+    if len(starts) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    order = np.argsort(starts, kind="stable")
+    starts, ends = starts[order], ends[order]
+    running_max_ends = np.maximum.accumulate(ends)
+    is_new = np.r_[True, starts[1:] > running_max_ends[:-1]]
+    group_starts = np.flatnonzero(is_new)
+    return starts[group_starts], np.maximum.reduceat(ends, group_starts)
+
+
+def overlaps_merged_intervals(merged: tuple[np.ndarray, np.ndarray], starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    Purpose:
+        [starts, ends) の各区間が、merge_intervalsでまとめた区間のいずれかと重なるかを二分探索でまとめて判定する
+    """
+    merged_starts, merged_ends = merged
+    if len(merged_starts) == 0:
+        return np.zeros(len(starts), dtype=bool)
+    # endがstartより大きい最初の区間だけを調べればよい (まとめた区間は互いに重ならないため)
+    candidate = np.searchsorted(merged_ends, starts, side="right")
+    in_range = candidate < len(merged_starts)
+    return in_range & (merged_starts[np.minimum(candidate, len(merged_starts) - 1)] < ends)
+
+
+@dataclass(frozen=True)
+class GenomeAnnotationIndex:
+    """
+    ゲノム全体のアノテーションを、染色体ごとのソートされた配列として保持するためのdataclass
+    オフターゲットサイトのような大量の区間を、CDS/エキソン/イントロン/遺伝子間のどこにあるか、まとめて分類するために使う
+    """
+    merged_intervals: dict[str, dict[str, tuple[np.ndarray, np.ndarray]]] # 領域の種類 -> 染色体 -> まとめた区間の (starts, ends)
+    gene_starts: dict[str, np.ndarray] # 染色体ごとの、start順にソートされた転写物のtxStart
+    gene_ends: dict[str, np.ndarray] # gene_startsと同じ順序で並んだ転写物のtxEnd
+    gene_names: dict[str, np.ndarray] # gene_startsと同じ順序で並んだ転写物の遺伝子名
+    gene_running_max_ends: dict[str, np.ndarray] # 先頭からその転写物までのtxEndの最大値
+    gene_running_max_rows: dict[str, np.ndarray] # gene_running_max_endsを与える転写物の位置
+
+    def find_overlapping_genes(self, chrom: str, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """
+        Purpose:
+            各区間と重なる遺伝子の名前を1つ返す (重なる遺伝子がない場合は None)
+        Comments:
+            区間のendより前から始まる最後の転写物が重ならない場合でも、それより前から始まる長い転写物が重なることがある。
+            そのため、先頭からのtxEndの最大値を持つ転写物も調べる
+        """
+        names = np.full(len(starts), None, dtype=object)
+        if chrom not in self.gene_starts:
+            return names
+        last = np.searchsorted(self.gene_starts[chrom], ends, side="left") - 1
+        has_candidate = last >= 0
+        last = np.maximum(last, 0)
+        by_last = has_candidate & (self.gene_ends[chrom][last] > starts)
+        by_running_max = has_candidate & ~by_last & (self.gene_running_max_ends[chrom][last] > starts)
+        names[by_last] = self.gene_names[chrom][last[by_last]]
+        names[by_running_max] = self.gene_names[chrom][self.gene_running_max_rows[chrom][last[by_running_max]]]
+        return names
+
+    def annotate(self, chroms: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Purpose:
+            [starts, ends) の各区間を、GENOMIC_REGION_TYPESのいずれかに分類し、重なる遺伝子の名前とともに返す
+        Parameters:
+            chroms, starts, ends: np.ndarray, 区間の染色体、0-based start、end
+        Returns:
+            tuple[np.ndarray, np.ndarray], (領域の種類, 遺伝子名 (ない場合は None))
+        """
+        chroms = np.asarray(chroms, dtype=object)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        region_types = np.full(len(starts), "intergenic", dtype=object)
+        gene_names = np.full(len(starts), None, dtype=object)
+        for chrom in pd.unique(chroms):
+            rows = np.flatnonzero(chroms == chrom)
+            unassigned = np.ones(len(rows), dtype=bool)
+            for region_type in GENOMIC_REGION_TYPES[:-1]:
+                merged = self.merged_intervals[region_type].get(chrom)
+                if merged is None:
+                    continue
+                hit = unassigned & overlaps_merged_intervals(merged, starts[rows], ends[rows])
+                region_types[rows[hit]] = region_type
+                unassigned &= ~hit
+            gene_names[rows] = self.find_overlapping_genes(chrom, starts[rows], ends[rows])
+        return region_types, gene_names
+
+
+def split_refflat_position_list(values: pd.Series) -> pd.Series:
+    """
+    Purpose: refFlatの "100,200," 形式の文字列 (前処理後のリストでもよい) を、1要素1行に展開する
+    """
+    if len(values) and isinstance(values.iloc[0], str):
+        values = values.str.rstrip(",").str.split(",")
+    return values.explode()
+
+
+def build_genome_annotation_index(refflat: pd.DataFrame) -> GenomeAnnotationIndex:
+    """
+    Purpose:
+        遺伝子で絞り込む前のrefFlatから、ゲノム全体のCDS、エキソン、転写物 (イントロンの判定に使う)、遺伝子の区間インデックスを作成する
+    Parameters:
+        refflat: pd.DataFrame, refFlatの列 (geneName, chrom, txStart, txEnd, cdsStart, cdsEnd, exonStarts, exonEnds) を持つデータフレーム
+    Returns:
+        GenomeAnnotationIndex
+    """
+    exon_starts = split_refflat_position_list(refflat["exonStarts"])
+    exon_ends = split_refflat_position_list(refflat["exonEnds"])
+    exon_df = pd.DataFrame({
+        "chrom": refflat["chrom"].reindex(exon_starts.index).to_numpy(),
+        "exonStarts": exon_starts.to_numpy(dtype=np.int64),
+        "exonEnds": exon_ends.to_numpy(dtype=np.int64),
+        "cdsStart": refflat["cdsStart"].reindex(exon_starts.index).to_numpy(dtype=np.int64),
+        "cdsEnd": refflat["cdsEnd"].reindex(exon_starts.index).to_numpy(dtype=np.int64),
+    })
+    # CDSはエキソンとcdsStart-cdsEndの重なり (non-codingの転写物では cdsStart == cdsEnd となり空になる)
+    exon_df["cds_start"] = np.maximum(exon_df["exonStarts"], exon_df["cdsStart"])
+    exon_df["cds_end"] = np.minimum(exon_df["exonEnds"], exon_df["cdsEnd"])
+    cds_df = exon_df[exon_df["cds_start"] < exon_df["cds_end"]]
+
+    interval_tables = {
+        "cds": (cds_df, "cds_start", "cds_end"),
+        "exon": (exon_df, "exonStarts", "exonEnds"),
+        "intron": (refflat, "txStart", "txEnd"),
+    }
+    merged_intervals = {}
+    for region_type, (table, start_col, end_col) in interval_tables.items():
+        merged_intervals[region_type] = {}
+        all_starts = table[start_col].to_numpy(dtype=np.int64)
+        all_ends = table[end_col].to_numpy(dtype=np.int64)
+        for chrom, positions in table.groupby("chrom", sort=False).indices.items():
+            merged_intervals[region_type][chrom] = merge_intervals(all_starts[positions], all_ends[positions])
+
+    # 遺伝子の全転写物の範囲を1つにまとめると転写物の間の領域も含んでしまうため、転写物ごとの範囲を使う
+    gene_starts, gene_ends, gene_names, gene_running_max_ends, gene_running_max_rows = {}, {}, {}, {}, {}
+    all_tx_starts = refflat["txStart"].to_numpy(dtype=np.int64)
+    all_tx_ends = refflat["txEnd"].to_numpy(dtype=np.int64)
+    all_gene_names = refflat["geneName"].to_numpy(dtype=object)
+    for chrom, positions in refflat.groupby("chrom", sort=False).indices.items():
+        order = positions[np.argsort(all_tx_starts[positions], kind="stable")]
+        ends = all_tx_ends[order]
+        running_max_ends = np.maximum.accumulate(ends)
+        gene_starts[chrom] = all_tx_starts[order]
+        gene_ends[chrom] = ends
+        gene_names[chrom] = all_gene_names[order]
+        gene_running_max_ends[chrom] = running_max_ends
+        gene_running_max_rows[chrom] = np.maximum.accumulate(np.where(ends == running_max_ends, np.arange(len(ends)), 0))
+    return GenomeAnnotationIndex(
+        merged_intervals=merged_intervals,
+        gene_starts=gene_starts,
+        gene_ends=gene_ends,
+        gene_names=gene_names,
+        gene_running_max_ends=gene_running_max_ends,
+        gene_running_max_rows=gene_running_max_rows,
+    )
+
+
+def explode_exons(refflat: pd.DataFrame) -> pd.DataFrame:
+    """
+    Purpose:
+        前処理済みのrefFlat (exonStarts/exonEndsがリスト) を、1エキソン1行のテーブルに変換する
+        "transcript_row" 列に、元のrefFlatでの行番号を保持する
+    """
+    exon_df = refflat[["geneName", "chrom", "exonStarts", "exonEnds"]].copy()
+    exon_df["transcript_row"] = np.arange(len(exon_df))
+    exon_df = exon_df.explode(["exonStarts", "exonEnds"]).dropna(subset=["exonStarts"])
+    exon_df[["exonStarts", "exonEnds"]] = exon_df[["exonStarts", "exonEnds"]].astype(np.int64)
+    return exon_df.reset_index(drop=True)
+
+
+def parse_region_string(region: str) -> tuple[str, int, int]:
+    """
+    Purpose:
+        "chr7:55,000,000-56,000,000" 形式 (UCSC genome browserと同じ1-based, 両端を含む) の文字列を
+        (chrom, start, end) の0-based半開区間に変換する
+    """
+    region = region.replace(",", "").strip()
+    chrom, sep, span = region.rpartition(":")
+    start_s, dash, end_s = span.partition("-")
+    if not sep or not chrom or not dash or not start_s.isdigit() or not end_s.isdigit():
+        raise ValueError(f"Invalid region format: '{region}'. Use chr:start-end (e.g. chr7:55000000-56000000)")
+    start, end = int(start_s), int(end_s)
+    if start < 1 or end < start:
+        raise ValueError(f"Invalid region coordinates: '{region}'. start must be >= 1 and <= end")
+    return chrom, start - 1, end
+
+
+def parse_regions_bed(bed_path) -> list[tuple[str, int, int]]:
+    """
+    Purpose:
+        BEDファイル (0-based start, 1-based end) の先頭3列から区間のリストを作成する
+        track/browser行とコメント行は無視する
+    """
+    regions = []
+    with open(bed_path, "r") as f:
+        for line in f:
+            if not line.strip() or line.startswith(("#", "track", "browser")):
+                continue
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) < 3 or not cols[1].isdigit() or not cols[2].isdigit():
+                raise ValueError(f"Invalid BED line in {bed_path}: '{line.rstrip()}'")
+            regions.append((cols[0], int(cols[1]), int(cols[2])))
+    return regions
@@ -0,0 +1,265 @@
+"""
+オフターゲットのゲノムスキャンで走査するコンティグ (FASTAのレコード) を選び、選んだレコードだけを読み込むモジュール。
+`--contigs` で指定する。
+
+- primary: 主要な染色体 (chr1-22, X, Y など、refFlatの前処理で残すものと同じ) だけを走査する
+- all: FASTAのすべてのレコードを走査する (従来の動作)
+- ファイル: 1行に1つのコンティグ名を書いたファイルに含まれるレコードだけを走査する
+
+FASTAのインデックス (.fai) がある場合は、選ばれなかったレコードをseekで読み飛ばし、読み込み自体を行わない。
+FASTAの隣に.faiがない場合は、register_fasta_index で登録したインデックス (--cache-dir に作ったもの) を使う。
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from pathlib import Path
+import logging
+from . import logging_config  # noqa: F401
+from .artifact_cache import ArtifactCache
+from .refflat_preprocessor import PRIMARY_CHROM_PATTERN
+
+CONTIG_POLICY_MODES = ("primary", "all")
+# FASTAのパス -> FASTAの隣以外にあるインデックス (.fai) のパス
+FASTA_INDEX_PATHS: dict[str, Path] = {}
+CACHED_FASTA_INDEX_FILE = "genome.fa.fai"
+
+
+@dataclass(frozen=True)
+class FastaIndexEntry:
+    """
+    FASTAのインデックス (.fai) の1行を保持するためのdataclass
+    """
+    name: str # レコード名 (ヘッダーの最初の単語)
+    length: int # 塩基数
+    offset: int # 配列の先頭のバイト位置
+    line_bases: int # 1行あたりの塩基数
+    line_width: int # 改行を含めた1行あたりのバイト数
+
+
+@dataclass(frozen=True)
+class ContigPolicy:
+    """
+    走査するコンティグの選び方を保持するためのdataclass
+    """
+    mode: str # "primary", "all" または "file"
+    contig_names: frozenset[str] | None = None # mode が "file" のときの、走査するコンティグ名
+    source: str | None = None # mode が "file" のときの、ファイル名
+
+    @property
+    def label(self) -> str:
+        """
+        出力に記録するための、走査したコンティグの選び方の表記 (例: "primary", "file:contigs.txt")
+        """
+        return f"file:{self.source}" if self.mode == "file" else self.mode
+
+    def includes(self, contig_name: str) -> bool:
+        if self.mode == "all":
+            return True
+        if self.mode == "primary":
+            return PRIMARY_CHROM_PATTERN.match(contig_name) is not None
+        return contig_name in self.contig_names
+
+
+def load_contig_policy(value: str) -> ContigPolicy:
+    """
+    Purpose:
+        --contigs の値 (primary, all またはコンティグ名を1行に1つ書いたファイルのパス) からContigPolicyを作る
+    Parameters:
+        value: str, --contigs の値
+    Returns:
+        ContigPolicy
+    """
+    if value in CONTIG_POLICY_MODES:
+        return ContigPolicy(mode=value)
+    contig_file = Path(value)
+    if not contig_file.is_file():
+        raise ValueError(f"--contigs must be 'primary', 'all', or a path to a file of contig names, but got: {value}")
+    with open(contig_file) as f:
+        # 空の行と、"#" で始まるコメント行は無視する
+        contig_names = frozenset(line.split()[0] for line in f if line.strip() and not line.startswith("#"))
+    if not contig_names:
+        raise ValueError(f"No contig names are given in {contig_file}")
+    return ContigPolicy(mode="file", contig_names=contig_names, source=contig_file.name)
+
+
+def register_fasta_index(fasta_path: Path, fai_path: Path) -> None:
+    """
+    Purpose: FASTAの隣にない (キャッシュに作った) インデックスを、そのFASTAのインデックスとして登録する
+    """
+    FASTA_INDEX_PATHS[str(Path(fasta_path).resolve())] = Path(fai_path)
+
+
+def find_fasta_index(fasta_path: Path) -> Path | None:
+    """
+    Purpose: FASTAのインデックスのパスを返す。FASTAの隣の.faiを優先し、なければ登録されたインデックスを返す
+    """
+    fai_path = Path(f"{fasta_path}.fai")
+    if fai_path.exists():
+        return fai_path
+    return FASTA_INDEX_PATHS.get(str(Path(fasta_path).resolve()))
+
+
+def build_fasta_index(fasta_path: Path, fai_path: Path) -> None:
+    """
+    Purpose:
+        samtools faidx と同じ形式のインデックス (.fai) を作り、fai_pathに保存する
+        レコードの途中で1行の長さが変わるFASTAにはインデックスを作れないため、ValueErrorを送出する
+    """
+    rows = []
+    name = None
+
+    def close_record():
+        if name is not None:
+            rows.append(f"{name}\t{length}\t{offset}\t{line_bases}\t{line_width}\n")
+
+    position = 0
+    with open(fasta_path, "rb") as fasta_file:
+        for line in fasta_file:
+            if line.startswith(b">"):
+                close_record()
+                fields = line[1:].decode().split()
+                name = fields[0] if fields else ""
+                length, offset, line_bases, line_width = 0, position + len(line), 0, 0
+                last_line_short = False
+            elif name is not None:
+                bases = len(line.rstrip(b"\r\n"))
+                if bases > 0:
+                    if last_line_short or (line_bases and (bases > line_bases or len(line) - bases != line_width - line_bases)):
+                        raise ValueError(f"Cannot index the FASTA file: lines of record '{name}' have different lengths.")
+                    if not line_bases:
+                        line_bases, line_width = bases, len(line)
+                    last_line_short = bases < line_bases
+                    length += bases
+            position += len(line)
+        close_record()
+    with open(fai_path, "w") as f:
+        f.writelines(rows)
+
+
+def prepare_cached_fasta_index(cache: ArtifactCache, fasta_path: Path) -> Path | None:
+    """
+    Purpose:
+        FASTAの隣にインデックス (.fai) がない場合に、FASTAの内容をキーにしてキャッシュにインデックスを作り、登録する
+        インデックスを作れないFASTAの場合は警告を出してNoneを返す (インデックスなしで先頭から読む)
+    """
+    fai_path = Path(f"{fasta_path}.fai")
+    if fai_path.exists():
+        return fai_path
+    try:
+        index_dir = cache.get_or_build(
+            "fasta_index",
+            cache.artifact_key([fasta_path]),
+            lambda build_dir: build_fasta_index(fasta_path, build_dir / CACHED_FASTA_INDEX_FILE),
+        )
+    except ValueError as e:
+        logging.warning(f"{e} The FASTA file is read without an index.")
+        return None
+    register_fasta_index(fasta_path, index_dir / CACHED_FASTA_INDEX_FILE)
+    return index_dir / CACHED_FASTA_INDEX_FILE
+
+
+def read_fasta_index(fasta_path: Path) -> list[FastaIndexEntry] | None:
+    """
+    Purpose:
+        FASTAのインデックス (.fai, samtools faidx で作成) をレコードの順に読み込む。インデックスがない場合はNoneを返す
+    """
+    fai_path = find_fasta_index(fasta_path)
+    if fai_path is None:
+        return None
+    entries = []
+    with open(fai_path) as f:
+        for line in f:
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) >= 5:
+                entries.append(FastaIndexEntry(cols[0], int(cols[1]), int(cols[2]), int(cols[3]), int(cols[4])))
+    return entries
+
+
+def read_indexed_record(fasta_file, entry: FastaIndexEntry) -> bytes:
+    """
+    Purpose:
+        インデックスの位置からレコードの配列だけを読み込み、改行を除いたbytesを返す
+    """
+    if entry.length == 0:
+        return b""
+    full_lines, remainder = divmod(entry.length, entry.line_bases)
+    fasta_file.seek(entry.offset)
+    sequence = fasta_file.read(full_lines * entry.line_width + remainder).replace(b"\n", b"").replace(b"\r", b"")
+    if len(sequence) != entry.length:
+        raise ValueError(f"FASTA index does not match the FASTA file at record '{entry.name}'. Please re-create it with `samtools faidx`.")
+    return sequence
+
+
+def select_indexed_contigs(fasta_path: Path, contig_policy: ContigPolicy) -> list[FastaIndexEntry] | None:
+    """
+    Purpose:
+        インデックスがある場合に、contig_policyで選ばれたレコードを返す。インデックスがない場合はNoneを返す
+    """
+    index_entries = read_fasta_index(fasta_path)
+    if index_entries is None:
+        return None
+    return [entry for entry in index_entries if contig_policy.includes(entry.name)]
+
+
+def count_selected_records(fasta_path: Path, contig_policy: ContigPolicy | None = None) -> int:
+    """
+    Purpose:
+        走査するレコードの数を返し、走査するコンティグと読み飛ばす塩基数をログに出す (進捗の表示に使う)
+        インデックスがない場合は、ヘッダー行を数える
+    """
+    contig_policy = contig_policy or ContigPolicy(mode="all")
+    index_entries = read_fasta_index(fasta_path)
+    if index_entries is None:
+        with open(fasta_path, "rb") as fasta_file:
+            record_count = sum(
+                1 for line in fasta_file
+                if line.startswith(b">") and contig_policy.includes(line[1:].decode().split()[0] if line[1:].split() else "")
+            )
+        logging.info(f"Number of contigs to scan in your FASTA file: {record_count} (--contigs {contig_policy.label})")
+        if contig_policy.mode != "all":
+            logging.info(f"No FASTA index (.fai) found. Excluded contigs are still read from the file; run `samtools faidx {fasta_path}` to skip them.")
+        return record_count
+
+    selected = [entry for entry in index_entries if contig_policy.includes(entry.name)]
+    if contig_policy.mode == "file":
+        missing = sorted(contig_policy.contig_names - {entry.name for entry in index_entries})
+        if missing:
+            logging.warning(f"These contigs given by --contigs are not in the FASTA file: {missing}")
+    skipped_bases = sum(entry.length for entry in index_entries) - sum(entry.length for entry in selected)
+    logging.info(f"Scanning {len(selected)} of {len(index_entries)} contigs in your FASTA file (--contigs {contig_policy.label}); skipping {skipped_bases:,} bp")
+    return len(selected)
+
+
+def iter_fasta_records(fasta_path: Path, contig_policy: ContigPolicy | None = None):
+    """
+    Purpose:
+        FASTAファイルをバイナリで読み込み、contig_policyで選ばれたレコードの (レコード名, 配列のbytes) を1つずつ返す
+        インデックス (.fai) がある場合は、選ばれたレコードの位置にseekして配列だけを読み込む。
+        インデックスがない場合は先頭から読み、選ばれなかったレコードの行は保持しない
+    Parameters:
+        fasta_path: Path, FASTAファイルのパス
+        contig_policy: ContigPolicy | None, 指定しない場合はすべてのレコードを返す
+    """
+    contig_policy = contig_policy or ContigPolicy(mode="all")
+    selected = select_indexed_contigs(fasta_path, contig_policy) if contig_policy.mode != "all" else None
+    if selected is not None:
+        with open(fasta_path, "rb") as fasta_file:
+            for entry in selected:
+                yield entry.name, read_indexed_record(fasta_file, entry)
+        return
+
+    with open(fasta_path, "rb") as fasta_file:
+        name = None
+        chunks = []
+        for line in fasta_file:
+            if line.startswith(b">"):
+                if name is not None:
+                    yield name, b"".join(chunks)
+                fields = line[1:].decode().split()
+                name = fields[0] if fields else ""
+                if not contig_policy.includes(name):
+                    name = None
+                chunks = []
+            elif name is not None:
+                chunks.append(line.strip())
+        if name is not None:
+            yield name, b"".join(chunks)
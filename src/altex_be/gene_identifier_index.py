@@ -0,0 +1,93 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+
+def strip_version(identifier: str) -> str:
+    """
+    Purpose:
+        "ENST00000269305.9" や "NM_000546.6" のようなバージョン付きのIDから、バージョンを取り除く
+        バージョンが付いていないIDはそのまま返す
+    """
+    stem, dot, version = identifier.rpartition(".")
+    if dot and stem and version.isdigit():
+        return stem
+    return identifier
+
+
+@dataclass(frozen=True)
+class GeneIdentifierIndex:
+    """
+    遺伝子記号、エイリアス、RefSeq ID、Ensembl ID (バージョンの有無を問わない) から
+    遺伝子記号と、その遺伝子に属するトランスクリプトの行番号を引くためのdataclass
+    """
+    symbol_by_identifier: dict[str, str] # 各種ID -> 遺伝子記号
+    rows_by_symbol: dict[str, np.ndarray] # 遺伝子記号 -> refFlatでの行番号
+
+    def resolve(self, identifier: str) -> str | None:
+        """
+        Purpose:
+            IDを遺伝子記号に変換する。見つからない場合はNoneを返す
+        """
+        symbol = self.symbol_by_identifier.get(identifier)
+        if symbol is None:
+            symbol = self.symbol_by_identifier.get(strip_version(identifier))
+        return symbol
+
+    def rows(self, identifiers) -> np.ndarray:
+        """
+        Purpose:
+            IDのリストに対応する遺伝子の、すべてのトランスクリプトの行番号を昇順で返す
+        """
+        hits = [self.rows_by_symbol[symbol] for symbol in {self.resolve(i) for i in identifiers} if symbol is not None]
+        if not hits:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(hits))
+
+
+def build_gene_identifier_index(refflat: pd.DataFrame, aliases: dict[str, str] | None = None) -> GeneIdentifierIndex:
+    """
+    Purpose:
+        refFlatのデータフレームからGeneIdentifierIndexを作成する。アノテーションごとに1度だけ作成すればよい
+    Parameters:
+        refflat: pd.DataFrame, "geneName" と "name" 列を持つrefFlatのデータフレーム
+        aliases: dict[str, str] | None, エイリアス -> 遺伝子記号 の辞書
+    Returns:
+        GeneIdentifierIndex
+    """
+    gene_names = refflat["geneName"].to_numpy()
+    transcript_names = refflat["name"].to_numpy()
+    rows_by_symbol = {
+        symbol: rows.astype(np.int64)
+        for symbol, rows in refflat.groupby("geneName", sort=False, observed=True).indices.items()
+    }
+    symbol_by_identifier: dict[str, str] = {}
+    # 優先度の低いものから登録し、遺伝子記号そのものが最後に上書きされるようにする
+    for alias, symbol in (aliases or {}).items():
+        if symbol in rows_by_symbol:
+            symbol_by_identifier[alias] = symbol
+    symbol_by_identifier.update(zip(map(strip_version, transcript_names), gene_names))
+    symbol_by_identifier.update(zip(transcript_names, gene_names))
+    symbol_by_identifier.update((symbol, symbol) for symbol in rows_by_symbol)
+    return GeneIdentifierIndex(symbol_by_identifier=symbol_by_identifier, rows_by_symbol=rows_by_symbol)
+
+
+def load_gene_aliases(alias_path: Path) -> dict[str, str]:
+    """
+    Purpose:
+        1列目にエイリアス、2列目に遺伝子記号を持つタブ区切りファイルを読み込み、エイリアス -> 遺伝子記号 の辞書を返す
+        (例: HGNCの "Alias symbol" / "Previous symbol" と "Approved symbol")
+        #で始まる行は無視する
+    """
+    aliases = {}
+    with open(alias_path, "r") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) < 2:
+                raise ValueError(f"Invalid line in gene alias file {alias_path}: '{line.rstrip()}'")
+            aliases[cols[0].strip()] = cols[1].strip()
+    return aliases
@@ -0,0 +1,377 @@
+"""
+ゲノムの接尾辞配列 (suffix array) のインデックス。`--genome-index` を指定したときに使われる。
+
+選ばれたコンティグ (`--contigs`) の配列を1本につなげた塩基コードの配列と、その接尾辞配列をディレクトリに保存し、
+次回以降はメモリマップで読み込む。オフターゲットの条件 (spacerまたはseed + PAM) は、配列の長さによらず
+二分探索で接尾辞配列の範囲を求めてから隣接するPAMを確認するので、ゲノムを走査し直さずに数と位置が得られる。
+
+- 接尾辞配列の構築は、pydivsufsortがあればそれを使い (pip install "AltEx-BE[index]")、なければNumPyのprefix doublingで行う
+  (NumPyでの構築は配列長の数十倍のメモリを使うため、ヒトなどの大きなゲノムではpydivsufsortを使うこと)
+- 配列長が2^31未満の場合は接尾辞配列をint32で、それ以上の場合はint64で保存する
+- 塩基コードは大文字小文字を区別しないので、RepeatMaskerのソフトマスク (小文字の区間) は別に区間のリストとして保存する
+- 保存したインデックスは、FASTAのファイル名、サイズ、更新時刻で同じFASTAから作られたかを確認する。
+  更新時刻だけが違う場合 (コピーした場合など) は、構築時に記録したFASTAのハッシュと比べる
+- 構築中はディレクトリのロックを持つので、同じディレクトリを指定して同時に起動したジョブは、1つのジョブの構築が終わるのを待って使う
+- `--genome-index` にディレクトリを指定しない場合は、`--cache-dir` にFASTAの内容と `--contigs` をキーにして保存する
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from pathlib import Path
+import json
+import logging
+import numpy as np
+import pandas as pd
+from . import logging_config  # noqa: F401
+from .artifact_cache import ArtifactCache, atomic_output_path, file_lock, hash_file
+from .fasta_contigs import ContigPolicy, iter_fasta_records
+from .native_kernels import BASE_CODE_TABLE, IUPAC_BASE_MASKS, OfftargetQuery
+
+try:
+    from pydivsufsort import divsufsort
+except ImportError:  # pydivsufsortは任意の依存 (pip install "AltEx-BE[index]")
+    divsufsort = None
+
+INDEX_FORMAT_VERSION = 3 # 3: index.json にFASTAの更新時刻とハッシュを記録する
+SEPARATOR_CODE = 5 # レコードの区切り。どの塩基 (0-3) やN (4) とも一致しない
+TEXT_FILE = "genome_codes.u8"
+SUFFIX_ARRAY_FILE = "suffix_array.npy"
+CONTIGS_FILE = "contigs.tsv"
+SOFT_MASK_FILE = "soft_masked_intervals.npy"
+PACKED_PREFIX_LENGTH = 21 # 接尾辞配列をNumPyで作るとき、最初に1つのint64に詰める文字数 (1文字3bit)
+METADATA_FILE = "index.json" # 構築の最後に書き出すので、このファイルがあるインデックスは完全に構築されている
+BUILD_LOCK_FILE = ".build.lock"
+LOCATE_CHUNK_SIZE = 1 << 22 # 一度にPAMを確認する一致の数の上限 (メモリを抑えるため)
+
+
+def build_suffix_array_numpy(text: np.ndarray) -> np.ndarray:
+    """
+    Purpose:
+        prefix doubling (先頭 k 文字での順位から 2k 文字での順位を求めることを繰り返す) で接尾辞配列を作る
+        最初に先頭 PACKED_PREFIX_LENGTH 文字を1つの整数に詰めて順位を付け、そこから k を倍にしていく
+        末尾を越えた位置は最も小さい文字として扱う (短い接尾辞が先に来る)
+    """
+    n = text.size
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    # 1文字を3bit (0は末尾を越えた位置) で詰める
+    codes = text.astype(np.int64) + 1
+    key = np.zeros(n, dtype=np.int64)
+    for j in range(PACKED_PREFIX_LENGTH):
+        key <<= 3
+        if j < n:
+            key[:n - j] |= codes[j:]
+    suffix_array = np.argsort(key, kind="stable")
+    sorted_key = key[suffix_array]
+    is_new_rank = np.empty(n, dtype=bool)
+    is_new_rank[0] = True
+    is_new_rank[1:] = sorted_key[1:] != sorted_key[:-1]
+    k = PACKED_PREFIX_LENGTH
+    while not is_new_rank.all() and k < n:
+        rank = np.empty(n, dtype=np.int64)
+        rank[suffix_array] = np.cumsum(is_new_rank)
+        # (先頭 k 文字の順位, 次の k 文字の順位) の組で並べ替える (0は末尾を越えた位置)
+        # 2つの順位を1つの整数に詰めると、配列長が約30億を超えるときにint64があふれるため、np.lexsortで組のまま比べる
+        next_rank = np.zeros(n, dtype=np.int64)
+        next_rank[:n - k] = rank[k:]
+        suffix_array = np.lexsort((next_rank, rank))
+        sorted_rank, sorted_next_rank = rank[suffix_array], next_rank[suffix_array]
+        is_new_rank[1:] = (sorted_rank[1:] != sorted_rank[:-1]) | (sorted_next_rank[1:] != sorted_next_rank[:-1])
+        k *= 2
+    return suffix_array
+
+
+def build_suffix_array(text: np.ndarray) -> np.ndarray:
+    """
+    Purpose: 接尾辞配列を作る。配列長に応じてint32またはint64にする
+    """
+    dtype = np.int32 if text.size < 2**31 else np.int64
+    if divsufsort is not None:
+        return np.asarray(divsufsort(np.ascontiguousarray(text)), dtype=dtype)
+    logging.info("pydivsufsort is not installed. Building the suffix array with NumPy (slow and memory-intensive for large genomes).")
+    return build_suffix_array_numpy(text).astype(dtype)
+
+
+@dataclass(frozen=True)
+class GenomeIndex:
+    """
+    ゲノムの接尾辞配列のインデックスを保持するためのdataclass
+    """
+    text: np.ndarray # 塩基コード (A=0, C=1, G=2, T=3, その他=4) をレコードの区切り (SEPARATOR_CODE) でつないだ配列
+    suffix_array: np.ndarray
+    contig_names: list[str]
+    contig_offsets: np.ndarray # 各レコードのtextでの開始位置
+    contig_policy_label: str
+    soft_masked_intervals: np.ndarray # ソフトマスクされた区間 (textでの [start, end)) を開始位置の順に並べた shape (n, 2) の配列
+
+    def overlaps_soft_mask(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """
+        Purpose: textでの各区間 [start, end) が、ソフトマスクされた塩基を含むかを返す
+        """
+        # 区間は重ならずに並んでいるので、startより後で終わる最初の区間だけを確認すればよい
+        interval_ids = np.searchsorted(self.soft_masked_intervals[:, 1], starts, side="right")
+        found = interval_ids < len(self.soft_masked_intervals)
+        overlaps = np.zeros(starts.size, dtype=bool)
+        overlaps[found] = self.soft_masked_intervals[interval_ids[found], 0] < ends[found]
+        return overlaps
+
+    def gather_windows(self, starts: np.ndarray, length: int) -> np.ndarray:
+        """
+        Purpose: 各開始位置から length 文字を取り出す。末尾を越えた位置は -1 にする (接尾辞配列と同じ順序になるように)
+        """
+        positions = starts[:, None].astype(np.int64) + np.arange(length, dtype=np.int64)
+        inside = positions < self.text.size
+        windows = np.full(positions.shape, -1, dtype=np.int16)
+        windows[inside] = self.text[positions[inside]]
+        return windows
+
+    def find_ranges(self, patterns: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Purpose:
+            同じ長さのパターン (塩基コードの2次元配列) ごとに、接尾辞配列でそのパターンから始まる接尾辞の範囲 [lower, upper) を二分探索で求める
+        """
+        n_patterns, length = patterns.shape
+        patterns = patterns.astype(np.int16)
+        bounds = []
+        for is_upper in (False, True):
+            lower = np.zeros(n_patterns, dtype=np.int64)
+            upper = np.full(n_patterns, self.suffix_array.size, dtype=np.int64)
+            active = np.flatnonzero(lower < upper)
+            while active.size:
+                middle = (lower[active] + upper[active]) // 2
+                windows = self.gather_windows(np.asarray(self.suffix_array[middle]), length)
+                differs = windows != patterns[active]
+                first = differs.argmax(axis=1)
+                rows = np.arange(active.size)
+                window_is_smaller = differs.any(axis=1) & (windows[rows, first] < patterns[active][rows, first])
+                # lowerはパターン以上の最初の接尾辞、upperはパターンより大きい最初の接尾辞 (パターンから始まるものはパターンと等しいとみなす)
+                go_right = window_is_smaller | (is_upper & ~differs.any(axis=1))
+                lower[active] = np.where(go_right, middle + 1, lower[active])
+                upper[active] = np.where(go_right, upper[active], middle)
+                active = active[lower[active] < upper[active]]
+            bounds.append(lower)
+        return bounds[0], bounds[1]
+
+    def to_contig_positions(self, positions: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Purpose: textでの位置を (レコードの番号, レコード内の0-based位置) に変換する
+        """
+        contig_ids = np.searchsorted(self.contig_offsets, positions, side="right") - 1
+        return contig_ids, positions - self.contig_offsets[contig_ids]
+
+    def count_queries(self, queries: set[OfftargetQuery], site_recorder=None) -> dict[OfftargetQuery, int]:
+        """
+        Purpose:
+            各条件 (配列の完全一致と、隣接するPAMの縮退したパターンへの一致) を満たす箇所の数を、接尾辞配列で数える
+            配列 (spacerまたはseed) の範囲を二分探索で求め、範囲内の各位置で隣接する塩基をPAMのパターンと比べる
+            site_recorderを指定した場合は、記録する条件の一致の位置を、ゲノムの走査と同じ順 (FASTAのレコード順、位置順) で記録する
+        Returns:
+            dict[OfftargetQuery, int], 条件 -> 出現回数
+        """
+        offtarget_count_dict = {query: 0 for query in queries}
+        groups: dict[tuple[int, int], list[OfftargetQuery]] = {}
+        for query in queries:
+            groups.setdefault((len(query.sequence), len(query.pam_pattern)), []).append(query)
+
+        for (length, pam_length), group in groups.items():
+            patterns = BASE_CODE_TABLE[np.frombuffer("".join(query.sequence for query in group).encode(), dtype=np.uint8)].reshape(len(group), length)
+            lower, upper = self.find_ranges(patterns)
+            pam_masks = np.array([[IUPAC_BASE_MASKS[base] for base in query.pam_pattern.upper()] for query in group], dtype=np.uint8).reshape(len(group), pam_length)
+            pam_on_right = np.array([query.pam_side == "right" for query in group])
+            record_sites = np.array([site_recorder is not None and query in site_recorder.queries for query in group])
+            counts = np.zeros(len(group), dtype=np.int64)
+            site_query_ids, site_positions = [], []
+
+            # 一致の数が多い条件があってもメモリを抑えられるように、一致の数の合計がLOCATE_CHUNK_SIZE程度になるように条件を分ける
+            match_counts = upper - lower
+            chunk_ids = np.cumsum(match_counts) // LOCATE_CHUNK_SIZE
+            for chunk_id in np.unique(chunk_ids):
+                query_ids = np.flatnonzero(chunk_ids == chunk_id)
+                query_ids = query_ids[match_counts[query_ids] > 0]
+                if query_ids.size == 0:
+                    continue
+                repeated_ids = np.repeat(query_ids, match_counts[query_ids])
+                offsets_in_range = np.arange(repeated_ids.size) - np.repeat(np.cumsum(match_counts[query_ids]) - match_counts[query_ids], match_counts[query_ids])
+                positions = np.asarray(self.suffix_array[lower[repeated_ids] + offsets_in_range]).astype(np.int64)
+                pam_starts = np.where(pam_on_right[repeated_ids], positions + length, positions - pam_length)
+                matched = (pam_starts >= 0) & (pam_starts + pam_length <= self.text.size)
+                for j in range(pam_length):
+                    bases = self.text[np.clip(pam_starts + j, 0, self.text.size - 1)].astype(np.uint8)
+                    matched &= ((pam_masks[repeated_ids, j] >> bases) & 1).astype(bool)
+                counts += np.bincount(repeated_ids[matched], minlength=len(group))
+                to_record = matched & record_sites[repeated_ids]
+                site_query_ids.append(repeated_ids[to_record])
+                site_positions.append(np.minimum(positions, pam_starts)[to_record])
+
+            for query, count in zip(group, counts.tolist()):
+                offtarget_count_dict[query] = count
+            if site_recorder is not None and site_query_ids:
+                self.record_sites(group, np.concatenate(site_query_ids), np.concatenate(site_positions), site_recorder)
+        return offtarget_count_dict
+
+    def record_sites(self, group: list[OfftargetQuery], query_ids: np.ndarray, positions: np.ndarray, site_recorder) -> None:
+        """
+        Purpose: 一致の位置を、条件ごとにゲノムの順に並べてsite_recorderに記録する
+        """
+        order = np.lexsort((positions, query_ids))
+        query_ids, positions = query_ids[order], positions[order]
+        # 条件ごとに先頭から max_sites_per_sgrna 個だけを記録する
+        rank_in_query = np.arange(query_ids.size) - np.searchsorted(query_ids, query_ids, side="left")
+        keep = rank_in_query < site_recorder.max_sites_per_sgrna
+        query_ids, positions = query_ids[keep], positions[keep]
+        site_lengths = np.array([query.site_length for query in group], dtype=np.int64)[query_ids]
+        in_repeat = self.overlaps_soft_mask(positions, positions + site_lengths)
+        contig_ids, contig_positions = self.to_contig_positions(positions)
+        for query_id, contig_id, position, site_in_repeat in zip(query_ids.tolist(), contig_ids.tolist(), contig_positions.tolist(), in_repeat.tolist()):
+            site_recorder.add(group[query_id], self.contig_names[contig_id], position, site_in_repeat)
+
+
+def find_soft_masked_intervals(sequence: np.ndarray) -> np.ndarray:
+    """
+    Purpose: 配列 (bytesのuint8) の中で、小文字 (ソフトマスク) が続く区間を shape (n, 2) の [start, end) で返す
+    """
+    is_lower = np.concatenate([[0], (sequence >= ord("a")).astype(np.int8), [0]])
+    edges = np.diff(is_lower)
+    return np.stack([np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)], axis=1).astype(np.int64)
+
+
+def build_genome_index(
+    fasta_path: Path,
+    index_dir: Path,
+    contig_policy: ContigPolicy | None = None,
+    fasta_digest: str | None = None,
+) -> GenomeIndex:
+    """
+    Purpose:
+        FASTAの選ばれたレコードから接尾辞配列のインデックスを作り、index_dirに保存する
+    Parameters:
+        fasta_path: Path, FASTAファイルのパス
+        index_dir: Path, インデックスを保存するディレクトリ
+        contig_policy: ContigPolicy | None, インデックスに含めるコンティグ (指定しない場合はすべてのレコード)
+        fasta_digest: str | None, FASTAの内容のハッシュ (hash_file)。指定しない場合は計算する
+    Returns:
+        GenomeIndex
+    """
+    contig_policy = contig_policy or ContigPolicy(mode="all")
+    index_dir.mkdir(parents=True, exist_ok=True)
+    contig_rows = []
+    soft_masked_intervals = []
+    offset = 0
+    with open(index_dir / TEXT_FILE, "wb") as text_file:
+        for name, sequence in iter_fasta_records(fasta_path, contig_policy):
+            sequence = np.frombuffer(sequence, dtype=np.uint8)
+            text_file.write(BASE_CODE_TABLE[sequence].tobytes())
+            text_file.write(bytes([SEPARATOR_CODE]))
+            soft_masked_intervals.append(find_soft_masked_intervals(sequence) + offset)
+            contig_rows.append((name, offset, len(sequence)))
+            offset += len(sequence) + 1
+    pd.DataFrame(contig_rows, columns=["name", "offset", "length"]).to_csv(index_dir / CONTIGS_FILE, sep="\t", index=False)
+    np.save(index_dir / SOFT_MASK_FILE, np.concatenate(soft_masked_intervals) if soft_masked_intervals else np.empty((0, 2), dtype=np.int64))
+
+    logging.info(f"Building the suffix array of {offset:,} bases in {len(contig_rows)} contigs...")
+    text = np.fromfile(index_dir / TEXT_FILE, dtype=np.uint8)
+    np.save(index_dir / SUFFIX_ARRAY_FILE, build_suffix_array(text))
+    del text
+
+    fasta_stat = Path(fasta_path).stat()
+    metadata = {
+        "format_version": INDEX_FORMAT_VERSION,
+        "fasta_name": Path(fasta_path).name,
+        "fasta_size": fasta_stat.st_size,
+        "fasta_mtime_ns": fasta_stat.st_mtime_ns,
+        "fasta_digest": fasta_digest or hash_file(fasta_path),
+        "contigs": contig_policy.label,
+    }
+    with atomic_output_path(index_dir / METADATA_FILE) as metadata_path, open(metadata_path, "w") as f:
+        json.dump(metadata, f, indent=2)
+    logging.info(f"Genome index saved to: {index_dir}")
+    return load_genome_index(index_dir, fasta_path, contig_policy)
+
+
+def load_genome_index(
+    index_dir: Path,
+    fasta_path: Path,
+    contig_policy: ContigPolicy | None = None,
+    check_fasta: bool = True,
+) -> GenomeIndex | None:
+    """
+    Purpose:
+        保存された接尾辞配列のインデックスをメモリマップで読み込む。インデックスがない場合はNoneを返す
+        別のFASTAや、別の --contigs から作られたインデックスの場合はValueErrorを送出する
+        FASTAの更新時刻が構築時と違う場合は、FASTAのハッシュを計算して、構築時のハッシュと比べる
+        (キャッシュのインデックスはFASTAの内容で選んでいるので、check_fasta=False でファイル名と内容を比べない)
+    """
+    contig_policy = contig_policy or ContigPolicy(mode="all")
+    metadata_path = Path(index_dir) / METADATA_FILE
+    if not metadata_path.exists():
+        return None
+    with open(metadata_path) as f:
+        metadata = json.load(f)
+    fasta_stat = Path(fasta_path).stat()
+    expected = {
+        "format_version": INDEX_FORMAT_VERSION,
+        "fasta_name": Path(fasta_path).name,
+        "fasta_size": fasta_stat.st_size,
+        "contigs": contig_policy.label,
+    }
+    if not check_fasta:
+        del expected["fasta_name"]
+    mismatched = {key: metadata.get(key) for key, value in expected.items() if metadata.get(key) != value}
+    if check_fasta and not mismatched and metadata.get("fasta_mtime_ns") != fasta_stat.st_mtime_ns:
+        logging.info(f"{fasta_path} was modified after the genome index was built. Comparing its contents...")
+        expected["fasta_digest"] = hash_file(fasta_path)
+        if metadata.get("fasta_digest") != expected["fasta_digest"]:
+            mismatched["fasta_digest"] = metadata.get("fasta_digest")
+    if mismatched:
+        raise ValueError(
+            f"The genome index in {index_dir} does not match this run ({mismatched}, expected {expected}). "
+            "Use another --genome-index directory or remove the old index."
+        )
+    contigs_df = pd.read_csv(Path(index_dir) / CONTIGS_FILE, sep="\t", dtype={"name": str})
+    return GenomeIndex(
+        text=np.memmap(Path(index_dir) / TEXT_FILE, dtype=np.uint8, mode="r"),
+        suffix_array=np.load(Path(index_dir) / SUFFIX_ARRAY_FILE, mmap_mode="r"),
+        contig_names=contigs_df["name"].tolist(),
+        contig_offsets=contigs_df["offset"].to_numpy(dtype=np.int64),
+        contig_policy_label=metadata["contigs"],
+        soft_masked_intervals=np.load(Path(index_dir) / SOFT_MASK_FILE),
+    )
+
+
+def prepare_genome_index(index_dir: Path, fasta_path: Path, contig_policy: ContigPolicy | None = None) -> GenomeIndex:
+    """
+    Purpose: 保存されたインデックスを読み込む。まだない場合は作成して保存する
+    """
+    genome_index = load_genome_index(index_dir, fasta_path, contig_policy)
+    if genome_index is not None:
+        logging.info(f"Using the genome index in: {index_dir}")
+        return genome_index
+    index_dir.mkdir(parents=True, exist_ok=True)
+    with file_lock(index_dir / BUILD_LOCK_FILE):
+        # ロックを待っている間に、ほかのジョブが構築を終えている場合がある
+        genome_index = load_genome_index(index_dir, fasta_path, contig_policy)
+        if genome_index is not None:
+            logging.info(f"Using the genome index built by another job in: {index_dir}")
+            return genome_index
+        logging.info(f"No genome index found in {index_dir}. Building it (only on the first run)...")
+        return build_genome_index(fasta_path, index_dir, contig_policy)
+
+
+def prepare_cached_genome_index(cache: ArtifactCache, fasta_path: Path, contig_policy: ContigPolicy | None = None) -> GenomeIndex:
+    """
+    Purpose:
+        FASTAの内容、--contigs、インデックスの形式をキーにして、キャッシュのインデックスを読み込む。まだない場合は作成して保存する
+    """
+    contig_policy = contig_policy or ContigPolicy(mode="all")
+    key = cache.artifact_key(
+        [fasta_path],
+        format_version=INDEX_FORMAT_VERSION,
+        contigs=contig_policy.label,
+        contig_names=sorted(contig_policy.contig_names or []),
+    )
+    index_dir = cache.get_or_build(
+        "genome_index",
+        key,
+        lambda build_dir: build_genome_index(fasta_path, build_dir, contig_policy, fasta_digest=cache.file_digest(fasta_path)),
+    )
+    logging.info(f"Using the genome index in: {index_dir}")
+    return load_genome_index(index_dir, fasta_path, contig_policy, check_fasta=False)
@@ -1,126 +1,312 @@
+"""
+GTF/GFF3ファイルを、refFlatと同じ列を持つトランスクリプトのテーブルに変換するモジュール。
+
+ファイルはチャンクごとに読み込み、各チャンクではトランスクリプトの範囲、CDS、エキソンの計算に必要な値だけを数値の配列として残す。
+exonStarts/exonEndsは、refflat_preprocessor.parse_exon_coordinates の後と同じく整数のリストで持つので、
+refFlatのテキストに書き出して読み直す必要がない。
+
+pyarrowがある場合は、pyarrowのCSVリーダーで読み込み、属性の抽出などの文字列処理もArrowの配列のまま行う。
+ない場合は、pandasのCエンジンで読み込む。
+`--cache-dir` を指定した場合は、変換したテーブルをファイルの内容をキーにしてキャッシュに保存し、ほかのジョブと共有する。
+"""
+from __future__ import annotations
+from dataclasses import dataclass, field
 from pathlib import Path
+import csv
 import logging
-import re
+import numpy as np
+import pandas as pd
 from . import logging_config  # noqa: F401
+from .artifact_cache import ArtifactCache, atomic_output_path, file_lock
+from .refflat_loader import REFFLAT_COLUMNS
 
-# もはやこれだけでいい
-def gtf_to_refflat(gtf_path: Path, output_path: Path, assembly_name: str) -> None:
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # pyarrowは任意の依存 (pip install "AltEx-BE[arrow]")
+    pa = None
+
+GTF_COLUMNS = ["chrom", "source", "feature", "start", "end", "score", "strand", "frame", "attributes"]
+GTF_COLUMN_TYPES = {"start": np.int64, "end": np.int64} # それ以外の列は文字列
+GTF_USED_COLUMNS = ["chrom", "feature", "start", "end", "strand", "attributes"]
+GTF_CHUNK_ROWS = 500_000 # pandasで一度に読み込む行数
+GTF_BLOCK_SIZE = 1 << 26 # pyarrowで一度に読み込むバイト数
+# 範囲の計算に使うfeature (小文字) と、そのコード
+RANGE_FEATURES = {"transcript": 0, "exon": 1, "cds": 2}
+GTF_TRANSCRIPT_ID_PATTERN = r'transcript_id "(?P<transcript_id>[^"]+)"'
+GTF_GENE_NAME_PATTERN = r'gene_name "(?P<gene_name>[^"]+)"'
+# GFF3の属性 (key=value;)。GENCODE/RefSeqは transcript_id, gene_name/gene を持ち、Ensemblは Parent と遺伝子の行の Name をたどる
+GFF3_ATTRIBUTE_PATTERNS = {
+    "ID": r"(?:^|;)ID=(?P<ID>[^;]+)",
+    "Parent": r"(?:^|;)Parent=(?P<Parent>[^;]+)",
+    "Name": r"(?:^|;)Name=(?P<Name>[^;]+)",
+    "transcript_id": r"(?:^|;)transcript_id=(?P<transcript_id>[^;]+)",
+    "gene_name": r"(?:^|;)(?:gene_name|gene)=(?P<gene_name>[^;]+)",
+}
+GFF3_ID_PREFIXES = r"^(?:transcript:|rna-)" # Ensembl と RefSeq のGFF3でトランスクリプトのIDに付く接頭辞
+CONVERSION_FORMAT_VERSION = 1 # 変換の結果が変わる修正をしたら上げる (キャッシュの変換済みファイルを作り直す)
+CACHED_REFFLAT_FILE = "refFlat.txt"
+
+
+def is_gff3(annotation_path: Path) -> bool:
     """
-    GTFファイルをrefflat形式に変換して保存する関数
-    GTFファイルのすべての行は、以下の構造になっている
-    chrom  source  feature  start  end  score  strand  frame  attributes
-    
-    GTFの全体構造は以下のようになっている
-    Gene A
-        transcript 1 # トランスクリプトの場合は、transcript列が存在し、startとendがそれぞれトランスクリプトの開始位置と終了位置を示す
-            exon 1
-            exon 2
-            CDS 1  #コーディングトランスクリプトの場合は、cds列が存在し、startとendがそれぞれCDSの開始位置と終了位置を示す
-        transcript 2
-            exon 1
-            exon 2
-            exon 3
-    Gene B
-        ...
-    
+    Purpose: 拡張子 (.gff3, .gff。.gzなどの圧縮の拡張子は除く) からGFF3かどうかを判定する
     """
-    output_refflat_path = output_path / f"converted_refflat_{assembly_name}.txt"
-    if output_refflat_path.exists():
-        logging.info(f"Converted refFlat file for {assembly_name} already exists. Skipping conversion.")
+    suffixes = [suffix.lower() for suffix in Path(annotation_path).suffixes if suffix.lower() not in (".gz", ".bz2", ".xz")]
+    return bool(suffixes) and suffixes[-1] in (".gff3", ".gff")
+
+
+def iter_raw_annotation_chunks(annotation_path: Path):
+    """
+    Purpose:
+        GTF/GFF3をチャンクごとに読み込み、コメント行を除いた、GTF_USED_COLUMNS の列を持つデータフレームを返す
+        pyarrowがある場合は、文字列の列をArrowの型 (pd.ArrowDtype) のままにし、pandasの文字列処理をpyarrowで実行させる
+    """
+    if pa is not None:
+        read_options = pa_csv.ReadOptions(column_names=GTF_COLUMNS, block_size=GTF_BLOCK_SIZE)
+        # コメント行などの列の数が合わない行は読み飛ばす
+        parse_options = pa_csv.ParseOptions(delimiter="\t", quote_char=False, invalid_row_handler=lambda row: "skip")
+        convert_options = pa_csv.ConvertOptions(
+            include_columns=GTF_USED_COLUMNS,
+            column_types={col: pa.int64() if col in GTF_COLUMN_TYPES else pa.string() for col in GTF_COLUMNS},
+        )
+        with pa_csv.open_csv(annotation_path, read_options=read_options, parse_options=parse_options, convert_options=convert_options) as reader:
+            for batch in reader:
+                chunk = batch.to_pandas(types_mapper={pa.string(): pd.ArrowDtype(pa.string())}.get)
+                yield chunk[~chunk["chrom"].str.startswith("#")]
         return
 
-    transcripts: dict[str, dict] = {}
-    tid_re = re.compile(r'transcript_id "(?P<transcript_id>[^"]+)"')
-    gname_re = re.compile(r'gene_name "(?P<gene_name>[^"]+)"')
-
-    with open(gtf_path, "r", encoding="utf-8") as fh:
-        for line in fh:
-            # コメント行と空行をスキップ
-            if line.startswith("#") or not line.strip():
-                continue
-            cols = line.rstrip("\n").split("\t")
-            # GTFの列数チェック
-            if len(cols) < 9:
-                continue
-            # 列の展開
-            chrom, source, feature, start_s, end_s, score, strand, frame, attr_str = cols
-            start = int(start_s)
-            end = int(end_s)
-            tid_m = tid_re.search(attr_str)
-            # transcript_idが見つからない場合はスキップ
-            if not tid_m:
-                continue
-            tid = tid_m.group("transcript_id")
-            # gene_nameの取得（存在しない場合は空文字）
-            gname_m = gname_re.search(attr_str)
-            gname = gname_m.group("gene_name") if gname_m else ""
-
-            # chromに"chr"が付いていなければ付与
-            if chrom and not str(chrom).startswith("chr"):
-                chrom = f"chr{chrom}"
-            
-            # featureを小文字化しておく
-            feature = feature.lower()
-
-            # トランスクリプト情報の初期化または取得
-            rec = transcripts.setdefault(
-                tid,
-                {
-                    "gene_name": gname,
-                    "chrom": chrom,
-                    "strand": strand,
-                    "tx_start": None,
-                    "tx_end": None,
-                    "cds_start": None,
-                    "cds_end": None,
-                    "exons": []
-                }
-            )
-
-            # 優先して最初に見つかった gene_name/chrom/strand を保持
-            if not rec["gene_name"] and gname:
-                rec["gene_name"] = gname
-            if not rec["chrom"]:
-                rec["chrom"] = chrom
-            if not rec["strand"]:
-                rec["strand"] = strand
-
-            if feature == "transcript":
-                rec["tx_start"] = start if rec["tx_start"] is None else min(rec["tx_start"], start)
-                rec["tx_end"] = end if rec["tx_end"] is None else max(rec["tx_end"], end)
-            elif feature == "exon":
-                rec["exons"].append((start - 1, end))  # UCSC: exonStarts 0-based
-                rec["tx_start"] = start if rec["tx_start"] is None else min(rec["tx_start"], start)
-                rec["tx_end"] = end if rec["tx_end"] is None else max(rec["tx_end"], end)
-            elif feature == "cds":
-                rec["cds_start"] = start if rec["cds_start"] is None else min(rec["cds_start"], start)
-                rec["cds_end"] = end if rec["cds_end"] is None else max(rec["cds_end"], end)
-
-    # 書き出し（トランスクリプトごとに1行）
-    with open(output_refflat_path, "w", encoding="utf-8") as out:
-        for tid, rec in transcripts.items():
-            exons = sorted(rec["exons"], key=lambda x: x[0])
-            exon_count = len(exons)
-            exon_starts_s = ",".join(str(s) for s, e in exons) + ("," if exon_count else "")
-            exon_ends_s = ",".join(str(e) for s, e in exons) + ("," if exon_count else "")
-            chrom = rec["chrom"]
-
-            tx_start_s = str(rec["tx_start"] - 1) if rec["tx_start"] is not None else ""
-            tx_end_s = str(rec["tx_end"]) if rec["tx_end"] is not None else ""
-            cds_start_s = str(rec["cds_start"] - 1) if rec["cds_start"] is not None else (tx_start_s if tx_start_s else "")
-            cds_end_s = str(rec["cds_end"]) if rec["cds_end"] is not None else (tx_end_s if tx_end_s else "")
-
-            out.write("\t".join([
-                rec["gene_name"] or "",
-                tid,
-                chrom or "",
-                rec["strand"] or "",
-                tx_start_s,
-                tx_end_s,
-                cds_start_s,
-                cds_end_s,
-                str(exon_count),
-                exon_starts_s,
-                exon_ends_s
-            ]) + "\n")
-    return 
+    reader = pd.read_csv(
+        annotation_path,
+        sep="\t",
+        header=None,
+        names=GTF_COLUMNS,
+        usecols=GTF_USED_COLUMNS,
+        dtype=str,
+        quoting=csv.QUOTE_NONE,
+        on_bad_lines="skip",
+        chunksize=GTF_CHUNK_ROWS,
+    )
+    for chunk in reader:
+        # コメント行と列の足りない行を除く
+        yield chunk[chunk["attributes"].notna() & ~chunk["chrom"].str.startswith("#")].astype(GTF_COLUMN_TYPES)
+
+
+def iter_annotation_chunks(annotation_path: Path):
+    """
+    Purpose:
+        GTF/GFF3をチャンクごとに読み込む。featureは小文字にし、chromに"chr"が付いていなければ付与する
+    """
+    for chunk in iter_raw_annotation_chunks(annotation_path):
+        if chunk.empty:
+            continue
+        has_prefix = chunk["chrom"].str.startswith("chr")
+        yield chunk.assign(
+            chrom=chunk["chrom"].where(has_prefix, "chr" + chunk["chrom"]),
+            feature=chunk["feature"].str.lower(),
+        )
+
+
+@dataclass
+class TranscriptTableBuilder:
+    """
+    チャンクごとに、トランスクリプトの情報を小さなテーブルとして集めるためのdataclass
+    """
+    attributes: list[pd.DataFrame] = field(default_factory=list) # トランスクリプトごとに最初に見つかった chrom, strand
+    gene_names: list[pd.DataFrame] = field(default_factory=list) # トランスクリプトごとに最初に見つかった (空でない) gene_name
+    ranges: list[pd.DataFrame] = field(default_factory=list) # transcript, exon, CDSの行の (transcript_id, kind, start, end)
+    gene_names_by_id: dict[str, str] = field(default_factory=dict) # GFF3: 遺伝子の行の ID -> Name
+    parents_by_id: dict[str, str] = field(default_factory=dict) # GFF3: トランスクリプトの行の ID -> Parent (遺伝子のID)
+
+    def add(self, records: pd.DataFrame) -> None:
+        """
+        Purpose:
+            transcript_id, gene_name, chrom, strand, feature, start, end 列を持つ行を追加する
+            (groupbyは使わず、duplicatedで各トランスクリプトの最初の行を選ぶ。Arrowの文字列の列のまま処理できる)
+        """
+        self.attributes.append(records.loc[~records["transcript_id"].duplicated(), ["transcript_id", "chrom", "strand"]])
+        named = records.loc[records["gene_name"].notna(), ["transcript_id", "gene_name"]]
+        self.gene_names.append(named[~named["transcript_id"].duplicated()])
+        kinds = np.full(len(records), -1, dtype=np.int8)
+        for feature, kind in RANGE_FEATURES.items():
+            kinds[(records["feature"] == feature).to_numpy(dtype=bool)] = kind
+        in_range = kinds >= 0
+        self.ranges.append(pd.DataFrame({
+            "transcript_id": records["transcript_id"][in_range].reset_index(drop=True),
+            "kind": kinds[in_range],
+            "start": records["start"].to_numpy(dtype=np.int64)[in_range],
+            "end": records["end"].to_numpy(dtype=np.int64)[in_range],
+        }))
+
+    def to_refflat(self) -> pd.DataFrame:
+        """
+        Purpose:
+            集めた情報から、1トランスクリプト1行のテーブル (REFFLAT_COLUMNS) を作る
+            トランスクリプトは最初に現れた順に並べ、エキソンはstartの順に並べる。エキソンのないトランスクリプトは除外する
+        """
+        if not self.attributes:
+            return pd.DataFrame({col: pd.Series(dtype=object) for col in REFFLAT_COLUMNS})
+        transcripts = pd.concat(self.attributes).drop_duplicates("transcript_id").set_index("transcript_id")
+        gene_names = pd.concat(self.gene_names).drop_duplicates("transcript_id").set_index("transcript_id")["gene_name"]
+        transcripts["gene_name"] = gene_names.reindex(transcripts.index)
+        transcripts = transcripts.astype(object)
+        transcripts.index = transcripts.index.astype(object)
+        if self.parents_by_id:
+            # GFF3で遺伝子名を持たないトランスクリプトは、Parentの遺伝子のNameを使う
+            parent_names = [self.gene_names_by_id.get(self.parents_by_id.get(tid, ""), np.nan) for tid in transcripts.index]
+            transcripts["gene_name"] = transcripts["gene_name"].fillna(pd.Series(parent_names, index=transcripts.index, dtype=object))
+        ranges = pd.concat(self.ranges, ignore_index=True)
+        ranges["code"] = pd.Index(transcripts.index).get_indexer(ranges["transcript_id"].astype(object))
+
+        exons = ranges[ranges["kind"] == RANGE_FEATURES["exon"]]
+        exon_codes = exons["code"].to_numpy()
+        order = np.lexsort((exons["start"].to_numpy(), exon_codes))
+        exon_counts = np.bincount(exon_codes, minlength=len(transcripts))
+        offsets = np.concatenate([[0], np.cumsum(exon_counts)]).tolist()
+        # GTF (1-based, 両端を含む) からrefFlat (0-based start, 半開区間) に変換する
+        all_starts = (exons["start"].to_numpy()[order] - 1).tolist()
+        all_ends = exons["end"].to_numpy()[order].tolist()
+        exon_starts = [all_starts[lo:hi] for lo, hi in zip(offsets[:-1], offsets[1:])]
+        exon_ends = [all_ends[lo:hi] for lo, hi in zip(offsets[:-1], offsets[1:])]
+
+        spans = ranges[ranges["kind"] != RANGE_FEATURES["cds"]].groupby("code")
+        cds = ranges[ranges["kind"] == RANGE_FEATURES["cds"]].groupby("code")
+        tx_start = spans["start"].min().reindex(range(len(transcripts))).to_numpy() - 1
+        tx_end = spans["end"].max().reindex(range(len(transcripts))).to_numpy()
+        cds_start = cds["start"].min().reindex(range(len(transcripts))).to_numpy() - 1
+        cds_end = cds["end"].max().reindex(range(len(transcripts))).to_numpy()
+        # CDSのないトランスクリプトは、cdsStart/cdsEndをトランスクリプトの範囲とする
+        cds_start = np.where(np.isnan(cds_start), tx_start, cds_start)
+        cds_end = np.where(np.isnan(cds_end), tx_end, cds_end)
+
+        refflat = pd.DataFrame({
+            "geneName": transcripts["gene_name"].fillna("").to_numpy(),
+            "name": transcripts.index.to_numpy(),
+            "chrom": transcripts["chrom"].to_numpy(),
+            "strand": transcripts["strand"].to_numpy(),
+            "txStart": tx_start,
+            "txEnd": tx_end,
+            "cdsStart": cds_start,
+            "cdsEnd": cds_end,
+            "exonCount": exon_counts,
+            "exonStarts": exon_starts,
+            "exonEnds": exon_ends,
+        })
+        has_exons = exon_counts > 0
+        if not has_exons.all():
+            logging.info(f"{int((~has_exons).sum())} transcripts without exons in the annotation were skipped.")
+        refflat = refflat[has_exons].reset_index(drop=True)
+        refflat[["txStart", "txEnd", "cdsStart", "cdsEnd"]] = refflat[["txStart", "txEnd", "cdsStart", "cdsEnd"]].astype(np.int64)
+        refflat["exonCount"] = refflat["exonCount"].astype(np.int64)
+        return refflat
+
+
+def add_gtf_chunk(builder: TranscriptTableBuilder, chunk: pd.DataFrame) -> None:
+    """
+    Purpose: GTFのチャンクから、transcript_idを持つ行をbuilderに追加する
+    """
+    transcript_ids = chunk["attributes"].str.extract(GTF_TRANSCRIPT_ID_PATTERN, expand=False)
+    chunk = chunk[transcript_ids.notna()]
+    builder.add(chunk.assign(
+        transcript_id=transcript_ids[transcript_ids.notna()],
+        gene_name=chunk["attributes"].str.extract(GTF_GENE_NAME_PATTERN, expand=False),
+    ))
+
+
+def add_gff3_chunk(builder: TranscriptTableBuilder, chunk: pd.DataFrame) -> None:
+    """
+    Purpose:
+        GFF3のチャンクから、エキソンとCDSの行をbuilderに追加する
+        遺伝子の行 (Parentなし) のNameと、トランスクリプトの行のParentは、遺伝子名の解決のために保持する
+    """
+    attributes = {key: chunk["attributes"].str.extract(pattern, expand=False) for key, pattern in GFF3_ATTRIBUTE_PATTERNS.items()}
+    is_exon_or_cds = chunk["feature"].isin(["exon", "cds"])
+
+    genes = attributes["Parent"].isna() & attributes["ID"].notna()
+    builder.gene_names_by_id.update(zip(attributes["ID"][genes], attributes["Name"][genes].fillna(attributes["gene_name"][genes])))
+    transcripts = ~is_exon_or_cds & attributes["Parent"].notna() & attributes["ID"].notna()
+    builder.parents_by_id.update(zip(attributes["ID"][transcripts].str.replace(GFF3_ID_PREFIXES, "", regex=True), attributes["Parent"][transcripts]))
+
+    # 複数のトランスクリプトに属するエキソン (Parent=t1,t2) は、トランスクリプトごとの行にする
+    records = chunk[is_exon_or_cds].assign(
+        transcript_id=attributes["transcript_id"][is_exon_or_cds].fillna(attributes["Parent"][is_exon_or_cds]).str.split(","),
+        gene_name=attributes["gene_name"][is_exon_or_cds],
+    ).explode("transcript_id")
+    records = records[records["transcript_id"].notna()]
+    records["transcript_id"] = records["transcript_id"].str.replace(GFF3_ID_PREFIXES, "", regex=True)
+    builder.add(records)
+
+
+def read_annotation_as_refflat(annotation_path: Path) -> pd.DataFrame:
+    """
+    Purpose:
+        GTF/GFF3ファイルをチャンクごとに読み込み、refFlatと同じ列を持つトランスクリプトのテーブルを返す
+        GTFのすべての行は、以下の構造になっている
+        chrom  source  feature  start  end  score  strand  frame  attributes
+
+        GTFの全体構造は以下のようになっている
+        Gene A
+            transcript 1 # startとendがトランスクリプトの開始位置と終了位置を示す
+                exon 1
+                exon 2
+                CDS 1  # コーディングトランスクリプトの場合は、CDSのstartとendの最小値と最大値がCDSの開始位置と終了位置になる
+            transcript 2
+                ...
+        Gene B
+            ...
+        GFF3 (拡張子が .gff3/.gff) ではエキソンとCDSの行の transcript_id (ない場合はParent) でトランスクリプトにまとめる
+    Parameters:
+        annotation_path: Path, GTF/GFF3ファイルのパス (gzip圧縮でもよい)
+    Returns:
+        pd.DataFrame, REFFLAT_COLUMNS の列を持つデータフレーム。exonStarts/exonEndsは整数のリスト
+    """
+    builder = TranscriptTableBuilder()
+    add_chunk = add_gff3_chunk if is_gff3(annotation_path) else add_gtf_chunk
+    for chunk in iter_annotation_chunks(annotation_path):
+        add_chunk(builder, chunk)
+    refflat = builder.to_refflat()
+    logging.info(f"Read {len(refflat)} transcripts from {Path(annotation_path).name}")
+    return refflat
+
+
+def write_refflat(refflat: pd.DataFrame, output_refflat_path: Path) -> None:
+    """
+    Purpose:
+        read_annotation_as_refflat のテーブルを、refFlat形式 (exonStarts/exonEndsは "100,200," 形式) で保存する
+        一時ファイルに書いてから名前を変えるので、ほかのジョブが書きかけのファイルを読むことはない
+    """
+    refflat = refflat.assign(
+        exonStarts=[",".join(map(str, starts)) + "," for starts in refflat["exonStarts"]],
+        exonEnds=[",".join(map(str, ends)) + "," for ends in refflat["exonEnds"]],
+    )
+    with atomic_output_path(output_refflat_path) as temp_path:
+        refflat[REFFLAT_COLUMNS].to_csv(temp_path, sep="\t", header=False, index=False)
+
+
+def prepare_cached_refflat(cache: ArtifactCache, annotation_path: Path) -> Path:
+    """
+    Purpose:
+        GTF/GFF3を変換したrefFlatのパスを返す。キャッシュにない場合は変換して保存する
+        同じ内容のファイルを同時に変換しようとしたジョブは、1つのジョブの変換が終わるのを待って同じファイルを使う
+    """
+    key = cache.artifact_key([annotation_path], format_version=CONVERSION_FORMAT_VERSION, gff3=is_gff3(annotation_path))
+    refflat_dir = cache.get_or_build(
+        "converted_refflat",
+        key,
+        lambda build_dir: write_refflat(read_annotation_as_refflat(annotation_path), build_dir / CACHED_REFFLAT_FILE),
+    )
+    return refflat_dir / CACHED_REFFLAT_FILE
+
+
+def gtf_to_refflat(gtf_path: Path, output_path: Path, assembly_name: str) -> None:
+    """
+    GTFファイルをrefflat形式に変換して、output_path/converted_refflat_{assembly_name}.txt に保存する関数
+    すでに保存されている場合は何もしない。ほかのジョブが変換中の場合は、終わるのを待つ
+    """
+    output_refflat_path = output_path / f"converted_refflat_{assembly_name}.txt"
+    # 同じ出力ディレクトリで同時に起動したジョブは、1つのジョブの変換が終わるのを待つ
+    with file_lock(output_path / f".converted_refflat_{assembly_name}.lock"):
+        if output_refflat_path.exists():
+            logging.info(f"Converted refFlat file for {assembly_name} already exists. Skipping conversion.")
+            return
+        write_refflat(read_annotation_as_refflat(gtf_path), output_refflat_path)
@@ -0,0 +1,431 @@
+from __future__ import annotations
+from pathlib import Path
+import struct
+import zlib
+import numpy as np
+import pandas as pd
+from .fasta_contigs import find_fasta_index
+
+# ---------------------------------------------------------------------------
+# BGZF + tabix
+# BGZFは64KB以下のgzipブロックを連結した形式で、各ブロックの先頭から独立に展開できる。
+# tabixのインデックス (.tbi) は、領域ごとにどのブロックのどこから読めばよいかを保持する。
+# 仕様: https://samtools.github.io/hts-specs/SAMv1.pdf (4.1 BGZF), https://samtools.github.io/hts-specs/tabix.pdf
+# ---------------------------------------------------------------------------
+
+BGZF_MAX_BLOCK_SIZE = 0xFF00 # htslibと同じ、1ブロックの展開後の最大サイズ
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+TABIX_LINEAR_SHIFT = 14 # 線形インデックスの窓の大きさ (16kb)
+TABIX_FORMAT_UCSC_BED = 0x10000 # generic形式 + 0-based start (UCSCのBED)
+
+
+def compress_bgzf_block(data: bytes) -> bytes:
+    """
+    Purpose:
+        1つのBGZFブロック (BSIZEを持つextra fieldを付けたgzip member) を作成する
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    block_size = 18 + len(compressed) + 8
+    header = b"\x1f\x8b\x08\x04" + b"\x00" * 4 + b"\x00\xff" + struct.pack("<HBBHH", 6, 66, 67, 2, block_size - 1)
+    return header + compressed + struct.pack("<II", zlib.crc32(data), len(data))
+
+
+def write_bgzf(lines: list[bytes], output_path: Path) -> np.ndarray:
+    """
+    Purpose:
+        行のリストをBGZFで圧縮して書き出し、各行の開始位置と終了位置の仮想オフセットを返す
+        仮想オフセットは (ブロックの圧縮後のファイル内位置 << 16) | (ブロック内の展開後の位置)
+        行がブロックをまたがないように、ブロックが一杯になったら次のブロックに移る
+    Returns:
+        np.ndarray, shape (len(lines), 2) の uint64 (各行の開始, 終了の仮想オフセット)
+    """
+    virtual_offsets = np.zeros((len(lines), 2), dtype=np.uint64)
+    block_offset = 0
+    buffer = bytearray()
+    with open(output_path, "wb") as f:
+        for i, line in enumerate(lines):
+            if buffer and len(buffer) + len(line) > BGZF_MAX_BLOCK_SIZE:
+                block = compress_bgzf_block(bytes(buffer))
+                f.write(block)
+                block_offset += len(block)
+                buffer.clear()
+            virtual_offsets[i, 0] = (block_offset << 16) | len(buffer)
+            buffer += line
+            virtual_offsets[i, 1] = (block_offset << 16) | len(buffer)
+        if buffer:
+            f.write(compress_bgzf_block(bytes(buffer)))
+        f.write(BGZF_EOF)
+    return virtual_offsets
+
+
+def calculate_tabix_bin(start: int, end: int) -> int:
+    """
+    Purpose:
+        [start, end) を含む最小のビンの番号を返す (SAM仕様のreg2bin)
+    """
+    end -= 1
+    for shift, offset in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)):
+        if start >> shift == end >> shift:
+            return offset + (start >> shift)
+    return 0
+
+
+def build_tabix_index(chroms: list[str], starts: np.ndarray, ends: np.ndarray, virtual_offsets: np.ndarray) -> bytes:
+    """
+    Purpose:
+        染色体ごとに連続し、開始位置でソートされた行のtabixインデックス (.tbi、BGZF圧縮前) を作成する
+    """
+    names = list(dict.fromkeys(chroms))
+    # 染色体ごとに連続しているので、染色体が変わる位置で区切る
+    chrom_changes = [i for i in range(1, len(chroms)) if chroms[i] != chroms[i - 1]]
+    chrom_rows = [range(begin, end) for begin, end in zip([0, *chrom_changes], [*chrom_changes, len(chroms)])] if chroms else []
+    header = struct.pack("<4si", b"TBI\x01", len(names))
+    # format, col_seq, col_beg, col_end, meta("#"), skip
+    header += struct.pack("<6i", TABIX_FORMAT_UCSC_BED, 1, 2, 3, ord("#"), 0)
+    name_block = b"".join(name.encode() + b"\x00" for name in names)
+    parts = [header, struct.pack("<i", len(name_block)), name_block]
+    for rows in chrom_rows:
+        bins: dict[int, list[list[int]]] = {}
+        linear_index: list[int | None] = [] # 窓に重なる最初の行の開始位置 (ファイルの先頭の0もありうるため、未設定はNone)
+        for row in rows:
+            start, end = int(starts[row]), int(ends[row])
+            begin_offset, end_offset = int(virtual_offsets[row, 0]), int(virtual_offsets[row, 1])
+            chunks = bins.setdefault(calculate_tabix_bin(start, end), [])
+            # 直前のチャンクに続く行は、同じチャンクにまとめる
+            if chunks and chunks[-1][1] == begin_offset:
+                chunks[-1][1] = end_offset
+            else:
+                chunks.append([begin_offset, end_offset])
+            last_window = max(end - 1, start) >> TABIX_LINEAR_SHIFT
+            if len(linear_index) <= last_window:
+                linear_index.extend([None] * (last_window + 1 - len(linear_index)))
+            for window in range(start >> TABIX_LINEAR_SHIFT, last_window + 1):
+                if linear_index[window] is None:
+                    linear_index[window] = begin_offset
+        # 行がない窓は、直前の窓の値で埋める (htslibと同じ)
+        for window in range(len(linear_index)):
+            if linear_index[window] is None:
+                linear_index[window] = linear_index[window - 1] if window > 0 else 0
+        parts.append(struct.pack("<i", len(bins)))
+        for bin_number in sorted(bins):
+            chunks = bins[bin_number]
+            parts.append(struct.pack("<Ii", bin_number, len(chunks)))
+            parts.extend(struct.pack("<QQ", begin, end) for begin, end in chunks)
+        parts.append(struct.pack("<i", len(linear_index)))
+        parts.append(np.asarray(linear_index, dtype="<u8").tobytes())
+    return b"".join(parts)
+
+
+def sort_bed(bed_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Purpose:
+        BEDのデータフレームを染色体名 (バイト順)、開始位置、終了位置でソートする
+        tabixとbigBedはどちらも、染色体ごとに連続して開始位置順に並んでいる必要がある
+    """
+    return bed_df.assign(
+        _chrom_key=bed_df["chrom"].astype(str),
+    ).sort_values(["_chrom_key", "chromStart", "chromEnd"], kind="stable").drop(columns="_chrom_key").reset_index(drop=True)
+
+
+def write_tabix_bed(bed_df: pd.DataFrame, output_path: Path) -> Path:
+    """
+    Purpose:
+        BEDをソートしてBGZFで圧縮し (.bed.gz)、tabixのインデックス (.bed.gz.tbi) を作成する
+        IGVやtabixで、表示している領域の行だけを読み込める
+    Parameters:
+        bed_df: pd.DataFrame, 先頭の3列が chrom, chromStart, chromEnd のBED
+        output_path: Path, 書き出す .bed.gz のパス
+    Returns:
+        Path, 書き出した .bed.gz のパス
+    """
+    sorted_bed = sort_bed(bed_df)
+    text = sorted_bed.to_csv(sep="\t", header=False, index=False, lineterminator="\n")
+    lines = [line.encode() + b"\n" for line in text.splitlines()]
+    virtual_offsets = write_bgzf(lines, output_path)
+    index = build_tabix_index(
+        sorted_bed["chrom"].astype(str).tolist(),
+        sorted_bed["chromStart"].to_numpy(dtype=np.int64),
+        sorted_bed["chromEnd"].to_numpy(dtype=np.int64),
+        virtual_offsets,
+    )
+    with open(f"{output_path}.tbi", "wb") as f:
+        for block_start in range(0, len(index), BGZF_MAX_BLOCK_SIZE):
+            f.write(compress_bgzf_block(index[block_start:block_start + BGZF_MAX_BLOCK_SIZE]))
+        f.write(BGZF_EOF)
+    return output_path
+
+
+# ---------------------------------------------------------------------------
+# bigBed
+# ヘッダー、autoSql、全体の統計、染色体名のB+木、圧縮したデータブロック、データブロックのR木からなる。
+# 仕様: Kent et al. (2010) BigWig and BigBed, Bioinformatics 26:2204 の Supplementary と UCSC の bbiWrite.c
+# ---------------------------------------------------------------------------
+
+BIGBED_MAGIC = 0x8789F2EB
+BPT_MAGIC = 0x78CA8C91
+CIRTREE_MAGIC = 0x2468ACE0
+BIGBED_VERSION = 4
+BIGBED_ITEMS_PER_SLOT = 512 # 1データブロックあたりの最大の行数 (bedToBigBedの既定値)
+BIGBED_BLOCK_SIZE = 256 # B+木とR木の1ノードあたりの最大の子の数 (bedToBigBedの既定値)
+BIGBED_HEADER_SIZE = 64
+TOTAL_SUMMARY_SIZE = 40
+
+
+def read_chrom_sizes(fasta_path: Path) -> dict[str, int]:
+    """
+    Purpose:
+        染色体名 -> 長さ の辞書を返す。FASTAのインデックス (.fai) があればそれを読み、なければFASTAを走査する
+    """
+    fai_path = find_fasta_index(fasta_path)
+    chrom_sizes: dict[str, int] = {}
+    if fai_path is not None:
+        with open(fai_path) as f:
+            for line in f:
+                cols = line.rstrip("\n").split("\t")
+                if len(cols) >= 2:
+                    chrom_sizes[cols[0]] = int(cols[1])
+        return chrom_sizes
+    chrom = None
+    with open(fasta_path) as f:
+        for line in f:
+            if line.startswith(">"):
+                chrom = line[1:].split()[0]
+                chrom_sizes[chrom] = 0
+            elif chrom is not None:
+                chrom_sizes[chrom] += len(line.rstrip())
+    return chrom_sizes
+
+
+def calculate_total_summary(chrom_ids: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> bytes:
+    """
+    Purpose:
+        bigBedの全体の統計 (1つ以上の行に覆われる塩基数と、その塩基での重なりの数の最小、最大、合計、二乗和) を計算する
+        bedToBigBedと同じく、重なりの数を塩基ごとの値として扱う
+    """
+    valid_count, min_val, max_val, sum_data, sum_squares = 0, np.inf, -np.inf, 0.0, 0.0
+    for chrom_id in np.unique(chrom_ids):
+        rows = chrom_ids == chrom_id
+        # 開始で+1、終了で-1 する区切りの位置でソートし、区切りの間の重なりの数を累積和で求める
+        positions = np.concatenate([starts[rows], ends[rows]])
+        deltas = np.concatenate([np.ones(rows.sum()), -np.ones(rows.sum())])
+        order = np.argsort(positions, kind="stable")
+        positions, depth = positions[order], np.cumsum(deltas[order])
+        lengths = np.diff(positions).astype(np.float64)
+        depth = depth[:-1]
+        covered = (depth > 0) & (lengths > 0)
+        if not covered.any():
+            continue
+        valid_count += int(lengths[covered].sum())
+        min_val = min(min_val, depth[covered].min())
+        max_val = max(max_val, depth[covered].max())
+        sum_data += float((depth[covered] * lengths[covered]).sum())
+        sum_squares += float((depth[covered] ** 2 * lengths[covered]).sum())
+    if valid_count == 0:
+        min_val = max_val = 0.0
+    return struct.pack("<Qdddd", valid_count, min_val, max_val, sum_data, sum_squares)
+
+
+def build_chrom_bptree(chrom_names: list[str], chrom_sizes: dict[str, int], tree_offset: int) -> bytes:
+    """
+    Purpose:
+        染色体名 -> (chromId, 長さ) を引くためのB+木を作成する。chrom_namesはバイト順にソートされている必要がある
+        葉から根まで1段ずつノードを作り、根から順にファイルに並べる
+    """
+    key_size = max(len(name.encode()) for name in chrom_names)
+    block_size = max(1, min(BIGBED_BLOCK_SIZE, len(chrom_names)))
+    header = struct.pack("<IIIIQQ", BPT_MAGIC, block_size, key_size, 8, len(chrom_names), 0)
+    keys = [name.encode().ljust(key_size, b"\x00") for name in chrom_names]
+
+    # 各段のノードを (最初のキー, [子]) のリストで表す。葉の子は (キー, chromId, 長さ)
+    leaf_items = [(key, chrom_id, chrom_sizes[name]) for chrom_id, (key, name) in enumerate(zip(keys, chrom_names))]
+    levels = [[(items[0][0], items) for items in chunked(leaf_items, block_size)]]
+    while len(levels[-1]) > 1:
+        levels.append([(nodes[0][0], nodes) for nodes in chunked(levels[-1], block_size)])
+    levels.reverse() # 根から葉の順
+
+    # 各ノードのファイル内の位置を決める
+    node_offsets = []
+    offset = tree_offset + len(header)
+    item_size = key_size + 8 # 葉は chromId と長さ (4 + 4 byte)、それ以外は子のファイル内の位置 (8 byte)
+    for level in levels:
+        offsets = []
+        for _, children in level:
+            offsets.append(offset)
+            offset += 4 + len(children) * item_size
+        node_offsets.append(offsets)
+
+    parts = [header]
+    for depth, level in enumerate(levels):
+        is_leaf = depth == len(levels) - 1
+        child_offsets = iter(node_offsets[depth + 1]) if not is_leaf else None
+        for _, children in level:
+            parts.append(struct.pack("<BBH", int(is_leaf), 0, len(children)))
+            for child in children:
+                if is_leaf:
+                    key, chrom_id, chrom_size = child
+                    parts.append(key + struct.pack("<II", chrom_id, chrom_size))
+                else:
+                    parts.append(child[0] + struct.pack("<Q", next(child_offsets)))
+    return b"".join(parts)
+
+
+def build_cirtree(blocks: list[tuple[int, int, int, int, int, int]], item_count: int, end_file_offset: int, tree_offset: int) -> bytes:
+    """
+    Purpose:
+        データブロックを位置から探すためのR木 (cirTree) を作成する
+    Parameters:
+        blocks: list, (startChromIx, startBase, endChromIx, endBase, ファイル内の位置, サイズ) のリスト (位置順)
+        item_count: int, ブロックの数
+        end_file_offset: int, データ部分の終わりのファイル内の位置
+        tree_offset: int, R木を書き出すファイル内の位置
+    """
+    block_size = BIGBED_BLOCK_SIZE
+    if blocks:
+        start_chrom, start_base = blocks[0][0], blocks[0][1]
+        end_chrom, end_base = max((block[2], block[3]) for block in blocks)
+    else:
+        start_chrom = start_base = end_chrom = end_base = 0
+    header = struct.pack(
+        "<IIQIIIIQII", CIRTREE_MAGIC, block_size, item_count, start_chrom, start_base, end_chrom, end_base,
+        end_file_offset, BIGBED_ITEMS_PER_SLOT, 0,
+    )
+    if not blocks:
+        return header + struct.pack("<BBH", 1, 0, 0)
+
+    def bounds(children):
+        return children[0][0], children[0][1], *max((child[2], child[3]) for child in children)
+
+    # 各段のノードを (startChromIx, startBase, endChromIx, endBase, [子]) のリストで表す
+    levels = [[(*bounds(children), children) for children in chunked(blocks, block_size)]]
+    while len(levels[-1]) > 1:
+        levels.append([(*bounds(children), children) for children in chunked(levels[-1], block_size)])
+    levels.reverse() # 根から葉の順
+
+    node_offsets = []
+    offset = tree_offset + len(header)
+    for depth, level in enumerate(levels):
+        item_size = 32 if depth == len(levels) - 1 else 24
+        offsets = []
+        for node in level:
+            offsets.append(offset)
+            offset += 4 + len(node[4]) * item_size
+        node_offsets.append(offsets)
+
+    parts = [header]
+    for depth, level in enumerate(levels):
+        is_leaf = depth == len(levels) - 1
+        child_offsets = iter(node_offsets[depth + 1]) if not is_leaf else None
+        for node in level:
+            children = node[4]
+            parts.append(struct.pack("<BBH", int(is_leaf), 0, len(children)))
+            for child in children:
+                if is_leaf:
+                    parts.append(struct.pack("<IIIIQQ", *child))
+                else:
+                    parts.append(struct.pack("<IIIIQ", *child[:4], next(child_offsets)))
+    return b"".join(parts)
+
+
+def chunked(items: list, size: int) -> list[list]:
+    """
+    Purpose: リストをsize個ずつに分ける
+    """
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def write_bigbed(
+    bed_df: pd.DataFrame,
+    chrom_sizes: dict[str, int],
+    output_path: Path,
+    autosql: str,
+    defined_field_count: int = 9,
+) -> Path:
+    """
+    Purpose:
+        BED (BED9+N) を bigBed 形式で書き出す。UCSC genome browserのtrack hubやIGVで、表示している領域だけを読み込める
+    Parameters:
+        bed_df: pd.DataFrame, 先頭の3列が chrom, chromStart, chromEnd で、autoSqlのフィールドと同じ順序の列を持つBED
+        chrom_sizes: dict[str, int], 染色体名 -> 長さ
+        output_path: Path, 書き出すパス
+        autosql: str, 各列の型と説明を記述したautoSql
+        defined_field_count: int, BEDの標準の列の数 (残りの列は拡張の列として扱われる)
+    Returns:
+        Path, 書き出したパス
+    Comments:
+        ズームレベルは作成しない (表示する領域の行を直接読み込む)。ブロックはzlibで圧縮する
+    """
+    sorted_bed = sort_bed(bed_df)
+    chroms = sorted_bed["chrom"].astype(str).to_numpy(dtype=object)
+    chrom_names = sorted(set(chroms), key=lambda name: name.encode())
+    missing = [name for name in chrom_names if name not in chrom_sizes]
+    if missing:
+        raise ValueError(f"Chromosome sizes are not available for: {', '.join(missing)}")
+    starts = sorted_bed["chromStart"].to_numpy(dtype=np.int64)
+    ends = sorted_bed["chromEnd"].to_numpy(dtype=np.int64)
+    chrom_ids_by_name = {name: i for i, name in enumerate(chrom_names)}
+    chrom_ids = np.array([chrom_ids_by_name[name] for name in chroms], dtype=np.int64)
+    over_end = ends > np.array([chrom_sizes[name] for name in chroms], dtype=np.int64)
+    if over_end.any():
+        raise ValueError(f"{int(over_end.sum())} items end beyond the chromosome size")
+
+    # chrom, start, end 以外の列は、タブ区切りの1つの文字列として保存する
+    rest_cols = sorted_bed.columns[3:]
+    rest = sorted_bed[rest_cols[0]].astype(str) if len(rest_cols) else pd.Series("", index=sorted_bed.index)
+    for col in rest_cols[1:]:
+        rest = rest + "\t" + sorted_bed[col].astype(str)
+    rest_bytes = [value.encode() + b"\x00" for value in rest]
+
+    autosql_bytes = autosql.encode() + b"\x00"
+    autosql_offset = BIGBED_HEADER_SIZE
+    total_summary_offset = autosql_offset + len(autosql_bytes)
+    chrom_tree_offset = total_summary_offset + TOTAL_SUMMARY_SIZE
+    chrom_tree = build_chrom_bptree(chrom_names, chrom_sizes, chrom_tree_offset) if chrom_names else b""
+    data_offset = chrom_tree_offset + len(chrom_tree)
+
+    # データブロック: 同じ染色体の連続する最大 BIGBED_ITEMS_PER_SLOT 行を1ブロックにする
+    data_parts = [struct.pack("<Q", len(sorted_bed))]
+    offset = data_offset + 8
+    blocks = []
+    max_block_size = 0
+    chrom_changes = np.flatnonzero(np.diff(chrom_ids)) + 1
+    for chrom_start, chrom_end in zip(np.r_[0, chrom_changes], np.r_[chrom_changes, len(sorted_bed)]):
+        for block_start in range(int(chrom_start), int(chrom_end), BIGBED_ITEMS_PER_SLOT):
+            rows = range(block_start, min(block_start + BIGBED_ITEMS_PER_SLOT, int(chrom_end)))
+            raw = b"".join(
+                struct.pack("<III", chrom_ids[row], starts[row], ends[row]) + rest_bytes[row] for row in rows
+            )
+            compressed = zlib.compress(raw)
+            max_block_size = max(max_block_size, len(raw))
+            chrom_id = int(chrom_ids[block_start])
+            blocks.append((chrom_id, int(starts[block_start]), chrom_id, int(ends[rows.start:rows.stop].max()), offset, len(compressed)))
+            data_parts.append(compressed)
+            offset += len(compressed)
+    index_offset = offset
+    index = build_cirtree(blocks, len(blocks), index_offset, index_offset)
+
+    header = struct.pack(
+        "<IHHQQQHHQQIQ",
+        BIGBED_MAGIC,
+        BIGBED_VERSION,
+        0, # zoomLevels
+        chrom_tree_offset,
+        data_offset,
+        index_offset,
+        len(sorted_bed.columns),
+        defined_field_count,
+        autosql_offset,
+        total_summary_offset,
+        max_block_size, # uncompressBufSize
+        0, # extensionOffset
+    )
+    with open(output_path, "wb") as f:
+        f.write(header)
+        f.write(autosql_bytes)
+        f.write(calculate_total_summary(chrom_ids, starts, ends))
+        f.write(chrom_tree)
+        for part in data_parts:
+            f.write(part)
+        f.write(index)
+        f.write(struct.pack("<I", BIGBED_MAGIC))
+    return output_path
@@ -5,8 +5,12 @@ import logging
 import datetime
 import subprocess
 import sys
+from functools import partial
 from . import (
     gtf2refflat_converter,
+    gene_identifier_index,
+    exon_interval_index,
+    refflat_loader,
     refflat_preprocessor,
     sequence_annotator,
     splicing_event_classifier,
@@ -15,7 +19,16 @@ from . import (
     output_formatter,
     offtarget_scorer,
     sgrna_prioritizer,
+    output_writer,
     bed_for_ucsc_custom_track_maker,
+    indexed_track_writer,
+    dtype_compactor,
+    memory_report,
+    batch_manifest,
+    genome_index,
+    artifact_cache,
+    fasta_contigs,
+    stage_scheduler,
     logging_config # noqa: F401
 )
 from .manage_arguments import (
@@ -24,6 +37,7 @@ from .manage_arguments import (
     validate_arguments
 )
 from .class_def.base_editors import BaseEditor
+from .fasta_contigs import ContigPolicy
 
 
 def run_pipeline():
@@ -55,7 +69,12 @@ def run_pipeline():
     parser = build_parser.build_parser()
     args = parser.parse_args()
     
-    refflat_path, gtf_path, fasta_path, output_directory, interest_gene_list, base_editors, assembly_name = parse_arguments.parse_arguments(args, parser)
+    refflat_path, gtf_path, fasta_path, output_directory, interest_gene_list, base_editors, assembly_name, regions = parse_arguments.parse_arguments(args, parser)
+    # バッチモードでは、すべての依頼の遺伝子とbase editorをまとめて1度だけ読み込み、設計、オフターゲット計算を行う
+    batch_entries = parse_arguments.parse_batch_manifest_from_args(args, parser, base_editors)
+    if batch_entries is not None:
+        interest_gene_list = batch_manifest.collect_batch_genes(batch_entries)
+        base_editors = batch_manifest.collect_batch_base_editors(batch_entries, base_editors)
 
     validate_arguments.validate_arguments(
         refflat_path,
@@ -65,152 +84,362 @@ def run_pipeline():
         interest_gene_list,
         base_editors,
         assembly_name,
-        parser
+        parser,
+        args.output_format,
+        args.top_n_per_exon,
+        args.workers,
+        args.offtarget_sites_per_sgrna,
+        args.offtarget_count_cap,
+        args.extra_seed_lengths,
     )
     
-    if gtf_path is not None :
+    scoring_terms = parse_arguments.parse_scoring_config_from_args(args, parser)
+    contig_policy = parse_arguments.parse_contig_policy_from_args(args, parser)
+    stage_memory = memory_report.MemoryReport(enabled=args.memory_report)
+    gene_aliases = gene_identifier_index.load_gene_aliases(Path(args.gene_alias_file)) if args.gene_alias_file else None
+    # オフターゲットサイトの位置を出力する場合は、スキャン中に位置を記録し、遺伝子で絞り込む前のアノテーションで分類する
+    site_recorder = offtarget_scorer.OfftargetSiteRecorder(args.offtarget_sites_per_sgrna) if args.offtarget_sites_per_sgrna else None
+
+    cache = artifact_cache.ArtifactCache(Path(args.cache_dir)) if args.cache_dir else None
+    if args.genome_index == "" and cache is None:
+        parser.error("--genome-index without a directory needs --cache-dir to keep the index in")
+    if cache is not None:
+        fasta_contigs.prepare_cached_fasta_index(cache, fasta_path)
+
+    if gtf_path is not None and cache is not None:
         logging.info("-" * 50)
-        logging.info("Converting GTF to refFlat format...")
-        gtf2refflat_converter.gtf_to_refflat(gtf_path, output_directory, assembly_name)
-        refflat = loading_and_preprocess_refflat(output_directory / f"converted_refflat_{assembly_name}.txt", interest_gene_list, parser, gtf_flag=True)
+        logging.info("Reading GTF/GFF3 file through the cache...")
+        converted_refflat_path = gtf2refflat_converter.prepare_cached_refflat(cache, gtf_path)
+        refflat, gene_index, genome_annotation_index = loading_and_preprocess_refflat(converted_refflat_path, interest_gene_list, parser, gtf_flag=True, regions=regions, gene_aliases=gene_aliases, build_annotation_index=site_recorder is not None)
+    elif gtf_path is not None :
+        logging.info("-" * 50)
+        converted_refflat_path = output_directory / f"converted_refflat_{assembly_name}.txt"
+        if converted_refflat_path.exists():
+            logging.info(f"Converted refFlat file for {assembly_name} already exists. Reading it instead of the GTF file.")
+            refflat, gene_index, genome_annotation_index = loading_and_preprocess_refflat(converted_refflat_path, interest_gene_list, parser, gtf_flag=True, regions=regions, gene_aliases=gene_aliases, build_annotation_index=site_recorder is not None)
+        else:
+            # GTF/GFF3から直接トランスクリプトのテーブルを作り、refFlatのテキストへの書き出しと読み直しを行わない
+            logging.info("Reading GTF/GFF3 file...")
+            annotation = gtf2refflat_converter.read_annotation_as_refflat(gtf_path)
+            if args.save_converted_refflat:
+                gtf2refflat_converter.write_refflat(annotation, converted_refflat_path)
+                logging.info(f"Saved the converted refFlat file to {converted_refflat_path}")
+            refflat, gene_index, genome_annotation_index = loading_and_preprocess_refflat(None, interest_gene_list, parser, gtf_flag=True, regions=regions, gene_aliases=gene_aliases, build_annotation_index=site_recorder is not None, annotation=annotation)
+            del annotation
     elif refflat_path is not None :
-        refflat = loading_and_preprocess_refflat(refflat_path, interest_gene_list, parser, gtf_flag=False)
+        refflat, gene_index, genome_annotation_index = loading_and_preprocess_refflat(refflat_path, interest_gene_list, parser, gtf_flag=False, regions=regions, gene_aliases=gene_aliases, build_annotation_index=site_recorder is not None)
+    stage_memory.record("loading refFlat", refflat)
 
     logging.info("-" * 50)
     logging.info("Classifying splicing events...")
-    classified_refflat = splicing_event_classifier.classify_splicing_events(refflat)
+    classified_refflat = splicing_event_classifier.classify_splicing_events(refflat, workers=args.workers)
     del refflat
+    stage_memory.record("classifying splicing events", classified_refflat)
 
-    splice_acceptor_single_exon_df, splice_donor_single_exon_df, exploded_classified_refflat = extract_target_exon(
-        classified_refflat, interest_gene_list, parser
-    )
-    del classified_refflat
+    # ゲノムインデックスの読み込み (初回は構築) はアノテーションに依存しないので、--workers が2以上の場合は
+    # エキソンの抽出からsgRNAの設計までと同時に進める。分類のプロセスプールをforkした後に開始する
+    # (途中でエラーになった場合は、withブロックを抜けるときに読み込みを待たずに終了する)
+    memory_budget = memory_report.get_available_memory()
+    with stage_scheduler.StageScheduler(args.workers, memory_budget) as pipeline_stages:
+        if args.genome_index is not None:
+            pipeline_stages.add("loading genome index", partial(load_genome_index, args.genome_index, cache, fasta_path, contig_policy))
 
-    logging.info("-" * 50)
-    logging.info("Annotating sequences to dataframe from genome FASTA...")
-    logging.info(f"Using this FASTA file as reference genome: {fasta_path}")
-    target_exon_df_with_acceptor_and_donor_sequence = sequence_annotator.annotate_sequence_to_splice_sites(
-        exploded_classified_refflat, splice_acceptor_single_exon_df, splice_donor_single_exon_df, fasta_path
-    )
-    del splice_acceptor_single_exon_df, splice_donor_single_exon_df
+        splice_acceptor_single_exon_df, splice_donor_single_exon_df, exploded_classified_refflat = extract_target_exon(
+            classified_refflat, interest_gene_list, parser, regions, gene_index
+        )
+        del classified_refflat
+        # 以降のテーブルは行数が多いため、文字列の列をcategoryに、座標をint32にしてメモリを節約する
+        exploded_classified_refflat = dtype_compactor.compact_dtypes(exploded_classified_refflat)
+        stage_memory.record("extracting target exons", splice_acceptor_single_exon_df, splice_donor_single_exon_df, exploded_classified_refflat)
 
-    logging.info("designing sgRNAs...")
-    target_exon_df_with_sgrna_dict = sgrna_designer.design_sgrna_for_base_editors_dict(
-        target_exon_df=target_exon_df_with_acceptor_and_donor_sequence,
-        base_editors=base_editors
-    )
+        logging.info("-" * 50)
+        logging.info("Annotating sequences to dataframe from genome FASTA...")
+        logging.info(f"Using this FASTA file as reference genome: {fasta_path}")
+        target_exon_df_with_acceptor_and_donor_sequence = sequence_annotator.annotate_sequence_to_splice_sites(
+            exploded_classified_refflat, splice_acceptor_single_exon_df, splice_donor_single_exon_df, fasta_path, max_workers=args.workers
+        )
+        del splice_acceptor_single_exon_df, splice_donor_single_exon_df
+        target_exon_df_with_acceptor_and_donor_sequence = dtype_compactor.compact_dtypes(target_exon_df_with_acceptor_and_donor_sequence)
+        stage_memory.record("annotating sequences", target_exon_df_with_acceptor_and_donor_sequence)
 
-    formatted_exploded_sgrna_df = format_output(target_exon_df_with_sgrna_dict, base_editors, parser)
-    del target_exon_df_with_acceptor_and_donor_sequence, exploded_classified_refflat
+        logging.info("designing sgRNAs...")
+        target_exon_df_with_sgrna_dict = sgrna_designer.design_sgrna_for_base_editors_dict(
+            target_exon_df=target_exon_df_with_acceptor_and_donor_sequence,
+            base_editors=base_editors,
+            engine=args.engine,
+            max_workers=args.workers,
+            memory_budget=memory_budget,
+        )
+        stage_memory.record("designing sgRNAs", target_exon_df_with_sgrna_dict)
+
+        formatted_exploded_sgrna_df = format_output(target_exon_df_with_sgrna_dict, base_editors, parser, assembly_name)
+        del target_exon_df_with_acceptor_and_donor_sequence, exploded_classified_refflat, target_exon_df_with_sgrna_dict
+        formatted_exploded_sgrna_df = dtype_compactor.compact_dtypes(formatted_exploded_sgrna_df)
+        stage_memory.record("formatting sgRNAs", formatted_exploded_sgrna_df)
     
-    logging.info("-" * 50)
-    logging.info("Scoring off-targets...")
-    exploded_sgrna_with_offtarget_info = offtarget_scorer.score_offtargets(formatted_exploded_sgrna_df, assembly_name, fasta_path=fasta_path)
+        logging.info("-" * 50)
+        logging.info("Scoring off-targets...")
+        offtarget_genome_index = None
+        if args.genome_index is not None:
+            try:
+                offtarget_genome_index = pipeline_stages.result("loading genome index")
+            except ValueError as e:
+                parser.error(str(e))
+    exploded_sgrna_with_offtarget_info = offtarget_scorer.score_offtargets(
+        formatted_exploded_sgrna_df,
+        assembly_name,
+        fasta_path=fasta_path,
+        engine=args.engine,
+        site_recorder=site_recorder,
+        contig_policy=contig_policy,
+        count_cap=args.offtarget_count_cap,
+        genome_index=offtarget_genome_index,
+        extra_seed_lengths=tuple(args.extra_seed_lengths),
+    )
+    del offtarget_genome_index
+    del formatted_exploded_sgrna_df
+    offtarget_sites = None
+    if site_recorder is not None:
+        offtarget_sites = offtarget_scorer.annotate_offtarget_sites(site_recorder.site_df, genome_annotation_index)
+        del site_recorder, genome_annotation_index
+    exploded_sgrna_with_offtarget_info = dtype_compactor.compact_dtypes(exploded_sgrna_with_offtarget_info)
+    stage_memory.record("scoring off-targets", exploded_sgrna_with_offtarget_info)
     logging.info("-" * 50)
     
-    logging.info("Prioritizing sgRNAs...")
-    prioritized_sgrna_df = sgrna_prioritizer.prioritize_sgrna(exploded_sgrna_with_offtarget_info)
-    logging.info("-" * 50)
+    output_time = datetime.datetime.now().strftime('%Y%m%d%H%M')
+    if batch_entries is not None:
+        for entry in batch_entries:
+            logging.info(f"Processing batch entry: {entry.output_prefix}")
+            entry_sgrna_df = batch_manifest.select_entry_sgrnas(exploded_sgrna_with_offtarget_info, entry, gene_index)
+            if entry_sgrna_df.empty:
+                logging.warning(f"No sgRNAs could be designed for batch entry: {entry.output_prefix}. Skipping output.")
+                continue
+            prioritize_and_write_results(
+                entry_sgrna_df,
+                output_directory,
+                f"{entry.output_prefix}_{assembly_name}_sgrnas_designed_by_altex-be",
+                args,
+                scoring_terms,
+                stage_memory,
+                fasta_path,
+                offtarget_sites=offtarget_sites,
+                stage_name=f"prioritizing sgRNAs ({entry.output_prefix})",
+            )
+        output_track_name = f"{output_time}_{assembly_name}_batch"
+    else:
+        output_track_name = f"{output_time}_{assembly_name}_sgrnas_designed_by_altex-be"
+        prioritize_and_write_results(
+            exploded_sgrna_with_offtarget_info,
+            output_directory,
+            output_track_name,
+            args,
+            scoring_terms,
+            stage_memory,
+            fasta_path,
+            offtarget_sites=offtarget_sites,
+        )
+    del exploded_sgrna_with_offtarget_info
 
-    output_track_name = f"{datetime.datetime.now().strftime('%Y%m%d%H%M')}_{assembly_name}_sgrnas_designed_by_altex-be"
-    logging.info("Saving results...")
-    prioritized_sgrna_df.to_csv(output_directory / f"{output_track_name}_table.csv")
-    logging.info(f"Results saved to: {output_directory / f'{output_track_name}_table.csv'}")
+    stage_memory.write(output_directory / f"{output_track_name}_memory_report.tsv")
 
-    write_ucsc_custom_track(
-        exploded_sgrna_with_offtarget_info,
-        output_directory,
-        output_track_name
-    )
-    
     logging.info("All AltEx-BE processes completed successfully.")
     logging.info(f"Output directory: {output_directory}")
     return
 
-def loading_and_preprocess_refflat(refflat_path: str, interest_gene_list: list[str], parser: argparse.ArgumentParser, gtf_flag: bool) -> pd.DataFrame:
+def loading_and_preprocess_refflat(
+    refflat_path: str | None,
+    interest_gene_list: list[str],
+    parser: argparse.ArgumentParser,
+    gtf_flag: bool,
+    regions: list[tuple[str, int, int]] | None = None,
+    gene_aliases: dict[str, str] | None = None,
+    build_annotation_index: bool = False,
+    annotation: pd.DataFrame | None = None,
+) -> tuple[pd.DataFrame, gene_identifier_index.GeneIdentifierIndex, exon_interval_index.GenomeAnnotationIndex | None]:
     """
     データのロード、前処理から、興味のある遺伝子の抽出までを行う。
+    遺伝子IDの検索用インデックスはアノテーションの読み込み直後に1度だけ作成し、以後の処理で使い回す。
+    build_annotation_indexがTrueの場合は、遺伝子で絞り込む前のアノテーションからゲノム全体の区間インデックスも作成する。
+    annotationを指定した場合 (GTF/GFF3から直接読み込んだ場合) は、refflat_pathを読まずにそのテーブルを使う。
     """
     logging.info("-" * 50)
-    logging.info("loading refFlat file...")
-    refflat = pd.read_csv(
-            refflat_path,
-            sep="\t",
-            header=None,
-            names=[
-                "geneName",
-                "name",
-                "chrom",
-                "strand",
-                "txStart",
-                "txEnd",
-                "cdsStart",
-                "cdsEnd",
-                "exonCount",
-                "exonStarts",
-                "exonEnds",
-            ],
+    if annotation is not None:
+        refflat = annotation.drop_duplicates(subset=["name"], keep=False).reset_index(drop=True)
+    else:
+        logging.info("loading refFlat file...")
+        # ゲノム全体の区間インデックスを作る場合はアノテーション全体が必要なので、すべての行を読み込む
+        refflat = refflat_loader.load_refflat(
+            Path(refflat_path),
+            None if build_annotation_index else interest_gene_list,
+            regions,
+            gene_aliases,
         )
-    
+
     logging.info("running processing of refFlat file...")
-    refflat = refflat.drop_duplicates(subset=["name"], keep=False)
-    refflat = refflat_preprocessor.preprocess_refflat(refflat, interest_gene_list, gtf_flag)
+    gene_index = gene_identifier_index.build_gene_identifier_index(refflat, gene_aliases)
+    genome_annotation_index = exon_interval_index.build_genome_annotation_index(refflat) if build_annotation_index else None
+    refflat = refflat_preprocessor.preprocess_refflat(refflat, interest_gene_list, gtf_flag, regions, gene_index)
     if refflat.empty :
         parser.error("No interest genes found in refFlat after preprocessing. Exiting...")
     # すべて constitutive exonでも設計対象とするが、exonが1つしかない遺伝子は対象外とする
-    if not refflat_preprocessor.check_multiple_exon_existance(refflat, interest_gene_list) :
+    if not refflat_preprocessor.check_multiple_exon_existance(refflat, interest_gene_list, gene_index) :
         parser.error("all of your interest genes are single-exon genes. AltEx-BE cannot process these genes. Exiting...")
-    return refflat
+    return refflat, gene_index, genome_annotation_index
 
-def extract_target_exon(classified_refflat: pd.DataFrame, interest_gene_list: list[str], parser: argparse.ArgumentParser) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+def extract_target_exon(
+    classified_refflat: pd.DataFrame,
+    interest_gene_list: list[str],
+    parser: argparse.ArgumentParser,
+    regions: list[tuple[str, int, int]] | None = None,
+    gene_index: gene_identifier_index.GeneIdentifierIndex | None = None,
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """
     分類されたスプライシングイベントデータフレームから、ターゲットエキソンを抽出する。
     """
     logging.info("-" * 50)
     logging.info("Extracting target exons...")
-    splice_acceptor_single_exon_df, splice_donor_single_exon_df, exploded_classified_refflat = target_exon_extractor.wrap_extract_target_exon(classified_refflat)
+    splice_acceptor_single_exon_df, splice_donor_single_exon_df, exploded_classified_refflat = target_exon_extractor.wrap_extract_target_exon(classified_refflat, regions)
     if splice_acceptor_single_exon_df.empty and splice_donor_single_exon_df.empty:
         parser.error("No target exons found for all of the given genes, exiting")
-        
+
+    genes_with_target_exons = set(exploded_classified_refflat["geneName"].unique())
     for gene in interest_gene_list:
         # Skip the sentinel value for --run-all-genes
         if gene == "all_genes":
             continue
-        if gene not in exploded_classified_refflat['geneName'].values:
+        symbol = gene_index.resolve(gene) if gene_index is not None else gene
+        if symbol not in genes_with_target_exons:
             logging.info(f"No target exons found for the gene: {gene}. Further processing of {gene} will be skipped.")
         else:
             logging.info(f"Target exons found for the gene: {gene}.")
     return splice_acceptor_single_exon_df, splice_donor_single_exon_df, exploded_classified_refflat
 
+def load_genome_index(
+    index_dir: str,
+    cache: artifact_cache.ArtifactCache | None,
+    fasta_path: Path,
+    contig_policy: ContigPolicy,
+) -> genome_index.GenomeIndex:
+    """
+    --genome-index のディレクトリ (指定しない場合は --cache-dir) からゲノムの接尾辞配列のインデックスを読み込む。まだない場合は作成する
+    ステージのスレッドで実行するので、ValueErrorはそのまま送出し、結果を受け取るメインスレッドで parser.error にする
+    """
+    if index_dir == "":
+        return genome_index.prepare_cached_genome_index(cache, fasta_path, contig_policy)
+    return genome_index.prepare_genome_index(Path(index_dir), fasta_path, contig_policy)
+
 def format_output(
     target_exon_df_with_sgrna_dict: dict[str, pd.DataFrame],
     base_editors: dict[str, BaseEditor],
-    parser: argparse.ArgumentParser
+    parser: argparse.ArgumentParser,
+    assembly_name: str | None = None,
 ) -> pd.DataFrame:
     logging.info("-" * 50)
     logging.info("Formatting output...")
-    formatted_exploded_sgrna_df = output_formatter.format_output(target_exon_df_with_sgrna_dict, base_editors)
+    formatted_exploded_sgrna_df = output_formatter.format_output(target_exon_df_with_sgrna_dict, base_editors, assembly_name)
     if formatted_exploded_sgrna_df.empty:
         parser.error("No sgRNAs could be designed for given genes and Base Editors, Exiting")
     return formatted_exploded_sgrna_df
 
+def prioritize_and_write_results(
+    exploded_sgrna_with_offtarget_info: pd.DataFrame,
+    output_directory: Path,
+    output_track_name: str,
+    args: argparse.Namespace,
+    scoring_terms: list[sgrna_prioritizer.ScoringTerm] | None,
+    stage_memory: memory_report.MemoryReport,
+    fasta_path: Path | None = None,
+    offtarget_sites: pd.DataFrame | None = None,
+    stage_name: str = "prioritizing sgRNAs",
+) -> None:
+    """
+    sgRNAに優先度を付けて、テーブルとトラックを書き出す。バッチモードでは依頼ごとに呼び出す。
+    offtarget_sitesを指定した場合は、出力するsgRNAのオフターゲットサイトもタブ区切りで書き出す。
+    """
+    logging.info("Prioritizing sgRNAs...")
+    prioritized_sgrna_df = sgrna_prioritizer.prioritize_sgrna(exploded_sgrna_with_offtarget_info, args.top_n_per_exon, scoring_terms)
+    stage_memory.record(stage_name, prioritized_sgrna_df)
+    logging.info("-" * 50)
+
+    logging.info("Saving results...")
+    # テーブル、オフターゲットサイト、トラックの書き出しは互いに独立なので、--workers が2以上の場合は同時に行う
+    with stage_scheduler.StageScheduler(args.workers) as scheduler:
+        scheduler.add("writing sgRNA table", partial(
+            output_writer.write_sgrna_table,
+            prioritized_sgrna_df,
+            output_directory,
+            output_track_name,
+            output_format=args.output_format,
+            partition_by=args.partition_by,
+        ))
+        if offtarget_sites is not None:
+            scheduler.add("writing off-target sites", partial(write_offtarget_sites, offtarget_sites, prioritized_sgrna_df, output_directory, output_track_name))
+        # --top-n-per-exon を指定した場合は、トラックにも選ばれたsgRNAだけを出力する
+        scheduler.add("writing tracks", partial(
+            write_ucsc_custom_track,
+            prioritized_sgrna_df,
+            output_directory,
+            output_track_name,
+            track_formats=args.track_format,
+            fasta_path=fasta_path,
+        ))
+        logging.info(f"Results saved to: {scheduler.result('writing sgRNA table')}")
+    return
+
+def write_offtarget_sites(
+    offtarget_sites: pd.DataFrame,
+    prioritized_sgrna_df: pd.DataFrame,
+    output_directory: Path,
+    output_track_name: str,
+) -> None:
+    """
+    出力するsgRNAのオフターゲットサイトを、タブ区切りで書き出す
+    """
+    output_sites_path = output_directory / f"{output_track_name}_offtarget_sites.tsv"
+    offtarget_sites[offtarget_sites["uuid"].isin(prioritized_sgrna_df["uuid"])].to_csv(output_sites_path, sep="\t", index=False)
+    logging.info(f"Off-target sites saved to: {output_sites_path}")
+
 def write_ucsc_custom_track(
     exploded_sgrna_with_offtarget_info: pd.DataFrame,
     output_directory: Path,
     output_track_name: str,
+    track_formats: list[str] | None = None,
+    fasta_path: Path | None = None,
 ) -> None:
+    """
+    track_formatsで指定された形式でsgRNAのトラックを書き出す。
+    bed: UCSCのカスタムトラック (track行付きのBED9)
+    tabix: ソートしてBGZFで圧縮したBED9と、tabixのインデックス (IGVなどで表示している領域だけを読み込める)
+    bigbed: オフターゲット数と優先度の列を持つbigBed (染色体の長さはFASTAから取得する)
+    指定しない場合は bed だけを書き出す
+    """
+    track_formats = track_formats or ["bed"]
     logging.info("Generating UCSC custom track...")
     bed_df = bed_for_ucsc_custom_track_maker.format_sgrna_for_ucsc_custom_track(exploded_sgrna_with_offtarget_info)
 
-    output_path = output_directory / f"{output_track_name}_ucsc_custom_track.bed"
-    track_description: str = f"sgRNAs designed by AltEx-BE on {datetime.datetime.now().strftime('%Y%m%d')}"
+    if "bed" in track_formats:
+        output_path = output_directory / f"{output_track_name}_ucsc_custom_track.bed"
+        track_description: str = f"sgRNAs designed by AltEx-BE on {datetime.datetime.now().strftime('%Y%m%d')}"
+
+        with open(output_path, "w") as f:
+            track_header = f'track name="{output_track_name}" description="{track_description}" visibility=2 itemRgb="On"\n'
+            f.write(track_header)
+            bed_df.to_csv(f, sep="\t", header=False, index=False, lineterminator='\n')
+        logging.info(f"UCSC custom track file saved to: {output_path}")
 
-    with open(output_path, "w") as f:
-        track_header = f'track name="{output_track_name}" description="{track_description}" visibility=2 itemRgb="On"\n'
-        f.write(track_header)
-        bed_df.to_csv(f, sep="\t", header=False, index=False, lineterminator='\n')
+    if "tabix" in track_formats:
+        output_path = indexed_track_writer.write_tabix_bed(bed_df, output_directory / f"{output_track_name}_track.bed.gz")
+        logging.info(f"Tabix-indexed track file saved to: {output_path} (index: {output_path}.tbi)")
 
-    logging.info(f"UCSC custom track file saved to: {output_path}")
+    if "bigbed" in track_formats:
+        bigbed_df = bed_for_ucsc_custom_track_maker.format_sgrna_for_bigbed(exploded_sgrna_with_offtarget_info)
+        output_path = indexed_track_writer.write_bigbed(
+            bigbed_df,
+            indexed_track_writer.read_chrom_sizes(fasta_path),
+            output_directory / f"{output_track_name}_track.bb",
+            bed_for_ucsc_custom_track_maker.SGRNA_BIGBED_AUTOSQL,
+        )
+        logging.info(f"bigBed track file saved to: {output_path}")
     return
 
 if __name__ == "__main__":
@@ -31,7 +31,7 @@ def build_parser() -> argparse.ArgumentParser:
     )
     transcript_group.add_argument(
         "-g", "--gtf-path",
-        help="Path of GTF file"
+        help="Path of GTF or GFF3 file (.gff3/.gff is read as GFF3; may be gzip-compressed)"
     )
     dir_group.add_argument(
         "-f", "--fasta-path",
@@ -43,6 +43,80 @@ def build_parser() -> argparse.ArgumentParser:
         required=True,
         help="Directory of the output files"
     )
+    dir_group.add_argument(
+        "--save-converted-refflat",
+        action="store_true",
+        help="With --gtf-path, also write the converted annotation to the output directory as converted_refflat_<assembly>.txt. Later runs with the same output directory read it instead of the GTF"
+    )
+    dir_group.add_argument(
+        "--cache-dir",
+        default=None,
+        required=False,
+        help="Shared directory for files derived from the inputs: the converted GTF/GFF3 annotation, the FASTA index (.fai) and the --genome-index suffix array. Entries are keyed by the content of the input files, and concurrent jobs wait for one build and reuse it"
+    )
+    dir_group.add_argument(
+        "--output-format",
+        choices=["csv", "tsv", "parquet", "feather"],
+        default="csv",
+        required=False,
+        help="Format of the output sgRNA table (parquet and feather need pyarrow: pip install 'AltEx-BE[arrow]')"
+    )
+    dir_group.add_argument(
+        "--partition-by",
+        nargs="+",
+        choices=["chrom", "base_editor_name"],
+        default=None,
+        required=False,
+        help="Split the output sgRNA table into hive-style directories by these columns (e.g. chrom=chr1/base_editor_name=BE4max/)"
+    )
+    dir_group.add_argument(
+        "--track-format",
+        nargs="+",
+        choices=["bed", "tabix", "bigbed"],
+        default=["bed"],
+        required=False,
+        help="Formats of the sgRNA track: 'bed' (plain UCSC custom track), 'tabix' (sorted, BGZF-compressed BED with .tbi index), 'bigbed' (indexed bigBed with off-target counts and priority)"
+    )
+    dir_group.add_argument(
+        "--top-n-per-exon",
+        type=int,
+        default=None,
+        required=False,
+        help="Output only the N highest-priority sgRNAs for each exon and base editor (default: output all sgRNAs)"
+    )
+    dir_group.add_argument(
+        "--scoring-config",
+        default=None,
+        required=False,
+        help="Path to a file (csv,tsv,txt) of weighted scorers (columns: scorer, weight, and optional scorer parameters). sgRNAs are ranked by the weighted score instead of the default order"
+    )
+    dir_group.add_argument(
+        "--offtarget-sites-per-sgrna",
+        type=int,
+        default=None,
+        required=False,
+        help="Write the locations of up to N PAM+20bp exact matches per sgRNA, annotated as cds/exon/intron/intergenic, to <output>_offtarget_sites.tsv"
+    )
+    dir_group.add_argument(
+        "--extra-seed-lengths",
+        nargs="+",
+        type=int,
+        default=[],
+        required=False,
+        help="Also count exact matches of PAM + seed for these seed lengths (1-20), written to pam+<N>bp_exact_match_count columns (e.g. --extra-seed-lengths 8 10 16)"
+    )
+    dir_group.add_argument(
+        "--contigs",
+        default="all",
+        required=False,
+        help="FASTA records scanned for off-targets: 'all' (default), 'primary' (chr1-22, X, Y; skips random/Un/alt/fix contigs), or a path to a file of contig names (one per line). With a FASTA index (.fai), excluded records are skipped without being read"
+    )
+    dir_group.add_argument(
+        "--batch-manifest",
+        default=None,
+        required=False,
+        help="Path to a batch manifest (csv,tsv,txt; columns: output_prefix, genes, gene_file, base_editors). Annotation loading and off-target scoring are shared, and results are written per entry"
+    )
     gene_group = parser.add_argument_group("Gene Options")
     gene_group.add_argument(
         "--gene-symbols",
@@ -74,11 +148,29 @@ def build_parser() -> argparse.ArgumentParser:
         required=False,
         help="Path to a file (csv,txt,tsv) containing gene symbols or IDs correspond to reference of transcript (one per line)"
     )
+    gene_group.add_argument(
+        "--gene-alias-file",
+        default=None,
+        required=False,
+        help="Path to a tab-separated file mapping gene aliases (1st column) to gene symbols in the reference (2nd column)"
+    )
     gene_group.add_argument(
         "--run-all-genes",
         action="store_true",
         help="Run the analysis for all genes in the reference transcriptome (overrides other gene selection options)"
     )
+    gene_group.add_argument(
+        "--regions",
+        default=None,
+        nargs="+",
+        help="List of genomic regions (chr:start-end, 1-based inclusive, space-separated). Only exons overlapping these regions are designed"
+    )
+    gene_group.add_argument(
+        "--regions-bed",
+        default=None,
+        required=False,
+        help="Path to a BED file of genomic regions. Only exons overlapping these regions are designed"
+    )
     base_editors = parser.add_argument_group("Base Editor Options")
     base_editors.add_argument(
         "-n", "--be-name",
@@ -116,6 +208,41 @@ def build_parser() -> argparse.ArgumentParser:
         required=False,
         help="input the path of csv file or txt file of base editor information",
     )
+    performance_group = parser.add_argument_group("Performance Options")
+    performance_group.add_argument(
+        "--engine",
+        choices=["python", "native"],
+        default="python",
+        required=False,
+        help="Engine for sgRNA design and off-target scanning. 'native' uses vectorized/compiled kernels (genome scanning needs numba: pip install 'AltEx-BE[native]')",
+    )
+    performance_group.add_argument(
+        "--genome-index",
+        nargs="?",
+        const="",
+        default=None,
+        required=False,
+        help="Directory of a suffix-array index of the genome FASTA. It is built on the first run (faster with: pip install 'AltEx-BE[index]') and memory-mapped afterwards, so off-target counts of any length are looked up without scanning the genome. Without a directory, the index is kept in --cache-dir",
+    )
+    performance_group.add_argument(
+        "--offtarget-count-cap",
+        type=int,
+        default=None,
+        required=False,
+        help="Stop counting the off-target matches of an sgRNA once its count reaches N. The count is reported as N and offtarget_count_saturated is set, and guides in repeats are dropped from the genome scan (default: count all matches)",
+    )
+    performance_group.add_argument(
+        "--memory-report",
+        action="store_true",
+        help="Log the memory used by the tables and the peak RSS after each stage, and save them to <output>_memory_report.tsv",
+    )
+    performance_group.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        required=False,
+        help="Number of processes for per-gene splicing classification (default: 1). Genes are split into cost-balanced chunks, largest genes first. With 2 or more, independent pipeline stages (sequence fetch, per-PAM design, genome index loading, output writers) also run concurrently on threads",
+    )
     return parser
 
 if __name__ == "__main__":
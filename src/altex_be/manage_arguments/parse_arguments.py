@@ -3,6 +3,10 @@ import pandas as pd
 import logging
 from pathlib import Path
 from .. class_def.base_editors import BaseEditor, PRESET_BASE_EDITORS
+from .. exon_interval_index import parse_region_string, parse_regions_bed
+from .. sgrna_prioritizer import ScoringTerm, load_scoring_terms
+from .. batch_manifest import BatchEntry, load_batch_manifest
+from .. fasta_contigs import ContigPolicy, load_contig_policy
 from .. import logging_config  # noqa: F401
 
 def parse_gene_file(gene_file: Path) -> list[str] | None:
@@ -36,8 +40,66 @@ def parse_genes_from_args(args: argparse.Namespace, parser: argparse.ArgumentPar
     refseq_ids = args.refseq_ids if args.refseq_ids is not None else []
     ensembl_ids = args.ensembl_ids if args.ensembl_ids is not None else []
     interest_gene_list = gene_symbols + refseq_ids + ensembl_ids + genes_from_file
+    # 遺伝子が指定されず領域だけが指定された場合は、すべての遺伝子を領域で絞り込む
+    if not interest_gene_list and (getattr(args, "regions", None) or getattr(args, "regions_bed", None)):
+        return ["all_genes"]
     return interest_gene_list
 
+def parse_regions_from_args(args: argparse.Namespace, parser: argparse.ArgumentParser) -> list[tuple[str, int, int]]:
+    """
+    --regions と --regions-bed から、(chrom, start, end) の0-based半開区間のリストを作成して返す
+    どちらも指定されていない場合は空のリストを返す
+    """
+    regions = []
+    try:
+        for region in getattr(args, "regions", None) or []:
+            regions.append(parse_region_string(region))
+        if getattr(args, "regions_bed", None):
+            regions.extend(parse_regions_bed(Path(args.regions_bed)))
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+    return regions
+
+def parse_scoring_config_from_args(args: argparse.Namespace, parser: argparse.ArgumentParser) -> list[ScoringTerm] | None:
+    """
+    --scoring-config で指定されたファイルから、重み付きスコアの設定を読み込んで返す
+    指定されていない場合はNoneを返す
+    """
+    if not getattr(args, "scoring_config", None):
+        return None
+    try:
+        return load_scoring_terms(Path(args.scoring_config))
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+
+def parse_contig_policy_from_args(args: argparse.Namespace, parser: argparse.ArgumentParser) -> ContigPolicy:
+    """
+    --contigs で指定された、オフターゲットを数えるコンティグの選び方を返す
+    """
+    try:
+        return load_contig_policy(getattr(args, "contigs", None) or "all")
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+
+def parse_batch_manifest_from_args(
+    args: argparse.Namespace,
+    parser: argparse.ArgumentParser,
+    base_editors: dict[str, BaseEditor],
+) -> list[BatchEntry] | None:
+    """
+    --batch-manifest で指定されたファイルから、依頼ごとの遺伝子、base editor、出力の接頭辞を読み込んで返す
+    base editorの名前は、プリセットと --be-files などで指定されたbase editorから探す
+    指定されていない場合はNoneを返す
+    """
+    if not getattr(args, "batch_manifest", None):
+        return None
+    if args.run_all_genes or args.gene_symbols or args.refseq_ids or args.ensembl_ids or args.gene_file:
+        parser.error("--batch-manifest cannot be combined with gene options (--gene-symbols, --refseq-ids, --ensembl-ids, --gene-file, --run-all-genes). Write genes in the manifest instead.")
+    try:
+        return load_batch_manifest(Path(args.batch_manifest), base_editors)
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+
 def parse_base_editors_from_file(
     args: argparse.Namespace, 
     parser: argparse.ArgumentParser, 
@@ -144,7 +206,7 @@ def parse_base_editors_from_all_sources(
 def parse_arguments(
     args: argparse.Namespace,
     parser: argparse.ArgumentParser
-) -> tuple[Path, Path, Path, list[str], dict[str, BaseEditor], str]:
+) -> tuple[Path, Path, Path, list[str], dict[str, BaseEditor], str, list[tuple[str, int, int]]]:
     """
     このモジュールに含まれるすべての関数のラッパー関数。
     """
@@ -152,4 +214,5 @@ def parse_arguments(
     interest_gene_list = parse_genes_from_args(args, parser)
     base_editors = parse_base_editors_from_all_sources(args, parser)
     assembly_name = parse_assembly_name_from_args(args)
-    return refflat_path, gtf_path, fasta_path, output_directory, interest_gene_list, base_editors, assembly_name
\ No newline at end of file
+    regions = parse_regions_from_args(args, parser)
+    return refflat_path, gtf_path, fasta_path, output_directory, interest_gene_list, base_editors, assembly_name, regions
\ No newline at end of file
@@ -3,6 +3,7 @@ import argparse
 import logging
 from pathlib import Path
 from .. import logging_config  # noqa: F401
+from ..output_writer import ARROW_OUTPUT_FORMATS, is_arrow_available
 
 def is_input_output_directories(
     refflat_path: Path, 
@@ -32,6 +33,30 @@ def is_interest_genes_provided(interest_gene_list: list[str], parser: argparse.A
     if not interest_gene_list:
         parser.error("Please provide at least one interest gene symbol or Refseq ID.")
 
+def is_output_format_available(output_format: str, parser: argparse.ArgumentParser) -> None:
+    if output_format in ARROW_OUTPUT_FORMATS and not is_arrow_available():
+        parser.error(f"--output-format {output_format} requires pyarrow. Please install it (pip install 'AltEx-BE[arrow]') or use csv/tsv.")
+
+def is_top_n_per_exon_valid(top_n_per_exon: int | None, parser: argparse.ArgumentParser) -> None:
+    if top_n_per_exon is not None and top_n_per_exon < 1:
+        parser.error("--top-n-per-exon must be a positive integer.")
+
+def is_offtarget_sites_per_sgrna_valid(offtarget_sites_per_sgrna: int | None, parser: argparse.ArgumentParser) -> None:
+    if offtarget_sites_per_sgrna is not None and offtarget_sites_per_sgrna < 1:
+        parser.error("--offtarget-sites-per-sgrna must be a positive integer.")
+
+def is_offtarget_count_cap_valid(offtarget_count_cap: int | None, parser: argparse.ArgumentParser) -> None:
+    if offtarget_count_cap is not None and offtarget_count_cap < 1:
+        parser.error("--offtarget-count-cap must be a positive integer.")
+
+def is_extra_seed_lengths_valid(extra_seed_lengths: list[int], parser: argparse.ArgumentParser) -> None:
+    if any(seed_len < 1 or seed_len > 20 for seed_len in extra_seed_lengths):
+        parser.error("--extra-seed-lengths must be between 1 and 20 (the sgRNA length).")
+
+def is_workers_valid(workers: int, parser: argparse.ArgumentParser) -> None:
+    if workers < 1:
+        parser.error("--workers must be a positive integer.")
+
 def load_supported_assemblies() -> list[str]:
     """
     パッケージ内のcrispr_direct_supported_assemblies.txtを読み込み、アセンブリ名リストを返す
@@ -63,7 +88,13 @@ def validate_arguments(
     interest_gene_list: list[str], 
     base_editors: dict[str, BaseEditor], 
     assembly_name: str, 
-    parser: argparse.ArgumentParser
+    parser: argparse.ArgumentParser,
+    output_format: str = "csv",
+    top_n_per_exon: int | None = None,
+    workers: int = 1,
+    offtarget_sites_per_sgrna: int | None = None,
+    offtarget_count_cap: int | None = None,
+    extra_seed_lengths: list[int] | None = None,
 ) -> None:
     """
     引数の妥当性を検証するラッパー関数
@@ -73,4 +104,10 @@ def validate_arguments(
     is_base_editors_provided(base_editors, parser)
     is_interest_genes_provided(interest_gene_list, parser)
     is_supported_assembly_name_in_crispr_direct(assembly_name)
+    is_output_format_available(output_format, parser)
+    is_top_n_per_exon_valid(top_n_per_exon, parser)
+    is_workers_valid(workers, parser)
+    is_offtarget_sites_per_sgrna_valid(offtarget_sites_per_sgrna, parser)
+    is_offtarget_count_cap_valid(offtarget_count_cap, parser)
+    is_extra_seed_lengths_valid(extra_seed_lengths or [], parser)
     return None
\ No newline at end of file
@@ -0,0 +1,91 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from pathlib import Path
+import logging
+import sys
+import pandas as pd
+from . import logging_config # noqa: F401
+
+MIB = 2 ** 20
+
+
+def measure_frame_memory(*frames, deep: bool = True) -> int:
+    """
+    Purpose:
+        DataFrame (またはDataFrameを値に持つdict) が使用しているメモリの合計をbyteで返す
+        deep=True の場合は、object型の列の各セルが指すPythonオブジェクトの大きさも含める (memory_usage(deep=True))
+        deep=False は配列の大きさだけを数えるので、大きなテーブルでもすぐに返る (ステージのメモリの見積もりに使う)
+    """
+    total = 0
+    for frame in frames:
+        if isinstance(frame, dict):
+            total += measure_frame_memory(*frame.values(), deep=deep)
+        elif isinstance(frame, pd.DataFrame):
+            total += int(frame.memory_usage(index=True, deep=deep).sum())
+    return total
+
+
+def get_available_memory() -> int | None:
+    """
+    Purpose:
+        新しく確保できるメモリ (Linuxの /proc/meminfo の MemAvailable) をbyteで返す。取得できない環境ではNoneを返す
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def get_peak_rss() -> int | None:
+    """
+    Purpose:
+        このプロセスのこれまでの最大常駐メモリ (peak RSS) をbyteで返す。取得できない環境 (Windows) ではNoneを返す
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxではkilobyte, macOSではbyteで返される
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@dataclass
+class MemoryReport:
+    """
+    パイプラインの各ステージの後に、保持しているデータフレームのメモリ使用量と peak RSS を記録するためのdataclass
+    enabledがFalseの場合は何もしない (memory_usage(deep=True) は大きなテーブルでは時間がかかるため)
+    """
+    enabled: bool = False
+    records: list[dict] = field(default_factory=list)
+
+    def record(self, stage: str, *frames) -> None:
+        """
+        Purpose:
+            ステージ名と、そのステージの出力のデータフレームのメモリ使用量を記録してログに出力する
+        """
+        if not self.enabled:
+            return
+        frame_bytes = measure_frame_memory(*frames)
+        peak_rss = get_peak_rss()
+        self.records.append({
+            "stage": stage,
+            "frame_memory_mib": round(frame_bytes / MIB, 1),
+            "peak_rss_mib": round(peak_rss / MIB, 1) if peak_rss is not None else None,
+        })
+        peak_message = f", peak RSS {peak_rss / MIB:.1f} MiB" if peak_rss is not None else ""
+        logging.info(f"Memory after {stage}: {frame_bytes / MIB:.1f} MiB in tables{peak_message}")
+
+    def write(self, output_path: Path) -> None:
+        """
+        Purpose:
+            記録したメモリ使用量をタブ区切りのファイルに書き出す
+        """
+        if not self.enabled:
+            return
+        pd.DataFrame(self.records, columns=["stage", "frame_memory_mib", "peak_rss_mib"]).to_csv(output_path, sep="\t", index=False)
+        logging.info(f"Memory report saved to: {output_path}")
@@ -0,0 +1,404 @@
+"""
+sgRNA設計とゲノムスキャンのホットループを、バイト配列 (numpy.uint8) 上で実行するカーネル群。
+`--engine native` を指定したときに使われる。
+
+- sgRNA設計 (PAM検索、編集ウィンドウでの絞り込み、CDSとの重なりの計算) はNumPyでベクトル化しており、追加の依存はない
+- ゲノム全体の完全一致カウントはNumbaでコンパイルする。Numbaがインストールされていない場合は、
+  呼び出し側が従来のPython (Aho-Corasick) の実装にフォールバックする
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from pathlib import Path
+import logging
+import numpy as np
+from tqdm import tqdm
+from . import logging_config # noqa: F401
+from .fasta_contigs import ContigPolicy, count_selected_records, iter_fasta_records
+
+try:
+    import numba
+except ImportError:  # Numbaは任意の依存 (pip install "AltEx-BE[native]")
+    numba = None
+
+NUMBA_AVAILABLE = numba is not None
+
+SGRNA_LENGTH = 20
+MAX_KMER_LENGTH = 32 # 1塩基2bitでuint64に収まる最大長
+BITMAP_BITS = 24 # 完全一致の候補を絞り込むためのビットマップの大きさ (2^24 bit = 2MB / 長さ)
+
+IUPAC_BASES = {
+    "A": "A", "C": "C", "G": "G", "T": "T", "N": "ACGT",
+    "M": "AC", "R": "AG", "W": "AT", "S": "CG", "Y": "CT", "K": "GT",
+    "V": "ACG", "H": "ACT", "D": "AGT", "B": "CGT",
+}
+IUPAC_COMPLEMENT = {
+    "A": "T", "T": "A", "C": "G", "G": "C", "N": "N",
+    "M": "K", "K": "M", "R": "Y", "Y": "R", "W": "W", "S": "S",
+    "V": "B", "B": "V", "H": "D", "D": "H",
+}
+# IUPACの縮退塩基 (大文字と小文字) と "+" を含む。それ以外の文字は、Pythonのエンジンと同じくKeyErrorにする
+DNA_COMPLEMENT_TABLE = str.maketrans(
+    "".join(IUPAC_COMPLEMENT) + "".join(IUPAC_COMPLEMENT).lower() + "+",
+    "".join(IUPAC_COMPLEMENT.values()) + "".join(IUPAC_COMPLEMENT.values()).lower() + "+",
+)
+DNA_COMPLEMENT_CHARACTERS_TABLE = str.maketrans("", "", "".join(map(chr, DNA_COMPLEMENT_TABLE))) # 補塩基のある文字を削除するテーブル
+
+# A/C/G/T (大文字小文字を問わない) を0-3に、それ以外を4に変換するテーブル
+BASE_CODE_TABLE = np.full(256, 4, dtype=np.uint8)
+for _code, _bases in enumerate(["Aa", "Cc", "Gg", "Tt"]):
+    for _base in _bases:
+        BASE_CODE_TABLE[ord(_base)] = _code
+
+
+def is_native_scan_available(engine: str) -> bool:
+    """
+    Purpose:
+        engine == "native" かつNumbaが利用可能な場合にTrueを返す。Numbaがない場合は警告を出してFalseを返す
+    """
+    if engine != "native":
+        return False
+    if not NUMBA_AVAILABLE:
+        logging.warning("Numba is not installed. Falling back to the python engine for genome scanning.")
+        return False
+    return True
+
+
+def reverse_complement(sequence: str) -> str:
+    """
+    Purpose:
+        str.translate を使って逆相補配列を作成する (IUPACの塩基と小文字, "+" に対応)
+    """
+    unknown = sequence.translate(DNA_COMPLEMENT_CHARACTERS_TABLE)
+    if unknown:
+        raise KeyError(unknown[0])
+    return sequence.translate(DNA_COMPLEMENT_TABLE)[::-1]
+
+
+def reverse_complement_iupac(pam_sequence: str) -> str:
+    """
+    Purpose:
+        IUPAC表記のPAM配列を逆相補に変換する (例: "NGG" -> "CCN")
+    """
+    return "".join(IUPAC_COMPLEMENT[base] for base in reversed(pam_sequence.upper()))
+
+
+# IUPACの各文字が許す塩基を、A=1, C=2, G=4, T=8 のビットで表したもの
+IUPAC_BASE_MASKS = {
+    base: sum(1 << "ACGT".index(allowed) for allowed in allowed_bases)
+    for base, allowed_bases in IUPAC_BASES.items()
+}
+PAM_SIDE_CODES = {"left": 0, "right": 1}
+
+
+@dataclass(frozen=True)
+class OfftargetQuery:
+    """
+    オフターゲットを数える条件。ゲノムの + strandでsequence (spacerまたはseed) に完全一致し、
+    pam_side側 ("left" または "right") に隣接する塩基がpam_pattern (IUPAC表記) に一致する箇所を数える
+    PAMの展開 (NNNなら64通り) を検索する配列に加えないので、縮退したPAMでも検索する配列の数は増えない
+    """
+    sequence: str
+    pam_pattern: str = "" # 空の場合はPAMを確認しない
+    pam_side: str = "right"
+
+    @property
+    def site_length(self) -> int:
+        return len(self.sequence) + len(self.pam_pattern)
+
+    def reverse_complement(self) -> OfftargetQuery:
+        """
+        Purpose: 同じサイトを - strand側から見た条件 (配列とPAMを逆相補にし、PAMの側を入れ替える) を返す
+        """
+        return OfftargetQuery(
+            sequence=reverse_complement(self.sequence),
+            pam_pattern=reverse_complement_iupac(self.pam_pattern),
+            pam_side="left" if self.pam_side == "right" else "right",
+        )
+
+
+def encode_sequences(sequences: list[str]) -> np.ndarray:
+    """
+    Purpose:
+        同じ長さの配列のリストを、(配列数, 配列長) のuint8の行列に変換する (ASCIIのバイトのまま)
+    """
+    if not sequences:
+        return np.empty((0, 0), dtype=np.uint8)
+    return np.frombuffer("".join(sequences).encode("ascii"), dtype=np.uint8).reshape(len(sequences), -1)
+
+
+def find_pattern_positions(seq_matrix: np.ndarray, iupac_pattern: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Purpose:
+        各行について、IUPAC表記のパターンにマッチする開始位置をすべて返す (重なりを含む)
+        regexの (?=([Gg][Gg])) と同じく、大文字小文字を区別せず、A/C/G/T以外の塩基にはマッチしない
+    Returns:
+        (行番号, 開始位置) の配列。行番号、開始位置の昇順に並ぶ
+    """
+    n_rows, seq_len = seq_matrix.shape
+    n_positions = seq_len - len(iupac_pattern) + 1
+    if n_rows == 0 or n_positions <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    codes = BASE_CODE_TABLE[seq_matrix]
+    mask = np.ones((n_rows, n_positions), dtype=bool)
+    for offset, base in enumerate(iupac_pattern.upper()):
+        allowed = np.zeros(5, dtype=bool)
+        allowed[["ACGT".index(b) for b in IUPAC_BASES[base]]] = True
+        mask &= allowed[codes[:, offset:offset + n_positions]]
+    rows, positions = np.nonzero(mask)
+    return rows.astype(np.int64), positions.astype(np.int64)
+
+
+@dataclass(frozen=True)
+class PamHitArrays:
+    """
+    sgrna_designer.PamHit を、すべての配列についてまとめて配列として保持するためのdataclass
+    """
+    rows: np.ndarray # 配列の行番号
+    pam_starts: np.ndarray # PAMの開始位置
+    sgrna_starts: np.ndarray # sgRNAの開始位置 (0-indexed)
+    sgrna_ends: np.ndarray # sgRNAの終了位置 (0-indexed)
+
+
+def enumerate_pam_hits(
+    seq_matrix: np.ndarray,
+    pam_sequence: str,
+    cds_boundary: int,
+    base_editor_type: str,
+    site_type: str,
+) -> PamHitArrays:
+    """
+    Purpose:
+        sgrna_designer.enumerate_pam_hits と同じ規則で、すべての配列のPAMを一度に検索する
+    """
+    base_editor_type = base_editor_type.lower()
+    upper = seq_matrix & 0xDF # ASCIIの英字を大文字にする
+    if site_type == "acceptor":
+        splice_site_ok = (upper[:, cds_boundary - 2] == ord("A")) & (upper[:, cds_boundary - 1] == ord("G"))
+    else:
+        splice_site_ok = (upper[:, cds_boundary + 1] == ord("G")) & (upper[:, cds_boundary + 2] == ord("T"))
+
+    pam_on_plus_strand = site_type == "acceptor" and base_editor_type == "abe"
+    pattern = pam_sequence if pam_on_plus_strand else reverse_complement_iupac(pam_sequence)
+    rows, pam_starts = find_pattern_positions(seq_matrix, pattern)
+    if pam_on_plus_strand:
+        sgrna_starts, sgrna_ends = pam_starts - SGRNA_LENGTH, pam_starts
+    else:
+        sgrna_starts = pam_starts + len(pattern)
+        sgrna_ends = sgrna_starts + SGRNA_LENGTH
+    keep = splice_site_ok[rows] & (sgrna_starts >= 0) & (sgrna_ends <= seq_matrix.shape[1])
+    return PamHitArrays(rows=rows[keep], pam_starts=pam_starts[keep], sgrna_starts=sgrna_starts[keep], sgrna_ends=sgrna_ends[keep])
+
+
+@dataclass(frozen=True)
+class DesignedSgrnaArrays:
+    """
+    編集ウィンドウで絞り込んだ後のsgRNAの情報を、配列としてまとめて保持するためのdataclass
+    """
+    rows: np.ndarray
+    pam_starts: np.ndarray
+    sgrna_starts: np.ndarray
+    sgrna_ends: np.ndarray
+    target_pos_in_sgrna: np.ndarray
+    overlap_between_cds_and_editing_window: np.ndarray
+    possible_unintended_edited_base_count: np.ndarray
+
+
+def _count_base_in_ranges(seq_matrix: np.ndarray, base: str, rows: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    各行の [start, end) に含まれる base (大文字のみ、str.countと同じ) の数を累積和で求める
+    """
+    cumulative = np.zeros((seq_matrix.shape[0], seq_matrix.shape[1] + 1), dtype=np.int32)
+    np.cumsum(seq_matrix == ord(base), axis=1, out=cumulative[:, 1:])
+    starts = np.clip(starts, 0, seq_matrix.shape[1])
+    ends = np.clip(ends, starts, seq_matrix.shape[1])
+    return cumulative[rows, ends] - cumulative[rows, starts]
+
+
+def design_sgrna_from_pam_hits(
+    seq_matrix: np.ndarray,
+    pam_hits: PamHitArrays,
+    editing_window_start_in_grna: int,
+    editing_window_end_in_grna: int,
+    target_base_pos_in_sequence: int,
+    cds_boundary: int,
+    base_editor_type: str,
+    site_type: str,
+) -> DesignedSgrnaArrays:
+    """
+    Purpose:
+        sgrna_designer.design_sgrna_from_pam_hits と同じ規則で、編集ウィンドウによる絞り込みと
+        CDSとの重なり、意図しない編集を受ける塩基数の計算をまとめて行う
+    """
+    base_editor_type = base_editor_type.lower()
+    starts, ends = pam_hits.sgrna_starts, pam_hits.sgrna_ends
+    if site_type == "acceptor" and base_editor_type == "abe":
+        window_starts = ends - editing_window_end_in_grna
+        window_ends = ends - editing_window_start_in_grna
+        target_pos_in_sgrna = ends - target_base_pos_in_sequence
+    else:
+        window_starts = starts + editing_window_start_in_grna - 1
+        window_ends = starts + editing_window_end_in_grna - 1
+        target_pos_in_sgrna = target_base_pos_in_sequence - starts + 1
+    keep = (window_starts <= target_base_pos_in_sequence) & (target_base_pos_in_sequence <= window_ends)
+    rows = pam_hits.rows[keep]
+    window_starts, window_ends = window_starts[keep], window_ends[keep]
+
+    if site_type == "acceptor":
+        has_overlap = window_ends >= cds_boundary
+        overlap = np.where(has_overlap, window_ends - cds_boundary + 1, 0)
+        count_start, count_end = np.full_like(window_ends, cds_boundary), window_ends + 1
+        unintended_base = {"cbe": "G", "abe": "A"}.get(base_editor_type)
+    else:
+        has_overlap = window_starts <= cds_boundary
+        overlap = np.where(has_overlap, cds_boundary - window_starts + 1, 0)
+        count_start, count_end = window_starts, np.full_like(window_starts, cds_boundary + 1)
+        unintended_base = {"cbe": "G", "abe": "T"}.get(base_editor_type)
+    if unintended_base is None:
+        unintended = np.zeros_like(overlap)
+    else:
+        counts = _count_base_in_ranges(seq_matrix, unintended_base, rows, count_start, count_end)
+        unintended = np.where(has_overlap, counts, 0)
+
+    return DesignedSgrnaArrays(
+        rows=rows,
+        pam_starts=pam_hits.pam_starts[keep],
+        sgrna_starts=starts[keep],
+        sgrna_ends=ends[keep],
+        target_pos_in_sgrna=target_pos_in_sgrna[keep],
+        overlap_between_cds_and_editing_window=overlap,
+        possible_unintended_edited_base_count=unintended,
+    )
+
+
+def encode_kmer(sequence: str) -> int:
+    """
+    Purpose:
+        A/C/G/Tだけからなる配列を、1塩基2bitの整数に変換する
+    """
+    value = 0
+    for base in sequence.upper():
+        value = (value << 2) | "ACGT".index(base)
+    return value
+
+
+def is_native_countable(query: OfftargetQuery) -> bool:
+    """
+    Purpose:
+        Numbaのカーネルで数えられる条件 (配列がA/C/G/TのみでMAX_KMER_LENGTH以下、PAMがIUPAC表記) かどうかを判定する
+    """
+    sequence = query.sequence
+    return (
+        0 < len(sequence) <= MAX_KMER_LENGTH
+        and set(sequence.upper()) <= set("ACGT")
+        and set(query.pam_pattern.upper()) <= set(IUPAC_BASE_MASKS)
+    )
+
+
+if NUMBA_AVAILABLE:
+    @numba.njit(cache=True, nogil=True)
+    def _scan_pam_constrained_matches(
+        sequence, base_codes, lengths, offsets, kmers, bitmaps, query_offsets, query_sides, pam_offsets, pam_masks, counts
+    ):  # pragma: no cover - compiled
+        # sequenceはFASTAの配列のbytesそのもの。base_codes (BASE_CODE_TABLE) で大文字小文字を区別せずに塩基コードにする
+        code = np.uint64(0)
+        valid = 0
+        bitmap_mask = np.uint64((1 << BITMAP_BITS) - 1)
+        for i in range(sequence.size):
+            base = base_codes[sequence[i]]
+            if base > 3:
+                code = np.uint64(0)
+                valid = 0
+                continue
+            code = (code << np.uint64(2)) | np.uint64(base)
+            valid += 1
+            for li in range(lengths.size):
+                length = lengths[li]
+                if valid < length:
+                    break
+                if length == MAX_KMER_LENGTH:
+                    kmer = code
+                else:
+                    kmer = code & ((np.uint64(1) << np.uint64(2 * length)) - np.uint64(1))
+                h = kmer & bitmap_mask
+                if ((bitmaps[li, h >> np.uint64(3)] >> (h & np.uint64(7))) & np.uint64(1)) == 0:
+                    continue
+                lo = offsets[li]
+                hi = offsets[li + 1]
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if kmers[mid] < kmer:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                if lo >= offsets[li + 1] or kmers[lo] != kmer:
+                    continue
+                # 一致した配列の条件ごとに、隣接する塩基がPAMのパターンに一致するかを確認する
+                for q in range(query_offsets[lo], query_offsets[lo + 1]):
+                    pam_length = pam_offsets[q + 1] - pam_offsets[q]
+                    if query_sides[q] == 1:
+                        pam_start = i + 1
+                    else:
+                        pam_start = i - length + 1 - pam_length
+                    if pam_start < 0 or pam_start + pam_length > sequence.size:
+                        continue
+                    matched = True
+                    for j in range(pam_length):
+                        if ((pam_masks[pam_offsets[q] + j] >> base_codes[sequence[pam_start + j]]) & 1) == 0:
+                            matched = False
+                            break
+                    if matched:
+                        counts[q] += 1
+
+
+def count_pam_constrained_matches_in_fasta(
+    fasta_path: Path,
+    queries: set[OfftargetQuery],
+    contig_policy: ContigPolicy | None = None,
+) -> dict[OfftargetQuery, int]:
+    """
+    Purpose:
+        ゲノム全体で、各条件 (配列の完全一致と、隣接するPAMの縮退したパターンへの一致) を満たす箇所の数をNumbaのカーネルで数える
+        配列は大文字小文字を区別せず、重なる一致も数える。queriesはすべて is_native_countable を満たす必要がある
+        contig_policyを指定した場合は、選ばれたコンティグだけを走査する
+    Returns:
+        dict[OfftargetQuery, int], 条件 -> 出現回数
+    """
+    by_length: dict[int, dict[int, list[OfftargetQuery]]] = {}
+    for query in queries:
+        by_length.setdefault(len(query.sequence), {}).setdefault(encode_kmer(query.sequence), []).append(query)
+    lengths = np.array(sorted(by_length), dtype=np.int64)
+    kmers_list, offsets, ordered_queries = [], [0], []
+    query_offsets = [0]
+    bitmaps = np.zeros((len(lengths), (1 << BITMAP_BITS) // 8), dtype=np.uint8)
+    for li, length in enumerate(lengths):
+        kmers = np.array(sorted(by_length[int(length)]), dtype=np.uint64)
+        h = kmers & np.uint64((1 << BITMAP_BITS) - 1)
+        np.bitwise_or.at(bitmaps[li], (h >> np.uint64(3)).astype(np.int64), (np.uint8(1) << (h & np.uint64(7)).astype(np.uint8)))
+        kmers_list.append(kmers)
+        offsets.append(offsets[-1] + len(kmers))
+        # 同じ配列を持つ条件を、kmerと同じ順に並べる
+        for kmer in kmers.tolist():
+            ordered_queries.extend(by_length[int(length)][kmer])
+            query_offsets.append(len(ordered_queries))
+    all_kmers = np.concatenate(kmers_list) if kmers_list else np.empty(0, dtype=np.uint64)
+    offsets = np.array(offsets, dtype=np.int64)
+    query_offsets = np.array(query_offsets, dtype=np.int64)
+    query_sides = np.array([PAM_SIDE_CODES[query.pam_side] for query in ordered_queries], dtype=np.int8)
+    pam_offsets = np.cumsum([0] + [len(query.pam_pattern) for query in ordered_queries]).astype(np.int64)
+    pam_masks = np.array(
+        [IUPAC_BASE_MASKS[base] for query in ordered_queries for base in query.pam_pattern.upper()],
+        dtype=np.uint8,
+    )
+    counts = np.zeros(len(ordered_queries), dtype=np.int64)
+
+    record_count = count_selected_records(fasta_path, contig_policy)
+    with tqdm(total=record_count, desc="Calculating off-target counts (native)", unit="chromosome") as pbar:
+        for _, chrom_seq in iter_fasta_records(fasta_path, contig_policy):
+            if lengths.size:
+                # 塩基コードの配列を作らずに、読み込んだbytesをそのまま走査する
+                _scan_pam_constrained_matches(
+                    np.frombuffer(chrom_seq, dtype=np.uint8), BASE_CODE_TABLE,
+                    lengths, offsets, all_kmers, bitmaps, query_offsets, query_sides, pam_offsets, pam_masks, counts
+                )
+            pbar.update(1)
+    return {query: int(count) for query, count in zip(ordered_queries, counts)}
@@ -1,11 +1,49 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+import numpy as np
 import pandas as pd
 from pathlib import Path
 import logging
+import re
 from tqdm import tqdm
 import ahocorasick
 from . import logging_config # noqa: F401
+from . import fasta_contigs, native_kernels
+from .native_kernels import OfftargetQuery
+from .fasta_contigs import ContigPolicy
+from .exon_interval_index import GenomeAnnotationIndex
+from .genome_index import GenomeIndex
 
 SEED_LENGTH = 12
+# --offtarget-count-cap を指定した場合、染色体をこの長さのブロックに分けて走査し、ブロックごとに上限に達した条件を取り除く
+SCAN_BLOCK_LENGTH = 10_000_000
+OFFTARGET_SITE_COLUMNS = ["uuid", "site_chrom", "site_start", "site_end", "site_strand", "site_in_repeat", "is_on_target"]
+
+
+@dataclass
+class OfftargetSiteRecorder:
+    """
+    ゲノムのスキャン中に、PAM+20bpの条件に一致した位置を条件ごとに記録するためのdataclass
+    1つの条件あたり max_sites_per_sgrna 個まで記録する (繰り返し配列では数万か所に一致することがあるため)
+    """
+    max_sites_per_sgrna: int
+    queries: set[OfftargetQuery] = field(default_factory=set) # 位置を記録する条件 (seedの条件は記録しない)
+    positions: dict[OfftargetQuery, list[tuple[str, int, bool]]] = field(default_factory=dict) # 条件 -> (染色体, PAMを含むサイトの0-based start, ソフトマスクされた塩基を含むか) のリスト
+    site_df: pd.DataFrame | None = None # build_offtarget_site_tableの結果
+
+    def add(self, query: OfftargetQuery, chrom: str, site_start: int, in_repeat: bool = False) -> None:
+        if query not in self.queries:
+            return
+        sites = self.positions.setdefault(query, [])
+        if len(sites) < self.max_sites_per_sgrna:
+            sites.append((chrom, site_start, in_repeat))
+
+    def is_full(self, query: OfftargetQuery) -> bool:
+        """
+        これ以上位置を記録しない条件 (記録の対象でない、または max_sites_per_sgrna 個を記録済み) ならTrueを返す
+        """
+        return query not in self.queries or len(self.positions.get(query, [])) >= self.max_sites_per_sgrna
+
 
 def add_crisprdirect_url_to_df(exploded_sgrna_df: pd.DataFrame, assembly_name: str) -> pd.DataFrame:
     """
@@ -15,7 +53,7 @@ def add_crisprdirect_url_to_df(exploded_sgrna_df: pd.DataFrame, assembly_name: s
     
     # 列全体に対して一度に文字列操作を行う
     target_sequences = exploded_sgrna_df["sgrna_target_sequence"].str.replace('+', '', regex=False).str.lower()
-    pams = exploded_sgrna_df["base_editor_pam_sequence"]
+    pams = exploded_sgrna_df["base_editor_pam_sequence"].astype(str)
     
     exploded_sgrna_df["crisprdirect_url"] = base_url + target_sequences + "&pam=" + pams + "&db=" + assembly_name
     return exploded_sgrna_df
@@ -31,136 +69,373 @@ def convert_dna_to_reversed_complement_dna(sequence: str) -> str:
     """
     complement_map = {
         "A": "T", "T": "A", "C": "G", "G": "C", "N": "N",
-        "a": "t", "t": "a", "c": "g", "g": "c", "+": "+"
+        "a": "t", "t": "a", "c": "g", "g": "c", "n": "n", "+": "+"
     }
+    # IUPACの縮退塩基 (ゲノムのFASTAに含まれることがある) も補塩基に変換する
+    complement_map.update(native_kernels.IUPAC_COMPLEMENT)
+    complement_map.update({base.lower(): complement.lower() for base, complement in native_kernels.IUPAC_COMPLEMENT.items()})
     return "".join([complement_map[base] for base in reversed(sequence)])
 
-def add_reversed_complement_sgrna_column(exploded_sgrna_df: pd.DataFrame) -> pd.DataFrame:
+def add_reversed_complement_sgrna_column(exploded_sgrna_df: pd.DataFrame, engine: str = "python") -> pd.DataFrame:
     """
     Purpose: 逆相補のsgRNA配列を追加する
     """
-    exploded_sgrna_df["reversed_sgrna_target_sequence"] = exploded_sgrna_df["sgrna_target_sequence"].apply(
-        convert_dna_to_reversed_complement_dna
-    )
+    convert = native_kernels.reverse_complement if engine == "native" else convert_dna_to_reversed_complement_dna
+    exploded_sgrna_df["reversed_sgrna_target_sequence"] = exploded_sgrna_df["sgrna_target_sequence"].apply(convert)
     return exploded_sgrna_df
 
-def get_seed_sequence(sequence_with_plus: str, seed_len: int = SEED_LENGTH) -> str:
+def build_offtarget_queries(sequence_with_plus: str, pam_pattern: str | None = None, seed_len: int = SEED_LENGTH) -> tuple[OfftargetQuery, OfftargetQuery]:
     """
     Purpose:
-        PAM+Target配列（'+'区切り）から、PAM + Seed領域（PAM隣接領域）のみを抽出する。
-        PAMの位置（前方か後方か）は'+'の位置で自動判定する。
+        PAM+Target配列（'+'区切り）から、PAM+20bpとPAM+12bp (PAM隣接のSeed領域) のオフターゲットの条件を作成する。
+        PAMの位置（前方か後方か）は'+'の位置で自動判定する (短い方がPAM)。
     Parameters:
-        sequence_with_plus: "NGG+ATGC..." (PAM+Spacer) or "...ATGC+NGG" (Spacer+PAM)
+        sequence_with_plus: "CCN+ATGC..." (PAM+Spacer) or "...ATGC+NGG" (Spacer+PAM)
+        pam_pattern: str | None, base editorのPAM配列 (IUPAC表記、sgRNAの向き)。
+            PAMが前方にある配列は逆相補の向きで書かれているので、PAMも逆相補にして使う。
+            指定しない場合は、配列に含まれるPAMの塩基そのものを使う
         seed_len: Seed領域の長さ (default: 12)
     Returns:
-        str: PAMとSeed領域を含む配列（'+'を含む）
+        tuple[OfftargetQuery, OfftargetQuery], (PAM+20bpの条件, PAM+12bpの条件)。どちらも + strandの向き
     """
-    parts = sequence_with_plus.split('+')
-    part0, part1 = parts[0], parts[1]
-    
-    # 短い方がPAM、長い方がSpacerなので、それに基づいてSeed領域を抽出
+    part0, part1 = sequence_with_plus.upper().split('+')[:2]
     if len(part0) < len(part1):
-        # SeedはSpacerの先頭
-        return f"{part0}+{part1[:seed_len]}"
-    else:
-        # SeedはSpacerの末尾
-        return f"{part0[-seed_len:]}+{part1}"
+        pattern = native_kernels.reverse_complement_iupac(pam_pattern) if pam_pattern else part0
+        return OfftargetQuery(part1, pattern, "left"), OfftargetQuery(part1[:seed_len], pattern, "left")
+    pattern = pam_pattern.upper() if pam_pattern else part1
+    return OfftargetQuery(part0, pattern, "right"), OfftargetQuery(part0[-seed_len:], pattern, "right")
 
-def calculate_offtarget_site_count_ahocorasick(exploded_sgrna_df: pd.DataFrame, fasta_path: Path) -> pd.DataFrame:
+def get_pam_regex(pam_pattern: str) -> re.Pattern:
     """
-    Purpose : ahocorasick法を用いて PAM+20bpのオフターゲットサイト数を計算する
-    Parameters : exploded_sgrna_df: sgRNAが1行1sgRNAに展開されたデータフレーム, fasta_path: FASTAファイルのパス
-    Returns : exploded_sgrna_df: PAM+20bpのオフターゲットサイト数を追加したデータフレーム
-    Algorism : sgRNA配列とその逆相補配列をセットに追加し、Aho-CorasickのAutomatonを構築。各染色体配列に対してAutomatonを用いて検索し、各sgRNA配列の出現回数をカウントする。
+    Purpose: IUPAC表記のPAMを、隣接する塩基 (大文字) の確認に使う正規表現に変換する
     """
-    # 遺伝子が - strandの場合、出力されている配列は - strandの配列である。しかし、検索対象は+ strandであるため、逆相補に変換する必要がある。
-    # 重複しないようにセットに追加
-    full_sequences = set()
-    full_sequences.update(exploded_sgrna_df["sgrna_target_sequence"].str.replace('+', '').str.upper())
-    full_sequences.update(exploded_sgrna_df["reversed_sgrna_target_sequence"].str.replace('+', '').str.upper())
+    return re.compile("".join(f"[{native_kernels.IUPAC_BASES[base]}]" for base in pam_pattern.upper()))
 
-    exploded_sgrna_df["seed_target_sequence"] = exploded_sgrna_df["sgrna_target_sequence"].apply(get_seed_sequence)
-    exploded_sgrna_df["reversed_seed_target_sequence"] = exploded_sgrna_df["reversed_sgrna_target_sequence"].apply(get_seed_sequence)
-
-    seed_sequences = set()
-    seed_sequences.update(exploded_sgrna_df["seed_target_sequence"].str.replace('+', '').str.upper())
-    seed_sequences.update(exploded_sgrna_df["reversed_seed_target_sequence"].str.replace('+', '').str.upper())
-
-    # まず最初にAho-CorasickのAutomatonを構築
+def build_query_automaton(
+    queries_by_sequence: dict[str, list[tuple[OfftargetQuery, re.Pattern | None]]],
+) -> ahocorasick.Automaton | None:
+    """
+    Purpose : PAMを除いた配列をAho-CorasickのAutomatonに登録する (同じ配列を持つ条件はまとめて登録する)。配列がない場合はNoneを返す
+    """
+    if not queries_by_sequence:
+        return None
     automaton = ahocorasick.Automaton()
+    for seq, sequence_queries in queries_by_sequence.items():
+        automaton.add_word(seq, (len(seq), sequence_queries))
+    automaton.make_automaton()
+    return automaton
 
-    for seq in full_sequences:
-        automaton.add_word(seq, ("full", seq))
+def count_exact_matches_ahocorasick(
+    fasta_path: Path,
+    queries: set[OfftargetQuery],
+    site_recorder: OfftargetSiteRecorder | None = None,
+    contig_policy: ContigPolicy | None = None,
+    count_cap: int | None = None,
+) -> dict[OfftargetQuery, int]:
+    """
+    Purpose : Aho-CorasickのAutomatonを構築し、ゲノム全体で各条件 (配列の完全一致と、隣接するPAMのパターンへの一致) を満たす箇所を数える
+        AutomatonにはPAMを除いた配列だけを登録し、一致するたびに隣接する塩基をPAMのパターンと比べる。
+        そのため、NNNのような縮退したPAMでも、PAMを展開した配列をAutomatonに登録する必要がない
+        site_recorderを指定した場合は、一致した位置も記録する。contig_policyを指定した場合は、選ばれたコンティグだけを走査する
+    Comments : count_capを指定した場合は、SCAN_BLOCK_LENGTHのブロックごとに、出現回数がcount_cap以上になった条件をAutomatonから取り除いて再構築する
+        (繰り返し配列にある条件の一致のたびにPythonの処理が走るのを避けるため)。取り除いた条件の出現回数はcount_cap以上の途中の値になる
+    Returns : 条件 -> 出現回数
+    """
+    queries_by_sequence: dict[str, list[tuple[OfftargetQuery, re.Pattern | None]]] = {}
+    for query in queries:
+        pam_regex = get_pam_regex(query.pam_pattern) if query.pam_pattern else None
+        queries_by_sequence.setdefault(query.sequence, []).append((query, pam_regex))
+    automaton = build_query_automaton(queries_by_sequence)
+    max_length = max((len(seq) for seq in queries_by_sequence), default=0)
 
-    for seq in seed_sequences:
-        automaton.add_word(seq, ("seed", seq))
+    # 条件ごとのカウント辞書
+    offtarget_count_dict = {query: 0 for query in queries}
 
-    automaton.make_automaton()
+    def process_block(automaton, sequence, raw_sequence, chrom, block_start, block_end):
+        # 前のブロックにまたがる一致も見つけるため、max_length - 1 だけ手前から走査し、block_start以降で終わる一致だけを数える
+        # automaton.iter はマッチした箇所の (end_index, value) を返す
+        for end_idx, (length, sequence_queries) in automaton.iter(sequence, max(block_start - max_length + 1, 0), block_end):
+            if end_idx < block_start:
+                continue
+            start = end_idx - length + 1
+            for query, pam_regex in sequence_queries:
+                if pam_regex is None:
+                    site_start = start
+                else:
+                    pam_length = len(query.pam_pattern)
+                    pam_start = end_idx + 1 if query.pam_side == "right" else start - pam_length
+                    if pam_start < 0 or not pam_regex.fullmatch(sequence, pam_start, pam_start + pam_length):
+                        continue
+                    site_start = min(start, pam_start)
+                offtarget_count_dict[query] += 1
+                if site_recorder is not None:
+                    # RepeatMaskerのソフトマスク (小文字) は元の配列で確認する
+                    site_recorder.add(query, chrom, site_start, not raw_sequence[site_start:site_start + query.site_length].isupper())
 
-    # sgRNAごとのカウント辞書
-    offtarget_count_dict_full = {seq: 0 for seq in full_sequences}
-    offtarget_count_dict_seed = {seq: 0 for seq in seed_sequences}
-
-    with open(fasta_path, 'r') as fasta_file:
-        header_count = sum(1 for line in fasta_file if line.startswith(">"))
-        logging.info(f"Number of chromosomes in your FASTA file: {header_count}")
-        pbar = tqdm(total=header_count, desc="Calculating off-target counts", unit="chromosome")
-        fasta_file.seek(0)
-        chrom_seq = ""
-
-        def process_chrom_seq(sequence):
-            sequence = sequence.upper()
-            # automaton.iter はマッチした箇所の (end_index, value) を返す
-            for end_idx, (kind, seq) in automaton.iter(sequence):
-                if kind == "full":
-                    offtarget_count_dict_full[seq] += 1
-                elif kind == "seed":
-                    offtarget_count_dict_seed[seq] += 1
-
-        for line in fasta_file:
-            if line.startswith(">"):
-                # 新しい染色体に切り替え
-                if chrom_seq:
-                    chrom_seq = chrom_seq.upper()
-                    #automaton.iter は (end_idx, (idx, seq)) を持っていて、そこに含まれるseqが見つかったらカウントを増やす
-                    process_chrom_seq(chrom_seq)
-                    chrom_seq = ""
-                    pbar.update(1)
+    def retire_saturated_queries() -> int:
+        # 出現回数がcount_cap以上で、位置の記録も終わった条件を取り除き、取り除いた条件の数を返す
+        retired_count = 0
+        for seq in list(queries_by_sequence):
+            active = [
+                (query, pam_regex) for query, pam_regex in queries_by_sequence[seq]
+                if offtarget_count_dict[query] < count_cap or (site_recorder is not None and not site_recorder.is_full(query))
+            ]
+            retired_count += len(queries_by_sequence[seq]) - len(active)
+            if active:
+                queries_by_sequence[seq] = active
             else:
-                chrom_seq += line.strip()
-        # 最後の染色体も処理
-        if chrom_seq:
-            chrom_seq = chrom_seq.upper()
-            process_chrom_seq(chrom_seq)
+                del queries_by_sequence[seq]
+        return retired_count
+
+    total_retired_count = 0
+    record_count = fasta_contigs.count_selected_records(fasta_path, contig_policy)
+    with tqdm(total=record_count, desc="Calculating off-target counts", unit="chromosome") as pbar:
+        for chrom_name, chrom_seq in fasta_contigs.iter_fasta_records(fasta_path, contig_policy):
+            # pyahocorasickは大文字小文字を区別するので、大文字にした配列を1つだけ作って走査する (ソフトマスクは元の配列に残る)
+            sequence = chrom_seq.upper().decode("ascii")
+            block_length = SCAN_BLOCK_LENGTH if count_cap is not None else max(len(sequence), 1)
+            for block_start in range(0, len(sequence), block_length):
+                if automaton is None:
+                    break
+                process_block(automaton, sequence, chrom_seq, chrom_name, block_start, min(block_start + block_length, len(sequence)))
+                if count_cap is not None:
+                    retired_count = retire_saturated_queries()
+                    if retired_count:
+                        total_retired_count += retired_count
+                        automaton = build_query_automaton(queries_by_sequence)
             pbar.update(1)
-            pbar.close()
-    
-    # 順配列、逆相補配列の両方のカウントを合計して新しい列に追加
-    exploded_sgrna_df["pam+20bp_exact_match_count"] = exploded_sgrna_df.apply(
-        lambda row: (
-            offtarget_count_dict_full[row["sgrna_target_sequence"].replace('+', '').upper()]
-            + offtarget_count_dict_full[row["reversed_sgrna_target_sequence"].replace('+', '').upper()]
-        ),
-        axis=1
+    if count_cap is not None:
+        logging.info(f"{total_retired_count} off-target queries reached --offtarget-count-cap {count_cap} and were retired from the scan")
+    return offtarget_count_dict
+
+def count_exact_matches(
+    fasta_path: Path,
+    queries: set[OfftargetQuery],
+    engine: str = "python",
+    site_recorder: OfftargetSiteRecorder | None = None,
+    contig_policy: ContigPolicy | None = None,
+    count_cap: int | None = None,
+    genome_index: GenomeIndex | None = None,
+) -> dict[OfftargetQuery, int]:
+    """
+    Purpose : engineに応じて、条件に一致する箇所の数え上げをNumbaのカーネルまたはAho-Corasickで行う
+        genome_indexを指定した場合は、ゲノムを走査せずに接尾辞配列のインデックスで数える (contig_policyはインデックスの作成時に適用済み)
+    Comments : Numbaがない場合や、A/C/G/T以外の塩基を含む配列がある場合はAho-Corasickにフォールバックする
+        Numbaのカーネルは数だけを数えるので、一致の位置を記録する場合 (site_recorderを指定した場合) もAho-Corasickを使う
+        count_capはAho-Corasickでの条件の取り除きにだけ使う (Numbaのカーネルは一致ごとのPythonの処理がないため、すべて数える)
+    """
+    if genome_index is not None:
+        if all(native_kernels.is_native_countable(query) for query in queries):
+            return genome_index.count_queries(queries, site_recorder)
+        logging.warning("Some sgRNAs contain bases other than A/C/G/T. Falling back to genome scanning instead of the genome index.")
+    if site_recorder is not None:
+        if engine == "native":
+            logging.info("Recording off-target sites uses the python engine for genome scanning.")
+        return count_exact_matches_ahocorasick(fasta_path, queries, site_recorder, contig_policy, count_cap)
+    if native_kernels.is_native_scan_available(engine):
+        if all(native_kernels.is_native_countable(query) for query in queries):
+            return native_kernels.count_pam_constrained_matches_in_fasta(fasta_path, queries, contig_policy)
+        logging.warning("Some sgRNAs contain bases other than A/C/G/T. Falling back to the python engine for genome scanning.")
+    return count_exact_matches_ahocorasick(fasta_path, queries, contig_policy=contig_policy, count_cap=count_cap)
+
+def get_seed_count_column(seed_len: int) -> str:
+    """
+    Purpose: PAM+seed領域の出現回数の列名を返す (例: pam+12bp_exact_match_count)
+    """
+    return f"pam+{seed_len}bp_exact_match_count"
+
+def add_offtarget_query_columns(exploded_sgrna_df: pd.DataFrame, extra_seed_lengths: tuple[int, ...] = ()) -> pd.DataFrame:
+    """
+    Purpose:
+        PAM+20bpとPAM+12bpの条件を、+ strandの向き (full_query, seed_query) と逆相補の向き (reversed_full_query, reversed_seed_query) で追加する
+        extra_seed_lengthsを指定した場合は、その長さのseedの条件も seed{長さ}_query, reversed_seed{長さ}_query 列に追加する
+        base_editor_pam_sequence列がある場合は、そのbase editorのPAMのパターン (NGGなど) に一致するPAMをすべて数える
+    """
+    if "base_editor_pam_sequence" in exploded_sgrna_df.columns:
+        pam_patterns = exploded_sgrna_df["base_editor_pam_sequence"].astype(str).tolist()
+    else:
+        pam_patterns = [None] * len(exploded_sgrna_df)
+    query_cache: dict[tuple[str, str | None], tuple[OfftargetQuery, ...]] = {}
+    rows = []
+    for sequence, pam_pattern in zip(exploded_sgrna_df["sgrna_target_sequence"].astype(str).tolist(), pam_patterns):
+        key = (sequence, pam_pattern)
+        if key not in query_cache:
+            full_query, seed_query = build_offtarget_queries(sequence, pam_pattern)
+            row = [full_query, full_query.reverse_complement(), seed_query, seed_query.reverse_complement()]
+            for seed_len in extra_seed_lengths:
+                extra_seed_query = build_offtarget_queries(sequence, pam_pattern, seed_len)[1]
+                row += [extra_seed_query, extra_seed_query.reverse_complement()]
+            query_cache[key] = tuple(row)
+        rows.append(query_cache[key])
+    query_columns = ["full_query", "reversed_full_query", "seed_query", "reversed_seed_query"]
+    for seed_len in extra_seed_lengths:
+        query_columns += [f"seed{seed_len}_query", f"reversed_seed{seed_len}_query"]
+    for col, values in zip(query_columns, zip(*rows) if rows else [[]] * len(query_columns)):
+        exploded_sgrna_df[col] = pd.Series(list(values), index=exploded_sgrna_df.index, dtype=object)
+    return exploded_sgrna_df
+
+
+def build_offtarget_site_table(exploded_sgrna_df: pd.DataFrame, site_recorder: OfftargetSiteRecorder) -> pd.DataFrame:
+    """
+    Purpose:
+        記録した一致の位置を、1行1サイトのテーブルにする (sgRNAとはuuidで対応付ける)
+        site_strandはsgRNA (protospacer) の向きのstrandとする。+ strandの向きの条件でPAMが3'側 (right) にあれば "+"、5'側 (left) にあれば "-" となる
+        設計元のsgRNAの位置と重なるサイトは is_on_target = True とする
+        サイト (PAMを含む) にFASTAでソフトマスクされた (小文字の) 塩基があれば site_in_repeat = True とする
+        1つのsgRNAのサイトが max_sites_per_sgrna を超える場合は、on-targetのサイト、sgRNAと同じ染色体のサイトの順に残し、
+        残りは両方の向きの条件 (full_queryとreversed_full_query) から記録した順に交互に選ぶ
+        (各条件の記録はスキャン順の最初の max_sites_per_sgrna 個なので、片方の向きのサイトだけが残ることはない)
+    Parameters:
+        exploded_sgrna_df: full_queryとreversed_full_query (add_offtarget_query_columns) を持つデータフレーム
+        site_recorder: OfftargetSiteRecorder, スキャン済みのもの
+    Returns:
+        pd.DataFrame, OFFTARGET_SITE_COLUMNSの列を持つデータフレーム。1つのsgRNAあたり max_sites_per_sgrna 行まで
+    """
+    site_rows = [
+        (query, chrom, start, start + query.site_length, "+" if query.pam_side == "right" else "-", in_repeat)
+        for query, sites in site_recorder.positions.items()
+        for chrom, start, in_repeat in sites
+    ]
+    sites = pd.DataFrame(site_rows, columns=["query", "site_chrom", "site_start", "site_end", "site_strand", "site_in_repeat"])
+    sgrna_df = pd.DataFrame({
+        "uuid": exploded_sgrna_df["uuid"].to_numpy(),
+        "sgrna_order": np.arange(len(exploded_sgrna_df)),
+        "chrom": exploded_sgrna_df["chrom"].astype(str).to_numpy(),
+        "sgrna_start_in_genome": exploded_sgrna_df["sgrna_start_in_genome"].to_numpy(dtype=np.int64),
+        "sgrna_end_in_genome": exploded_sgrna_df["sgrna_end_in_genome"].to_numpy(dtype=np.int64),
+    })
+    site_df = pd.concat([
+        sgrna_df.assign(query=exploded_sgrna_df[column].to_numpy(), query_column=column_order).merge(sites, on="query", how="inner")
+        for column_order, column in enumerate(["full_query", "reversed_full_query"])
+    ], ignore_index=True)
+    site_df["is_on_target"] = (
+        (site_df["site_chrom"] == site_df["chrom"])
+        & (site_df["site_start"] < site_df["sgrna_end_in_genome"])
+        & (site_df["site_end"] > site_df["sgrna_start_in_genome"])
+    )
+    # 上限を超えるサイトは、on-target、同じ染色体、各条件で記録した順 (両方の向きから交互に) の優先度で残す
+    site_df["record_order"] = site_df.groupby(["sgrna_order", "query_column"]).cumcount()
+    site_df["is_other_chrom"] = site_df["site_chrom"] != site_df["chrom"]
+    site_df = site_df.sort_values(
+        ["sgrna_order", "is_on_target", "is_other_chrom", "record_order", "query_column"],
+        ascending=[True, False, True, True, True],
+        kind="stable",
     )
-    exploded_sgrna_df["pam+12bp_exact_match_count"] = exploded_sgrna_df.apply(
-        lambda row: (
-            offtarget_count_dict_seed[row["seed_target_sequence"].replace('+', '').upper()]
-            + offtarget_count_dict_seed[row["reversed_seed_target_sequence"].replace('+', '').upper()]
-        ),
-        axis=1
+    site_df = site_df[site_df.groupby("sgrna_order").cumcount() < site_recorder.max_sites_per_sgrna]
+    site_df = site_df.sort_values(["sgrna_order", "site_chrom", "site_start", "site_strand"], kind="stable")
+    return site_df[OFFTARGET_SITE_COLUMNS].reset_index(drop=True)
+
+def annotate_offtarget_sites(site_df: pd.DataFrame, annotation_index: GenomeAnnotationIndex) -> pd.DataFrame:
+    """
+    Purpose:
+        各サイトがCDS、エキソン、イントロン、遺伝子間のどこにあるか (site_region_type) と、重なる遺伝子 (site_gene_name) を追加する
+        染色体ごとにソートされた配列に対する二分探索でまとめて判定するため、サイトが数百万か所あっても数秒で終わる
+    """
+    region_types, gene_names = annotation_index.annotate(
+        site_df["site_chrom"].to_numpy(dtype=object),
+        site_df["site_start"].to_numpy(),
+        site_df["site_end"].to_numpy(),
     )
+    site_df["site_region_type"] = region_types
+    site_df["site_gene_name"] = gene_names
+    return site_df
 
-    # 逆相補配列の列とseed配列の列は不要なので削除
-    exploded_sgrna_df = exploded_sgrna_df.drop(columns=["reversed_sgrna_target_sequence", "seed_target_sequence", "reversed_seed_target_sequence"])
+def calculate_offtarget_site_count_ahocorasick(
+    exploded_sgrna_df: pd.DataFrame,
+    fasta_path: Path,
+    engine: str = "python",
+    site_recorder: OfftargetSiteRecorder | None = None,
+    contig_policy: ContigPolicy | None = None,
+    count_cap: int | None = None,
+    genome_index: GenomeIndex | None = None,
+    extra_seed_lengths: tuple[int, ...] = (),
+) -> pd.DataFrame:
+    """
+    Purpose : ahocorasick法を用いて PAM+20bpとPAM+12bpのオフターゲットサイト数を計算する
+        PAMはbase editorのPAMのパターン (IUPAC表記) に一致すればよい (NGGのeditorでは AGG, TGG, CGG, GGG のすべてを数える)
+    Parameters : exploded_sgrna_df: sgRNAが1行1sgRNAに展開されたデータフレーム, fasta_path: FASTAファイルのパス
+        engine: "python" または "native" ("native"の場合はNumbaのカーネルでゲノムをスキャンする)
+        site_recorder: 指定した場合は一致の位置を記録し、site_recorder.site_dfにサイトのテーブルを格納する
+        contig_policy: 指定した場合は、選ばれたコンティグだけを走査する (指定しない場合はすべてのレコード)
+        count_cap: 指定した場合は、出現回数がこの値に達した条件を走査から外し、出現回数をこの値で打ち切る。
+            打ち切ったsgRNAは offtarget_count_saturated 列をTrueにする
+        genome_index: 指定した場合は、ゲノムを走査せずに接尾辞配列のインデックスで数える
+        extra_seed_lengths: PAM+12bpに加えて数えるseedの長さ。pam+{長さ}bp_exact_match_count 列に追加する
+    Returns : exploded_sgrna_df: PAM+20bpのオフターゲットサイト数を追加したデータフレーム
+    Algorism : sgRNA配列 (PAMを除く) とその逆相補配列をセットに追加し、Aho-CorasickのAutomatonを構築。各染色体配列に対してAutomatonを用いて検索し、
+        隣接する塩基がPAMのパターンに一致する箇所の数をカウントする。
+    """
+    extra_seed_lengths = tuple(seed_len for seed_len in dict.fromkeys(extra_seed_lengths) if seed_len not in (SEED_LENGTH, native_kernels.SGRNA_LENGTH))
+    # 遺伝子が - strandの場合、出力されている配列は - strandの配列である。しかし、検索対象は+ strandであるため、逆相補の条件も数える必要がある。
+    exploded_sgrna_df = add_offtarget_query_columns(exploded_sgrna_df, extra_seed_lengths)
+    # 出力する列 -> (+ strandの条件の列, 逆相補の条件の列)
+    count_columns = {
+        "pam+20bp_exact_match_count": ("full_query", "reversed_full_query"),
+        get_seed_count_column(SEED_LENGTH): ("seed_query", "reversed_seed_query"),
+    }
+    for seed_len in extra_seed_lengths:
+        count_columns[get_seed_count_column(seed_len)] = (f"seed{seed_len}_query", f"reversed_seed{seed_len}_query")
+    query_columns = [column for columns in count_columns.values() for column in columns]
+    full_queries = set(exploded_sgrna_df["full_query"]) | set(exploded_sgrna_df["reversed_full_query"])
+    all_queries = set().union(*(set(exploded_sgrna_df[column]) for column in query_columns))
+
+    if site_recorder is not None:
+        site_recorder.queries = full_queries
+    offtarget_count_dict = count_exact_matches(fasta_path, all_queries, engine, site_recorder, contig_policy, count_cap, genome_index)
+    if site_recorder is not None:
+        site_recorder.site_df = build_offtarget_site_table(exploded_sgrna_df, site_recorder)
+
+    # 順配列、逆相補配列の両方のカウントを合計して新しい列に追加
+    def sum_counts(column: str, reversed_column: str) -> list[int]:
+        return [
+            offtarget_count_dict[query] + offtarget_count_dict[reversed_query]
+            for query, reversed_query in zip(exploded_sgrna_df[column], exploded_sgrna_df[reversed_column])
+        ]
+    for count_column, (column, reversed_column) in count_columns.items():
+        exploded_sgrna_df[count_column] = sum_counts(column, reversed_column)
+    if count_cap is not None:
+        # 走査から外した条件の出現回数は外した時点までの値なので、engineによらず同じ結果になるようにcount_capで打ち切る
+        # (外していない条件は正確に数えているため、打ち切った値は min(真の出現回数, count_cap) に等しい)
+        exploded_sgrna_df["offtarget_count_saturated"] = (exploded_sgrna_df[list(count_columns)] >= count_cap).any(axis=1)
+        for column in count_columns:
+            exploded_sgrna_df[column] = exploded_sgrna_df[column].clip(upper=count_cap)
+
+    # 逆相補配列の列と条件の列は不要なので削除
+    exploded_sgrna_df = exploded_sgrna_df.drop(columns=["reversed_sgrna_target_sequence"] + query_columns)
     return exploded_sgrna_df
 
-def score_offtargets(exploded_sgrna_df: pd.DataFrame, assembly_name: str, fasta_path: Path) -> pd.DataFrame:
+def add_sgrna_in_repeat_column(exploded_sgrna_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Purpose:
+        sgRNAの配列 (PAMを含む) にFASTAでソフトマスクされた (小文字の) 塩基があれば sgrna_in_repeat = True とする
+        設計に使う配列はFASTAの大文字小文字をそのまま保持しているので、リピート配列上のsgRNAを見分けられる
+    """
+    exploded_sgrna_df["sgrna_in_repeat"] = exploded_sgrna_df["sgrna_target_sequence"].astype(str).str.contains("[acgtn]", regex=True)
+    return exploded_sgrna_df
+
+def score_offtargets(
+    exploded_sgrna_df: pd.DataFrame,
+    assembly_name: str,
+    fasta_path: Path,
+    engine: str = "python",
+    site_recorder: OfftargetSiteRecorder | None = None,
+    contig_policy: ContigPolicy | None = None,
+    count_cap: int | None = None,
+    genome_index: GenomeIndex | None = None,
+    extra_seed_lengths: tuple[int, ...] = (),
+) -> pd.DataFrame:
     """
     Purpose: このモジュールのラップ関数
+        オフターゲットを数えたコンティグの選び方 (--contigs) を offtarget_scanned_contigs 列に記録する
+        リピート配列 (ソフトマスク) 上にあるsgRNAを sgrna_in_repeat 列に記録する
     """
+    contig_policy = contig_policy or ContigPolicy(mode="all")
     exploded_sgrna_df = add_crisprdirect_url_to_df(exploded_sgrna_df, assembly_name)
-    exploded_sgrna_df = add_reversed_complement_sgrna_column(exploded_sgrna_df)
-    exploded_sgrna_df = calculate_offtarget_site_count_ahocorasick(exploded_sgrna_df, fasta_path)
+    exploded_sgrna_df = add_reversed_complement_sgrna_column(exploded_sgrna_df, engine)
+    exploded_sgrna_df = calculate_offtarget_site_count_ahocorasick(
+        exploded_sgrna_df, fasta_path, engine, site_recorder, contig_policy, count_cap, genome_index, extra_seed_lengths
+    )
+    exploded_sgrna_df["offtarget_scanned_contigs"] = contig_policy.label
+    exploded_sgrna_df = add_sgrna_in_repeat_column(exploded_sgrna_df)
     exploded_sgrna_df = exploded_sgrna_df.drop(columns=["sgrna_target_sequence"])
     return exploded_sgrna_df
\ No newline at end of file
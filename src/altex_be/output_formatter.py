@@ -1,17 +1,52 @@
 from altex_be.sgrna_designer import BaseEditor
+from itertools import chain
+import numpy as np
 import pandas as pd
-import uuid
 import logging
 from . import logging_config # noqa: F401
+from .content_id import SGRNA_ID_COLUMNS, compute_content_ids
+
+
+SITE_TYPES = ("acceptor", "donor")
+
+FOUNDATION_COLS = [
+    "geneName",
+    "chrom",
+    "exonStarts",
+    "exonEnds",
+    "strand",
+    "exonlengths",
+    "coding",
+    "frame",
+    "exontype",
+    "exon_position",
+    "cds_info",
+    "uuid"
+    ]
 
+def count_list_lengths(series: pd.Series) -> np.ndarray:
+    """
+    Purpose : リストが格納された列について、各セルのリストの長さを返す (NAは0とする)
+    """
+    if series.dtype != object:
+        return series.notna().to_numpy(dtype=np.int64)
+    # NA (pd.NA, None, NaN) を含むとstr.len()の結果はobject型になり、fillnaが暗黙のダウンキャストの警告を出すため、
+    # NAをNaNにしたfloatの配列にしてから0にする
+    lengths = series.str.len().to_numpy(dtype="float64", na_value=np.nan)
+    return np.nan_to_num(lengths, nan=0).astype(np.int64)
 
 def convert_empty_list_into_na(target_exon_with_sgrna_dict: dict[str, pd.DataFrame]) -> dict[str, pd.DataFrame]:
     """
     Convert empty lists in the DataFrame to NaN.
+    リストの長さで空のリストを判定し、object型の列だけを書き換える
     """
     for df in target_exon_with_sgrna_dict.values():
         for col in df.columns:
-            df[col] = df[col].apply(lambda x: pd.NA if isinstance(x, list) and not x else x)
+            if df[col].dtype != object:
+                continue
+            is_empty_list = (df[col].map(type, na_action="ignore") == list).to_numpy() & (count_list_lengths(df[col]) == 0)
+            if is_empty_list.any():
+                df[col] = df[col].mask(is_empty_list, pd.NA)
     return target_exon_with_sgrna_dict
 
 def prepare_melted_df(target_exon_with_sgrna_df: pd.DataFrame) -> pd.DataFrame:
@@ -19,34 +54,27 @@ def prepare_melted_df(target_exon_with_sgrna_df: pd.DataFrame) -> pd.DataFrame:
     Purpose : 1行-複数のsgRNAの状態からexplodeして1行-1sgRNAに変換する前処理として、列名を整形し、データフレームを整形する
     Parameters : target_exon_with_sgrna_df: あるBEに対して設計されたsgRNAのdf。 acceptorとdonorの2つのサイトタイプの情報が含まれる
     Return : melted_df: 整形後のデータフレーム
-    """
-
-    foundation_cols = [
-        "geneName",
-        "chrom",
-        "exonStarts",
-        "exonEnds",
-        "strand",
-        "exonlengths",
-        "coding",
-        "frame",
-        "exontype",
-        "exon_position",
-        "cds_info",
-        "uuid"
-        ]
-    df_list = []
-    for site in ["acceptor", "donor"]:
-        cols = [col for col in target_exon_with_sgrna_df.columns if col.startswith(site)]
-        site_df = target_exon_with_sgrna_df[foundation_cols + cols].rename(
-            columns={
-                col: f"{col.replace(f'{site}_', '')}" for col in cols
-            }
-        )
-        site_df = site_df.dropna(subset=["sgrna_target_sequence"])
-        site_df["site_type"] = site
-        df_list.append(site_df.reset_index(drop=True))
-    melted_df = pd.concat(df_list, ignore_index=True)
+    Comments : sgRNAが設計されなかった (リストが空またはNAの) サイトは除く。
+        acceptorとdonorで共通の列は、残す行の番号をまとめてから1度だけtakeし、サイトごとの列だけを連結する
+    """
+    site_cols = {
+        site: [col for col in target_exon_with_sgrna_df.columns if col.startswith(site)]
+        for site in SITE_TYPES
+    }
+    kept_rows = {
+        site: np.flatnonzero(count_list_lengths(target_exon_with_sgrna_df[f"{site}_sgrna_target_sequence"]) > 0)
+        for site in SITE_TYPES
+    }
+    melted_df = target_exon_with_sgrna_df[FOUNDATION_COLS].take(
+        np.concatenate([kept_rows[site] for site in SITE_TYPES])
+    ).reset_index(drop=True)
+    for col in site_cols["acceptor"]:
+        renamed_col = col.replace("acceptor_", "")
+        melted_df[renamed_col] = np.concatenate([
+            target_exon_with_sgrna_df[f"{site}_{renamed_col}"].to_numpy()[kept_rows[site]]
+            for site in SITE_TYPES
+        ])
+    melted_df["site_type"] = np.repeat(SITE_TYPES, [len(kept_rows[site]) for site in SITE_TYPES]).astype(object)
     return melted_df
 
 def is_sgrna_designed(melted_df: pd.DataFrame) -> bool:
@@ -58,6 +86,21 @@ def is_sgrna_designed(melted_df: pd.DataFrame) -> bool:
         return False
     return True
 
+def explode_list_columns(melted_df: pd.DataFrame, list_cols: list[str]) -> pd.DataFrame:
+    """
+    Purpose : list_colsのリストを1行1要素に展開する。list_colsの各行のリストは同じ長さである必要がある
+    Comments : DataFrame.explodeと同じ結果になるが、各行の繰り返し回数をリストの長さから求め、
+        リスト以外の列はtakeで、リストの列はchain.from_iterableで一括して作成する
+    """
+    lengths = count_list_lengths(melted_df[list_cols[0]])
+    repeated_rows = np.repeat(np.arange(len(melted_df)), lengths)
+    other_cols = [col for col in melted_df.columns if col not in list_cols]
+    exploded_df = melted_df[other_cols].take(repeated_rows)
+    for col in list_cols:
+        # DataFrame.explodeと同じく、展開した列はobject型とする
+        exploded_df[col] = np.fromiter(chain.from_iterable(melted_df[col].to_numpy()), dtype=object, count=len(repeated_rows))
+    return exploded_df[melted_df.columns]
+
 def explode_sgrna_df(target_exon_with_sgrna_dict: dict[str, pd.DataFrame]) -> pd.DataFrame:
     """
     Purpose: 複数のBEに対して設計されたsgRNAのdfが、1列-1sgRNAになるように変換する
@@ -68,8 +111,7 @@ def explode_sgrna_df(target_exon_with_sgrna_dict: dict[str, pd.DataFrame]) -> pd
         melted_df = prepare_melted_df(df)
         melted_df["base_editor_name"] = be
         sgrna_cols = [col for col in melted_df.columns if col.startswith("sgrna_")]
-        melted_df = melted_df.explode(column=sgrna_cols)
-        exploded_dfs.append(melted_df)
+        exploded_dfs.append(explode_list_columns(melted_df, sgrna_cols))
     # すべてのBEのdfを結合
     exploded_sgrna_df = pd.concat(exploded_dfs, ignore_index=True)
     return exploded_sgrna_df
@@ -79,10 +121,12 @@ def add_sgrna_strand_to_df(exploded_sgrna_df: pd.DataFrame) -> pd.DataFrame:
     Purpose: exploded_sgrna_dfのstrand情報は、標的遺伝子のstrand情報であるため、sgRNAのstrand情報を追加する
     sgrna_target_sequenceの、+ で区切られる末尾または先頭の文字がPAM配列に対応している。
     そのため、sgRNAのstrand情報は、sgrna_target_sequenceの中のどこに+があるかで判定できる。
+    Comments: "+" の位置をp、配列長をLとすると、"+"の前の長さはp、後の長さはL-p-1なので、2p+1 < L のとき "-" となる
     """
-    exploded_sgrna_df["sgrna_strand"] = exploded_sgrna_df["sgrna_target_sequence"].apply(
-        lambda x: "-" if len(x.split('+')[0]) < len(x.split('+')[1]) else "+" 
-    )
+    target_sequence = exploded_sgrna_df["sgrna_target_sequence"]
+    plus_pos = target_sequence.str.find("+").to_numpy(dtype=np.int64)
+    sequence_length = target_sequence.str.len().to_numpy(dtype=np.int64)
+    exploded_sgrna_df["sgrna_strand"] = np.where(2 * plus_pos + 1 < sequence_length, "-", "+").astype(object)
     return exploded_sgrna_df
 
 def add_base_editor_info_to_df(exploded_sgrna_df: pd.DataFrame, base_editors: dict[str, BaseEditor]) -> pd.DataFrame:
@@ -106,22 +150,21 @@ def add_base_editor_info_to_df(exploded_sgrna_df: pd.DataFrame, base_editors: di
     exploded_sgrna_df = pd.merge(exploded_sgrna_df, be_df, on="base_editor_name", how="left")
     return exploded_sgrna_df
 
-def update_uuid_unique_to_every_sgrna(exploded_sgrna_df: pd.DataFrame) -> pd.DataFrame:
+def update_uuid_unique_to_every_sgrna(exploded_sgrna_df: pd.DataFrame, assembly_name: str | None = None) -> pd.DataFrame:
     """
-    Purpose: ここまでの処理は、情報のマージのために各エキソンに対してユニークなUUIDを設定していたが、ここからはsgRNAごとにユニークなUUIDを設定する
+    Purpose: ここまでの処理は、情報のマージのために各エキソンに対してユニークなIDを設定していたが、ここからはsgRNAごとにユニークなIDを設定する
+    Comments: IDはアセンブリ、sgRNAの位置とstrand、BE、サイトタイプ、エキソンから決まる64bitの整数で、同じ入力なら実行ごとに変わらない
     """
-    exploded_sgrna_df['uuid'] = [uuid.uuid4().hex for _ in range(len(exploded_sgrna_df))]
+    exploded_sgrna_df['uuid'] = compute_content_ids(exploded_sgrna_df, SGRNA_ID_COLUMNS, assembly_name)
     return exploded_sgrna_df
 
 def format_output(target_exon_with_sgrna_dict: dict[str, pd.DataFrame], 
-                base_editors: dict[str, BaseEditor]) -> pd.DataFrame:
+                base_editors: dict[str, BaseEditor],
+                assembly_name: str | None = None) -> pd.DataFrame:
     """
     Purpose: このモジュールのラップ関数
     """
-    # 空のリストをNaNに変換
-    target_exon_with_sgrna_dict = convert_empty_list_into_na(target_exon_with_sgrna_dict)
-
-    # sgRNAのdfをexplodeして1列-1sgRNAに変換
+    # sgRNAのdfをexplodeして1列-1sgRNAに変換 (sgRNAが設計されなかったサイトはここで除かれる)
     exploded_sgrna_df = explode_sgrna_df(target_exon_with_sgrna_dict)
 
     # exploded_sgrna_dfの検証
@@ -134,8 +177,8 @@ def format_output(target_exon_with_sgrna_dict: dict[str, pd.DataFrame],
     # BaseEditorの情報を追加
     exploded_sgrna_df = add_base_editor_info_to_df(exploded_sgrna_df, base_editors)
 
-    # UUIDをsgRNAごとにユニークに更新
-    exploded_sgrna_df = update_uuid_unique_to_every_sgrna(exploded_sgrna_df)
+    # IDをsgRNAごとにユニークに更新
+    exploded_sgrna_df = update_uuid_unique_to_every_sgrna(exploded_sgrna_df, assembly_name)
 
     # geneNameを基にソート
     exploded_sgrna_df = exploded_sgrna_df.sort_values(by=["geneName", "exon_position"])
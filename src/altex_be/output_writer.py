@@ -0,0 +1,109 @@
+from __future__ import annotations
+from pathlib import Path
+import importlib.util
+import logging
+import pandas as pd
+from . import logging_config # noqa: F401
+
+OUTPUT_FORMATS = ("csv", "tsv", "parquet", "feather")
+ARROW_OUTPUT_FORMATS = ("parquet", "feather")
+PARTITION_COLUMNS = ("chrom", "base_editor_name")
+# ユニークな値の割合がこれ以下の文字列列は、categorical (Arrowではdictionary encoding) にする
+CATEGORICAL_MAX_UNIQUE_RATIO = 0.5
+
+
+def is_arrow_available() -> bool:
+    """
+    Purpose:
+        parquet/featherの書き出しに必要なpyarrowがインストールされているかを判定する
+    """
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def convert_to_typed_columns(sgrna_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Purpose:
+        explodeの結果object型になっている列を、値に応じた型に変換する
+        整数 -> Int64, 小数 -> Float64, 真偽値 -> boolean,
+        文字列 -> 値の種類が少なければcategory, 多ければstring
+    Returns:
+        型を変換したDataFrame (入力は変更しない)
+    """
+    typed_df = sgrna_df.copy()
+    for col in typed_df.columns:
+        if typed_df[col].dtype != object:
+            continue
+        inferred = pd.api.types.infer_dtype(typed_df[col], skipna=True)
+        if inferred == "integer":
+            typed_df[col] = typed_df[col].astype("Int64")
+        elif inferred in ("floating", "mixed-integer-float"):
+            typed_df[col] = typed_df[col].astype("Float64")
+        elif inferred == "boolean":
+            typed_df[col] = typed_df[col].astype("boolean")
+        elif inferred == "string":
+            n_unique = typed_df[col].nunique(dropna=True)
+            if n_unique <= max(1, len(typed_df) * CATEGORICAL_MAX_UNIQUE_RATIO):
+                typed_df[col] = typed_df[col].astype("category")
+            else:
+                typed_df[col] = typed_df[col].astype("string")
+    return typed_df
+
+
+def write_table_file(sgrna_df: pd.DataFrame, output_path: Path, output_format: str) -> None:
+    """
+    Purpose:
+        1つのDataFrameを、指定された形式で1つのファイルに書き出す
+        csvはこれまでと同じくindexを含めて書き出す。tsv/parquet/featherはindexを含めない
+    """
+    if output_format == "csv":
+        sgrna_df.to_csv(output_path)
+    elif output_format == "tsv":
+        sgrna_df.to_csv(output_path, sep="\t", index=False)
+    elif output_format == "parquet":
+        sgrna_df.to_parquet(output_path, index=False)
+    elif output_format == "feather":
+        sgrna_df.reset_index(drop=True).to_feather(output_path)
+    else:
+        raise ValueError(f"Unsupported output format: {output_format}")
+
+
+def write_sgrna_table(
+    sgrna_df: pd.DataFrame,
+    output_directory: Path,
+    output_track_name: str,
+    output_format: str = "csv",
+    partition_by: list[str] | None = None,
+) -> Path:
+    """
+    Purpose:
+        最終的なsgRNAのテーブルを書き出す
+    Parameters:
+        sgrna_df: pd.DataFrame, 優先順位付けまで終わったsgRNAのテーブル
+        output_directory: Path, 出力ディレクトリ
+        output_track_name: str, 出力ファイル名の接頭辞
+        output_format: str, "csv", "tsv", "parquet", "feather" のいずれか
+        partition_by: list[str] | None, PARTITION_COLUMNSの中から、分割に使う列
+    Returns:
+        Path, 書き出したファイル (分割した場合はディレクトリ) のパス
+    Comments:
+        分割する場合は、<track_name>_table/chrom=chr1/base_editor_name=xxx/part-0.<format> のような
+        hive形式のディレクトリに書き出す。pyarrow.datasetやpd.read_parquetで必要なパーティションだけを読み込める。
+        parquet/featherではパーティションの列はディレクトリ名から復元されるため、ファイルからは除く
+    """
+    if output_format in ARROW_OUTPUT_FORMATS:
+        sgrna_df = convert_to_typed_columns(sgrna_df)
+    if not partition_by:
+        output_path = output_directory / f"{output_track_name}_table.{output_format}"
+        write_table_file(sgrna_df, output_path, output_format)
+        return output_path
+
+    output_path = output_directory / f"{output_track_name}_table"
+    drop_partition_columns = output_format in ARROW_OUTPUT_FORMATS
+    for keys, partition_df in sgrna_df.groupby(list(partition_by), sort=True, observed=True):
+        partition_dir = output_path.joinpath(*[f"{col}={value}" for col, value in zip(partition_by, keys)])
+        partition_dir.mkdir(parents=True, exist_ok=True)
+        if drop_partition_columns:
+            partition_df = partition_df.drop(columns=list(partition_by))
+        write_table_file(partition_df, partition_dir / f"part-0.{output_format}", output_format)
+    logging.info(f"Results are partitioned by {', '.join(partition_by)}")
+    return output_path
@@ -0,0 +1,192 @@
+"""
+refFlatを、列の型を指定して読み込むモジュール。
+
+pyarrowがある場合は、pyarrowのCSVリーダー (マルチスレッド) でブロックごとに読み込み、
+興味のある遺伝子 (または領域) に関係する行だけをArrowの配列のまま選んでからpandasに変換する。
+不要な行はPythonの文字列にならないので、大きなアノテーションでも少数の遺伝子なら短時間で読み込める。
+
+- 遺伝子記号、エイリアス、トランスクリプトIDの解決は、関係する行だけから作ったGeneIdentifierIndexで行う (アノテーション全体から作った場合と同じ結果になる)
+- トランスクリプトIDで指定された遺伝子の、残りのトランスクリプトが読み込んだ行にない場合と、領域を指定した場合は、その遺伝子の行だけをもう一度読み込む
+- pyarrowがない場合は、pandasのCエンジンで全体を読み込んでから絞り込む (従来の動作)
+"""
+from __future__ import annotations
+from collections import Counter
+from pathlib import Path
+import logging
+import numpy as np
+import pandas as pd
+from . import logging_config  # noqa: F401
+from .exon_interval_index import build_exon_interval_index
+from .gene_identifier_index import build_gene_identifier_index, strip_version
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+except ImportError:  # pyarrowは任意の依存 (pip install "AltEx-BE[arrow]")
+    pa = None
+
+REFFLAT_COLUMNS = [
+    "geneName",
+    "name",
+    "chrom",
+    "strand",
+    "txStart",
+    "txEnd",
+    "cdsStart",
+    "cdsEnd",
+    "exonCount",
+    "exonStarts",
+    "exonEnds",
+]
+INTEGER_COLUMNS = ["txStart", "txEnd", "cdsStart", "cdsEnd", "exonCount"]
+READ_BLOCK_SIZE = 1 << 24 # pyarrowで一度に読み込むバイト数
+VERSION_SUFFIX_PATTERN = r"(.)\.[0-9]+$" # strip_version と同じく、stemが空でない場合だけバージョンを取り除く
+
+
+def read_refflat(refflat_path: Path) -> pd.DataFrame:
+    """
+    Purpose:
+        refFlat全体を、列の型を指定して読み込む (文字列の列はobject、座標の列はint64)
+    """
+    if pa is not None:
+        return pa_csv.read_csv(refflat_path, **arrow_csv_options()).to_pandas()
+    return pd.read_csv(
+        refflat_path,
+        sep="\t",
+        header=None,
+        names=REFFLAT_COLUMNS,
+        dtype={col: np.int64 if col in INTEGER_COLUMNS else object for col in REFFLAT_COLUMNS},
+        engine="c",
+    )
+
+
+def arrow_csv_options() -> dict:
+    """
+    Purpose: pyarrowでrefFlatを読み込むときのオプション (タブ区切り、ヘッダーなし、列の型を指定)
+    """
+    return {
+        "read_options": pa_csv.ReadOptions(column_names=REFFLAT_COLUMNS, block_size=READ_BLOCK_SIZE),
+        "parse_options": pa_csv.ParseOptions(delimiter="\t", quote_char=False),
+        "convert_options": pa_csv.ConvertOptions(
+            column_types={col: pa.int64() if col in INTEGER_COLUMNS else pa.string() for col in REFFLAT_COLUMNS},
+        ),
+    }
+
+
+def scan_refflat(refflat_path: Path, select_rows) -> tuple[pd.DataFrame, pa.ChunkedArray]:
+    """
+    Purpose:
+        refFlatをブロックごとに読み込み、select_rows(batch) がTrueを返した行だけをpandasに変換する
+    Returns:
+        tuple[pd.DataFrame, pa.ChunkedArray], (選んだ行。indexはファイルでの行番号, すべての行のname列)
+    """
+    tables, row_ids, names = [], [], []
+    offset = 0
+    with pa_csv.open_csv(refflat_path, **arrow_csv_options()) as reader:
+        for batch in reader:
+            mask = select_rows(batch)
+            tables.append(batch.filter(pa.array(mask)))
+            row_ids.append(np.flatnonzero(mask) + offset)
+            names.append(batch.column("name"))
+            offset += batch.num_rows
+        schema = reader.schema
+    selected = pa.Table.from_batches(tables, schema=schema).to_pandas()
+    selected.index = np.concatenate(row_ids) if row_ids else np.empty(0, dtype=np.int64)
+    return selected, pa.chunked_array(names, type=pa.string())
+
+
+def find_duplicated_names(all_names: pa.ChunkedArray, names: set[str]) -> set[str]:
+    """
+    Purpose: namesのうち、refFlat全体で2回以上出現するトランスクリプト名を返す
+    """
+    if not names:
+        return set()
+    value_set = pa.array(sorted(names), type=pa.string())
+    occurrences = Counter(pc.filter(all_names, pc.is_in(all_names, value_set=value_set)).to_pylist())
+    return {name for name, count in occurrences.items() if count > 1}
+
+
+def overlaps_regions(batch: pa.RecordBatch, regions: list[tuple[str, int, int]]) -> np.ndarray:
+    """
+    Purpose: トランスクリプトの範囲 (txStart-txEnd) が、いずれかの領域と重なる行をTrueにする
+    """
+    spans = pd.DataFrame({
+        "chrom": batch.column("chrom").to_pandas(),
+        "exonStarts": batch.column("txStart").to_numpy(),
+        "exonEnds": batch.column("txEnd").to_numpy(),
+    })
+    mask = np.zeros(batch.num_rows, dtype=bool)
+    mask[build_exon_interval_index(spans).query_regions(regions)] = True
+    return mask
+
+
+def load_refflat(
+    refflat_path: Path,
+    interest_genes: list[str] | None = None,
+    regions: list[tuple[str, int, int]] | None = None,
+    gene_aliases: dict[str, str] | None = None,
+) -> pd.DataFrame:
+    """
+    Purpose:
+        refFlatを読み込み、nameが重複するトランスクリプトを (すべて) 除外する
+        interest_genesを指定した場合は、その遺伝子 (領域を指定した場合は、トランスクリプトが領域と重なる遺伝子) の行だけを残す。
+        残る行は、全体を読み込んでからrefflat_preprocessorで絞り込んだ場合と同じになる
+    Parameters:
+        refflat_path: Path, refFlatのパス
+        interest_genes: list[str] | None, 興味のある遺伝子 (遺伝子記号、エイリアス、RefSeq ID, Ensembl ID)。Noneの場合はすべての遺伝子
+        regions: list[tuple[str, int, int]] | None, (chrom, start, end) の0-based半開区間のリスト
+        gene_aliases: dict[str, str] | None, エイリアス -> 遺伝子記号 の辞書
+    Returns:
+        pd.DataFrame, REFFLAT_COLUMNS の列を持つ、ファイルでの順に並んだデータフレーム
+    """
+    all_genes = interest_genes is None or ("all_genes" in interest_genes and len(interest_genes) == 1)
+    if pa is None or (all_genes and not regions):
+        refflat = read_refflat(refflat_path)
+        return refflat.drop_duplicates(subset=["name"], keep=False).reset_index(drop=True)
+
+    if all_genes:
+        candidates, all_names = scan_refflat(refflat_path, lambda batch: overlaps_regions(batch, regions))
+        loaded_symbols = set()
+    else:
+        # 各IDの解決に関係する行 (遺伝子記号、トランスクリプト名、バージョンを除いたトランスクリプト名、エイリアスの先の遺伝子記号が一致する行) を読み込む
+        identifiers = set(interest_genes) | {strip_version(gene) for gene in interest_genes}
+        gene_aliases = {alias: symbol for alias, symbol in (gene_aliases or {}).items() if alias in identifiers}
+        loaded_symbols = identifiers | set(gene_aliases.values())
+        symbol_set = pa.array(sorted(loaded_symbols), type=pa.string())
+        identifier_set = pa.array(sorted(identifiers), type=pa.string())
+
+        def select_rows(batch: pa.RecordBatch) -> np.ndarray:
+            names = batch.column("name")
+            stripped_names = pc.replace_substring_regex(names, pattern=VERSION_SUFFIX_PATTERN, replacement=r"\1")
+            mask = pc.or_(
+                pc.is_in(batch.column("geneName"), value_set=symbol_set),
+                pc.or_(pc.is_in(names, value_set=identifier_set), pc.is_in(stripped_names, value_set=identifier_set)),
+            )
+            return mask.to_numpy(zero_copy_only=False)
+
+        candidates, all_names = scan_refflat(refflat_path, select_rows)
+
+    duplicated_names = find_duplicated_names(all_names, set(candidates["name"]))
+    candidates = candidates[~candidates["name"].isin(duplicated_names)]
+    if all_genes:
+        gene_names = set(candidates["geneName"])
+    else:
+        gene_index = build_gene_identifier_index(candidates, gene_aliases)
+        gene_names = {symbol for symbol in map(gene_index.resolve, interest_genes) if symbol is not None}
+
+    # 読み込んだ行にすべてのトランスクリプトがあるとは限らない遺伝子は、その遺伝子の行を読み込み直す
+    missing_symbols = gene_names - loaded_symbols
+    if missing_symbols:
+        missing_set = pa.array(sorted(missing_symbols), type=pa.string())
+        rest, _ = scan_refflat(
+            refflat_path,
+            lambda batch: pc.is_in(batch.column("geneName"), value_set=missing_set).to_numpy(zero_copy_only=False),
+        )
+        rest = rest[~rest["name"].isin(find_duplicated_names(all_names, set(rest["name"])))]
+        candidates = pd.concat([candidates, rest])
+        candidates = candidates[~candidates.index.duplicated()].sort_index()
+
+    refflat = candidates[candidates["geneName"].isin(gene_names)].reset_index(drop=True)
+    logging.info(f"Loaded {len(refflat)} of {len(all_names)} transcripts in the refFlat file")
+    return refflat
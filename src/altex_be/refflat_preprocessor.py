@@ -4,15 +4,35 @@ import re
 import pandas as pd
 import logging
 from . import logging_config # noqa: F401
+from .exon_interval_index import build_exon_interval_index, explode_exons
+from .gene_identifier_index import GeneIdentifierIndex, build_gene_identifier_index
 
-def select_interest_genes(refFlat: pd.DataFrame, interest_genes: set[str]) -> pd.DataFrame:
+# 主要な染色体 (常染色体とX, Y) の名前。_random, _alt, _fix, chrUn などは含まない
+PRIMARY_CHROM_PATTERN = re.compile(r"^chr(\d+|X|Y)$")
+
+def split_position_list(positions: str | list[int]) -> list[int]:
+    """
+    Purpose:
+        refFlatの "100,200," 形式の文字列を、整数のリストに変換する
+        GTF/GFF3から直接読み込んだ場合 (gtf2refflat_converter.read_annotation_as_refflat) のように、すでにリストの場合はそのまま返す
+    """
+    if isinstance(positions, str):
+        return [int(i) for i in positions.split(",") if i.strip() != ""]
+    return positions
+
+def select_interest_genes(
+    refFlat: pd.DataFrame,
+    interest_genes: set[str],
+    gene_index: GeneIdentifierIndex | None = None,
+) -> pd.DataFrame:
     """
     Purpose:
         refFlatのデータフレームから、興味のある遺伝子のみを選択する。
-        指定されたのが遺伝子記号でもRefSeq IDでも、その遺伝子に属するすべてのトランスクリプトを返す。
+        指定されたのが遺伝子記号でもエイリアスでも、RefSeq ID / Ensembl ID (バージョンの有無を問わない) でも、その遺伝子に属するすべてのトランスクリプトを返す。
     Parameters:
         refFlat: pd.DataFrame, refFlatのデータフレーム
         interest_genes: set[str], 興味のある遺伝子名のリスト(gene symbol または Refseq ID)
+        gene_index: GeneIdentifierIndex | None, refFlatから作成したインデックス。Noneの場合はここで作成する
     Returns:
         pd.DataFrame, 興味のある遺伝子のみを含むrefFlatのデータフレーム
     """
@@ -20,32 +40,38 @@ def select_interest_genes(refFlat: pd.DataFrame, interest_genes: set[str]) -> pd
     if "all_genes" in interest_genes and len(interest_genes) == 1:
         logging.info("All genes in the reference transcriptome will be included in the analysis.")
         # Apply only exonStart validation for all genes
-        refFlat = refFlat[refFlat["exonStarts"].apply(lambda x: all(int(s) > 0 for s in x.split(",") if s.strip() != ""))].reset_index(drop=True)
+        refFlat = refFlat[refFlat["exonStarts"].apply(lambda x: all(s > 0 for s in split_position_list(x)))].reset_index(drop=True)
         return refFlat
-    
-    gene_symbol_set = set(refFlat["geneName"].values)
-    ref_seq_id_set = set(refFlat["name"].values)
-    
-    refFlat = refFlat[refFlat["geneName"].isin(interest_genes) | refFlat["name"].isin(interest_genes)].reset_index(drop=True)
+
+    if gene_index is None:
+        gene_index = build_gene_identifier_index(refFlat)
+
+    refFlat = refFlat.iloc[gene_index.rows(interest_genes)].reset_index(drop=True)
     # ごくまれに存在する、exonのスタートが0のものを除外する
-    # exonStarts を文字列のまま扱い、0 が含まれているかを確認
-    refFlat = refFlat[refFlat["exonStarts"].apply(lambda x: all(int(s) > 0 for s in x.split(",") if s.strip() != ""))].reset_index(drop=True)
+    refFlat = refFlat[refFlat["exonStarts"].apply(lambda x: all(s > 0 for s in split_position_list(x)))].reset_index(drop=True)
 
     for gene in interest_genes:
-        if gene not in gene_symbol_set and gene not in ref_seq_id_set:
+        symbol = gene_index.resolve(gene)
+        if symbol is None:
             logging.warning(f"Gene {gene} is not found in refFlat.")
-            continue
-        else :
+        elif symbol == gene:
             logging.info(f"Gene {gene} is found in refFlat.")
-    
+        else:
+            logging.info(f"Gene {gene} is found in refFlat as {symbol}.")
+
     return refFlat
 
-def check_multiple_exon_existance(refFlat: pd.DataFrame, interest_gene_list) -> bool:
+def check_multiple_exon_existance(
+    refFlat: pd.DataFrame,
+    interest_gene_list,
+    gene_index: GeneIdentifierIndex | None = None,
+) -> bool:
     """
     Purpose:
         refFlatのデータフレームに、複数のエキソンが存在するかを確認する。
     Parameters:
         refFlat: pd.DataFrame, refFlatのデータフレーム
+        gene_index: GeneIdentifierIndex | None, 遺伝子IDを遺伝子記号に変換するためのインデックス
     Returns:
         bool, 複数のエキソンが存在する場合はTrue、存在しない場合はFalse
     """
@@ -57,29 +83,39 @@ def check_multiple_exon_existance(refFlat: pd.DataFrame, interest_gene_list) ->
             logging.info("Multiple exons found in the reference transcriptome")
             found = True
         return found
-    
+
+    if gene_index is None:
+        gene_index = build_gene_identifier_index(refFlat)
+    # 遺伝子ごとの最大エキソン数を一度だけ集計し、以後は辞書引きで判定する
+    max_exon_counts = refFlat.groupby("geneName", observed=True)["exonCount"].max().to_dict()
     for gene in interest_gene_list:
-        exon_counts = refFlat[refFlat["geneName"] == gene]["exonCount"]
-        if (exon_counts > 1).any():
+        if max_exon_counts.get(gene_index.resolve(gene), 0) > 1:
             logging.info(f"Gene {gene} has multiple exons")
             found = True
     return found
 
 # constitutive exonも含めてデザインするなら、いらない可能性もある
-def check_transcript_variant(refFlat: pd.DataFrame, interest_genes: list[str]) -> bool:
+def check_transcript_variant(
+    refFlat: pd.DataFrame,
+    interest_genes: list[str],
+    gene_index: GeneIdentifierIndex | None = None,
+) -> bool:
     """
     Purpose:
         refFlatのデータフレームに、トランスクリプトのバリアントが存在するかを確認する。
     Parameters:
         refFlat: pd.DataFrame, refFlatのデータフレーム
+        gene_index: GeneIdentifierIndex | None, 遺伝子IDを遺伝子記号に変換するためのインデックス
     Returns:
         bool, トランスクリプトのバリアントが存在する場合はTrue、存在しない場合はFalse
     """
+    if gene_index is None:
+        gene_index = build_gene_identifier_index(refFlat)
+    # 遺伝子ごとにトランスクリプトの数をカウント
+    transcript_counts = refFlat.groupby("geneName", observed=True).size().to_dict()
     bool_list = []
     for gene in interest_genes:
-        # 遺伝子ごとにトランスクリプトの数をカウント
-        transcripts = refFlat[refFlat["geneName"] == gene]
-        if transcripts.shape[0] > 1:
+        if transcript_counts.get(gene_index.resolve(gene), 0) > 1:
             logging.info(f"Gene {gene} has multiple transcripts")
             bool_list.append(True)
         else:
@@ -99,12 +135,8 @@ def parse_exon_coordinates(refFlat: pd.DataFrame) -> pd.DataFrame:
         refFlat: pd.DataFrame, refFlatのデータフレーム
     """
     # Convert the exonStarts and exonEnds columns to lists of integers
-    refFlat["exonStarts"] = refFlat["exonStarts"].apply(
-        lambda x: [int(i) for i in x.split(",") if i.strip() != ""]
-    )
-    refFlat["exonEnds"] = refFlat["exonEnds"].apply(
-        lambda x: [int(i) for i in x.split(",") if i.strip() != ""]
-    )
+    refFlat["exonStarts"] = refFlat["exonStarts"].apply(split_position_list)
+    refFlat["exonEnds"] = refFlat["exonEnds"].apply(split_position_list)
 
     refFlat["exons"] = refFlat.apply(
         lambda row: list(zip(row["exonStarts"], row["exonEnds"])), axis=1
@@ -142,8 +174,7 @@ def drop_abnormal_mapped_transcripts(refflat: pd.DataFrame) -> pd.DataFrame:
     """
 
     # 正規表現パターンを使用して、染色体名が数字またはX, Yで終わるものを抜き出す（_random,_alt,_fixは除外）
-    pattern = re.compile(r"^chr(\d+|X|Y)$")
-    data_filtered = refflat[refflat["chrom"].str.match(pattern)]
+    data_filtered = refflat[refflat["chrom"].str.match(PRIMARY_CHROM_PATTERN)]
     return data_filtered.reset_index(drop=True)
 
 
@@ -314,14 +345,42 @@ def flag_outside_common_exon_space(refflat: pd.DataFrame) -> pd.DataFrame:
     return refflat
 
 
-def preprocess_refflat(refflat: pd.DataFrame, interest_genes: list[str], gtf_flag: bool) -> pd.DataFrame:
+def select_genes_in_regions(refFlat: pd.DataFrame, regions: list[tuple[str, int, int]]) -> pd.DataFrame:
+    """
+    Purpose:
+        指定された領域と1塩基以上重なるエキソンを持つ遺伝子を選択する。
+        スプライシングイベントの分類には遺伝子の全トランスクリプトが必要なので、該当遺伝子のトランスクリプトはすべて残す。
+    Parameters:
+        refFlat: pd.DataFrame, parse_exon_coordinates済みのrefFlatのデータフレーム
+        regions: list[tuple[str, int, int]], (chrom, start, end) の0-based半開区間のリスト
+    Returns:
+        pd.DataFrame, 領域と重なる遺伝子のみを含むrefFlatのデータフレーム
+    """
+    exon_df = explode_exons(refFlat)
+    hit_rows = build_exon_interval_index(exon_df).query_regions(regions)
+    genes_in_regions = set(exon_df["geneName"].to_numpy()[hit_rows])
+    logging.info(f"{len(genes_in_regions)} genes have exons overlapping the given regions.")
+    return refFlat[refFlat["geneName"].isin(genes_in_regions)].reset_index(drop=True)
+
+
+def preprocess_refflat(
+    refflat: pd.DataFrame,
+    interest_genes: list[str],
+    gtf_flag: bool,
+    regions: list[tuple[str, int, int]] | None = None,
+    gene_index: GeneIdentifierIndex | None = None,
+) -> pd.DataFrame:
     """
     このモジュールの関数をwrapした関数
     """
-    refflat = select_interest_genes(refflat, interest_genes)
+    refflat = select_interest_genes(refflat, interest_genes, gene_index)
     if refflat.empty:
         return refflat
     refflat = parse_exon_coordinates(refflat)
+    if regions:
+        refflat = select_genes_in_regions(refflat, regions)
+        if refflat.empty:
+            return refflat
     refflat = calculate_exon_lengths(refflat)
     refflat = drop_abnormal_mapped_transcripts(refflat)
     refflat = annotate_coding_information(refflat, gtf_flag)
@@ -1,6 +1,10 @@
+from functools import partial
 import pandas as pd
 import pybedtools
+from .stage_scheduler import StageScheduler
 
+# 同じ染色体・位置・strandの領域は、どのエキソン由来でも同じ配列になる
+WINDOW_KEY = ["chrom", "chromStart", "chromEnd", "strand"]
 
 
 def annotate_sequence_to_bed(bed: pd.DataFrame, fasta_path: str) -> pd.DataFrame:
@@ -13,9 +17,14 @@ def annotate_sequence_to_bed(bed: pd.DataFrame, fasta_path: str) -> pd.DataFrame
         fasta_path: str, FASTAファイルのパス
     Returns:
         bed_for_df: pd.DataFrame, 配列アノテーションが追加されたデータフレーム(形式はBED)
+    Comments:
+        アイソフォーム間やa3ss/a5ssのペアで同じスプライス部位を共有するエキソンが多いため、
+        同じ領域は1度だけFASTAから取得し、取得した配列を元のすべての行に結合する
     """
     bed_for_df = bed
-    bed_for_sequence = pybedtools.BedTool.from_dataframe(bed)
+    bed_for_df.columns = ["chrom", "chromStart", "chromEnd", "name", "score", "strand"]
+    unique_windows = bed_for_df.drop_duplicates(subset=WINDOW_KEY).reset_index(drop=True)
+    bed_for_sequence = pybedtools.BedTool.from_dataframe(unique_windows)
     # FASTAファイルから配列を取得　s = true　で配列のstrandを考慮し、-の時は相補鎖を出力する
     # もちろん、相補鎖も5'-3'の方向に出力される (今後間違えないように注意する)
     fasta_sequences = bed_for_sequence.sequence(fi=fasta_path, s=True, name=True)
@@ -36,10 +45,9 @@ def annotate_sequence_to_bed(bed: pd.DataFrame, fasta_path: str) -> pd.DataFrame
         # 最後の配列は次のheaderが存在しないため、for ループを抜けた後にリストに追加する必要がある
         if seq:
             sequences.append("".join(seq))
-    # .sequence()メソッドを使用すると、元の構造が保持されないため、bedの別のコピーをdfにする
-    bed_for_df.columns = ["chrom", "chromStart", "chromEnd", "name", "score", "strand"]
-    # 取得した配列をデータフレームに追加
-    bed_for_df["sequence"] = sequences
+    # .sequence()メソッドを使用すると、元の構造が保持されないため、重複を除いた領域に配列を付けてから元のbedに結合する
+    unique_windows = unique_windows[WINDOW_KEY].assign(sequence=sequences)
+    bed_for_df = bed_for_df.merge(unique_windows, on=WINDOW_KEY, how="left")
     return bed_for_df
 
 
@@ -78,16 +86,17 @@ def annotate_sequence_to_splice_sites(
     single_exon_df: pd.DataFrame,
     splice_acceptor_single_exon_df: pd.DataFrame,
     splice_donor_single_exon_df: pd.DataFrame,
-    fasta_path: str
+    fasta_path: str,
+    max_workers: int = 1,
 ) -> pd.DataFrame:
     """
     このモジュールの操作をまとめて実行するためのラッパー関数
+    max_workersが2以上の場合は、acceptorとdonorの配列の取得 (それぞれbedtoolsのプロセス) を同時に実行する
     """
-    acceptor_bed_with_sequences = annotate_sequence_to_bed(
-        splice_acceptor_single_exon_df, fasta_path
-    )
-    donor_bed_with_sequences = annotate_sequence_to_bed(
-        splice_donor_single_exon_df, fasta_path
-    )
+    with StageScheduler(max_workers) as scheduler:
+        scheduler.add("acceptor sequences", partial(annotate_sequence_to_bed, splice_acceptor_single_exon_df, fasta_path))
+        scheduler.add("donor sequences", partial(annotate_sequence_to_bed, splice_donor_single_exon_df, fasta_path))
+        acceptor_bed_with_sequences = scheduler.result("acceptor sequences")
+        donor_bed_with_sequences = scheduler.result("donor sequences")
     single_exon_df = join_sequence_to_single_exon_df(single_exon_df, acceptor_bed_with_sequences, donor_bed_with_sequences)
     return single_exon_df
@@ -2,7 +2,11 @@ from __future__ import annotations
 from dataclasses import (dataclass,astuple)
 import pandas as pd
 import re
+from functools import partial
 from .class_def.base_editors import BaseEditor
+from . import native_kernels
+from .memory_report import measure_frame_memory
+from .stage_scheduler import StageScheduler
 
 
 @dataclass(frozen=True)
@@ -19,6 +23,16 @@ class SgrnaInfo:
     overlap_between_cds_and_editing_window: int # 編集ウィンドウとCDSの重なりの長さ
     possible_unintended_edited_base_count: int # 意図しないcdsでの変異が起こる可能性のある塩基の数
 
+@dataclass(frozen=True)
+class PamHit:
+    """
+    編集ウィンドウに依存しない、PAMの検索結果を保持するためのdataclass
+    同じPAMを持つBaseEditorの間で使い回す
+    """
+    pam: str # マッチしたPAM配列
+    sgrna_start: int # 取得している50塩基対のうち、sgRNAの開始位置 (0-indexed)
+    sgrna_end: int # 取得している50塩基対のうち、sgRNAの終了位置 (0-indexed)
+
 def convert_dna_to_reversed_complement(sequence: str) -> str:
     """
     purpose:
@@ -30,8 +44,11 @@ def convert_dna_to_reversed_complement(sequence: str) -> str:
     """
     complement_map = {
         "A": "T", "T": "A", "C": "G", "G": "C", "N": "N",
-        "a": "t", "t": "a", "c": "g", "g": "c", "n": "n"
+        "a": "t", "t": "a", "c": "g", "g": "c", "n": "n", "+": "+"
         }
+    # IUPACの縮退塩基 (ゲノムのFASTAに含まれることがある) も補塩基に変換する
+    complement_map.update(native_kernels.IUPAC_COMPLEMENT)
+    complement_map.update({base.lower(): complement.lower() for base, complement in native_kernels.IUPAC_COMPLEMENT.items()})
     return "".join([complement_map[base] for base in reversed(sequence)])
 
 def reverse_complement_pam_as_regex(pam_sequence: str) -> re.Pattern:
@@ -234,7 +251,42 @@ def design_sgrna(
         つまり、+鎖を逆相補にしたものがsgRNAとなる。
         しかし、マッピング時のことを考えて、sgRNA編集ターゲット, 実際の逆相補化されたgRNA配列の両方を出力する
     """
-    sgrna_list = []
+    pam_hits = enumerate_pam_hits(
+        editing_sequence=editing_sequence,
+        pam_regex=pam_regex,
+        reversed_pam_regex=reversed_pam_regex,
+        cds_boundary=cds_boundary,
+        base_editor_type=base_editor_type,
+        site_type=site_type,
+    )
+    return design_sgrna_from_pam_hits(
+        editing_sequence=editing_sequence,
+        pam_hits=pam_hits,
+        editing_window_start_in_grna=editing_window_start_in_grna,
+        editing_window_end_in_grna=editing_window_end_in_grna,
+        target_base_pos_in_sequence=target_base_pos_in_sequence,
+        cds_boundary=cds_boundary,
+        base_editor_type=base_editor_type,
+        site_type=site_type,
+    )
+
+def enumerate_pam_hits(
+    editing_sequence: str,
+    pam_regex: re.Pattern,
+    reversed_pam_regex: re.Pattern,
+    cds_boundary: int,
+    base_editor_type: str,
+    site_type: str
+) -> list[PamHit]:
+    """
+    Purpose:
+        SA/SD周辺配列からPAMを検索し、配列内に収まるsgRNAの候補位置を列挙する
+        結果は編集ウィンドウに依存しないため、PAM・サイトタイプ・BEの種類が同じBaseEditorの間で共有できる
+    Parameters:
+        design_sgrnaと同じ
+    Returns:
+        list[PamHit], splice siteがAG/GTでない場合は空のリスト
+    """
     base_editor_type = base_editor_type.lower()
     if site_type == "acceptor":
         splice_site = editing_sequence[cds_boundary - 2:cds_boundary].upper()
@@ -245,11 +297,37 @@ def design_sgrna(
         expected_site = "GT"
         pam_iter = reversed_pam_regex.finditer(editing_sequence)
     if splice_site != expected_site:
-        return sgrna_list
+        return []
+    pam_hits = []
     for match in pam_iter:
         sgrna_start, sgrna_end = decide_sgrna_start_and_end(match, site_type, base_editor_type)
         if sgrna_start < 0 or sgrna_end > len(editing_sequence):
             continue
+        pam_hits.append(PamHit(pam=match.group(1), sgrna_start=sgrna_start, sgrna_end=sgrna_end))
+    return pam_hits
+
+def design_sgrna_from_pam_hits(
+    editing_sequence: str,
+    pam_hits: list[PamHit],
+    editing_window_start_in_grna: int,
+    editing_window_end_in_grna: int,
+    target_base_pos_in_sequence: int,
+    cds_boundary: int,
+    base_editor_type: str,
+    site_type: str
+) -> list[SgrnaInfo]:
+    """
+    Purpose:
+        enumerate_pam_hitsで列挙した候補から、編集ウィンドウにターゲット塩基が含まれるものだけを残してsgRNAの情報を作成する
+    Parameters:
+        design_sgrnaと同じ
+    Returns:
+        sgrna_list: list[SgrnaInfo], 条件に適合するsgRNAの情報のリスト
+    """
+    sgrna_list = []
+    base_editor_type = base_editor_type.lower()
+    for hit in pam_hits:
+        sgrna_start, sgrna_end = hit.sgrna_start, hit.sgrna_end
 
         # ABEかつ、acceptorの場合だけ、sgRNAが-鎖に結合するので、+鎖上では、3'端がPAMとなる
         # そのため、編集ウィンドウの開始位置と終了位置をsgrnaの3'から数える必要がある
@@ -263,7 +341,7 @@ def design_sgrna(
         if not (window_start_in_seq <= target_base_pos_in_sequence <= window_end_in_seq):
             continue
         target_sequence = editing_sequence[sgrna_start:sgrna_end]
-        pam_plus_target_sequence = f"{target_sequence}+{match.group(1)}" if site_type == "acceptor" and base_editor_type == "abe" else f"{match.group(1)}+{target_sequence}"
+        pam_plus_target_sequence = f"{target_sequence}+{hit.pam}" if site_type == "acceptor" and base_editor_type == "abe" else f"{hit.pam}+{target_sequence}"
         if site_type == "acceptor" and base_editor_type == "cbe":
             actual_sequence = convert_dna_to_reversed_complement(target_sequence)
         elif site_type == "acceptor" and base_editor_type == "abe":
@@ -295,6 +373,125 @@ def design_sgrna(
         )
     return sgrna_list
 
+ACCEPTOR_CDS_BOUNDARY = 25 # 25番目以後の塩基がCDSに含まれる
+DONOR_CDS_BOUNDARY = 24 # 24番目以前の塩基がCDSに含まれる
+SITE_TYPES = ("acceptor", "donor")
+
+def decide_cds_boundary(site_type: str) -> int:
+    return ACCEPTOR_CDS_BOUNDARY if site_type == "acceptor" else DONOR_CDS_BOUNDARY
+
+# exontypeがa5ss-longの場合はacceptor用のsgRNAを設計しない。a5ssはacceptorの位置が-shortと同じだから。
+# first と last exonでは、それぞれacceptorとdonorのsgRNAを設計しない。
+
+# design_sgrna 関数内で、splice siteがAG/GTでない場合はsgRNAを設計しないように変更したが、
+# そもそもsplice siteがAG/GTでない場合はsgRNAは設計されない。
+# だから、おそらく、first exonのacceptorやlast exonのdonorに対してsgRNAが設計されることはない。が、念のため、例外処理として、first exonのacceptorとlast exonのdonorに対してはsgRNAを設計しないようにした。
+
+# exontypeがa3ss-longの場合はdonor用のsgRNAを設計しない。 a3ssはdonorの位置が-shortと同じだから。
+SKIPPED_EXONTYPE = {"acceptor": "a5ss-long", "donor": "a3ss-long"}
+SKIPPED_EXON_POSITION = {"acceptor": "first", "donor": "last"}
+
+def decide_designable_rows(target_exon_df: pd.DataFrame, site_type: str) -> list[bool]:
+    """
+    Purpose:
+        exontypeとexon_positionから、各行でsite_typeのsgRNAを設計するかどうかを判定する
+    Returns:
+        list[bool], target_exon_dfの行と同じ順序
+    """
+    return [
+        exontype != SKIPPED_EXONTYPE[site_type]
+        and exon_position != SKIPPED_EXON_POSITION[site_type]
+        and is_valid_exon_position(exon_position, site_type)
+        for exontype, exon_position in zip(target_exon_df["exontype"], target_exon_df["exon_position"])
+    ]
+
+def enumerate_pam_hits_for_target_exon_df(
+    target_exon_df: pd.DataFrame,
+    pam_sequence: str,
+    base_editor_type: str
+) -> dict[str, list[list[PamHit]]]:
+    """
+    Purpose:
+        各エキソンのSA/SD周辺配列に対してPAMを1度だけ検索し、サイトタイプごとに各行のPamHitのリストを返す
+    Parameters:
+        target_exon_df: DataFrame, 各エキソンの情報を含むDataFrame
+        pam_sequence: str, PAM配列
+        base_editor_type: str, "abe" または "cbe"
+    Returns:
+        dict[str, list[list[PamHit]]], {"acceptor": [...], "donor": [...]}, 各リストはtarget_exon_dfの行と同じ順序
+    """
+    pam_regex = convert_pam_as_regex(pam_sequence)
+    reversed_pam_regex = reverse_complement_pam_as_regex(pam_sequence)
+
+    pam_hits_by_site = {}
+    for site_type in SITE_TYPES:
+        # アイソフォーム間で同じスプライス部位を共有するエキソンは同じ配列を持つので、配列ごとに1度だけ検索する
+        memo: dict[str, list[PamHit]] = {}
+
+        def memoized_enumerate_pam_hits(sequence: str) -> list[PamHit]:
+            if sequence not in memo:
+                memo[sequence] = enumerate_pam_hits(
+                    editing_sequence=sequence,
+                    pam_regex=pam_regex,
+                    reversed_pam_regex=reversed_pam_regex,
+                    cds_boundary=decide_cds_boundary(site_type),
+                    base_editor_type=base_editor_type,
+                    site_type=site_type,
+                )
+            return memo[sequence]
+
+        pam_hits_by_site[site_type] = [
+            memoized_enumerate_pam_hits(sequence) if is_designable else []
+            for sequence, is_designable in zip(
+                target_exon_df[f"{site_type}_exon_intron_boundary_±25bp_sequence"],
+                decide_designable_rows(target_exon_df, site_type),
+            )
+        ]
+    return pam_hits_by_site
+
+def design_sgrna_from_pam_hits_by_site(
+    target_exon_df: pd.DataFrame,
+    pam_hits_by_site: dict[str, list[list[PamHit]]],
+    editing_window_start_in_grna: int,
+    editing_window_end_in_grna: int,
+    base_editor_type: str
+) -> dict[str, list[list[SgrnaInfo]]]:
+    """
+    Purpose:
+        enumerate_pam_hits_for_target_exon_dfの結果に、あるBaseEditorの編集ウィンドウを適用してsgRNAを設計する
+    Returns:
+        dict[str, list[list[SgrnaInfo]]], {"acceptor": [...], "donor": [...]}, 各リストはtarget_exon_dfの行と同じ順序
+    """
+    grna_by_site = {}
+    for site_type in SITE_TYPES:
+        target_base_pos_in_sequence = decide_target_base_pos_in_sequence(base_editor_type, site_type)
+        # 同じ配列に対する設計結果は同じなので、配列ごとに1度だけ設計する
+        memo: dict[str, list[SgrnaInfo]] = {}
+
+        def memoized_design_sgrna(sequence: str, pam_hits: list[PamHit]) -> list[SgrnaInfo]:
+            if sequence not in memo:
+                memo[sequence] = design_sgrna_from_pam_hits(
+                    editing_sequence=sequence,
+                    pam_hits=pam_hits,
+                    editing_window_start_in_grna=editing_window_start_in_grna,
+                    editing_window_end_in_grna=editing_window_end_in_grna,
+                    target_base_pos_in_sequence=target_base_pos_in_sequence,
+                    cds_boundary=decide_cds_boundary(site_type),
+                    base_editor_type=base_editor_type,
+                    site_type=site_type,
+                )
+            return memo[sequence]
+
+        grna_by_site[site_type] = [
+            memoized_design_sgrna(sequence, pam_hits)
+            if pam_hits else []
+            for sequence, pam_hits in zip(
+                target_exon_df[f"{site_type}_exon_intron_boundary_±25bp_sequence"],
+                pam_hits_by_site[site_type],
+            )
+        ]
+    return grna_by_site
+
 def design_sgrna_for_target_exon_df(
     target_exon_df: pd.DataFrame,
     pam_sequence: str,
@@ -313,44 +510,168 @@ def design_sgrna_for_target_exon_df(
     Returns:
         各エキソンに対して設計されたsgRNAの情報を含むDataFrame
     """
-    ACCEPTOR_CDS_BOUNDARY = 25 # 25番目以後の塩基がCDSに含まれる
-    DONOR_CDS_BOUNDARY = 24 # 24番目以前の塩基がCDSに含まれる
-
-    pam_regex = convert_pam_as_regex(pam_sequence)
-    reversed_pam_regex = reverse_complement_pam_as_regex(pam_sequence)
+    pam_hits_by_site = enumerate_pam_hits_for_target_exon_df(target_exon_df, pam_sequence, base_editor_type)
+    grna_by_site = design_sgrna_from_pam_hits_by_site(
+        target_exon_df,
+        pam_hits_by_site,
+        editing_window_start_in_grna,
+        editing_window_end_in_grna,
+        base_editor_type,
+    )
+    target_exon_df["grna_acceptor"] = grna_by_site["acceptor"]
+    target_exon_df["grna_donor"] = grna_by_site["donor"]
+    return target_exon_df
 
-    def apply_design(row, site_type, base_editor_type):
-        sequence_col = f"{site_type}_exon_intron_boundary_±25bp_sequence"
-        if is_valid_exon_position(row["exon_position"], site_type):
-            return design_sgrna(
-                editing_sequence=row[sequence_col],
-                pam_regex=pam_regex,
-                reversed_pam_regex=reversed_pam_regex,
-                editing_window_start_in_grna=editing_window_start_in_grna,
-                editing_window_end_in_grna=editing_window_end_in_grna,
-                target_base_pos_in_sequence=decide_target_base_pos_in_sequence(base_editor_type, site_type),
-                cds_boundary=ACCEPTOR_CDS_BOUNDARY if site_type == "acceptor" else DONOR_CDS_BOUNDARY,
-                base_editor_type=base_editor_type,
-                site_type=site_type
-            )
-        return []
-    
-    # exontypeがa5ss-longの場合はacceptor用のsgRNAを設計しない。a5ssはacceptorの位置が-shortと同じだから。
-    # first と last exonでは、それぞれacceptorとdonorのsgRNAを設計しない。
+def design_sgrna_natively_by_site(
+    target_exon_df: pd.DataFrame,
+    pam_sequence: str,
+    base_editor_type: str,
+    base_editors: list[BaseEditor],
+) -> dict[str, dict[str, list[list[SgrnaInfo]]]]:
+    """
+    Purpose:
+        enumerate_pam_hits_for_target_exon_df と design_sgrna_from_pam_hits_by_site を、
+        native_kernelsのベクトル化されたカーネルでまとめて実行する (--engine native)
+        PAMと種類が同じBaseEditorのグループを受け取り、PAMの検索は1度だけ行う
+    Returns:
+        dict[base_editor_name, dict[site_type, list[list[SgrnaInfo]]]], 各リストはtarget_exon_dfの行と同じ順序
+    """
+    base_editor_type = base_editor_type.lower()
+    grna_by_editor: dict[str, dict[str, list[list[SgrnaInfo]]]] = {be.base_editor_name: {} for be in base_editors}
+    for site_type in SITE_TYPES:
+        cds_boundary = decide_cds_boundary(site_type)
+        target_base_pos_in_sequence = decide_target_base_pos_in_sequence(base_editor_type, site_type)
+        sequences = target_exon_df[f"{site_type}_exon_intron_boundary_±25bp_sequence"].tolist()
+        designable_rows = decide_designable_rows(target_exon_df, site_type)
+        # アイソフォーム間で同じ配列を持つ行は1度だけ計算する。行列にするため、配列長ごとにまとめる
+        sequences_by_length: dict[int, list[str]] = {}
+        for sequence in dict.fromkeys(seq for seq, is_designable in zip(sequences, designable_rows) if is_designable):
+            sequences_by_length.setdefault(len(sequence), []).append(sequence)
+
+        # 配列の符号化とPAMの検索はBaseEditorによらないので、配列長ごとに1度だけ行う
+        pam_hits_by_length = []
+        for unique_sequences in sequences_by_length.values():
+            seq_matrix = native_kernels.encode_sequences(unique_sequences)
+            pam_hits = native_kernels.enumerate_pam_hits(seq_matrix, pam_sequence, cds_boundary, base_editor_type, site_type)
+            pam_hits_by_length.append((unique_sequences, seq_matrix, pam_hits))
+
+        for base_editor in base_editors:
+            sgrna_by_sequence: dict[str, list[SgrnaInfo]] = {}
+            for unique_sequences, seq_matrix, pam_hits in pam_hits_by_length:
+                # 編集ウィンドウでの絞り込みだけをBaseEditorごとに行う
+                designed = native_kernels.design_sgrna_from_pam_hits(
+                    seq_matrix,
+                    pam_hits,
+                    base_editor.editing_window_start_in_grna,
+                    base_editor.editing_window_end_in_grna,
+                    target_base_pos_in_sequence,
+                    cds_boundary,
+                    base_editor_type,
+                    site_type,
+                )
+                for row, pam_start, sgrna_start, sgrna_end, target_pos, overlap, unintended in zip(
+                    designed.rows.tolist(),
+                    designed.pam_starts.tolist(),
+                    designed.sgrna_starts.tolist(),
+                    designed.sgrna_ends.tolist(),
+                    designed.target_pos_in_sgrna.tolist(),
+                    designed.overlap_between_cds_and_editing_window.tolist(),
+                    designed.possible_unintended_edited_base_count.tolist(),
+                ):
+                    sequence = unique_sequences[row]
+                    pam = sequence[pam_start:pam_start + len(pam_sequence)]
+                    target_sequence = sequence[sgrna_start:sgrna_end]
+                    if site_type == "acceptor" and base_editor_type == "abe":
+                        pam_plus_target_sequence = f"{target_sequence}+{pam}"
+                        actual_sequence = target_sequence
+                    else:
+                        pam_plus_target_sequence = f"{pam}+{target_sequence}"
+                        actual_sequence = native_kernels.reverse_complement(target_sequence)
+                    sgrna_by_sequence.setdefault(sequence, []).append(
+                        SgrnaInfo(
+                            target_sequence=pam_plus_target_sequence,
+                            actual_sequence=actual_sequence,
+                            start_in_sequence=sgrna_start,
+                            end_in_sequence=sgrna_end,
+                            target_pos_in_sgrna=target_pos,
+                            overlap_between_cds_and_editing_window=overlap,
+                            possible_unintended_edited_base_count=unintended,
+                        )
+                    )
+            grna_by_editor[base_editor.base_editor_name][site_type] = [
+                sgrna_by_sequence.get(sequence, []) if is_designable else []
+                for sequence, is_designable in zip(sequences, designable_rows)
+            ]
+    return grna_by_editor
+
+def plan_sgrna_design(base_editors: dict[str, BaseEditor]) -> dict[tuple[str, str], list[BaseEditor]]:
+    """
+    Purpose:
+        PAM配列とBEの種類 (abe/cbe) が同じBaseEditorをまとめる。
+        PAMの検索結果はこの組み合わせ (とサイトタイプ) だけで決まるため、グループごとに1度だけ検索すればよい
+    Returns:
+        dict[(pam_sequence, base_editor_type), list[BaseEditor]]
+    """
+    design_plan: dict[tuple[str, str], list[BaseEditor]] = {}
+    for base_editor in base_editors.values():
+        key = (base_editor.pam_sequence.upper(), base_editor.base_editor_type.lower())
+        design_plan.setdefault(key, []).append(base_editor)
+    return design_plan
 
-    # design_sgrna 関数内で、splice siteがAG/GTでない場合はsgRNAを設計しないように変更したが、
-    # そもそもsplice siteがAG/GTでない場合はsgRNAは設計されない。
-    # だから、おそらく、first exonのacceptorやlast exonのdonorに対してsgRNAが設計されることはない。が、念のため、例外処理として、first exonのacceptorとlast exonのdonorに対してはsgRNAを設計しないようにした。
+def design_grna_columns_for_base_editors(
+    target_exon_df: pd.DataFrame,
+    base_editors: dict[str, BaseEditor],
+    engine: str = "python",
+) -> dict[str, pd.DataFrame]:
+    """
+    Purpose:
+        plan_sgrna_designでまとめたグループごとにPAMを検索し、各BaseEditorの編集ウィンドウで絞り込んで
+        grna_acceptor/grna_donor列を追加したDataFrameをBaseEditorごとに返す
+        計算量はBaseEditorの数ではなく、異なるPAMの数に比例する
+        engine == "native" の場合は、native_kernelsのベクトル化されたカーネルを使う (結果は同じ)
+    """
+    results = {}
+    for (pam_sequence, base_editor_type), grouped_base_editors in plan_sgrna_design(base_editors).items():
+        results.update(design_grna_columns_for_pam_group(target_exon_df, pam_sequence, base_editor_type, grouped_base_editors, engine))
+    # 出力の順序は入力されたBaseEditorの順序に合わせる
+    return {be.base_editor_name: results[be.base_editor_name] for be in base_editors.values()}
 
-    # exontypeがa3ss-longの場合はdonor用のsgRNAを設計しない。 a3ssはdonorの位置が-shortと同じだから。
-    target_exon_df["grna_acceptor"] = target_exon_df.apply(
-        lambda r:[] if r["exontype"] =="a5ss-long" or r["exon_position"] == "first" else apply_design(r, "acceptor", base_editor_type), axis=1
-    )
-    target_exon_df["grna_donor"] = target_exon_df.apply(
-        lambda r:[] if r["exontype"]=="a3ss-long" or r["exon_position"] == "last" else apply_design(r, "donor", base_editor_type), axis=1
-    )
 
-    return target_exon_df
+def design_grna_columns_for_pam_group(
+    target_exon_df: pd.DataFrame,
+    pam_sequence: str,
+    base_editor_type: str,
+    grouped_base_editors: list[BaseEditor],
+    engine: str = "python",
+) -> dict[str, pd.DataFrame]:
+    """
+    Purpose:
+        plan_sgrna_designの1つのグループ (同じPAMとタイプのBaseEditor) について、PAMを1度だけ検索して
+        grna_acceptor/grna_donor列を追加したDataFrameをBaseEditorごとに返す
+    """
+    results = {}
+    if engine == "native":
+        grna_by_editor = design_sgrna_natively_by_site(target_exon_df, pam_sequence, base_editor_type, grouped_base_editors)
+        for base_editor_name, grna_by_site in grna_by_editor.items():
+            results[base_editor_name] = target_exon_df.assign(
+                grna_acceptor=grna_by_site["acceptor"],
+                grna_donor=grna_by_site["donor"],
+            )
+        return results
+    pam_hits_by_site = enumerate_pam_hits_for_target_exon_df(target_exon_df, pam_sequence, base_editor_type)
+    for base_editor in grouped_base_editors:
+        grna_by_site = design_sgrna_from_pam_hits_by_site(
+            target_exon_df,
+            pam_hits_by_site,
+            base_editor.editing_window_start_in_grna,
+            base_editor.editing_window_end_in_grna,
+            base_editor_type,
+        )
+        results[base_editor.base_editor_name] = target_exon_df.assign(
+            grna_acceptor=grna_by_site["acceptor"],
+            grna_donor=grna_by_site["donor"],
+        )
+    return results
 
 
 def extract_sgrna_features(sgrna_list: list[SgrnaInfo]) -> tuple[list,list,list,list,list,list,list]:
@@ -466,6 +787,7 @@ def convert_sgrna_start_end_position_to_position_in_chromosome(
 def design_sgrna_for_base_editors(
     target_exon_df: pd.DataFrame,
     base_editors: dict[str, BaseEditor],
+    engine: str = "python",
 ) -> pd.DataFrame:
     """
     Purpose:
@@ -473,6 +795,7 @@ def design_sgrna_for_base_editors(
     Parameters:
         target_exon_df: pd.DataFrame, 各エキソンの情報を含むDataFrame
         base_editors: dict[str, BaseEditor], BaseEditorの情報を含む辞書
+        engine: str, "python" または "native"
     Returns:
         pd.DataFrame, 各BaseEditorに対して設計されたsgRNAの情報を含むDataFrame
     """
@@ -495,15 +818,10 @@ def design_sgrna_for_base_editors(
     ]
     foundation_cols_df = target_exon_df[foundation_cols].copy()
 
+    # 1. 同じPAMを持つBaseEditorの間でPAMの検索結果を共有してsgRNAを設計する
+    designed_df_dict = design_grna_columns_for_base_editors(target_exon_df, base_editors, engine)
     for base_editor in base_editors.values():
-        # 1. sgRNAを設計する
-        temp_df = design_sgrna_for_target_exon_df(
-            target_exon_df=target_exon_df,
-            pam_sequence=base_editor.pam_sequence,
-            editing_window_start_in_grna=base_editor.editing_window_start_in_grna,
-            editing_window_end_in_grna=base_editor.editing_window_end_in_grna,
-            base_editor_type=base_editor.base_editor_type
-        )
+        temp_df = designed_df_dict[base_editor.base_editor_name]
         # 2. sgRNAの情報を展開する
         temp_df = organize_target_exon_df_with_grna_sequence(temp_df)
         # 3. sgRNAの開始位置と終了位置をゲノム上の位置に変換する
@@ -538,6 +856,9 @@ def design_sgrna_for_base_editors(
 def design_sgrna_for_base_editors_dict(
     target_exon_df: pd.DataFrame,
     base_editors: dict[str,BaseEditor],
+    engine: str = "python",
+    max_workers: int = 1,
+    memory_budget: int | None = None,
 ) -> dict[str, pd.DataFrame]:
     """
     Purpose:
@@ -545,26 +866,48 @@ def design_sgrna_for_base_editors_dict(
     Parameters:
         target_exon_df: pd.DataFrame, 各エキソンの情報を含むDataFrame
         base_editors: dict[str, BaseEditor], BaseEditorの情報を含む辞書
+        engine: str, "python" または "native"
+        max_workers: int, 同時に実行するステージ (PAMのグループごとの検索、BaseEditorごとの展開) の数
+        memory_budget: int | None, 同時に実行するステージが新しく確保するメモリの上限 (byte)。Noneの場合は制限しない
     Returns:
         dict[str, pd.DataFrame], 各BaseEditorに対して設計されたsgRNAの情報を含むDataFrame
+    Comments:
+        PAMのグループごとに、検索とBaseEditorごとの展開を1つのステージにしてStageSchedulerで実行し、グループどうしは同時に進める。
+        展開をグループのステージの中で行うので、ステージの間でグループの結果 (BaseEditorごとのDataFrame) を受け渡さない。
+        ステージはBaseEditorごとにtarget_exon_dfのコピー (grna_acceptor/grna_donor列を追加したもの) と展開したDataFrameを作るので、
+        その大きさ (target_exon_dfの2倍 x BaseEditorの数) をメモリの見積もりにする
     """
-    results = {}  # 各BaseEditorの結果を格納する辞書
-
-    for base_editor in base_editors.values():
-        # 1. sgRNAを設計する
-        temp_df = design_sgrna_for_target_exon_df(
-            target_exon_df=target_exon_df,
-            pam_sequence=base_editor.pam_sequence,
-            editing_window_start_in_grna=base_editor.editing_window_start_in_grna,
-            editing_window_end_in_grna=base_editor.editing_window_end_in_grna,
-            base_editor_type=base_editor.base_editor_type
-        )
-        # 2. sgRNAの情報を展開する
-        temp_df = organize_target_exon_df_with_grna_sequence(temp_df)
-        # 3. sgRNAの開始位置と終了位置をゲノム上の位置に変換する
-        temp_df = convert_sgrna_start_end_position_to_position_in_chromosome(temp_df)
+    frame_bytes = measure_frame_memory(target_exon_df, deep=False)
+    with StageScheduler(max_workers, memory_budget) as scheduler:
+        for (pam_sequence, base_editor_type), grouped_base_editors in plan_sgrna_design(base_editors).items():
+            scheduler.add(
+                f"PAM search {pam_sequence} ({base_editor_type})",
+                partial(design_and_expand_pam_group, target_exon_df, pam_sequence, base_editor_type, grouped_base_editors, engine),
+                memory_bytes=2 * frame_bytes * len(grouped_base_editors),
+            )
+        results = {}
+        for expanded_df_dict in scheduler.results().values():
+            results.update(expanded_df_dict)
+    # 結果の順序は入力されたBaseEditorの順序に合わせる
+    return {be.base_editor_name: results[be.base_editor_name] for be in base_editors.values()}
 
-        # 結果を辞書に追加
-        results[base_editor.base_editor_name] = temp_df
 
-    return results
\ No newline at end of file
+def design_and_expand_pam_group(
+    target_exon_df: pd.DataFrame,
+    pam_sequence: str,
+    base_editor_type: str,
+    grouped_base_editors: list[BaseEditor],
+    engine: str = "python",
+) -> dict[str, pd.DataFrame]:
+    """
+    Purpose: 1つのPAMのグループのsgRNAを設計し、BaseEditorごとにsgRNAごとの行に展開したDataFrameを返す
+    """
+    # 1. 同じPAMを持つBaseEditorの間でPAMの検索結果を共有してsgRNAを設計する
+    designed_df_dict = design_grna_columns_for_pam_group(target_exon_df, pam_sequence, base_editor_type, grouped_base_editors, engine)
+    expanded_df_dict = {}
+    for base_editor in grouped_base_editors:
+        # 2. sgRNAの情報を展開する (展開したBaseEditorの設計結果は、すぐに解放する)
+        temp_df = organize_target_exon_df_with_grna_sequence(designed_df_dict.pop(base_editor.base_editor_name))
+        # 3. sgRNAの開始位置と終了位置をゲノム上の位置に変換する
+        expanded_df_dict[base_editor.base_editor_name] = convert_sgrna_start_end_position_to_position_in_chromosome(temp_df)
+    return expanded_df_dict
@@ -1,6 +1,286 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+import inspect
+import numpy as np
 import pandas as pd
 
-def prioritize_sgrna(exploded_sgrna_with_offtarget_info: pd.DataFrame) -> pd.DataFrame:
+EXON_KEY = ["geneName", "exonStarts", "exonEnds"]
+EXON_EDITOR_KEY = EXON_KEY + ["base_editor_name"] # --top-n-per-exon は Exon と BaseEditor の組ごとに上位を選ぶ
+SCORE_COLUMN = "sgrna_score"
+
+def encode_sgrna_sequences(sgrna_sequences: pd.Series) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    すべての sgRNA 配列を1つのバイト列 (大文字の uint8) にまとめ、各配列の開始位置と長さと一緒に返す。
+    配列ごとの集計を、行ごとの Python の処理なしに累積和の差で行うために使う。
+    """
+    sequences = sgrna_sequences.to_numpy(dtype=object)
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    bases = np.frombuffer("".join(sequences).encode("ascii"), dtype=np.uint8) & 0xDF  # 大文字にする
+    starts = np.cumsum(lengths) - lengths
+    return bases, starts, lengths
+
+def count_in_sequences(is_hit: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    バイト列上の真偽値 is_hit を、配列ごとに [start, start + length) の範囲で数える。
+    """
+    hit_cumsum = np.concatenate([[0], np.cumsum(is_hit)])
+    return hit_cumsum[starts + lengths] - hit_cumsum[starts]
+
+def calculate_gc_content(sgrna_sequences: pd.Series) -> np.ndarray:
+    """
+    GC content (%) をベクトル化して計算する。空の配列は 0 とする。
+    式 (gc / len * 100) は行ごとに計算していた時と同じにしている。
+    """
+    bases, starts, lengths = encode_sgrna_sequences(sgrna_sequences)
+    gc_counts = count_in_sequences((bases == ord("G")) | (bases == ord("C")), starts, lengths)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(lengths > 0, gc_counts / lengths * 100, 0)
+
+def calculate_gc_valid(sgrna_sequences: pd.Series) -> np.ndarray:
+    """
+    GC content が最適範囲（40-60%）かどうか（バイナリ判定）
+    """
+    gc_content = calculate_gc_content(sgrna_sequences)
+    return (gc_content >= 40) & (gc_content <= 60)
+
+# ---------------------------------------------------------------------------
+# スコアリング
+# 各スコア関数は sgRNA のテーブル全体を受け取り、全 sgRNA のスコア (0-1, 大きいほど良い) を
+# numpy の配列として一度に返す。register_scorer で名前を付けて登録すると、設定ファイルから使える。
+# ---------------------------------------------------------------------------
+
+ScorerFunction = Callable[..., np.ndarray]
+SCORERS: dict[str, ScorerFunction] = {}
+
+def register_scorer(name: str) -> Callable[[ScorerFunction], ScorerFunction]:
+    """
+    スコア関数を SCORERS に登録するデコレータ。
+    スコア関数は (sgrna_df, **params) -> np.ndarray の形で、params は設定ファイルの列から渡される。
+    """
+    def decorator(scorer: ScorerFunction) -> ScorerFunction:
+        SCORERS[name] = scorer
+        return scorer
+    return decorator
+
+@register_scorer("gc_content")
+def score_gc_content(sgrna_df: pd.DataFrame, low: float = 40.0, high: float = 60.0, tolerance: float = 20.0) -> np.ndarray:
+    """
+    GC content が [low, high] の範囲内なら 1、範囲外では離れるほど直線的に下がり、tolerance 離れると 0 になる。
+    """
+    gc_content = calculate_gc_content(sgrna_df["sgrna_sequence"])
+    distance = np.maximum(low - gc_content, 0) + np.maximum(gc_content - high, 0)
+    return np.clip(1 - distance / tolerance, 0, 1)
+
+@register_scorer("offtarget_aggregate")
+def score_offtarget_aggregate(sgrna_df: pd.DataFrame, seed_match_weight: float = 0.1) -> np.ndarray:
+    """
+    CFD の aggregate score (100 / (100 + オフターゲットサイトのCFDの合計)) にならったオフターゲットのスコア。
+    ミスマッチを許した検索は行っていないため、PAM+20bp の完全一致 (自身を除く) を CFD = 1、
+    PAM+12bp (seed) だけが一致するサイトを CFD = seed_match_weight として合計し、1 / (1 + 合計) を返す。
+    """
+    full_match = sgrna_df["pam+20bp_exact_match_count"].to_numpy(dtype=np.float64)
+    seed_match = sgrna_df["pam+12bp_exact_match_count"].to_numpy(dtype=np.float64)
+    offtarget_sites = np.maximum(full_match - 1, 0) + seed_match_weight * np.maximum(seed_match - full_match, 0)
+    return 1 / (1 + offtarget_sites)
+
+@register_scorer("window_position")
+def score_window_position(sgrna_df: pd.DataFrame, preferred_position: float | None = None) -> np.ndarray:
+    """
+    編集ターゲットの sgRNA 内での位置が、編集ウィンドウの中央 (または preferred_position) に近いほど高いスコアを与える。
+    ウィンドウの端では 1 / (ウィンドウの半分の幅 + 1) まで下がる。
+    """
+    window_start = sgrna_df["base_editor_editing_window_start"].to_numpy(dtype=np.float64)
+    window_end = sgrna_df["base_editor_editing_window_end"].to_numpy(dtype=np.float64)
+    target_pos = sgrna_df["sgrna_target_pos_in_sgrna"].to_numpy(dtype=np.float64)
+    center = (window_start + window_end) / 2 if preferred_position is None else np.full_like(target_pos, preferred_position)
+    half_width = (window_end - window_start) / 2
+    return np.clip(1 - np.abs(target_pos - center) / (half_width + 1), 0, 1)
+
+@register_scorer("unintended_edits")
+def score_unintended_edits(sgrna_df: pd.DataFrame) -> np.ndarray:
+    """
+    CDS 内で意図しない編集を受ける可能性のある塩基が少ないほど高いスコアを与える (1 / (1 + 塩基数))。
+    """
+    return 1 / (1 + sgrna_df["sgrna_possible_unintended_edited_base_count"].to_numpy(dtype=np.float64))
+
+@register_scorer("poly_t")
+def score_poly_t(sgrna_df: pd.DataFrame, run_length: float = 4) -> np.ndarray:
+    """
+    U6 プロモーターの転写終結シグナルとなる T の連続 (run_length 塩基以上) を含む sgRNA を 0、それ以外を 1 とする。
+    """
+    run_length = int(run_length)
+    bases, starts, lengths = encode_sgrna_sequences(sgrna_df["sgrna_sequence"])
+    # 各位置から run_length 塩基がすべて T かどうかを、T の累積和の差で判定する
+    t_cumsum = np.concatenate([[0], np.cumsum(bases == ord("T"))])
+    n_windows = max(len(bases) - run_length + 1, 0)
+    is_poly_t_start = (t_cumsum[run_length:run_length + n_windows] - t_cumsum[:n_windows]) == run_length
+    # 配列の境界をまたぐ窓を数えないように、各配列の最後の run_length - 1 塩基から始まる窓は除く
+    has_poly_t = count_in_sequences(
+        np.concatenate([is_poly_t_start, np.zeros(len(bases) - n_windows, dtype=bool)]),
+        starts,
+        np.maximum(lengths - run_length + 1, 0),
+    ) > 0
+    return np.where(has_poly_t, 0.0, 1.0)
+
+@register_scorer("column")
+def score_column(sgrna_df: pd.DataFrame, column: str, higher_is_better: float = 1) -> np.ndarray:
+    """
+    テーブルにある数値の列 (外部のツールで計算した on-target の効率など) を min-max で 0-1 に正規化してスコアにする。
+    欠損値は 0 とする。
+    """
+    values = pd.to_numeric(sgrna_df[column], errors="coerce").to_numpy(dtype=np.float64)
+    if not higher_is_better:
+        values = -values
+    value_range = np.nanmax(values) - np.nanmin(values) if np.isfinite(values).any() else 0
+    if value_range == 0:
+        return np.where(np.isnan(values), 0.0, 1.0)
+    return np.nan_to_num((values - np.nanmin(values)) / value_range, nan=0.0)
+
+@dataclass(frozen=True)
+class ScoringTerm:
+    """
+    重み付きスコアの1項を保持するためのdataclass
+    """
+    scorer: str # SCORERS に登録されたスコア関数の名前
+    weight: float # 重み
+    params: dict = field(default_factory=dict) # スコア関数に渡すパラメータ
+
+def load_scoring_terms(config_path: Path) -> list[ScoringTerm]:
+    """
+    スコアリングの設定ファイル (csv, tsv, txt) を読み込む。
+    1行が1つのスコア関数に対応し、"scorer" と "weight" 列は必須、それ以外の列はスコア関数のパラメータとして渡す (空欄は既定値)。
+    例:
+        scorer,weight,low,high,seed_match_weight
+        offtarget_aggregate,3,,,0.1
+        gc_content,1,40,60,
+        window_position,1,,,
+    """
+    ext = Path(config_path).suffix.lower()
+    if ext not in [".csv", ".tsv", ".txt"]:
+        raise ValueError("Unsupported file extension for scoring config file. Use .csv, .tsv, or .txt")
+    config_df = pd.read_csv(config_path, sep="," if ext == ".csv" else "\t", header=0)
+    if not {"scorer", "weight"} <= set(config_df.columns):
+        raise ValueError(f"Scoring config file must have 'scorer' and 'weight' columns, but got: {list(config_df.columns)}")
+
+    scoring_terms = []
+    for _, row in config_df.iterrows():
+        scorer = str(row["scorer"]).strip()
+        if scorer not in SCORERS:
+            raise ValueError(f"Unknown scorer '{scorer}'. Available scorers: {sorted(SCORERS)}")
+        weight = pd.to_numeric(row["weight"], errors="coerce")
+        if pd.isna(weight) or weight < 0:
+            raise ValueError(f"Weight of scorer '{scorer}' must be a non-negative number, but got: {row['weight']}")
+        params = {
+            col: value.item() if isinstance(value, np.generic) else value
+            for col, value in row.drop(["scorer", "weight"]).items()
+            if not pd.isna(value)
+        }
+        try:
+            inspect.signature(SCORERS[scorer]).bind(None, **params)
+        except TypeError as e:
+            raise ValueError(f"Invalid parameters for scorer '{scorer}': {e}") from e
+        scoring_terms.append(ScoringTerm(scorer=scorer, weight=float(weight), params=params))
+    if not scoring_terms or sum(term.weight for term in scoring_terms) == 0:
+        raise ValueError("Scoring config file must contain at least one scorer with a positive weight")
+    return scoring_terms
+
+def calculate_sgrna_score(sgrna_df: pd.DataFrame, scoring_terms: list[ScoringTerm]) -> np.ndarray:
+    """
+    各スコア関数を全 sgRNA に対して一度ずつ実行し、重み付き平均 (0-1) を返す。
+    """
+    weighted_sum = np.zeros(len(sgrna_df), dtype=np.float64)
+    for term in scoring_terms:
+        scores = np.nan_to_num(np.asarray(SCORERS[term.scorer](sgrna_df, **term.params), dtype=np.float64), nan=0.0)
+        weighted_sum += term.weight * scores
+    return weighted_sum / sum(term.weight for term in scoring_terms)
+
+# ---------------------------------------------------------------------------
+# 優先順位付け
+# ---------------------------------------------------------------------------
+
+def lexicographic_ranking_keys(sgrna_df: pd.DataFrame) -> list[np.ndarray]:
+    """
+    prioritize_sgrna の既定の順序 (20bp完全一致数 -> GC -> 12bp完全一致数 -> 意図しない編集) を、
+    np.lexsort に渡すキーの配列として返す (優先度の高いキーが先頭)。
+    """
+    return [
+        sgrna_df["pam+20bp_exact_match_count"].to_numpy(dtype=np.float64),
+        ~calculate_gc_valid(sgrna_df["sgrna_sequence"]),
+        sgrna_df["pam+12bp_exact_match_count"].to_numpy(dtype=np.float64),
+        sgrna_df["sgrna_possible_unintended_edited_base_count"].to_numpy(dtype=np.float64),
+    ]
+
+def rank_sgrna_within_exon(
+    sgrna_df: pd.DataFrame,
+    ranking_keys: list[np.ndarray],
+    group_key: list[str] = EXON_KEY,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Exon (group_key の組) をソート順に番号付けし、ranking_keys と合わせて1回だけ安定ソートして、Exon 内の順位を求める。
+    Returns:
+        (ソート後の行番号, ソート後の各行の Exon 内での順位 (1始まり))
+    """
+    exon_codes = sgrna_df.groupby(group_key, sort=True, observed=True).ngroup().to_numpy()
+    # np.lexsort は最後のキーを第1キーとしてソートする
+    order = np.lexsort((*reversed(ranking_keys), exon_codes))
+    # ソート後の各行の Exon 内での順位は、その Exon の先頭からの距離 + 1
+    sorted_codes = exon_codes[order]
+    is_group_start = np.concatenate([[True], sorted_codes[1:] != sorted_codes[:-1]])
+    group_start_positions = np.maximum.accumulate(np.where(is_group_start, np.arange(len(order)), 0))
+    priority = np.arange(len(order)) - group_start_positions + 1
+    return order, priority
+
+def select_top_n_sgrna_per_exon(
+    exploded_sgrna_with_offtarget_info: pd.DataFrame,
+    top_n_per_exon: int | None,
+    scoring_terms: list[ScoringTerm] | None = None,
+) -> pd.DataFrame:
+    """
+    Exon と BaseEditor の組ごとに優先順位の高い top_n_per_exon 個の sgRNA だけを選ぶ (None の場合はすべて)。
+    sgrna_priority は従来どおり Exon 内 (すべての BaseEditor を通した) の順位とする。
+
+    テーブル全体をコピーして複数列でソートする代わりに、ランキングの列だけを配列にして np.lexsort で順位を求め、
+    選ばれた行だけを取り出す。scoring_terms を指定しない場合、結果は prioritize_sgrna の出力から
+    Exon と BaseEditor の組ごとに先頭の top_n_per_exon 行を選んだものと同じになる。
+    scoring_terms を指定した場合は、重み付きスコア (sgrna_score 列) の高い順に順位を付ける。
+
+    Parameters:
+        exploded_sgrna_with_offtarget_info: sgRNA データフレーム
+        top_n_per_exon: Exon と BaseEditor の組ごとに残す sgRNA の数
+        scoring_terms: 重み付きスコアの設定
+
+    Returns:
+        優先度を付け、Exon と BaseEditor の組ごとに上位の sgRNA だけを残したデータフレーム
+    """
+    df = exploded_sgrna_with_offtarget_info
+    if scoring_terms:
+        scores = calculate_sgrna_score(df, scoring_terms)
+        ranking_keys = [-scores]
+    else:
+        ranking_keys = lexicographic_ranking_keys(df)
+    order, priority = rank_sgrna_within_exon(df, ranking_keys)
+
+    if top_n_per_exon is not None:
+        # Exon と BaseEditor の組の中での順位を、Exon の順位と同じ並びに戻して比べる
+        editor_order, editor_priority = rank_sgrna_within_exon(df, ranking_keys, EXON_EDITOR_KEY)
+        priority_within_editor = np.empty(len(order), dtype=np.int64)
+        priority_within_editor[editor_order] = editor_priority
+        selected = priority_within_editor[order] <= top_n_per_exon
+    else:
+        selected = np.ones(len(order), dtype=bool)
+    top_sgrna_df = df.take(order[selected]).reset_index(drop=True)
+    if scoring_terms:
+        top_sgrna_df[SCORE_COLUMN] = scores[order[selected]]
+    top_sgrna_df["sgrna_priority"] = priority[selected]
+    return top_sgrna_df
+
+def prioritize_sgrna(
+    exploded_sgrna_with_offtarget_info: pd.DataFrame,
+    top_n_per_exon: int | None = None,
+    scoring_terms: list[ScoringTerm] | None = None,
+) -> pd.DataFrame:
     """
     Exon ごとに sgRNA を優先順位付けする。
     
@@ -12,18 +292,19 @@ def prioritize_sgrna(exploded_sgrna_with_offtarget_info: pd.DataFrame) -> pd.Dat
     
     Parameters:
         exploded_sgrna_with_offtarget_info: sgRNA データフレーム
+        top_n_per_exon: 指定した場合は、Exon と BaseEditor の組ごとに上位 top_n_per_exon 個の sgRNA だけを返す
+        scoring_terms: 指定した場合は、上記の順序の代わりに重み付きスコア (sgrna_score 列) の高い順に順位を付ける
         
     Returns:
         優先度を付けたデータフレーム
     """
+    if top_n_per_exon is not None or scoring_terms:
+        return select_top_n_sgrna_per_exon(exploded_sgrna_with_offtarget_info, top_n_per_exon, scoring_terms)
+
     df = exploded_sgrna_with_offtarget_info.copy()
     
     # GC content が最適範囲（40-60%）かどうか（バイナリ判定）
-    gc_content = df["sgrna_sequence"].apply(
-        lambda seq: (seq.upper().count('G') + seq.upper().count('C')) / len(seq) * 100
-        if len(seq) > 0 else 0
-    )
-    df["gc_valid"] = (gc_content >= 40) & (gc_content <= 60)
+    df["gc_valid"] = calculate_gc_valid(df["sgrna_sequence"])
     
     # Exon ごとにソート
     sorted_sgrna_df = df.sort_values(
@@ -43,7 +324,7 @@ def prioritize_sgrna(exploded_sgrna_with_offtarget_info: pd.DataFrame) -> pd.Dat
     
     sorted_sgrna_df["sgrna_priority"] = (
         sorted_sgrna_df
-        .groupby(["geneName", "exonStarts", "exonEnds"])
+        .groupby(["geneName", "exonStarts", "exonEnds"], observed=True)
         .cumcount() + 1
     )
     
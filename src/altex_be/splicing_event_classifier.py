@@ -2,6 +2,9 @@ from __future__ import (
     annotations,  # python 3.8以下の型ヒントの頭文字は大文字でないといけない
 )
 
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+import numpy as np
 import pandas as pd
 
 
@@ -82,30 +85,116 @@ def classify_splicing_event(
         return "other"
     
 
-def classify_splicing_events_per_gene(refflat: pd.DataFrame) -> pd.DataFrame:
-    result = []
+# classify_splicing_eventが返すexontype。プロセス間では、この順番のコード (int8) の配列として結果を受け渡す
+EXONTYPES = (
+    "constitutive",
+    "alternative",
+    "a5ss-short",
+    "a5ss-long",
+    "a3ss-short",
+    "a3ss-long",
+    "intron_retention",
+    "overlap",
+    "unique-alternative",
+    "other",
+)
+EXONTYPE_CODES = {exontype: code for code, exontype in enumerate(EXONTYPES)}
+# 遺伝子数がこれより少ない場合は、プロセスの起動とデータの受け渡しの方が時間がかかるので並列化しない
+PARALLEL_MIN_GENES = 200
+# 1つのworkerあたりのチャンク数。コストの見積もりがずれても、空いたworkerが残りのチャンクを処理できるように複数に分ける
+CHUNKS_PER_WORKER = 4
+
 
+def classify_gene_exons(all_transcripts: list[list[tuple[int, int]]]) -> np.ndarray:
     """
-    classify_exon_types()は入力が(start, end)のタプルであることを前提としているので、
-    refflatのデータフレームをそのまま入力しても正しく動作しない。
-    refflatの各行に対して、exons列を(start, end)のタプルのリストに変換する。
-    そしてclassify_row_exons()関数を適用して、各行のexons列に対して分類を行う。
-    その結果を新しい列"exontype"に追加する。
-    そのリストをpd.concat()で結合して、最終的なDataFrameを返す。
+    Purpose:
+        1つの遺伝子の全てのトランスクリプトの全てのexonを分類し、exontypeのコードを
+        (トランスクリプト順、exon順に) 平坦化したint8の配列として返す
     """
+    return np.fromiter(
+        (EXONTYPE_CODES[classify_splicing_event(exon, all_transcripts)] for transcript in all_transcripts for exon in transcript),
+        dtype=np.int8,
+    )
 
-    def classify_row_exons(row, gene_group):
-        all_transcripts = gene_group["exons"].tolist()
-        return [classify_splicing_event(exon, all_transcripts) for exon in row["exons"]]
 
-    for gene, group in refflat.groupby("geneName"):
-        group = group.copy()
-        group["exontype"] = group.apply(
-            lambda row: classify_row_exons(row, group), axis=1
-        )
-        result.append(group)
+def classify_gene_chunk(genes: list[list[list[tuple[int, int]]]]) -> np.ndarray:
+    """
+    Purpose:
+        workerプロセスで実行する関数。複数の遺伝子を分類し、結果のコードを遺伝子順につなげた1つの配列で返す
+        (DataFrameを返すよりも、プロセス間で受け渡すデータが小さい)
+    """
+    if not genes:
+        return np.empty(0, dtype=np.int8)
+    return np.concatenate([classify_gene_exons(all_transcripts) for all_transcripts in genes])
 
-    return pd.concat(result, ignore_index=True)
+
+def balance_gene_chunks(gene_costs: np.ndarray, n_chunks: int) -> list[list[int]]:
+    """
+    Purpose:
+        遺伝子をコストの大きい順に、その時点で合計コストが最も小さいチャンクに割り当てる (LPT法)
+        巨大な遺伝子が最後に残って1つのworkerだけが動き続けることを防ぐ
+    Parameters:
+        gene_costs: np.ndarray, 遺伝子ごとのコストの見積もり
+        n_chunks: int, チャンクの数
+    Returns:
+        list[list[int]], 各チャンクに含まれる遺伝子の番号。合計コストの大きいチャンクから順に並べる
+    """
+    heap = [(0, chunk_id) for chunk_id in range(n_chunks)]
+    chunks = [[] for _ in range(n_chunks)]
+    chunk_costs = [0] * n_chunks
+    for gene in np.argsort(-gene_costs, kind="stable"):
+        cost, chunk_id = heapq.heappop(heap)
+        chunks[chunk_id].append(int(gene))
+        chunk_costs[chunk_id] = cost + int(gene_costs[gene])
+        heapq.heappush(heap, (chunk_costs[chunk_id], chunk_id))
+    order = sorted(range(n_chunks), key=lambda chunk_id: -chunk_costs[chunk_id])
+    return [chunks[chunk_id] for chunk_id in order if chunks[chunk_id]]
+
+
+def classify_genes_in_parallel(genes: list[list[list[tuple[int, int]]]], workers: int) -> list[np.ndarray]:
+    """
+    Purpose:
+        遺伝子をプロセスプールで並列に分類し、遺伝子ごとのexontypeのコードの配列を、入力と同じ順で返す
+    """
+    exon_counts = np.array([sum(len(transcript) for transcript in all_transcripts) for all_transcripts in genes], dtype=np.int64)
+    # 各exonを遺伝子の全てのexonと比較するので、コストは遺伝子のexon数の2乗に比例する
+    chunks = balance_gene_chunks(exon_counts ** 2, workers * CHUNKS_PER_WORKER)
+    codes_per_gene = [None] * len(genes)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunk_results = executor.map(classify_gene_chunk, [[genes[gene] for gene in chunk] for chunk in chunks])
+        for chunk, chunk_codes in zip(chunks, chunk_results):
+            offsets = np.cumsum(exon_counts[chunk])[:-1]
+            for gene, gene_codes in zip(chunk, np.split(chunk_codes, offsets)):
+                codes_per_gene[gene] = gene_codes
+    return codes_per_gene
+
+
+def classify_splicing_events_per_gene(refflat: pd.DataFrame, workers: int = 1) -> pd.DataFrame:
+    """
+    Purpose:
+        refflatのexons列 ((start, end)のタプルのリスト) の各exonを、同じ遺伝子の全てのトランスクリプトと比較して分類し、
+        exontype列 (exonごとのexontypeのリスト) を追加する
+        遺伝子ごとの処理は互いに独立しているため、workersが2以上で遺伝子が多い場合はプロセスプールで並列に処理する
+    Parameters:
+        refflat: pd.DataFrame, geneName列とexons列を持つデータフレーム
+        workers: int, 使用するプロセス数
+    Returns:
+        pd.DataFrame, 遺伝子名順に並べ替えたデータフレーム (同じ遺伝子内では元の順番を保つ)
+    """
+    gene_positions = list(refflat.groupby("geneName").indices.values())
+    exons = refflat["exons"].tolist()
+    genes = [[exons[position] for position in positions] for positions in gene_positions]
+
+    if workers > 1 and len(genes) >= PARALLEL_MIN_GENES:
+        codes_per_gene = classify_genes_in_parallel(genes, workers)
+    else:
+        codes_per_gene = [classify_gene_exons(all_transcripts) for all_transcripts in genes]
+
+    classified_refflat = refflat.iloc[np.concatenate(gene_positions) if gene_positions else []].reset_index(drop=True)
+    exontypes = np.array(EXONTYPES, dtype=object)[np.concatenate(codes_per_gene) if codes_per_gene else np.empty(0, dtype=np.int8)]
+    offsets = np.cumsum(classified_refflat["exons"].str.len().to_numpy())[:-1]
+    classified_refflat["exontype"] = [types.tolist() for types in np.split(exontypes, offsets)] if len(classified_refflat) else []
+    return classified_refflat
 
 
 def flip_a3ss_a5ss_on_minus_strand(classified_refflat: pd.DataFrame) -> pd.DataFrame:
@@ -129,10 +218,10 @@ def flip_a3ss_a5ss_on_minus_strand(classified_refflat: pd.DataFrame) -> pd.DataF
 
     return classified_refflat
 
-def classify_splicing_events(refflat: pd.DataFrame) -> pd.DataFrame:
+def classify_splicing_events(refflat: pd.DataFrame, workers: int = 1) -> pd.DataFrame:
     """
     このモジュールのwrap関数
     """
-    classified_refflat = classify_splicing_events_per_gene(refflat)
+    classified_refflat = classify_splicing_events_per_gene(refflat, workers)
     classified_refflat = flip_a3ss_a5ss_on_minus_strand(classified_refflat)
     return classified_refflat
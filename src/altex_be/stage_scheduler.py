@@ -0,0 +1,180 @@
+"""
+パイプラインの中で互いに依存しないステージ (acceptorとdonorの配列の取得、PAMごとのsgRNAの設計、出力の書き出し、
+ゲノムインデックスの読み込みなど) を、スレッドで同時に実行するための小さなスケジューラ。
+
+- ステージは名前、関数、依存するステージ (depends_on) で登録する。依存するステージの結果が、登録した順に関数の引数になる
+- 依存するステージが終わったステージから、max_workers 個までを同時に実行する
+- memory_bytes (ステージが新しく確保するメモリの見積もり) の合計が memory_budget を超える場合は、実行中のステージが終わるまで開始を待つ
+  (実行中のステージがない場合は、見積もりによらず開始する)
+- max_workers が1以下の場合はスレッドを使わず、result() で結果を求められたときに呼び出し元のスレッドで実行する (従来と同じ順序になる)
+
+ステージの間では大きなデータフレームを受け渡すので、プロセスではなくスレッドで実行する。
+重い処理 (bedtoolsのサブプロセス、numbaのnogilカーネル、NumPy、zlib、pyarrowの書き出し) はGILを解放するため、スレッドでも並行に進む。
+スレッドはデーモンスレッドなので、例外でwithブロックを抜けた場合は、実行中のステージの終了を待たない。
+"""
+from __future__ import annotations
+from collections.abc import Callable
+from concurrent.futures import Future
+from dataclasses import dataclass
+import threading
+from typing import Any
+from . import logging_config  # noqa: F401
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    スケジューラに登録したステージを保持するためのdataclass
+    """
+    name: str
+    func: Callable[..., Any]
+    depends_on: tuple[str, ...] = ()
+    memory_bytes: int = 0 # ステージが新しく確保するメモリの見積もり (byte)
+
+
+class StageScheduler:
+    """
+    依存関係のあるステージを、依存するステージが終わった順に同時に実行するスケジューラ
+    with文で使い、ブロックを正常に抜けるときはすべてのステージが終わるのを待つ (ステージの例外はそこでも送出する)。
+    例外で抜けるときは、まだ開始していないステージを取り消し、実行中のステージは待たない
+    """
+
+    def __init__(self, max_workers: int = 1, memory_budget: int | None = None):
+        self.max_workers = max_workers
+        self.memory_budget = memory_budget
+        self.stages: dict[str, Stage] = {}
+        self.futures: dict[str, Future] = {}
+        self.pending: list[str] = [] # 登録したが、まだ開始していないステージ (登録順なので、依存するステージより後に並ぶ)
+        self.running_count = 0
+        self.running_memory = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> StageScheduler:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def close(self) -> None:
+        """
+        Purpose: すべてのステージが終わるのを待つ。失敗したステージがある場合は、その例外を送出する
+        """
+        self.results()
+
+    def abort(self) -> None:
+        """
+        Purpose:
+            まだ開始していないステージを取り消す。実行中のステージは待たない
+            (ステージはデーモンスレッドで実行するので、例外でパイプラインを終了するときに、
+            構築に時間のかかるゲノムインデックスなどの終了を待たずにインタプリタが終了できる)
+        """
+        with self.lock:
+            for name in self.pending:
+                self.futures[name].cancel()
+            self.pending.clear()
+
+    def add(
+        self,
+        name: str,
+        func: Callable[..., Any],
+        depends_on: tuple[str, ...] = (),
+        memory_bytes: int = 0,
+    ) -> None:
+        """
+        Purpose:
+            ステージを登録する。依存するステージが終わっていれば (メモリの見積もりが予算に収まれば) すぐに開始する
+        Parameters:
+            name: str, ステージの名前 (ほかのステージの depends_on と result() で使う)
+            func: Callable[..., Any], ステージの処理。依存するステージの結果を depends_on の順に引数として受け取る
+            depends_on: tuple[str, ...], 先に登録した、依存するステージの名前
+            memory_bytes: int, ステージが新しく確保するメモリの見積もり (byte)
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' is already added.")
+        unknown = [dependency for dependency in depends_on if dependency not in self.stages]
+        if unknown:
+            raise ValueError(f"Stage '{name}' depends on stages that are not added yet: {unknown}")
+        self.stages[name] = Stage(name, func, tuple(depends_on), memory_bytes)
+        if self.max_workers <= 1:
+            return
+        with self.lock:
+            self.futures[name] = Future()
+            self.pending.append(name)
+            self.dispatch()
+
+    def result(self, name: str) -> Any:
+        """
+        Purpose:
+            ステージの結果を返す。終わっていない場合は終わるまで待つ。ステージ (または依存するステージ) の例外はここで送出する
+        """
+        if self.max_workers <= 1 and name not in self.futures:
+            stage = self.stages[name]
+            future = Future()
+            try:
+                future.set_result(stage.func(*[self.result(dependency) for dependency in stage.depends_on]))
+            except BaseException as e:
+                future.set_exception(e)
+            self.futures[name] = future
+        return self.futures[name].result()
+
+    def results(self) -> dict[str, Any]:
+        """
+        Purpose: すべてのステージの結果を、登録した順の 名前 -> 結果 の辞書で返す
+        """
+        return {name: self.result(name) for name in self.stages}
+
+    def dispatch(self) -> None:
+        """
+        Purpose:
+            依存するステージが終わり、メモリの見積もりが予算に収まるステージを登録順に開始する (self.lockを持って呼び出す)
+        """
+        for name in list(self.pending):
+            if name not in self.pending:
+                continue # 開始したステージのコールバックの中で、すでに処理された
+            stage = self.stages[name]
+            dependencies = [self.futures[dependency] for dependency in stage.depends_on]
+            if not all(future.done() for future in dependencies):
+                continue
+            failed = next((future for future in dependencies if future.cancelled() or future.exception() is not None), None)
+            if failed is not None:
+                # 依存するステージが失敗した場合は実行せず、同じ例外で失敗させる (依存するステージより後に並ぶので、連鎖して伝わる)
+                self.pending.remove(name)
+                self.futures[name].set_exception(
+                    RuntimeError(f"A stage that '{name}' depends on was cancelled.") if failed.cancelled() else failed.exception()
+                )
+                continue
+            if self.running_count >= self.max_workers:
+                continue
+            if (
+                self.memory_budget is not None
+                and self.running_count > 0
+                and self.running_memory + stage.memory_bytes > self.memory_budget
+            ):
+                continue
+            self.pending.remove(name)
+            self.running_count += 1
+            self.running_memory += stage.memory_bytes
+            arguments = [future.result() for future in dependencies]
+            threading.Thread(
+                target=self.run_stage, args=(stage, arguments), name=f"altex-stage-{name}", daemon=True
+            ).start()
+
+    def run_stage(self, stage: Stage, arguments: list[Any]) -> None:
+        """
+        Purpose: ステージを実行して結果 (または例外) を記録し、待っていたステージを開始する
+        """
+        try:
+            result, error = stage.func(*arguments), None
+        except BaseException as e:
+            result, error = None, e
+        with self.lock:
+            self.running_count -= 1
+            self.running_memory -= stage.memory_bytes
+            if error is not None:
+                self.futures[stage.name].set_exception(error)
+            else:
+                self.futures[stage.name].set_result(result)
+            self.dispatch()
@@ -290,7 +290,7 @@ with tabs[0]:
 with tabs[1]:
     st.caption(f"Last run output directory: `{st.session_state.last_run_outdir}`")
     if st.session_state.last_run_outdir and Path(st.session_state.last_run_outdir).is_dir():
-        result_files = [f for f in Path(st.session_state.last_run_outdir).iterdir() if f.is_file() and f.suffix in (".csv", ".tsv")]
+        result_files = [f for f in Path(st.session_state.last_run_outdir).iterdir() if f.is_file() and f.suffix in (".csv", ".tsv", ".parquet", ".feather")]
         if result_files:
             selected_file = st.selectbox("Select a result file to preview", [f.name for f in result_files])
             if selected_file:
@@ -298,14 +298,18 @@ with tabs[1]:
                 try:
                     if selected_file.endswith(".tsv"):
                         df = pd.read_csv(file_path, sep="\t", engine="python")
+                    elif selected_file.endswith(".parquet"):
+                        df = pd.read_parquet(file_path)
+                    elif selected_file.endswith(".feather"):
+                        df = pd.read_feather(file_path)
                     else:
                         df = pd.read_csv(file_path, engine="python")
-                except (UnicodeDecodeError, pd.errors.ParserError, OSError) as exc:
+                except (UnicodeDecodeError, pd.errors.ParserError, OSError, ImportError) as exc:
                     st.error(f"Failed to read the file: {exc}")
                 else:
                     st.dataframe(df)
         else:
-            st.info("No result files (CSV/TSV) found in the output directory.")
+            st.info("No result files (CSV/TSV/Parquet/Feather) found in the output directory.")
     else:
         st.info("Run a job to see results here.")
 
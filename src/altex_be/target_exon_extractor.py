@@ -1,46 +1,127 @@
 from __future__ import annotations
+import numpy as np
 import pandas as pd
-import uuid
 import logging
 from . import logging_config # noqa: F401
+from .exon_interval_index import build_exon_interval_index
+from .content_id import EXON_ID_COLUMNS, compute_content_ids
+from .output_formatter import explode_list_columns
 
 # BED形式も0base-start, 1base-endであるため、refFlatのexonStartsとexonEndsをそのまま使用する
 
+# target_exonごとに、編集対象とするexontype
+TARGET_EXONTYPES = {
+    "alternative_exons": ("alternative", "unique-alternative", "a3ss-long", "a5ss-long"),
+    "all": ("alternative", "unique-alternative", "a3ss-long", "a5ss-long", "constitutive"),
+}
+# 転写産物間で重複するエキソンを1つにまとめるためのキー
+EXON_DEDUP_KEY = ["chrom", "geneName", "exonStarts", "exonEnds"]
+
+def join_unique_sorted_values(values: pd.Series, group_codes: np.ndarray) -> np.ndarray:
+    """
+    Purpose:
+        グループごとに、重複を除いてソートした値を ";" で結合する (";".join(sorted(set(x))) と同じ結果)
+        グループごとにPythonの関数を呼ぶ代わりに、(グループ, 値) の組の重複削除とソートを一度に行い、
+        各グループの先頭の値と、";" を付けた残りの値を np.add.reduceat で連結する
+    Parameters:
+        values: pd.Series, 文字列の列
+        group_codes: np.ndarray, 0から始まる連番のグループ番号 (groupby().ngroup()の結果)
+    Returns:
+        np.ndarray, グループ番号の順に並んだ結合後の文字列
+    """
+    pairs = (
+        pd.DataFrame({"code": group_codes, "value": values.to_numpy(dtype=object)})
+        .drop_duplicates()
+        .sort_values(["code", "value"], kind="stable")
+    )
+    codes = pairs["code"].to_numpy()
+    pieces = pairs["value"].to_numpy(dtype=object)
+    if len(pieces) == 0:
+        return pieces
+    is_group_start = np.concatenate([[True], codes[1:] != codes[:-1]])
+    pieces = np.where(is_group_start, pieces, ";" + pieces)
+    return np.add.reduceat(pieces, np.flatnonzero(is_group_start))
+
 def explode_classified_refflat(classified_refflat: pd.DataFrame, target_exon: str = "all") -> pd.DataFrame:
-    classified_refflat = classified_refflat.explode(["exonStarts", "exonEnds", "exontype", "exon_position", "exonlengths", "frame", "cds_info"])
-    classified_refflat = classified_refflat.drop(columns = ["exons"])
+    classified_refflat = explode_list_columns(
+        classified_refflat.drop(columns = ["exons"]),
+        ["exonStarts", "exonEnds", "exontype", "exon_position", "exonlengths", "frame", "cds_info"],
+    )
     classified_refflat[["exonStarts", "exonEnds"]] = classified_refflat[["exonStarts", "exonEnds"]].astype(
         int
     )  # int型に変換
-    # exontypeがalternativeまたはunique-alternativeのエキソンだけを抽出
-    if target_exon == "alternative_exons":
-        classified_refflat = classified_refflat[classified_refflat["exontype"].apply(lambda x: x in ("alternative", "unique-alternative","a3ss-long","a5ss-long"))]
-    elif target_exon == "all":
+    if target_exon == "all":
         # exon数が2以下かつ、すべてのエキソンがconstitutiveである遺伝子は、スプライシング操作をしても意味がないため除外する
-        def filter_genes(group):
-            num_exons = len(group)
-            has_alternative = any(group['exontype'] != 'constitutive')
-            if num_exons <= 2 and not has_alternative:
-                return False
-            return True
-        classified_refflat = classified_refflat.groupby('geneName').filter(filter_genes)
-        classified_refflat = classified_refflat[classified_refflat["exontype"].apply(lambda x: x in ("alternative", "unique-alternative","a3ss-long","a5ss-long","constitutive"))]
-    # 重複を消す前に、重複間で cds_info が異なるものがある場合は、append して結合する
-    classified_refflat = classified_refflat.groupby(["chrom", "geneName","exonStarts", "exonEnds"], as_index=False).agg({
-        "geneName": "first",  # geneNameは同じであると仮定
-        "strand": "first",  # strandも同じであると仮定
-        "exonlengths": "first",  # exonlengthsも同じであると仮定
-        "frame": "first",  # frameも同じであると仮定
-        "coding": "first",  # codingも同じであると仮定
-        "exontype": "first",  # exontypeも同じであると仮定
-        "exon_position": lambda x: ";".join(sorted(set(x))),
-        "cds_info": lambda x: ";".join(sorted(set(x))),  # cds_infoは異なる可能性があるため、重複を削除して結合
-    })
+        gene_names = classified_refflat["geneName"]
+        num_exons = gene_names.groupby(gene_names, sort=False).transform("size")
+        has_alternative = (classified_refflat["exontype"] != "constitutive").groupby(gene_names, sort=False).transform("any")
+        classified_refflat = classified_refflat[(num_exons > 2) | has_alternative]
+    # exontypeがalternativeまたはunique-alternativeのエキソンだけを抽出 (allではconstitutiveも含める)
+    if target_exon in TARGET_EXONTYPES:
+        classified_refflat = classified_refflat[classified_refflat["exontype"].isin(TARGET_EXONTYPES[target_exon])]
 
-    # 重複を削除し一方だけ残す
-    classified_refflat = classified_refflat.drop_duplicates(subset=["chrom", "geneName", "exonStarts", "exonEnds"])
-    classified_refflat['uuid'] = [uuid.uuid4().hex for _ in range(len(classified_refflat))]  # 一意のIDを生成
-    return classified_refflat.reset_index(drop=True)
+    # 転写産物間で重複するエキソンを1行にまとめる
+    # strand, exonlengths, frame, coding, exontypeは重複間で同じであると仮定して最初の値を使う
+    # exon_position, cds_infoは異なる可能性があるため、重複を削除して結合する
+    grouped = classified_refflat.groupby(EXON_DEDUP_KEY, sort=True)
+    group_codes = grouped.ngroup().to_numpy()
+    deduplicated_exons = (
+        grouped[["geneName", "strand", "exonlengths", "frame", "coding", "exontype"]]
+        .first()
+        .reset_index(level="geneName", drop=True)
+        .reset_index()
+    )
+    for col in ["exon_position", "cds_info"]:
+        deduplicated_exons[col] = join_unique_sorted_values(classified_refflat[col], group_codes)
+
+    deduplicated_exons['uuid'] = compute_content_ids(deduplicated_exons, EXON_ID_COLUMNS)  # エキソンの座標から一意のIDを生成
+    return deduplicated_exons
+
+def select_exons_in_regions(exploded_classified_refflat: pd.DataFrame, regions: list[tuple[str, int, int]]) -> pd.DataFrame:
+    """
+    Purpose:
+        1エキソン1行に展開されたデータフレームから、指定された領域と1塩基以上重なるエキソンだけを抽出する
+    Parameters:
+        exploded_classified_refflat: pd.DataFrame, explode_classified_refflatの出力
+        regions: list[tuple[str, int, int]], (chrom, start, end) の0-based半開区間のリスト
+    """
+    hit_rows = build_exon_interval_index(exploded_classified_refflat).query_regions(regions)
+    return exploded_classified_refflat.iloc[hit_rows].reset_index(drop=True)
+
+def get_splice_site_positions(exon_df: pd.DataFrame) -> dict[str, np.ndarray]:
+    """
+    Purpose:
+        strandに応じて、各エキソンのacceptor, donorのゲノム上の位置を返す
+        +鎖ではexonStartがacceptor, exonEndがdonor。-鎖ではその逆になる
+    """
+    is_plus = (exon_df["strand"] == "+").to_numpy()
+    exon_starts = exon_df["exonStarts"].to_numpy()
+    exon_ends = exon_df["exonEnds"].to_numpy()
+    return {
+        "acceptor": np.where(is_plus, exon_starts, exon_ends),
+        "donor": np.where(is_plus, exon_ends, exon_starts),
+    }
+
+def annotate_splice_site_sharing(exploded_classified_refflat: pd.DataFrame) -> pd.DataFrame:
+    """
+    Purpose:
+        アイソフォーム間やa3ss/a5ssのペアでは、異なるエキソンが同じスプライス部位を共有することが多い。
+        スプライス部位を (chrom, position, strand, site type) で同定し、それを共有するターゲットエキソンの数を
+        acceptor_splice_site_shared_exon_count / donor_splice_site_shared_exon_count 列に追加する。
+        同じスプライス部位の配列取得とsgRNA設計は1度だけ行われ、この列で共有関係を出力に残す。
+    """
+    for site_type, positions in get_splice_site_positions(exploded_classified_refflat).items():
+        exploded_classified_refflat[f"{site_type}_splice_site_shared_exon_count"] = (
+            exploded_classified_refflat
+            .groupby([
+                exploded_classified_refflat["chrom"],
+                exploded_classified_refflat["strand"],
+                pd.Series(positions, index=exploded_classified_refflat.index),
+            ])["chrom"]
+            .transform("size")
+            .astype(int)
+        )
+    return exploded_classified_refflat
 
 def format_classified_refflat_to_bed(exploded_classified_refflat: pd.DataFrame) -> pd.DataFrame:
     """
@@ -70,26 +151,27 @@ def format_classified_refflat_to_bed(exploded_classified_refflat: pd.DataFrame)
     classified_refflat = exploded_classified_refflat[["chrom", "exonStarts", "exonEnds", "name", "score", "strand", "exontype", "exon_position"]]
     return classified_refflat.reset_index(drop=True)
 
+def build_splice_site_regions(target_exon_df: pd.DataFrame, splice_site_positions: np.ndarray, window: int) -> pd.DataFrame:
+    """
+    Purpose :
+        スプライス部位の位置を中心とした、前後window塩基の座位を示すBED形式のDataFrameを作成する
+    """
+    return pd.DataFrame({
+        "chrom": target_exon_df["chrom"].to_numpy(),
+        "chromStart": splice_site_positions - window,
+        "chromEnd": splice_site_positions + window,
+        "name": target_exon_df["name"].to_numpy(),
+        "score": target_exon_df["score"].to_numpy(),
+        "strand": target_exon_df["strand"].to_numpy(),
+    })
+
 def extract_splice_acceptor_regions(target_exon_df: pd.DataFrame, window: int) -> pd.DataFrame:
     """
     Purpose :
         抜き出したexonのexonStart/Endから、SA部位周辺の、windowで指定した幅の座位を示すDataFrameを作成する
         strandが+の時はexonStartがSplice Acceptor, -の時はその逆でexonEndがSAになる
     """
-    splice_acceptor_single_exon_df = target_exon_df.copy()
-    splice_acceptor_single_exon_df["chromStart"] = splice_acceptor_single_exon_df.apply(
-        lambda row: row["exonStarts"] - window
-        if row["strand"] == "+"
-        else row["exonEnds"] - window,
-        axis=1,
-    )
-    splice_acceptor_single_exon_df["chromEnd"] = splice_acceptor_single_exon_df.apply(
-        lambda row: row["exonStarts"] + window
-        if row["strand"] == "+"
-        else row["exonEnds"] + window,
-        axis=1,
-    )
-    return splice_acceptor_single_exon_df[["chrom","chromStart","chromEnd","name","score","strand"]].reset_index(drop=True)
+    return build_splice_site_regions(target_exon_df, get_splice_site_positions(target_exon_df)["acceptor"], window)
 
 
 def extract_splice_donor_regions(target_exon_df: pd.DataFrame, window: int) -> pd.DataFrame:
@@ -98,29 +180,23 @@ def extract_splice_donor_regions(target_exon_df: pd.DataFrame, window: int) -> p
         抜き出したexonのexonStart/Endから、SD部位周辺の、windowで指定した幅の座位を示すDataFrameを作成する
         strandが+の時はexonEndがSplice Donor, -の時はその逆でexonStartがSDになる
     """
-    splice_donor_single_exon_df = target_exon_df.copy()
-    splice_donor_single_exon_df["chromStart"] = splice_donor_single_exon_df.apply(
-        lambda row: row["exonEnds"] - window
-        if row["strand"] == "+"
-        else row["exonStarts"] - window,
-        axis=1,
-    )
-    splice_donor_single_exon_df["chromEnd"] = splice_donor_single_exon_df.apply(
-        lambda row: row["exonEnds"] + window
-        if row["strand"] == "+"
-        else row["exonStarts"] + window,
-        axis=1,
-    )
-    return splice_donor_single_exon_df[["chrom","chromStart","chromEnd","name","score","strand"]].reset_index(drop=True)
+    return build_splice_site_regions(target_exon_df, get_splice_site_positions(target_exon_df)["donor"], window)
 
-def wrap_extract_target_exon(classified_refflat: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+def wrap_extract_target_exon(
+    classified_refflat: pd.DataFrame,
+    regions: list[tuple[str, int, int]] | None = None,
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """
     Purpose:
     このモジュールの操作をまとめて実行するためのラッパー関数
+    regionsが指定された場合は、その領域と重なるエキソンだけを対象とする
     """
     exploded_classified_refflat = explode_classified_refflat(classified_refflat, target_exon="all")
+    if regions:
+        exploded_classified_refflat = select_exons_in_regions(exploded_classified_refflat, regions)
+    exploded_classified_refflat = annotate_splice_site_sharing(exploded_classified_refflat)
     target_exon_df = format_classified_refflat_to_bed(exploded_classified_refflat)
-    if target_exon_df is None:
+    if target_exon_df is None or target_exon_df.empty:
         logging.warning("there are no exons in your interested genes which have at least one targetable splicing event")
         return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
     splice_acceptor_single_exon_df = extract_splice_acceptor_regions(target_exon_df, 25)
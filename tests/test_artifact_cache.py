@@ -0,0 +1,70 @@
+from concurrent.futures import ProcessPoolExecutor
+import time
+
+import pytest
+
+from altex_be.artifact_cache import ArtifactCache, atomic_output_path
+
+
+def slow_build(cache_root, log_path):
+    # 同時に呼ばれても、作成 (ログへの追記) は1回だけ行われる
+    def build(build_dir):
+        with open(log_path, "a") as log:
+            log.write("built\n")
+        time.sleep(0.5)
+        (build_dir / "artifact.txt").write_text("done")
+
+    artifact_dir = ArtifactCache(cache_root).get_or_build("artifact", "key", build)
+    return (artifact_dir / "artifact.txt").read_text()
+
+
+def test_get_or_build_waits_for_concurrent_build(tmp_path):
+    log_path = tmp_path / "builds.log"
+    with ProcessPoolExecutor(max_workers=3) as executor:
+        results = list(executor.map(slow_build, [tmp_path / "cache"] * 3, [log_path] * 3))
+    assert results == ["done"] * 3
+    assert log_path.read_text() == "built\n"
+    # 一時ディレクトリは残らない
+    assert sorted(path.name for path in (tmp_path / "cache" / "artifact").iterdir() if not path.name.endswith(".lock")) == ["key"]
+
+
+def test_get_or_build_discards_failed_build(tmp_path):
+    cache = ArtifactCache(tmp_path / "cache")
+
+    def failing_build(build_dir):
+        (build_dir / "partial.txt").write_text("partial")
+        raise ValueError("build failed")
+
+    with pytest.raises(ValueError, match="build failed"):
+        cache.get_or_build("artifact", "key", failing_build)
+    assert [path.name for path in (tmp_path / "cache" / "artifact").iterdir()] == ["key.lock"]
+
+    artifact_dir = cache.get_or_build("artifact", "key", lambda build_dir: (build_dir / "artifact.txt").write_text("done"))
+    assert (artifact_dir / "artifact.txt").read_text() == "done"
+
+
+def test_artifact_key_follows_file_content(tmp_path):
+    cache = ArtifactCache(tmp_path / "cache")
+    (tmp_path / "a.gtf").write_text("same content")
+    (tmp_path / "b.gtf").write_text("same content")
+    key = cache.artifact_key([tmp_path / "a.gtf"], format_version=1)
+    # 名前や場所が違っても内容が同じなら同じキー、内容や設定が違えば別のキーになる
+    assert cache.artifact_key([tmp_path / "b.gtf"], format_version=1) == key
+    assert cache.artifact_key([tmp_path / "a.gtf"], format_version=2) != key
+    (tmp_path / "b.gtf").write_text("other content")
+    assert cache.artifact_key([tmp_path / "b.gtf"], format_version=1) != key
+
+
+def test_atomic_output_path(tmp_path):
+    output_path = tmp_path / "table.txt"
+    output_path.write_text("old")
+    with pytest.raises(RuntimeError):
+        with atomic_output_path(output_path) as temp_path:
+            temp_path.write_text("half written")
+            raise RuntimeError
+    assert output_path.read_text() == "old"
+    assert [path.name for path in tmp_path.iterdir()] == ["table.txt"]
+
+    with atomic_output_path(output_path) as temp_path:
+        temp_path.write_text("new")
+    assert output_path.read_text() == "new"
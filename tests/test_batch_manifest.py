@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+from altex_be.batch_manifest import (
+    BatchEntry,
+    collect_batch_base_editors,
+    collect_batch_genes,
+    load_batch_manifest,
+    select_entry_sgrnas,
+)
+from altex_be.class_def.base_editors import PRESET_BASE_EDITORS
+from altex_be.gene_identifier_index import build_gene_identifier_index
+
+
+def test_load_batch_manifest(tmp_path):
+    (tmp_path / "genes.txt").write_text("EGFR\n\nKRAS\n")
+    manifest_path = tmp_path / "manifest.tsv"
+    manifest_path.write_text(
+        "output_prefix\tgenes\tgene_file\tbase_editors\n"
+        "projectA\tTP53;NM_005228\t\ttarget_aid_ngg\n"
+        "projectB\t\tgenes.txt\t\n"
+    )
+    entries = load_batch_manifest(manifest_path, PRESET_BASE_EDITORS)
+
+    assert entries[0] == BatchEntry("projectA", ("TP53", "NM_005228"), ("target_aid_ngg",))
+    assert entries[1].genes == ("EGFR", "KRAS")
+    # base_editorsが空の場合は、利用可能なすべてのbase editorを使う
+    assert entries[1].base_editor_names == tuple(PRESET_BASE_EDITORS)
+    assert collect_batch_genes(entries) == ["TP53", "NM_005228", "EGFR", "KRAS"]
+    assert list(collect_batch_base_editors(entries[:1], PRESET_BASE_EDITORS)) == ["target_aid_ngg"]
+
+
+@pytest.mark.parametrize("content, message", [
+    ("output_prefix,genes\nprojectA,\n", "No genes"),
+    ("output_prefix,genes,base_editors\nprojectA,TP53,unknown_be\n", "Unknown base editors"),
+    ("output_prefix,genes\nprojectA,TP53\nprojectA,EGFR\n", "unique"),
+    ("output_prefix,genes\n../projectA,TP53\n", "Invalid output_prefix"),
+    ("prefix,genes\nprojectA,TP53\n", "columns are invalid"),
+])
+def test_load_batch_manifest_invalid(tmp_path, content, message):
+    manifest_path = tmp_path / "manifest.csv"
+    manifest_path.write_text(content)
+    with pytest.raises(ValueError, match=message):
+        load_batch_manifest(manifest_path, PRESET_BASE_EDITORS)
+
+
+def test_select_entry_sgrnas():
+    gene_index = build_gene_identifier_index(pd.DataFrame({
+        "geneName": ["TP53", "EGFR"],
+        "name": ["NM_000546", "NM_005228"],
+    }))
+    sgrna_df = pd.DataFrame({
+        "geneName": ["TP53", "TP53", "EGFR", "EGFR"],
+        "base_editor_name": ["target_aid_ngg", "be4max_ngg", "target_aid_ngg", "be4max_ngg"],
+        "sgrna_sequence": ["A", "B", "C", "D"],
+    })
+    entry = BatchEntry("projectA", ("NM_000546", "EGFR"), ("be4max_ngg",))
+
+    selected = select_entry_sgrnas(sgrna_df, entry, gene_index)
+    assert selected["sgrna_sequence"].tolist() == ["B", "D"]
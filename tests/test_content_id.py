@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+from altex_be.content_id import (
+    EXON_ID_COLUMNS,
+    compute_content_ids,
+)
+
+
+def make_exon_df() -> pd.DataFrame:
+    return pd.DataFrame({
+        "chrom": ["chr1", "chr1", "chr2"],
+        "geneName": ["gene1", "gene1", "gene2"],
+        "exonStarts": [100, 300, 100],
+        "exonEnds": [150, 350, 150],
+        "strand": ["+", "+", "-"],
+    })
+
+
+def test_compute_content_ids_is_deterministic_and_unique():
+    ids = compute_content_ids(make_exon_df(), EXON_ID_COLUMNS)
+
+    assert ids.dtype == np.uint64
+    assert len(set(ids.tolist())) == 3
+    np.testing.assert_array_equal(ids, compute_content_ids(make_exon_df(), EXON_ID_COLUMNS))
+
+
+def test_compute_content_ids_does_not_depend_on_row_order_or_dtype():
+    exon_df = make_exon_df()
+    ids = compute_content_ids(exon_df, EXON_ID_COLUMNS)
+
+    reordered = exon_df.iloc[::-1].astype({"exonStarts": object, "chrom": "category"})
+    np.testing.assert_array_equal(compute_content_ids(reordered, EXON_ID_COLUMNS), ids[::-1])
+
+
+def test_compute_content_ids_depends_on_assembly():
+    exon_df = make_exon_df()
+    hg38_ids = compute_content_ids(exon_df, EXON_ID_COLUMNS, "hg38")
+    mm39_ids = compute_content_ids(exon_df, EXON_ID_COLUMNS, "mm39")
+
+    assert not set(hg38_ids.tolist()) & set(mm39_ids.tolist())
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from altex_be.dtype_compactor import compact_dtypes, to_int32_if_possible
+from altex_be.output_writer import is_arrow_available
+
+
+def test_compact_dtypes_keeps_values():
+    input_data = pd.DataFrame(
+        {
+            "chrom": ["chr1", "chr2", "chr1"],
+            "geneName": ["gene2", "gene1", "gene2"],
+            "sgrna_start_in_genome": pd.Series([100, 200, 300], dtype=object),
+            "sgrna_sequence": ["ACGT", "TTTT", "GGGG"],
+            "exonStarts_list": [[1], [2], [3]],
+        }
+    )
+    expected_csv = input_data.to_csv()
+
+    output_data = compact_dtypes(input_data.copy())
+
+    assert isinstance(output_data["chrom"].dtype, pd.CategoricalDtype)
+    assert output_data["sgrna_start_in_genome"].dtype == np.int32
+    if is_arrow_available():
+        assert output_data["sgrna_sequence"].dtype == "string[pyarrow]"
+    # 対象外の列 (リストの列) はそのまま
+    assert output_data["exonStarts_list"].dtype == object
+    # 書き出す値と、ソートの順序は変わらない
+    assert output_data.to_csv() == expected_csv
+    assert output_data.sort_values("geneName").index.tolist() == input_data.sort_values("geneName").index.tolist()
+
+
+def test_to_int32_if_possible_keeps_out_of_range_and_missing_values():
+    large_values = pd.Series([0, 3_000_000_000])
+    missing_values = pd.Series([1, None], dtype=object)
+
+    assert to_int32_if_possible(large_values).dtype == np.int64
+    assert to_int32_if_possible(missing_values).dtype == object
@@ -0,0 +1,83 @@
+import pandas as pd
+import pytest
+
+from altex_be.exon_interval_index import (
+    build_genome_annotation_index,
+    build_exon_interval_index,
+    explode_exons,
+    parse_region_string,
+    parse_regions_bed,
+)
+
+
+@pytest.fixture
+def exon_df():
+    return pd.DataFrame({
+        "geneName": ["gene1", "gene1", "gene2", "gene3", "gene4"],
+        "chrom": ["chr1", "chr1", "chr1", "chr1", "chr2"],
+        "exonStarts": [100, 1000, 500, 150, 100],
+        "exonEnds": [200, 1100, 600, 5000, 200],
+    })
+
+
+def test_query_returns_overlapping_rows(exon_df):
+    index = build_exon_interval_index(exon_df)
+    # 半開区間なので、endが一致するだけの区間は重ならない
+    assert sorted(index.query("chr1", 200, 500).tolist()) == [3]
+    assert sorted(index.query("chr1", 199, 501).tolist()) == [0, 2, 3]
+    # startが離れていても、長いエキソン (gene3) は検出される
+    assert sorted(index.query("chr1", 4000, 4001).tolist()) == [3]
+    assert index.query("chr3", 0, 1000).tolist() == []
+
+
+def test_query_regions_is_unique_and_sorted(exon_df):
+    index = build_exon_interval_index(exon_df)
+    result = index.query_regions([("chr1", 1050, 1060), ("chr2", 0, 150), ("chr1", 1000, 1001)])
+    assert result.tolist() == [1, 3, 4]
+
+
+def test_explode_exons():
+    refflat = pd.DataFrame({
+        "geneName": ["gene1", "gene2"],
+        "chrom": ["chr1", "chr2"],
+        "exonStarts": [[100, 300], [50]],
+        "exonEnds": [[200, 400], [80]],
+    })
+    output = explode_exons(refflat)
+    assert output["exonStarts"].tolist() == [100, 300, 50]
+    assert output["transcript_row"].tolist() == [0, 0, 1]
+
+
+def test_parse_region_string():
+    assert parse_region_string("chr7:55,000,000-56,000,000") == ("chr7", 54999999, 56000000)
+    with pytest.raises(ValueError):
+        parse_region_string("chr7:56000000")
+    with pytest.raises(ValueError):
+        parse_region_string("chr7:200-100")
+
+
+def test_parse_regions_bed(tmp_path):
+    bed = tmp_path / "regions.bed"
+    bed.write_text("track name=test\nchr1\t100\t200\tlocus1\nchr2\t0\t50\n")
+    assert parse_regions_bed(bed) == [("chr1", 100, 200), ("chr2", 0, 50)]
+
+
+def test_genome_annotation_index_annotate():
+    refflat = pd.DataFrame({
+        "geneName": ["GENE1", "GENE1", "GENE2"],
+        "chrom": ["chr1", "chr1", "chr1"],
+        "txStart": [100, 100, 5000],
+        "txEnd": [1000, 3000, 6000],
+        "cdsStart": [150, 150, 5000],
+        "cdsEnd": [900, 900, 5000], # GENE2はnon-coding
+        "exonStarts": ["100,800,", "100,2000,", "5000,5500,"],
+        "exonEnds": ["200,1000,", "200,3000,", "5100,6000,"],
+    })
+    index = build_genome_annotation_index(refflat)
+    region_types, gene_names = index.annotate(
+        ["chr1", "chr1", "chr1", "chr1", "chr1", "chr2"],
+        [160, 950, 500, 4000, 5050, 160],
+        [170, 960, 510, 4010, 5060, 170],
+    )
+    assert region_types.tolist() == ["cds", "exon", "intron", "intergenic", "exon", "intergenic"]
+    assert gene_names.tolist() == ["GENE1", "GENE1", "GENE1", None, "GENE2", None]
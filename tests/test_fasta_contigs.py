@@ -0,0 +1,96 @@
+import pytest
+
+from altex_be.artifact_cache import ArtifactCache
+from altex_be.fasta_contigs import (
+    ContigPolicy,
+    build_fasta_index,
+    count_selected_records,
+    iter_fasta_records,
+    load_contig_policy,
+    prepare_cached_fasta_index,
+    read_fasta_index,
+)
+
+RECORDS = {
+    "chr1": "ACGTACGTAC" * 3 + "ACG",
+    "chr1_KI270706v1_random": "GGGGGCCCCC" * 2,
+    "chrUn_GL000195v1": "TTTTA",
+    "chrX": "acgtnACGTN" * 2 + "A",
+}
+
+
+def write_fasta_with_index(fasta_path, line_bases=10):
+    # samtools faidx と同じ形式のインデックスを作る
+    fai_lines = []
+    with open(fasta_path, "wb") as f:
+        for name, sequence in RECORDS.items():
+            f.write(f">{name} description\n".encode())
+            offset = f.tell()
+            for i in range(0, len(sequence), line_bases):
+                f.write(sequence[i:i + line_bases].encode() + b"\n")
+            fai_lines.append(f"{name}\t{len(sequence)}\t{offset}\t{line_bases}\t{line_bases + 1}\n")
+    with open(f"{fasta_path}.fai", "w") as f:
+        f.writelines(fai_lines)
+
+
+@pytest.mark.parametrize("with_index", [True, False])
+def test_iter_fasta_records_with_contig_policy(tmp_path, with_index):
+    fasta_path = tmp_path / "genome.fa"
+    write_fasta_with_index(fasta_path)
+    if not with_index:
+        (tmp_path / "genome.fa.fai").unlink()
+
+    all_records = dict(iter_fasta_records(fasta_path))
+    assert all_records == {name: sequence.encode() for name, sequence in RECORDS.items()}
+
+    primary = ContigPolicy(mode="primary")
+    assert [name for name, _ in iter_fasta_records(fasta_path, primary)] == ["chr1", "chrX"]
+    assert dict(iter_fasta_records(fasta_path, primary))["chrX"] == RECORDS["chrX"].encode()
+    assert count_selected_records(fasta_path, primary) == 2
+
+    (tmp_path / "contigs.txt").write_text("# contigs to scan\nchrUn_GL000195v1\nchr1\n")
+    from_file = load_contig_policy(str(tmp_path / "contigs.txt"))
+    assert from_file.label == "file:contigs.txt"
+    assert dict(iter_fasta_records(fasta_path, from_file)) == {
+        "chr1": RECORDS["chr1"].encode(),
+        "chrUn_GL000195v1": RECORDS["chrUn_GL000195v1"].encode(),
+    }
+
+
+def test_load_contig_policy_invalid(tmp_path):
+    with pytest.raises(ValueError, match="--contigs must be"):
+        load_contig_policy(str(tmp_path / "missing.txt"))
+    (tmp_path / "empty.txt").write_text("\n")
+    with pytest.raises(ValueError, match="No contig names"):
+        load_contig_policy(str(tmp_path / "empty.txt"))
+
+
+@pytest.mark.parametrize("line_bases", [10, 7])
+def test_build_fasta_index_matches_samtools_format(tmp_path, line_bases):
+    fasta_path = tmp_path / "genome.fa"
+    write_fasta_with_index(fasta_path, line_bases)
+    build_fasta_index(fasta_path, tmp_path / "built.fai")
+    # samtools faidx と同じく、1行より短いレコードの1行あたりの塩基数はそのレコードの長さになる
+    built = [line.split("\t") for line in (tmp_path / "built.fai").read_text().splitlines()]
+    expected = [line.split("\t") for line in (tmp_path / "genome.fa.fai").read_text().splitlines()]
+    assert [row[:3] for row in built] == [row[:3] for row in expected]
+    assert built[2][3:] == ["5", "6"]
+
+    (tmp_path / "uneven.fa").write_text(">chr1\nACGT\nAC\nACGT\n")
+    with pytest.raises(ValueError, match="different lengths"):
+        build_fasta_index(tmp_path / "uneven.fa", tmp_path / "uneven.fa.fai")
+
+
+def test_prepare_cached_fasta_index(tmp_path, monkeypatch):
+    monkeypatch.setattr("altex_be.fasta_contigs.FASTA_INDEX_PATHS", {})
+    fasta_path = tmp_path / "genome.fa"
+    write_fasta_with_index(fasta_path)
+    (tmp_path / "genome.fa.fai").unlink()
+    assert read_fasta_index(fasta_path) is None
+
+    # FASTAの隣に.faiがない場合は、キャッシュに作ったインデックスを使う
+    fai_path = prepare_cached_fasta_index(ArtifactCache(tmp_path / "cache"), fasta_path)
+    assert fai_path.parent.parent == tmp_path / "cache" / "fasta_index"
+    assert [entry.name for entry in read_fasta_index(fasta_path)] == list(RECORDS)
+    every_contig = ContigPolicy(mode="file", contig_names=frozenset(RECORDS), source="contigs.txt")
+    assert dict(iter_fasta_records(fasta_path, every_contig)) == {name: sequence.encode() for name, sequence in RECORDS.items()}
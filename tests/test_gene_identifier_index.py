@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+from altex_be.gene_identifier_index import (
+    build_gene_identifier_index,
+    load_gene_aliases,
+    strip_version,
+)
+
+
+@pytest.fixture
+def refflat():
+    return pd.DataFrame({
+        "geneName": ["TP53", "TP53", "EGFR", "Gm1234"],
+        "name": ["NM_000546", "NM_001126112", "NM_005228", "ENSMUST00000193812.2"],
+    })
+
+
+def test_strip_version():
+    assert strip_version("ENST00000269305.9") == "ENST00000269305"
+    assert strip_version("NM_000546") == "NM_000546"
+    assert strip_version("GENE.A") == "GENE.A"
+
+
+def test_resolve_identifiers(refflat):
+    index = build_gene_identifier_index(refflat, aliases={"ERBB1": "EGFR", "UNKNOWN_ALIAS": "NOT_IN_REFFLAT"})
+    assert index.resolve("TP53") == "TP53"
+    assert index.resolve("NM_001126112") == "TP53"
+    # バージョンの有無にかかわらず検索できる
+    assert index.resolve("NM_005228.5") == "EGFR"
+    assert index.resolve("ENSMUST00000193812") == "Gm1234"
+    assert index.resolve("ENSMUST00000193812.2") == "Gm1234"
+    assert index.resolve("ERBB1") == "EGFR"
+    assert index.resolve("UNKNOWN_ALIAS") is None
+    assert index.resolve("BRCA1") is None
+
+
+def test_rows_returns_all_transcripts_of_gene(refflat):
+    index = build_gene_identifier_index(refflat)
+    assert index.rows(["NM_000546"]).tolist() == [0, 1]
+    assert index.rows(["EGFR", "TP53", "BRCA1"]).tolist() == [0, 1, 2]
+    assert index.rows(["BRCA1"]).tolist() == []
+
+
+def test_load_gene_aliases(tmp_path):
+    alias_file = tmp_path / "aliases.tsv"
+    alias_file.write_text("# alias\tsymbol\nERBB1\tEGFR\nP53\tTP53\n")
+    assert load_gene_aliases(alias_file) == {"ERBB1": "EGFR", "P53": "TP53"}
@@ -0,0 +1,106 @@
+from pathlib import Path
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from altex_be.artifact_cache import ArtifactCache
+from altex_be.fasta_contigs import ContigPolicy
+from altex_be.genome_index import build_suffix_array_numpy, prepare_cached_genome_index, prepare_genome_index
+from altex_be.offtarget_scorer import (
+    OfftargetSiteRecorder,
+    add_reversed_complement_sgrna_column,
+    calculate_offtarget_site_count_ahocorasick,
+)
+
+
+def test_build_suffix_array_numpy():
+    rng = np.random.default_rng(0)
+    for length in [1, 2, 30, 200]:
+        # 繰り返しの多い配列でも、素朴に並べ替えた結果と一致する
+        text = rng.integers(0, 3, length).astype(np.uint8)
+        expected = sorted(range(length), key=lambda i: text[i:].tolist())
+        assert build_suffix_array_numpy(text).tolist() == expected
+    # 先頭 PACKED_PREFIX_LENGTH 文字では順位が決まらない周期的な配列は、prefix doublingを何度も繰り返す
+    for text in [np.zeros(300, dtype=np.uint8), np.tile(np.array([0, 1, 1], dtype=np.uint8), 100)]:
+        expected = sorted(range(text.size), key=lambda i: text[i:].tolist())
+        assert build_suffix_array_numpy(text).tolist() == expected
+
+
+@pytest.mark.parametrize("soft_masked", [False, True])
+def test_genome_index_matches_genome_scan(tmp_path, soft_masked):
+    fasta_path = Path("tests/data/test2.fa")
+    if soft_masked:
+        # 一部の塩基を小文字にしても、数は変わらず、サイトの site_in_repeat だけが変わる
+        masked_path = tmp_path / "soft_masked.fa"
+        masked_path.write_text("".join(
+            line if line.startswith(">") else line[:10] + line[10:30].lower() + line[30:]
+            for line in fasta_path.read_text().splitlines(keepends=True)
+        ))
+        fasta_path = masked_path
+    input_df = pd.DataFrame({
+        "uuid": ["id_A", "id_D", "id_E"],
+        "chrom": ["chr1_test", "chr2_test", "chr2_test"],
+        "sgrna_strand": ["-", "+", "+"],
+        "sgrna_start_in_genome": [9, 0, 20],
+        "sgrna_end_in_genome": [29, 20, 40],
+        "sgrna_target_sequence": [
+            "GGG+GATTACAGATTACAGATTAC",
+            "GTAATCTGTAATCTGTAATC+CCC",
+            "GCTAGCTAGCTAGCTATTTT+TGG",
+        ],
+    })
+    genome_index = prepare_genome_index(tmp_path / "index", fasta_path)
+
+    outputs, recorders = [], []
+    for index in [None, genome_index]:
+        site_recorder = OfftargetSiteRecorder(max_sites_per_sgrna=5)
+        outputs.append(calculate_offtarget_site_count_ahocorasick(
+            add_reversed_complement_sgrna_column(input_df.copy()),
+            fasta_path,
+            site_recorder=site_recorder,
+            genome_index=index,
+            extra_seed_lengths=(8, 16),
+        ))
+        recorders.append(site_recorder)
+    pd.testing.assert_frame_equal(outputs[0], outputs[1])
+    pd.testing.assert_frame_equal(recorders[0].site_df, recorders[1].site_df)
+    assert outputs[1]["pam+8bp_exact_match_count"].tolist() == [3, 3, 1]
+    assert outputs[1]["pam+16bp_exact_match_count"].tolist() == [2, 2, 1]
+    assert recorders[1].site_df["site_in_repeat"].any() == soft_masked
+
+    # 保存したインデックスは読み込んで使い、別の --contigs では使わない
+    assert prepare_genome_index(tmp_path / "index", fasta_path).contig_names == ["chr1_test", "chr2_test"]
+    with pytest.raises(ValueError, match="does not match"):
+        prepare_genome_index(tmp_path / "index", fasta_path, ContigPolicy(mode="primary"))
+
+
+def test_prepare_genome_index_checks_fasta_contents(tmp_path):
+    fasta_path = tmp_path / "genome.fa"
+    fasta_path.write_bytes(Path("tests/data/test2.fa").read_bytes())
+    prepare_genome_index(tmp_path / "index", fasta_path)
+
+    # 更新時刻だけが変わったFASTA (内容は同じ) では、保存したインデックスを使う
+    os.utime(fasta_path, ns=(0, 0))
+    assert prepare_genome_index(tmp_path / "index", fasta_path).contig_names == ["chr1_test", "chr2_test"]
+    # 名前とサイズが同じでも、内容が変わったFASTAでは使わない
+    sequence = fasta_path.read_text()
+    fasta_path.write_text(sequence.replace("GATTACA", "GATTTCA", 1))
+    assert fasta_path.stat().st_size == len(sequence)
+    with pytest.raises(ValueError, match="fasta_digest"):
+        prepare_genome_index(tmp_path / "index", fasta_path)
+
+
+def test_prepare_cached_genome_index(tmp_path):
+    cache = ArtifactCache(tmp_path / "cache")
+    copied_path = tmp_path / "copied.fa"
+    copied_path.write_bytes(Path("tests/data/test2.fa").read_bytes())
+    genome_index = prepare_cached_genome_index(cache, Path("tests/data/test2.fa"))
+    assert genome_index.contig_names == ["chr1_test", "chr2_test"]
+
+    # 内容が同じFASTAは同じインデックスを使い、別の --contigs では別のインデックスを作る
+    prepare_cached_genome_index(cache, copied_path)
+    assert len(list((tmp_path / "cache" / "genome_index").glob("*/index.json"))) == 1
+    prepare_cached_genome_index(cache, copied_path, ContigPolicy(mode="file", contig_names=frozenset(["chr2_test"]), source="contigs.txt"))
+    assert len(list((tmp_path / "cache" / "genome_index").glob("*/index.json"))) == 2
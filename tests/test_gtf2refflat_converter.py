@@ -1,8 +1,15 @@
 import pandas as pd
+import pytest
 from pathlib import Path
+from altex_be import gtf2refflat_converter
+from altex_be.artifact_cache import ArtifactCache
 from altex_be.gtf2refflat_converter import (
     gtf_to_refflat,
+    prepare_cached_refflat,
+    read_annotation_as_refflat,
 )
+from altex_be.refflat_loader import REFFLAT_COLUMNS, load_refflat
+from altex_be.refflat_preprocessor import parse_exon_coordinates
 
 def test_gtf_to_refflat():
     assembly_name = "mm39"
@@ -14,4 +21,72 @@ def test_gtf_to_refflat():
     assert refflat_df.shape[1] == 11  # geneName列が追加されていることを確認
     assert refflat_df.iloc[0,0].startswith("Gm")  # geneName列に正しい遺伝子記号が追加されていることを確認
     (output_path / f"converted_refflat_{assembly_name}.txt").unlink()  # クリーンアップ
-    return
\ No newline at end of file
+    (output_path / f".converted_refflat_{assembly_name}.lock").unlink()
+    return
+
+@pytest.mark.parametrize("use_pyarrow", [True, False])
+def test_read_annotation_as_refflat_matches_converted_file(tmp_path, monkeypatch, use_pyarrow):
+    if use_pyarrow:
+        pytest.importorskip("pyarrow")
+    else:
+        monkeypatch.setattr(gtf2refflat_converter, "pa", None)
+    gtf_path = Path("tests/data/test.gtf")
+    refflat_df = read_annotation_as_refflat(gtf_path)
+    assert refflat_df.columns.tolist() == REFFLAT_COLUMNS
+    # exonStarts/exonEndsは整数のリストで、前処理はそのまま受け付ける
+    assert isinstance(refflat_df["exonStarts"].iloc[0], list)
+    parsed_df = parse_exon_coordinates(refflat_df.copy())
+    assert parsed_df["exons"].iloc[0] == list(zip(refflat_df["exonStarts"].iloc[0], refflat_df["exonEnds"].iloc[0]))
+
+    # 保存したrefFlatを読み込んだ場合と同じ値になる
+    gtf_to_refflat(gtf_path, tmp_path, assembly_name="mm39")
+    converted_df = load_refflat(tmp_path / "converted_refflat_mm39.txt")
+    converted_df = parse_exon_coordinates(converted_df).drop(columns=["exons"])
+    pd.testing.assert_frame_equal(refflat_df, converted_df)
+
+
+def test_read_annotation_as_refflat_from_gff3(tmp_path):
+    gff3_path = tmp_path / "annotation.gff3"
+    gff3_path.write_text(
+        "##gff-version 3\n"
+        # Ensembl形式: 遺伝子名は遺伝子の行のNameから、エキソンの順序はstartで並べ替える
+        "1\tensembl\tgene\t100\t900\t.\t+\t.\tID=gene:ENSG01;Name=GENE1\n"
+        "1\tensembl\tmRNA\t100\t900\t.\t+\t.\tID=transcript:ENST01;Parent=gene:ENSG01\n"
+        "1\tensembl\texon\t500\t900\t.\t+\t.\tParent=transcript:ENST01\n"
+        "1\tensembl\texon\t100\t200\t.\t+\t.\tParent=transcript:ENST01\n"
+        "1\tensembl\tCDS\t150\t200\t.\t+\t0\tParent=transcript:ENST01\n"
+        "1\tensembl\tCDS\t500\t600\t.\t+\t1\tParent=transcript:ENST01\n"
+        "###\n"
+        # RefSeq形式: transcript_idとgeneの属性を使う
+        "chr2\tRefSeq\tgene\t10\t90\t.\t-\t.\tID=gene-GENE2;Name=GENE2;gene=GENE2\n"
+        "chr2\tRefSeq\tlnc_RNA\t10\t90\t.\t-\t.\tID=rna-NR_01.1;Parent=gene-GENE2;gene=GENE2;transcript_id=NR_01.1\n"
+        "chr2\tRefSeq\texon\t10\t30\t.\t-\t.\tParent=rna-NR_01.1;gene=GENE2;transcript_id=NR_01.1\n"
+        "chr2\tRefSeq\texon\t60\t90\t.\t-\t.\tParent=rna-NR_01.1;gene=GENE2;transcript_id=NR_01.1\n"
+        "##FASTA\n"
+        ">1\n"
+        "ACGT\n"
+    )
+    refflat_df = read_annotation_as_refflat(gff3_path)
+    assert refflat_df[["geneName", "name", "chrom", "strand"]].values.tolist() == [
+        ["GENE1", "ENST01", "chr1", "+"],
+        ["GENE2", "NR_01.1", "chr2", "-"],
+    ]
+    assert refflat_df[["txStart", "txEnd", "cdsStart", "cdsEnd", "exonCount"]].values.tolist() == [
+        [99, 900, 149, 600, 2],
+        [9, 90, 9, 90, 2],
+    ]
+    assert refflat_df["exonStarts"].tolist() == [[99, 499], [9, 59]]
+    assert refflat_df["exonEnds"].tolist() == [[200, 900], [30, 90]]
+
+
+def test_prepare_cached_refflat(tmp_path):
+    cache = ArtifactCache(tmp_path / "cache")
+    refflat_path = prepare_cached_refflat(cache, Path("tests/data/test.gtf"))
+    assert refflat_path.parent.parent == tmp_path / "cache" / "converted_refflat"
+    pd.testing.assert_frame_equal(
+        parse_exon_coordinates(load_refflat(refflat_path)).drop(columns=["exons"]),
+        read_annotation_as_refflat(Path("tests/data/test.gtf")),
+    )
+    # 2回目は変換せずに、キャッシュのファイルを返す
+    refflat_path.write_text("cached")
+    assert prepare_cached_refflat(cache, Path("tests/data/test.gtf")).read_text() == "cached"
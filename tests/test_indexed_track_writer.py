@@ -0,0 +1,116 @@
+import gzip
+import struct
+import zlib
+
+import pandas as pd
+import pytest
+
+from altex_be.indexed_track_writer import (
+    BIGBED_MAGIC,
+    calculate_tabix_bin,
+    read_chrom_sizes,
+    write_bigbed,
+    write_tabix_bed,
+)
+
+AUTOSQL = """table test
+"test"
+    (
+    string chrom; "chrom"
+    uint chromStart; "start"
+    uint chromEnd; "end"
+    string name; "name"
+    uint count; "extra field"
+    )
+"""
+
+
+@pytest.fixture
+def bed_df():
+    # 染色体名、位置の順に並んでいない入力
+    return pd.DataFrame(
+        {
+            "chrom": ["chr2", "chr1", "chr10", "chr1"],
+            "chromStart": [50, 300, 10, 100],
+            "chromEnd": [70, 320, 30, 120],
+            "name": ["c", "b", "d", "a"],
+            "count": [3, 2, 4, 1],
+        }
+    )
+
+
+def test_calculate_tabix_bin():
+    assert calculate_tabix_bin(0, 1) == 4681
+    assert calculate_tabix_bin(0, 2 ** 14 + 1) == 585
+    assert calculate_tabix_bin(0, 2 ** 29) == 0
+
+
+def test_write_tabix_bed_is_sorted_bgzf(tmp_path, bed_df):
+    output_path = write_tabix_bed(bed_df, tmp_path / "track.bed.gz")
+
+    # BGZFはgzipとして読める
+    with gzip.open(output_path, "rt") as f:
+        lines = [line.split("\t")[:3] for line in f.read().splitlines()]
+    assert lines == [["chr1", "100", "120"], ["chr1", "300", "320"], ["chr10", "10", "30"], ["chr2", "50", "70"]]
+    with gzip.open(f"{output_path}.tbi", "rb") as f:
+        assert f.read(4) == b"TBI\x01"
+
+
+def test_write_tabix_bed_can_be_queried(tmp_path, bed_df):
+    pysam = pytest.importorskip("pysam")
+    output_path = write_tabix_bed(bed_df, tmp_path / "track.bed.gz")
+
+    with pysam.TabixFile(str(output_path)) as tabix_file:
+        names = [line.split("\t")[3] for line in tabix_file.fetch("chr1", 110, 310)]
+    assert names == ["a", "b"]
+
+
+def test_write_bigbed(tmp_path, bed_df):
+    chrom_sizes = {"chr1": 1000, "chr2": 1000, "chr10": 1000}
+    output_path = write_bigbed(bed_df, chrom_sizes, tmp_path / "track.bb", AUTOSQL, defined_field_count=4)
+
+    data = output_path.read_bytes()
+    magic, version, zoom_levels, chrom_tree_offset, data_offset, index_offset, field_count, defined_field_count, autosql_offset = struct.unpack_from("<IHHQQQHHQ", data)
+    assert magic == BIGBED_MAGIC
+    assert struct.unpack_from("<I", data, len(data) - 4)[0] == BIGBED_MAGIC
+    assert (field_count, defined_field_count) == (5, 4)
+    assert data[autosql_offset:autosql_offset + len(AUTOSQL)].decode() == AUTOSQL
+    assert struct.unpack_from("<Q", data, data_offset)[0] == 4
+
+    # 染色体ごとに1ブロック。chromIdは染色体名のバイト順 (chr1, chr10, chr2)
+    records = []
+    offset = data_offset + 8
+    decompressor = zlib.decompressobj()
+    while offset < index_offset:
+        decompressor = zlib.decompressobj()
+        block = decompressor.decompress(data[offset:index_offset])
+        offset = index_offset - len(decompressor.unused_data)
+        while block:
+            chrom_id, start, end = struct.unpack_from("<III", block)
+            rest, _, block = block[12:].partition(b"\x00")
+            records.append((chrom_id, start, end, rest.decode()))
+    assert records == [(0, 100, 120, "a\t1"), (0, 300, 320, "b\t2"), (1, 10, 30, "d\t4"), (2, 50, 70, "c\t3")]
+
+
+def test_write_bigbed_can_be_queried(tmp_path, bed_df):
+    pyBigWig = pytest.importorskip("pyBigWig")
+    chrom_sizes = {"chr1": 1000, "chr2": 1000, "chr10": 1000}
+    output_path = write_bigbed(bed_df, chrom_sizes, tmp_path / "track.bb", AUTOSQL, defined_field_count=4)
+
+    bigbed = pyBigWig.open(str(output_path))
+    assert bigbed.chroms() == chrom_sizes
+    assert bigbed.entries("chr1", 110, 310) == [(100, 120, "a\t1"), (300, 320, "b\t2")]
+
+
+def test_write_bigbed_rejects_unknown_chromosomes(tmp_path, bed_df):
+    with pytest.raises(ValueError):
+        write_bigbed(bed_df, {"chr1": 1000}, tmp_path / "track.bb", AUTOSQL)
+
+
+def test_read_chrom_sizes(tmp_path):
+    fasta_path = tmp_path / "genome.fa"
+    fasta_path.write_text(">chr1 description\nACGT\nAC\n>chr2\nAAA\n")
+    assert read_chrom_sizes(fasta_path) == {"chr1": 6, "chr2": 3}
+
+    (tmp_path / "genome.fa.fai").write_text("chr1\t100\t6\t4\t5\n")
+    assert read_chrom_sizes(fasta_path) == {"chr1": 100}
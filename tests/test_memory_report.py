@@ -0,0 +1,29 @@
+import pandas as pd
+
+from altex_be.memory_report import MemoryReport, measure_frame_memory
+
+
+def test_measure_frame_memory_sums_frames_and_dicts():
+    df = pd.DataFrame({"a": ["x" * 10] * 100})
+    single = measure_frame_memory(df)
+
+    assert single > 0
+    assert measure_frame_memory(df, {"abe": df, "cbe": df}) == single * 3
+
+
+def test_memory_report_writes_only_when_enabled(tmp_path):
+    df = pd.DataFrame({"a": range(10)})
+
+    disabled_report = MemoryReport(enabled=False)
+    disabled_report.record("stage", df)
+    disabled_report.write(tmp_path / "disabled.tsv")
+    assert disabled_report.records == []
+    assert not (tmp_path / "disabled.tsv").exists()
+
+    report = MemoryReport(enabled=True)
+    report.record("stage1", df)
+    report.record("stage2", df, df)
+    report.write(tmp_path / "report.tsv")
+    written = pd.read_csv(tmp_path / "report.tsv", sep="\t")
+    assert written["stage"].tolist() == ["stage1", "stage2"]
+    assert written["frame_memory_mib"].notna().all()
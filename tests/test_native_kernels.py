@@ -0,0 +1,122 @@
+import pandas as pd
+import pytest
+from pathlib import Path
+from altex_be import native_kernels
+from altex_be.sgrna_designer import (
+    convert_dna_to_reversed_complement,
+    convert_pam_as_regex,
+    design_grna_columns_for_base_editors,
+)
+from altex_be.offtarget_scorer import (
+    add_reversed_complement_sgrna_column,
+    calculate_offtarget_site_count_ahocorasick,
+    convert_dna_to_reversed_complement_dna,
+    count_exact_matches_ahocorasick,
+)
+from altex_be.class_def.base_editors import PRESET_BASE_EDITORS, BaseEditor
+from altex_be.native_kernels import OfftargetQuery
+
+
+def test_reverse_complement():
+    assert native_kernels.reverse_complement("ATGCatgcN") == "NgcatGCAT"
+    assert native_kernels.reverse_complement("GGG+GATTAC") == "GTAATC+CCC"
+    assert native_kernels.reverse_complement_iupac("NGG") == "CCN"
+    assert native_kernels.reverse_complement_iupac("TTTV") == "BAAA"
+
+
+def test_reverse_complement_matches_python_engine():
+    # IUPACの縮退塩基 (大文字と小文字) は両方のエンジンで補塩基にする
+    input_df = pd.DataFrame({"sgrna_target_sequence": ["GGG+GATTACRYKMBDHVSWN", "gattacrykmbdhvswn+ngg"]})
+    outputs = [
+        add_reversed_complement_sgrna_column(input_df.copy(), engine=engine)["reversed_sgrna_target_sequence"].tolist()
+        for engine in ["python", "native"]
+    ]
+    assert outputs[0] == outputs[1] == ["NWSBDHVKMRYGTAATC+CCC", "ccn+nwsbdhvkmrygtaatc"]
+    assert convert_dna_to_reversed_complement("ACGTRYn") == native_kernels.reverse_complement("ACGTRYn")
+    # 塩基でない文字は、どちらのエンジンでもKeyErrorになる
+    for convert in [convert_dna_to_reversed_complement_dna, convert_dna_to_reversed_complement, native_kernels.reverse_complement]:
+        with pytest.raises(KeyError):
+            convert("GATTAC-X")
+
+
+def test_find_pattern_positions_matches_regex():
+    sequences = ["AGGTCCGGNaggTGG", "NGGNGGNNNNNNNNN", "cccccccccccAGGG"]
+    rows, positions = native_kernels.find_pattern_positions(native_kernels.encode_sequences(sequences), "NGG")
+    expected = [
+        (row, match.start(1))
+        for row, sequence in enumerate(sequences)
+        for match in convert_pam_as_regex("NGG").finditer(sequence)
+    ]
+    assert list(zip(rows.tolist(), positions.tolist())) == expected
+
+
+def test_native_engine_designs_the_same_sgrnas_as_python_engine():
+    acceptor = "CCTCCCTCTCCCCACCCTCTCCCAGGAGAGGATGTCCCTGGTGAGAATC"
+    donor = "TGCCCCTCCAGCCCGGCCTCCAGGTAAGTAGCATTGGGGGAGGTTCAGAC"
+    target_exon_df = pd.DataFrame({
+        "exontype": ["alternative", "a5ss-long", "a3ss-long", "alternative"],
+        "exon_position": ["internal", "internal", "first;internal", "last"],
+        "acceptor_exon_intron_boundary_±25bp_sequence": [acceptor, acceptor, acceptor.lower(), acceptor],
+        "donor_exon_intron_boundary_±25bp_sequence": [donor, donor, donor, donor.replace("GT", "AA")],
+    })
+    base_editors = dict(PRESET_BASE_EDITORS)
+    base_editors["test_sauri"] = BaseEditor("test_sauri", "NNGRRT", 3, 12, "cbe")
+
+    python_result = design_grna_columns_for_base_editors(target_exon_df, base_editors)
+    native_result = design_grna_columns_for_base_editors(target_exon_df, base_editors, engine="native")
+
+    assert list(native_result) == list(python_result)
+    for name in base_editors:
+        for column in ["grna_acceptor", "grna_donor"]:
+            assert native_result[name][column].tolist() == python_result[name][column].tolist()
+
+
+def test_native_engine_searches_pam_once_per_group(monkeypatch):
+    calls = []
+    enumerate_pam_hits = native_kernels.enumerate_pam_hits
+    monkeypatch.setattr(native_kernels, "enumerate_pam_hits", lambda *args: calls.append(args[1:]) or enumerate_pam_hits(*args))
+    target_exon_df = pd.DataFrame({
+        "exontype": ["alternative"],
+        "exon_position": ["internal"],
+        "acceptor_exon_intron_boundary_±25bp_sequence": ["CCTCCCTCTCCCCACCCTCTCCCAGGAGAGGATGTCCCTGGTGAGAATC"],
+        "donor_exon_intron_boundary_±25bp_sequence": ["TGCCCCTCCAGCCCGGCCTCCAGGTAAGTAGCATTGGGGGAGGTTCAGAC"],
+    })
+    design_grna_columns_for_base_editors(target_exon_df, PRESET_BASE_EDITORS, engine="native")
+    # 6つのプリセットは4つのPAMのグループにまとめられ、グループごとにacceptorとdonorで1度ずつ検索する
+    assert len(calls) == 4 * 2
+
+
+def test_count_pam_constrained_matches_in_fasta_matches_ahocorasick():
+    pytest.importorskip("numba")
+    fasta_path = Path("tests/data/test2.fa")
+    queries = {
+        OfftargetQuery("GATTACAGATTACAGATTAC", "GGG", "left"),
+        OfftargetQuery("GATTACAGATTACAGATTAC", "NNN", "left"),
+        OfftargetQuery("GATTACAGATTA", "NRG", "left"),
+        OfftargetQuery("GTAATCTGTAATCTGTAATC", "CCN", "right"),
+        OfftargetQuery("AAAAAAAAAAAAAAAAAAAA", "NGG", "right"),
+        OfftargetQuery("GATTAC"),
+        OfftargetQuery("ACA", "T", "right"),
+    }
+
+    expected = count_exact_matches_ahocorasick(fasta_path, queries)
+    counts = native_kernels.count_pam_constrained_matches_in_fasta(fasta_path, queries)
+
+    assert counts == expected
+
+
+def test_calculate_offtarget_site_count_with_native_engine():
+    fasta_path = Path("tests/data/test2.fa")
+    input_df = pd.DataFrame({
+        "sgrna_target_sequence": [
+            "GGG+GATTACAGATTACAGATTAC",
+            "AAA+AAAAAAAAAAAAAAAAAAAA",
+            "ggg+gattacagattacagattac",
+            "GTAATCTGTAATCTGTAATC+CCC",
+        ]
+    })
+    input_df = add_reversed_complement_sgrna_column(input_df, engine="native")
+    output_df = calculate_offtarget_site_count_ahocorasick(input_df, fasta_path, engine="native")
+
+    assert output_df["pam+20bp_exact_match_count"].tolist() == [2, 0, 2, 2]
+    assert output_df["pam+12bp_exact_match_count"].tolist() == [3, 0, 3, 3]
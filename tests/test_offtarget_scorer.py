@@ -1,10 +1,15 @@
 import pandas as pd
 from pathlib import Path
+from altex_be import offtarget_scorer
 from altex_be.offtarget_scorer import (
+    OfftargetSiteRecorder,
     add_crisprdirect_url_to_df,
+    add_sgrna_in_repeat_column,
+    build_offtarget_site_table,
     calculate_offtarget_site_count_ahocorasick,
     add_reversed_complement_sgrna_column
 )
+from altex_be.native_kernels import OfftargetQuery
 
 def test_add_crisprdirect_url_to_df():
     # 1. Arrange: テストデータの準備
@@ -70,4 +75,122 @@ def test_calculate_offtarget_site_count():
     print(output_df)
 
     # Assert: 結果を検証
-    pd.testing.assert_frame_equal(output_df, expected_df)
\ No newline at end of file
+    pd.testing.assert_frame_equal(output_df, expected_df)
+
+def test_record_offtarget_sites():
+    fasta_path = Path("tests/data/test2.fa")
+    input_df = pd.DataFrame({
+        "uuid": ["id_A", "id_D"],
+        "chrom": ["chr1_test", "chr2_test"],
+        "sgrna_strand": ["-", "+"],
+        "sgrna_start_in_genome": [9, 0],
+        "sgrna_end_in_genome": [29, 20],
+        "sgrna_target_sequence": [
+            "GGG+GATTACAGATTACAGATTAC",      # chr1_testの5-28と31-54に一致する
+            "GTAATCTGTAATCTGTAATC+CCC"       # 上の配列の逆相補配列 (同じサイトに一致する)
+        ],
+    })
+    input_df = add_reversed_complement_sgrna_column(input_df)
+
+    site_recorder = OfftargetSiteRecorder(max_sites_per_sgrna=5)
+    calculate_offtarget_site_count_ahocorasick(input_df, fasta_path, site_recorder=site_recorder)
+    expected_df = pd.DataFrame({
+        "uuid": ["id_A", "id_A", "id_D", "id_D"],
+        "site_chrom": ["chr1_test"] * 4,
+        "site_start": [5, 31, 5, 31],
+        "site_end": [28, 54, 28, 54],
+        # PAMが5'側にある (CCN) sgRNAは - strandのprotospacerになる
+        "site_strand": ["-"] * 4,
+        "site_in_repeat": [False] * 4,
+        "is_on_target": [True, False, False, False],
+    })
+    pd.testing.assert_frame_equal(site_recorder.site_df, expected_df)
+
+    capped_recorder = OfftargetSiteRecorder(max_sites_per_sgrna=1)
+    calculate_offtarget_site_count_ahocorasick(input_df, fasta_path, site_recorder=capped_recorder)
+    assert capped_recorder.site_df["site_start"].tolist() == [5, 5]
+
+
+def test_build_offtarget_site_table_keeps_on_target_and_both_strands_under_cap():
+    full_query = OfftargetQuery("GATTACAGATTACAGATTAC", "NGG", "right")
+    reversed_full_query = full_query.reverse_complement()
+    input_df = pd.DataFrame({
+        "uuid": ["id_A"],
+        "chrom": ["chr2"],
+        "sgrna_start_in_genome": [100],
+        "sgrna_end_in_genome": [120],
+        "full_query": [full_query],
+        "reversed_full_query": [reversed_full_query],
+    })
+    site_recorder = OfftargetSiteRecorder(max_sites_per_sgrna=3, queries={full_query, reversed_full_query})
+    for chrom, start in [("chr1", 0), ("chr1", 10), ("chr2", 100)]:
+        site_recorder.add(full_query, chrom, start)
+    for chrom, start in [("chr3", 5), ("chr3", 15)]:
+        site_recorder.add(reversed_full_query, chrom, start)
+    # 位置の順に上限で切ると chr1 の + strandのサイトだけが残るが、on-targetと - strandのサイトも残す
+    site_df = build_offtarget_site_table(input_df, site_recorder)
+    assert list(zip(site_df["site_chrom"], site_df["site_start"], site_df["site_strand"])) == [
+        ("chr1", 0, "+"), ("chr2", 100, "+"), ("chr3", 5, "-")
+    ]
+    assert site_df["is_on_target"].tolist() == [False, True, False]
+
+
+def test_calculate_offtarget_site_count_with_degenerate_pam(tmp_path):
+    fasta_path = tmp_path / "degenerate_pam.fa"
+    spacer = "GATTACAGATTACAGATTAC"
+    # NGGに一致するAGG, TGGと、一致しないTGAの3か所に同じspacerを置く
+    fasta_path.write_text(f">chr1\nCCCC{spacer}AGGCCCC{spacer}TGGCCCC{spacer}TGACCCC\n")
+    input_df = pd.DataFrame({
+        "strand": ["+"],
+        "uuid": ["id_A"],
+        "sgrna_target_sequence": [f"{spacer}+AGG"],
+        "base_editor_pam_sequence": ["NGG"],
+    })
+    input_df = add_reversed_complement_sgrna_column(input_df)
+    output_df = calculate_offtarget_site_count_ahocorasick(input_df, fasta_path)
+
+    assert output_df["pam+20bp_exact_match_count"].tolist() == [2]
+    assert output_df["pam+12bp_exact_match_count"].tolist() == [2]
+
+
+def test_calculate_offtarget_site_count_with_count_cap(monkeypatch):
+    # ブロックの境界をまたぐ一致も数え、上限に達した条件は走査から外す
+    monkeypatch.setattr(offtarget_scorer, "SCAN_BLOCK_LENGTH", 16)
+    input_df = pd.DataFrame({
+        "strand": ["+", "+"],
+        "uuid": ["id_A", "id_B"],
+        "sgrna_target_sequence": [
+            "GGG+GATTACAGATTACAGATTAC",      # 20-merは2回、12-merは3回出現
+            "AAA+AAAAAAAAAAAAAAAAAAAA",      # 0回出現
+        ],
+    })
+    input_df = add_reversed_complement_sgrna_column(input_df)
+    output_df = calculate_offtarget_site_count_ahocorasick(input_df, Path("tests/data/test2.fa"), count_cap=2)
+
+    assert output_df["pam+20bp_exact_match_count"].tolist() == [2, 0]
+    assert output_df["pam+12bp_exact_match_count"].tolist() == [2, 0]
+    assert output_df["offtarget_count_saturated"].tolist() == [True, False]
+
+
+def test_calculate_offtarget_site_count_with_soft_masked_fasta(tmp_path):
+    fasta_path = tmp_path / "soft_masked.fa"
+    spacer = "GATTACAGATTACAGATTAC"
+    # 大文字のサイト、全体がソフトマスクされたサイト、一部がソフトマスクされたサイトの3か所
+    fasta_path.write_text(f">chr1\nCCCC{spacer}AGGcccc{spacer.lower()}tggCCCC{spacer[:10]}{spacer[10:].lower()}AGGCCCC\n")
+    input_df = pd.DataFrame({
+        "uuid": ["id_A", "id_B"],
+        "chrom": ["chr1", "chr1"],
+        "sgrna_strand": ["+", "+"],
+        "sgrna_start_in_genome": [4, 31],
+        "sgrna_end_in_genome": [24, 51],
+        "sgrna_target_sequence": [f"{spacer}+AGG", f"{spacer.lower()}+tgg"],
+        "base_editor_pam_sequence": ["NGG", "NGG"],
+    })
+    input_df = add_reversed_complement_sgrna_column(input_df)
+    site_recorder = OfftargetSiteRecorder(max_sites_per_sgrna=5)
+    output_df = calculate_offtarget_site_count_ahocorasick(input_df, fasta_path, site_recorder=site_recorder)
+
+    # 大文字小文字を区別せずに数える
+    assert output_df["pam+20bp_exact_match_count"].tolist() == [3, 3]
+    assert site_recorder.site_df.loc[site_recorder.site_df["uuid"] == "id_A", "site_in_repeat"].tolist() == [False, True, True]
+    assert add_sgrna_in_repeat_column(output_df)["sgrna_in_repeat"].tolist() == [False, True]
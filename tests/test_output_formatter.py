@@ -3,6 +3,7 @@ from altex_be.output_formatter import (
     convert_empty_list_into_na,
     prepare_melted_df,
     explode_sgrna_df,
+    add_sgrna_strand_to_df,
     add_base_editor_info_to_df
 )
 from altex_be.sgrna_designer import BaseEditor
@@ -60,6 +61,29 @@ def test_prepare_melted_df():
         expected_df
     )
 
+def test_prepare_melted_df_drops_sites_without_sgrna():
+    input_df = pd.DataFrame({
+        "geneName": ["gene1", "gene2"],
+        "chrom": ["chr1", "chr1"],
+        "exonStarts": [100, 200],
+        "exonEnds": [150, 250],
+        "strand": ["+", "-"],
+        "exonlengths": [50, 50],
+        "exontype": ["alternative", "unique-alternative"],
+        "coding": ["coding", "coding"],
+        "frame" : ["out-frame", "in-frame"],
+        "exon_position": ["first", "last"],
+        "uuid" : ["uuid1", "uuid2"],
+        "cds_info": ["utr_exon", "cds_exon"],
+        "acceptor_sgrna_target_sequence": [[], ["CCC+CGTA"]],
+        "donor_sgrna_target_sequence": [["CCC+GCTA"], pd.NA]
+    })
+    output_df = prepare_melted_df(input_df)
+
+    assert output_df["uuid"].tolist() == ["uuid2", "uuid1"]
+    assert output_df["site_type"].tolist() == ["acceptor", "donor"]
+    assert output_df["sgrna_target_sequence"].tolist() == [["CCC+CGTA"], ["CCC+GCTA"]]
+
 def test_explode_sgrna_df():
     input_df1 = pd.DataFrame({
         "geneName": ["gene1"],
@@ -124,6 +148,13 @@ def test_explode_sgrna_df():
         expected_df.sort_values(by=list(expected_df.columns)).reset_index(drop=True)
     )
 
+def test_add_sgrna_strand_to_df():
+    input_df = pd.DataFrame({
+        "sgrna_target_sequence": ["CCN+ATCGATCGATCGATCGATCG", "ATCGATCGATCGATCGATCG+NGG", "TTTV+ATCGATCGATCGATCGATCG"]
+    })
+    output_df = add_sgrna_strand_to_df(input_df)
+    assert output_df["sgrna_strand"].tolist() == ["-", "+", "-"]
+
 def test_add_base_editor_info_to_df():
     input_df = pd.DataFrame({
         "chrom": ["chr1", "chr1", "chr1", "chr1"],
@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+from altex_be.output_writer import (
+    convert_to_typed_columns,
+    write_sgrna_table,
+)
+
+
+def make_sgrna_df() -> pd.DataFrame:
+    return pd.DataFrame({
+        "geneName": ["GENE1", "GENE1", "GENE2", "GENE2"],
+        "chrom": ["chr1", "chr1", "chr2", "chr2"],
+        "base_editor_name": ["BE4max", "ABE8e", "BE4max", "BE4max"],
+        "sgrna_start_in_genome": pd.Series([100, 200, 300, 400], dtype=object),
+        "sgrna_sequence": ["AAAA", "CCCC", "GGGG", "TTTT"],
+        "sgrna_priority": [1, 1, 1, 2],
+    })
+
+
+def test_convert_to_typed_columns():
+    typed_df = convert_to_typed_columns(make_sgrna_df())
+
+    assert typed_df["sgrna_start_in_genome"].dtype == "Int64"
+    assert isinstance(typed_df["chrom"].dtype, pd.CategoricalDtype)
+    assert isinstance(typed_df["base_editor_name"].dtype, pd.CategoricalDtype)
+    assert typed_df["sgrna_sequence"].dtype == "string"
+    assert typed_df["sgrna_priority"].dtype == "int64"
+
+
+def test_write_sgrna_table_tsv(tmp_path):
+    output_path = write_sgrna_table(make_sgrna_df(), tmp_path, "track", output_format="tsv")
+
+    assert output_path == tmp_path / "track_table.tsv"
+    pd.testing.assert_frame_equal(
+        pd.read_csv(output_path, sep="\t"),
+        make_sgrna_df().astype({"sgrna_start_in_genome": "int64"}),
+    )
+
+
+def test_write_sgrna_table_partitioned_tsv(tmp_path):
+    output_path = write_sgrna_table(make_sgrna_df(), tmp_path, "track", output_format="tsv", partition_by=["chrom", "base_editor_name"])
+
+    written = sorted(p.relative_to(output_path).as_posix() for p in output_path.rglob("*.tsv"))
+    assert written == [
+        "chrom=chr1/base_editor_name=ABE8e/part-0.tsv",
+        "chrom=chr1/base_editor_name=BE4max/part-0.tsv",
+        "chrom=chr2/base_editor_name=BE4max/part-0.tsv",
+    ]
+    partition_df = pd.read_csv(output_path / "chrom=chr2" / "base_editor_name=BE4max" / "part-0.tsv", sep="\t")
+    assert partition_df["sgrna_sequence"].tolist() == ["GGGG", "TTTT"]
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "feather"])
+def test_write_sgrna_table_arrow_formats(tmp_path, output_format):
+    pytest.importorskip("pyarrow")
+    output_path = write_sgrna_table(make_sgrna_df(), tmp_path, "track", output_format=output_format)
+    reader = pd.read_parquet if output_format == "parquet" else pd.read_feather
+
+    loaded = reader(output_path, columns=["chrom", "sgrna_start_in_genome"])
+
+    assert isinstance(loaded["chrom"].dtype, pd.CategoricalDtype)
+    assert loaded["sgrna_start_in_genome"].tolist() == [100, 200, 300, 400]
+
+
+def test_write_sgrna_table_partitioned_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    output_path = write_sgrna_table(make_sgrna_df(), tmp_path, "track", output_format="parquet", partition_by=["chrom"])
+
+    loaded = pd.read_parquet(output_path, filters=[("chrom", "==", "chr1")])
+
+    assert loaded["sgrna_sequence"].tolist() == ["AAAA", "CCCC"]
+    assert loaded["chrom"].astype(str).tolist() == ["chr1", "chr1"]
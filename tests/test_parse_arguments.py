@@ -8,6 +8,7 @@ from altex_be.manage_arguments.parse_arguments import (
     parse_base_editors_from_args,
     parse_base_editors_from_file,
     parse_base_editors_from_all_sources,
+    parse_regions_from_args,
 )
 from altex_be.sgrna_designer import BaseEditor
 
@@ -115,6 +116,30 @@ def test_parse_genes_from_args_run_all_genes():
     assert isinstance(result, list)
     assert result == ["all_genes"]
 
+def test_parse_genes_from_args_regions_only():
+    args = argparse.Namespace(
+        gene_symbols=None,
+        refseq_ids=None,
+        ensembl_ids=None,
+        gene_file=None,
+        run_all_genes=False,
+        regions=["chr7:55000000-56000000"],
+        regions_bed=None,
+    )
+    parser = argparse.ArgumentParser()
+    assert parse_genes_from_args(args, parser) == ["all_genes"]
+
+def test_parse_regions_from_args(tmp_path):
+    bed = tmp_path / "regions.bed"
+    bed.write_text("chr1\t100\t200\n")
+    args = argparse.Namespace(regions=["chr7:1,001-2,000"], regions_bed=str(bed))
+    parser = argparse.ArgumentParser()
+    assert parse_regions_from_args(args, parser) == [("chr7", 1000, 2000), ("chr1", 100, 200)]
+
+    args = argparse.Namespace(regions=["chr7-1000"], regions_bed=None)
+    with pytest.raises(SystemExit):
+        parse_regions_from_args(args, parser)
+
 def test_parse_base_editors_from_files(tmp_path):
     # ダミーのbase editorファイル作成
     be_file = tmp_path / "editors.csv"
@@ -0,0 +1,56 @@
+import pytest
+
+from altex_be import refflat_loader
+from altex_be.refflat_loader import load_refflat
+
+REFFLAT_ROWS = [
+    "GENE_A\tNM_0001\tchr1\t+\t100\t500\t150\t450\t2\t100,300,\t200,500,",
+    "GENE_A\tNM_0002\tchr1\t+\t100\t500\t150\t450\t3\t100,250,300,\t200,280,500,",
+    "GENE_B\tNM_0003\tchr1\t-\t1000\t2000\t1100\t1900\t2\t1000,1500,\t1200,2000,",
+    "GENE_C\tNM_0005\tchr2\t+\t10\t90\t20\t80\t2\t10,60,\t30,90,",
+    "GENE_C\tNM_0005\tchrX\t+\t10\t90\t20\t80\t2\t10,60,\t30,90,", # nameが重複するトランスクリプトは両方除外する
+    "GENE_C\tNM_0007\tchr2\t+\t10\t200\t20\t180\t2\t10,150,\t30,200,",
+    "GENE_D\tENST0006.2\tchr2\t-\t5000\t6000\t5100\t5900\t2\t5000,5800,\t5200,6000,",
+]
+
+
+def write_refflat(tmp_path):
+    path = tmp_path / "refFlat.txt"
+    path.write_text("\n".join(REFFLAT_ROWS) + "\n")
+    return path
+
+
+@pytest.fixture(params=["pyarrow", "pandas"])
+def refflat_path(request, tmp_path, monkeypatch):
+    if request.param == "pandas":
+        monkeypatch.setattr(refflat_loader, "pa", None)
+    return write_refflat(tmp_path)
+
+
+def test_load_refflat_all_genes(refflat_path):
+    refflat = load_refflat(refflat_path)
+    assert refflat.columns.tolist() == refflat_loader.REFFLAT_COLUMNS
+    assert refflat["name"].tolist() == ["NM_0001", "NM_0002", "NM_0003", "NM_0007", "ENST0006.2"]
+    assert refflat["txStart"].dtype == "int64"
+    assert refflat["exonStarts"].tolist()[0] == "100,300,"
+    assert load_refflat(refflat_path, ["all_genes"]).equals(refflat)
+
+
+def test_load_refflat_with_interest_genes(tmp_path):
+    pytest.importorskip("pyarrow")
+    refflat_path = write_refflat(tmp_path)
+    # トランスクリプトIDやエイリアスで指定しても、その遺伝子のすべてのトランスクリプトを読み込む
+    assert load_refflat(refflat_path, ["NM_0002"])["name"].tolist() == ["NM_0001", "NM_0002"]
+    refflat = load_refflat(refflat_path, ["GC", "ENST0006"], gene_aliases={"GC": "GENE_C"})
+    assert refflat["name"].tolist() == ["NM_0007", "ENST0006.2"]
+    assert load_refflat(refflat_path, ["UNKNOWN"]).empty
+
+
+def test_load_refflat_with_regions(tmp_path):
+    pytest.importorskip("pyarrow")
+    refflat_path = write_refflat(tmp_path)
+    # 領域と重なるトランスクリプトを持つ遺伝子は、重ならないトランスクリプトも読み込む
+    refflat = load_refflat(refflat_path, ["all_genes"], regions=[("chr2", 100, 120), ("chr1", 1900, 1950)])
+    assert refflat["name"].tolist() == ["NM_0003", "NM_0007"]
+    refflat = load_refflat(refflat_path, ["all_genes"], regions=[("chr1", 260, 270)])
+    assert refflat["name"].tolist() == ["NM_0001", "NM_0002"]
@@ -10,7 +10,9 @@ from altex_be.refflat_preprocessor import (
     drop_abnormal_mapped_transcripts,
     parse_exon_coordinates,
     add_common_exon_window,
-    flag_outside_common_exon_space
+    flag_outside_common_exon_space,
+    select_interest_genes,
+    check_multiple_exon_existance,
 )
 
 
@@ -304,3 +306,28 @@ def test_outside_common_exon_space():
 
     # tx2 は first と last が outside
     assert flags_tx2 == [True, False, True]
+
+
+def test_select_interest_genes_by_transcript_id():
+    # RefSeq IDを指定した場合でも、その遺伝子のすべてのトランスクリプトが選択される
+    input_data = pd.DataFrame(
+        {
+            "geneName": ["gene1", "gene1", "gene2"],
+            "name": ["NM_001", "NM_002", "NM_003"],
+            "exonStarts": ["10,100,", "10,150,", "5,50,"],
+        }
+    )
+    output_data = select_interest_genes(input_data, {"NM_002.3"})
+    assert output_data["name"].tolist() == ["NM_001", "NM_002"]
+
+
+def test_check_multiple_exon_existance_by_transcript_id():
+    input_data = pd.DataFrame(
+        {
+            "geneName": ["gene1", "gene2"],
+            "name": ["NM_001", "NM_002"],
+            "exonCount": [3, 1],
+        }
+    )
+    assert check_multiple_exon_existance(input_data, ["NM_001"])
+    assert not check_multiple_exon_existance(input_data, ["NM_002", "gene3"])
@@ -14,8 +14,12 @@ from altex_be.sgrna_designer import (
     extract_sgrna_features,
     organize_target_exon_df_with_grna_sequence,
     convert_sgrna_start_end_position_to_position_in_chromosome,
-    design_sgrna_for_base_editors
-)   
+    design_sgrna_for_base_editors,
+    plan_sgrna_design,
+    design_grna_columns_for_base_editors,
+    design_sgrna_for_base_editors_dict,
+)
+from altex_be.class_def.base_editors import PRESET_BASE_EDITORS   
 
 pd.set_option('display.max_columns', None)  # 全てのカラムを表示するための設定
 
@@ -580,4 +584,67 @@ def test_convert_sgrna_start_end_position_to_position_in_chromosome_empty():
     assert result["acceptor_sgrna_start_in_genome"][0] == []
     assert result["acceptor_sgrna_end_in_genome"][0] == []
     assert result["donor_sgrna_start_in_genome"][0] == []
-    assert result["donor_sgrna_end_in_genome"][0] == []
\ No newline at end of file
+    assert result["donor_sgrna_end_in_genome"][0] == []
+
+def test_plan_sgrna_design():
+    design_plan = plan_sgrna_design(PRESET_BASE_EDITORS)
+    # 6つのプリセットは、PAMとBEの種類の組み合わせで4グループにまとめられる
+    assert set(design_plan.keys()) == {("NGG", "cbe"), ("NG", "cbe"), ("NGG", "abe"), ("NG", "abe")}
+    assert [be.base_editor_name for be in design_plan[("NGG", "cbe")]] == ["target_aid_ngg", "be4max_ngg"]
+
+
+def test_design_grna_columns_for_base_editors_matches_per_editor_design():
+    target_exon_df = pd.DataFrame({
+        "exontype": ["alternative", "a5ss-long", "constitutive"],
+        "exon_position": ["internal", "internal", "first"],
+        "acceptor_exon_intron_boundary_±25bp_sequence": [
+            "NNNNCCCNNNNNNNNNNNNNNNNAGNNNNNNNNNNNNNNNNNNNNNNNNN",
+            "NNNNCCCNNNNNNNNNNNNNNNNAGNNNNNNNNNNNNNNNNNNNNNNNNN",
+            "ACGTCCCTTACCGGATTACCCTCAGGTAAGGCCATTGGACCTGGAAAGTC",
+        ],
+        "donor_exon_intron_boundary_±25bp_sequence": [
+            "NNNNNCCCNNNNNNNNNNNNNNNNNGTNNNNNNNNNNNNNNNNNNNNNNN",
+            "NNNNNCCCNNNNNNNNNNNNNNNNNGTNNNNNNNNNNNNNNNNNNNNNNN",
+            "TTCCAGGCCTACCGTACCGGTAACAGGTAAGTCCGGTTACCGGAAGTAGG",
+        ],
+    })
+    output = design_grna_columns_for_base_editors(target_exon_df, PRESET_BASE_EDITORS)
+    assert list(output.keys()) == list(PRESET_BASE_EDITORS.keys())
+    for base_editor in PRESET_BASE_EDITORS.values():
+        expected = design_sgrna_for_target_exon_df(
+            target_exon_df=target_exon_df.copy(),
+            pam_sequence=base_editor.pam_sequence,
+            editing_window_start_in_grna=base_editor.editing_window_start_in_grna,
+            editing_window_end_in_grna=base_editor.editing_window_end_in_grna,
+            base_editor_type=base_editor.base_editor_type,
+        )
+        for site in ["acceptor", "donor"]:
+            assert output[base_editor.base_editor_name][f"grna_{site}"].tolist() == expected[f"grna_{site}"].tolist()
+    # 入力のDataFrameは変更されない
+    assert "grna_acceptor" not in target_exon_df.columns
+
+
+def test_design_sgrna_for_base_editors_dict_is_independent_of_workers():
+    target_exon_df = pd.DataFrame({
+        "exontype": ["alternative", "constitutive"],
+        "exon_position": ["internal", "first"],
+        "strand": ["+", "-"],
+        "chromStart_acceptor": [100, 1000],
+        "chromEnd_acceptor": [150, 1050],
+        "chromStart_donor": [200, 2000],
+        "chromEnd_donor": [250, 2050],
+        "acceptor_exon_intron_boundary_±25bp_sequence": [
+            "NNNNCCCNNNNNNNNNNNNNNNNAGNNNNNNNNNNNNNNNNNNNNNNNNN",
+            "ACGTCCCTTACCGGATTACCCTCAGGTAAGGCCATTGGACCTGGAAAGTC",
+        ],
+        "donor_exon_intron_boundary_±25bp_sequence": [
+            "NNNNNCCCNNNNNNNNNNNNNNNNNGTNNNNNNNNNNNNNNNNNNNNNNN",
+            "TTCCAGGCCTACCGTACCGGTAACAGGTAAGTCCGGTTACCGGAAGTAGG",
+        ],
+    })
+    sequential = design_sgrna_for_base_editors_dict(target_exon_df, PRESET_BASE_EDITORS, max_workers=1)
+    # PAMのグループごとのステージを同時に実行しても、結果とBaseEditorの順序は変わらない
+    concurrent = design_sgrna_for_base_editors_dict(target_exon_df, PRESET_BASE_EDITORS, max_workers=3)
+    assert list(concurrent.keys()) == list(PRESET_BASE_EDITORS.keys())
+    for base_editor_name, expected in sequential.items():
+        pd.testing.assert_frame_equal(concurrent[base_editor_name], expected)
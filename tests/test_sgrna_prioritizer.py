@@ -1,7 +1,12 @@
 import pandas as pd
 import numpy as np
 import pytest
-from altex_be.sgrna_prioritizer import prioritize_sgrna
+from altex_be.sgrna_prioritizer import (
+    ScoringTerm,
+    load_scoring_terms,
+    prioritize_sgrna,
+    score_poly_t,
+)
 
 
 @pytest.fixture
@@ -16,6 +21,7 @@ def sample_sgrna_df():
         "pam+12bp_exact_match_count": [10, 20, 10, 15, 10],
         "sgrna_overlap_between_cds_and_editing_window": [0, 0, 1, 0, 0],
         "sgrna_possible_unintended_edited_base_count": [0, 0, 2, 0, 0],
+        "base_editor_name": ["be_a", "be_a", "be_b", "be_a", "be_b"],
     })
 
 
@@ -150,3 +156,77 @@ def test_composite_score_internally_calculated(sample_sgrna_df):
     
     # First result should have lowest 20bp count (1 instead of 5)
     assert gene1_results.iloc[0]["pam+20bp_exact_match_count"] == 1
+
+
+def test_top_n_per_exon_matches_full_prioritization(sample_sgrna_df):
+    """Test that top-N mode returns the same rows as taking the first N of each exon and editor in the full ranking."""
+    full_result = prioritize_sgrna(sample_sgrna_df)
+    group_key = ["geneName", "exonStarts", "exonEnds", "base_editor_name"]
+    expected = full_result[full_result.groupby(group_key).cumcount() < 1].reset_index(drop=True)
+
+    result = prioritize_sgrna(sample_sgrna_df, top_n_per_exon=1)
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert result.groupby(group_key).size().max() == 1
+    # 各 BaseEditor の最良の sgRNA が残る (sgrna_priority は Exon 内のすべての BaseEditor を通した順位)
+    gene1_results = result[result["geneName"] == "gene1"]
+    assert gene1_results["base_editor_name"].tolist() == ["be_a", "be_b"]
+    assert gene1_results["sgrna_priority"].tolist() == [1, 2]
+
+
+def test_top_n_per_exon_keeps_original_order_for_ties():
+    """Test that ties are broken by the original row order, as in the full sort."""
+    df = pd.DataFrame({
+        "geneName": ["gene1"] * 4,
+        "exonStarts": [100] * 4,
+        "exonEnds": [150] * 4,
+        "sgrna_sequence": ["ATGCATGCATGCATGCATGC"] * 4,
+        "pam+20bp_exact_match_count": [1, 1, 1, 0],
+        "pam+12bp_exact_match_count": [10, 10, 10, 10],
+        "sgrna_overlap_between_cds_and_editing_window": [0, 0, 0, 0],
+        "sgrna_possible_unintended_edited_base_count": [0, 0, 0, 0],
+        "sgrna_id": ["a", "b", "c", "d"],
+        "base_editor_name": ["be_a"] * 4,
+    })
+
+    result = prioritize_sgrna(df, top_n_per_exon=3)
+
+    assert result["sgrna_id"].tolist() == ["d", "a", "b"]
+    assert result["sgrna_priority"].tolist() == [1, 2, 3]
+
+
+def test_scoring_terms_rank_by_weighted_score(sample_sgrna_df):
+    """Test that scoring terms replace the default order with the weighted score."""
+    df = sample_sgrna_df.assign(ontarget=[0.1, 0.9, 0.5, 0.3, 0.8])
+    terms = [ScoringTerm(scorer="column", weight=1.0, params={"column": "ontarget"})]
+
+    result = prioritize_sgrna(df, scoring_terms=terms)
+
+    gene1_results = result[result["geneName"] == "gene1"]
+    assert gene1_results["ontarget"].tolist() == [0.9, 0.5, 0.1]
+    assert gene1_results["sgrna_priority"].tolist() == [1, 2, 3]
+    assert result["sgrna_score"].between(0, 1).all()
+
+
+def test_score_poly_t_does_not_span_sequences():
+    """Test that a T run is detected only within a single sgRNA."""
+    df = pd.DataFrame({"sgrna_sequence": ["ACGTTTTACG", "ACGTT", "TTACG", "acgtttt"]})
+
+    np.testing.assert_array_equal(score_poly_t(df), [0.0, 1.0, 1.0, 0.0])
+
+
+def test_load_scoring_terms(tmp_path):
+    """Test that empty cells fall back to scorer defaults and unknown scorers are rejected."""
+    config = tmp_path / "scoring.csv"
+    config.write_text("scorer,weight,seed_match_weight,low\nofftarget_aggregate,3,0.2,\ngc_content,1,,45\n")
+
+    terms = load_scoring_terms(config)
+
+    assert terms == [
+        ScoringTerm(scorer="offtarget_aggregate", weight=3.0, params={"seed_match_weight": 0.2}),
+        ScoringTerm(scorer="gc_content", weight=1.0, params={"low": 45.0}),
+    ]
+
+    config.write_text("scorer,weight\nunknown,1\n")
+    with pytest.raises(ValueError):
+        load_scoring_terms(config)
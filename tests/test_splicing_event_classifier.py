@@ -1,6 +1,9 @@
+import numpy as np
 import pandas as pd
 
+from altex_be import splicing_event_classifier
 from altex_be.splicing_event_classifier import (
+    balance_gene_chunks,
     classify_splicing_event,
     classify_splicing_events_per_gene,
     flip_a3ss_a5ss_on_minus_strand,
@@ -169,3 +172,25 @@ def test_flip_a3ss_a5ss_in_minus_strand():
     )
     output_data = flip_a3ss_a5ss_on_minus_strand(input_data)
     pd.testing.assert_frame_equal(output_data, expected_output)
+
+
+def test_balance_gene_chunks():
+    chunks = balance_gene_chunks(np.array([1, 100, 3, 50, 50, 2]), 2)
+    # 大きい遺伝子から順に、合計コストが小さいチャンクに割り当てる
+    assert chunks == [[1, 2], [3, 4, 5, 0]]
+    assert sorted(gene for chunk in chunks for gene in chunk) == list(range(6))
+
+
+def test_classify_splicing_events_per_gene_in_parallel(monkeypatch):
+    rng = np.random.default_rng(0)
+    rows = []
+    for gene in range(30):
+        exon_pool = sorted(rng.choice(np.arange(0, 2000, 100), size=6, replace=False))
+        for transcript in range(3):
+            exons = sorted(rng.choice(exon_pool, size=rng.integers(1, 7), replace=False))
+            rows.append({"geneName": f"gene{gene}", "name": f"{gene}-{transcript}", "exons": [(int(e), int(e) + 50 + transcript * (e % 3)) for e in exons]})
+    refflat = pd.DataFrame(rows).sample(frac=1, random_state=0)
+
+    expected = classify_splicing_events_per_gene(refflat)
+    monkeypatch.setattr(splicing_event_classifier, "PARALLEL_MIN_GENES", 1)
+    pd.testing.assert_frame_equal(classify_splicing_events_per_gene(refflat, workers=2), expected)
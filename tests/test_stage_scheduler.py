@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from altex_be.stage_scheduler import StageScheduler
+
+
+@pytest.mark.parametrize("max_workers", [1, 3])
+def test_stage_scheduler_passes_dependency_results(max_workers):
+    with StageScheduler(max_workers) as scheduler:
+        scheduler.add("a", lambda: 2)
+        scheduler.add("b", lambda: 3)
+        scheduler.add("product", lambda a, b: a * b, depends_on=("a", "b"))
+        scheduler.add("label", lambda product: f"product={product}", depends_on=("product",))
+        assert scheduler.result("label") == "product=6"
+    assert scheduler.results() == {"a": 2, "b": 3, "product": 6, "label": "product=6"}
+
+    with pytest.raises(ValueError, match="not added yet"):
+        StageScheduler(max_workers).add("c", lambda d: d, depends_on=("d",))
+
+
+def test_stage_scheduler_runs_independent_stages_concurrently():
+    # 2つのステージが同時に実行されなければ、Barrierを通過できない
+    barrier = threading.Barrier(2, timeout=5)
+    with StageScheduler(max_workers=2) as scheduler:
+        scheduler.add("acceptor", lambda: barrier.wait() is not None)
+        scheduler.add("donor", lambda: barrier.wait() is not None)
+    assert scheduler.results() == {"acceptor": True, "donor": True}
+
+
+def test_stage_scheduler_memory_admission():
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def stage():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    # 見積もりの合計が予算を超えるステージは、実行中のステージが終わるまで開始しない
+    with StageScheduler(max_workers=4, memory_budget=100) as scheduler:
+        for i in range(4):
+            scheduler.add(f"stage{i}", stage, memory_bytes=60)
+    assert peak[0] == 1
+    # 見積もりが予算より大きいステージも、ほかに実行中のステージがなければ開始する
+    with StageScheduler(max_workers=4, memory_budget=10) as scheduler:
+        scheduler.add("large", lambda: "done", memory_bytes=60)
+    assert scheduler.result("large") == "done"
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_stage_scheduler_propagates_failures(max_workers):
+    def fail():
+        raise ValueError("stage failed")
+
+    with pytest.raises(ValueError, match="stage failed"):
+        with StageScheduler(max_workers) as scheduler:
+            scheduler.add("failing", fail)
+            scheduler.add("dependent", lambda value: value, depends_on=("failing",))
+            scheduler.add("independent", lambda: "ok")
+    # 失敗したステージに依存するステージは実行されず、同じ例外で失敗する
+    with pytest.raises(ValueError, match="stage failed"):
+        scheduler.result("dependent")
+    assert scheduler.result("independent") == "ok"
+
+
+def test_stage_scheduler_does_not_wait_for_running_stages_on_error():
+    release = threading.Event()
+    started = time.monotonic()
+    with pytest.raises(SystemExit):
+        with StageScheduler(max_workers=1 + 1) as scheduler:
+            scheduler.add("slow", lambda: release.wait(5))
+            scheduler.add("after slow", lambda value: value, depends_on=("slow",))
+            raise SystemExit(2)
+    # 例外でブロックを抜けるときは、実行中のステージを待たず、まだ開始していないステージを取り消す
+    assert time.monotonic() - started < 1
+    assert scheduler.futures["after slow"].cancelled()
+    release.set()
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 from altex_be.target_exon_extractor import (
@@ -5,6 +6,8 @@ from altex_be.target_exon_extractor import (
     extract_splice_donor_regions,
     explode_classified_refflat,
     format_classified_refflat_to_bed,
+    annotate_splice_site_sharing,
+    join_unique_sorted_values,
 )
 
 
@@ -70,7 +73,7 @@ def test_extract_target_exon():
             "exonStarts": [100, 300, 500, 700],
             "exonEnds": [150, 350, 550, 750],
             "score": [0, 0, 0, 0],
-            # ここでは、ダミーのUUIDを使用（テストではoutput, expected_outputからは除外して比較する）
+            # ここでは、ダミーのIDを使用（テストではoutput, expected_outputからは除外して比較する）
             "name": ["UUID1", "UUID2", "UUID3", "UUID4"],
             "strand": ["+", "+", "-", "-"],
             "exontype": ["alternative", "alternative", "a3ss-long", "a5ss-long"],
@@ -80,7 +83,7 @@ def test_extract_target_exon():
     print(output_data)
     print(expected_output)
     pd.testing.assert_frame_equal(
-        output_data.drop(columns=["name"]).reset_index(drop=True), #UUIDは毎回異なる値が生成されるため、比較から除外
+        output_data.drop(columns=["name"]).reset_index(drop=True), #IDはハッシュ値なので、比較から除外
         expected_output.drop(columns=["name"]).reset_index(drop=True)
     )
 
@@ -142,4 +145,56 @@ def test_extract_splice_donor_regions():
     )
     pd.testing.assert_frame_equal(
         output_data.reset_index(drop=True), expected_output.reset_index(drop=True)
-    )
\ No newline at end of file
+    )
+
+def test_annotate_splice_site_sharing():
+    input_data = pd.DataFrame(
+        {
+            "chrom": ["chr1", "chr1", "chr1", "chr2", "chr2"],
+            "strand": ["+", "+", "+", "-", "-"],
+            # chr1: a3ss のペア (donorを共有)、chr2: a5ss のペア (-鎖なので exonEnds が acceptor で共有される)
+            "exonStarts": [100, 120, 300, 500, 520],
+            "exonEnds": [200, 200, 400, 600, 600],
+        }
+    )
+    output_data = annotate_splice_site_sharing(input_data)
+    assert output_data["acceptor_splice_site_shared_exon_count"].tolist() == [1, 1, 1, 2, 2]
+    assert output_data["donor_splice_site_shared_exon_count"].tolist() == [2, 2, 1, 1, 1]
+
+
+def test_annotate_splice_site_sharing_empty():
+    input_data = pd.DataFrame({"chrom": [], "strand": [], "exonStarts": [], "exonEnds": []})
+    output_data = annotate_splice_site_sharing(input_data)
+    assert output_data.empty
+    assert "acceptor_splice_site_shared_exon_count" in output_data.columns
+
+
+def test_join_unique_sorted_values():
+    values = pd.Series(["last", "first", "last", "internal", "first"])
+    group_codes = np.array([0, 0, 0, 1, 2])
+    output_data = join_unique_sorted_values(values, group_codes)
+    assert output_data.tolist() == ["first;last", "internal", "first"]
+
+
+def test_explode_classified_refflat_all_drops_short_constitutive_genes():
+    input_data = pd.DataFrame(
+        {
+            "chrom": ["chr1", "chr2"],
+            "geneName": ["gene1", "gene2"],
+            "strand": ["+", "-"],
+            "exonStarts": [[100, 200], [100, 200, 300]],
+            "exonEnds": [[150, 250], [150, 250, 350]],
+            "exons": [[0, 1], [0, 1, 2]],
+            "coding": ["coding", "coding"],
+            "exontype": [["constitutive", "constitutive"], ["constitutive", "constitutive", "constitutive"]],
+            "exonlengths": [[50, 50], [50, 50, 50]],
+            "frame": [["in-frame", "in-frame"], ["in-frame", "in-frame", "in-frame"]],
+            "cds_info": [["cds_start", "cds_end"], ["cds_start", "cds_exon", "cds_end"]],
+            "exon_position": [["first", "last"], ["last", "internal", "first"]],
+        }
+    )
+    output_data = explode_classified_refflat(input_data, target_exon="all")
+    # gene1はエキソンが2つで、すべてconstitutiveなので除外される
+    assert output_data["geneName"].tolist() == ["gene2", "gene2", "gene2"]
+    assert output_data["exonStarts"].tolist() == [100, 200, 300]
+    assert output_data["exon_position"].tolist() == ["last", "internal", "first"]